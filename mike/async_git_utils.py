@@ -0,0 +1,488 @@
+"""
+Asynchronous versions of the core Git operations in `git_utils`, for programs
+that perform many of them at once on an asyncio event loop (e.g. a service
+deploying docs for many repositories). Rather than relying on the process's
+working directory, each operation takes the repository to use via `cwd`.
+"""
+
+import asyncio
+import os
+import re
+import time
+import uuid
+from asyncio.subprocess import DEVNULL, PIPE
+from contextlib import asynccontextmanager
+
+from .git_utils import (BranchStatus, FileInfo, GitBranchDiverged,
+                        GitCommitError, GitEmptyCommit, GitError,
+                        GitPushRejected, GitRefConflict, GitRevUnrelated,
+                        _defer_maintenance, _lock_file, _lock_timeout,
+                        _maintenance_steps, _needs_maintenance, _pack_limit,
+                        _push_rejected_re, _take_deferred_maintenance,
+                        _try_lock, _unlock, git_path, make_when)
+
+
+async def _run(cmd, *, cwd=None, input=None):
+    proc = await asyncio.create_subprocess_exec(
+        *cmd, stdin=DEVNULL if input is None else PIPE, stdout=PIPE,
+        stderr=PIPE, cwd=cwd
+    )
+    stdout, stderr = await proc.communicate(input)
+    return proc.returncode, stdout, stderr.decode('utf-8')
+
+
+async def _run_text(cmd, message, *, cwd=None):
+    returncode, stdout, stderr = await _run(cmd, cwd=cwd)
+    if returncode != 0:
+        raise GitError(message, stderr)
+    return stdout.decode('utf-8').strip()
+
+
+async def get_config(key, encoding='utf-8', *, cwd=None):
+    returncode, stdout, stderr = await _run(['git', 'config', '--', key],
+                                            cwd=cwd)
+    if returncode != 0:
+        raise GitError('error getting config {!r}'.format(key), stderr)
+    return stdout.decode(encoding).strip()
+
+
+async def get_commit_encoding(*, cwd=None):
+    try:
+        return await get_config('i18n.commitEncoding', cwd=cwd)
+    except GitError:
+        return 'utf-8'
+
+
+async def get_latest_commit(rev, *, short=False, cwd=None):
+    cmd = ['git', 'rev-parse'] + (['--short'] if short else []) + [rev]
+    return await _run_text(cmd, 'error getting latest commit', cwd=cwd)
+
+
+async def count_reachable(rev, *, cwd=None):
+    return int(await _run_text(
+        ['git', 'rev-list', '--count', rev, '--'],
+        'unable to get number of reachable commits from {}'.format(rev),
+        cwd=cwd
+    ))
+
+
+async def get_ref(branch, *, nonexist_ok=False, cwd=None):
+    cmd = ['git', 'rev-parse', '--symbolic-full-name', branch]
+    try:
+        return await _run_text(cmd, 'error getting git ref for {}'
+                               .format(branch), cwd=cwd)
+    except GitError:
+        if nonexist_ok:
+            return 'refs/heads/{}'.format(branch)
+        raise
+
+
+async def get_git_dir(*, cwd=None):
+    path = await _run_text(['git', 'rev-parse', '--git-common-dir'],
+                           'error getting git directory', cwd=cwd)
+    return os.path.abspath(os.path.join(cwd or '', path))
+
+
+async def get_head(branch, *, cwd=None):
+    try:
+        return await get_latest_commit(branch, cwd=cwd)
+    except GitError:
+        return ''
+
+
+async def _update_ref(branch, args, old_ref, message, *, cwd=None):
+    cmd = (['git', 'update-ref'] + args +
+           ([] if old_ref is None else [old_ref]))
+    returncode, _, stderr = await _run(cmd, cwd=cwd)
+    if returncode != 0:
+        if ( old_ref is not None and
+             await get_head(branch, cwd=cwd) != old_ref ):
+            raise GitRefConflict(branch)
+        raise GitError(message, stderr)
+
+
+async def update_ref(branch, new_ref, old_ref=None, *, cwd=None):
+    ref = await get_ref(branch, nonexist_ok=True, cwd=cwd)
+    await _update_ref(branch, [ref, new_ref], old_ref,
+                      'error updating ref for {}'.format(branch), cwd=cwd)
+
+
+@asynccontextmanager
+async def lock_branch(branch, timeout=None, *, cwd=None):
+    # Like `git_utils.lock_branch`, but locks are reentrant within a task.
+    git_dir, ref = await asyncio.gather(
+        get_git_dir(cwd=cwd), get_ref(branch, nonexist_ok=True, cwd=cwd)
+    )
+    path = _lock_file(git_dir, ref)
+    owner = asyncio.current_task()
+    deadline = time.monotonic() + _lock_timeout(timeout)
+    while not _try_lock(path, owner):
+        if time.monotonic() >= deadline:
+            raise GitError(('timed out waiting for lock on {} (if no other ' +
+                            'mike process is running, delete {})')
+                           .format(branch, path))
+        await asyncio.sleep(0.05)
+
+    try:
+        yield
+    finally:
+        _unlock(path)
+        for work_dir in _take_deferred_maintenance(owner):
+            await auto_maintain(cwd=work_dir)
+
+
+async def auto_maintain(*, cwd=None):
+    # Like `git_utils.auto_maintain`, but waits for the current task to release
+    # its locks.
+    if _pack_limit() <= 0:
+        return False
+    if _defer_maintenance(asyncio.current_task(), cwd):
+        return False
+    git_dir = await get_git_dir(cwd=cwd)
+    if not _needs_maintenance(git_dir):
+        return False
+
+    path = _lock_file(git_dir, 'maintain')
+    if not _try_lock(path, asyncio.current_task()):
+        return False
+    try:
+        for cmd, _ in _maintenance_steps:
+            returncode, _, _ = await _run(cmd, cwd=cwd)
+            if returncode != 0:
+                return False
+        return True
+    finally:
+        _unlock(path)
+
+
+async def has_branch(branch, *, cwd=None):
+    try:
+        await get_latest_commit(branch, cwd=cwd)
+        return True
+    except GitError:
+        return False
+
+
+async def get_merge_base(rev1, rev2, *, cwd=None):
+    returncode, stdout, stderr = await _run(['git', 'merge-base', rev1, rev2],
+                                            cwd=cwd)
+    if returncode == 0:
+        return stdout.decode('utf-8').strip()
+    elif returncode == 1:
+        raise GitRevUnrelated(rev1, rev2)
+    raise GitError('error getting merge-base', stderr)
+
+
+async def compare_branches(branch1, branch2, *, cwd=None):
+    base, latest1, latest2 = await asyncio.gather(
+        get_merge_base(branch1, branch2, cwd=cwd),
+        get_latest_commit(branch1, cwd=cwd),
+        get_latest_commit(branch2, cwd=cwd),
+    )
+
+    if base == latest1:
+        return BranchStatus.even if base == latest2 else BranchStatus.behind
+    else:
+        return BranchStatus.ahead if base == latest2 else BranchStatus.diverged
+
+
+async def update_from_upstream(remote, branch, *, cwd=None):
+    remote_branch = '{}/{}'.format(remote, branch)
+    if not await has_branch(remote_branch, cwd=cwd):
+        return
+
+    head = await get_head(branch, cwd=cwd)
+    if not head:
+        await update_ref(branch, await get_latest_commit(remote_branch,
+                                                         cwd=cwd),
+                         head, cwd=cwd)
+    else:
+        status = await compare_branches(head, remote_branch, cwd=cwd)
+        if status == BranchStatus.behind:
+            await update_ref(branch, await get_latest_commit(remote_branch,
+                                                             cwd=cwd),
+                             head, cwd=cwd)
+        if status == BranchStatus.diverged:
+            raise GitBranchDiverged(branch, remote_branch)
+
+
+async def push_branch(remote, branch, *, cwd=None):
+    returncode, stdout, stderr = await _run(
+        ['git', 'push', '--porcelain', '--', remote, branch], cwd=cwd
+    )
+    if returncode != 0:
+        if _push_rejected_re.search(stdout.decode('utf-8')):
+            raise GitPushRejected(remote, branch, stderr)
+        raise GitError('failed to push branch {} to {}'.format(branch, remote),
+                       stderr)
+
+
+async def delete_branch(branch, old_ref=None, *, cwd=None):
+    message = 'unable to delete branch {}'.format(branch)
+    if old_ref is not None:
+        ref = await get_ref(branch, cwd=cwd)
+        await _update_ref(branch, ['-d', ref], old_ref, message, cwd=cwd)
+        return
+
+    await _run_text(['git', 'branch', '--delete', '--force', '--', branch],
+                    message, cwd=cwd)
+
+
+async def is_commit_empty(rev, *, cwd=None):
+    return not await _run_text(
+        ['git', 'log', '-1', '--format=', '--name-only', rev, '--'],
+        'error getting commit changes', cwd=cwd
+    )
+
+
+async def delete_latest_commit(branch, *, cwd=None):
+    head = await get_latest_commit(branch, cwd=cwd)
+    if await count_reachable(head, cwd=cwd) > 1:
+        await update_ref(branch, await get_latest_commit(head + '^', cwd=cwd),
+                         head, cwd=cwd)
+    else:
+        await delete_branch(branch, head, cwd=cwd)
+
+
+class Commit:
+    # Like `git_utils.Commit`, but each write waits until `git fast-import`
+    # has room for more data, so adding many (or large) files never buffers
+    # more than a little of the commit in memory. Use `async with` (or call
+    # `start`) before adding or deleting files.
+    def __init__(self, branch, message, *, allow_empty=False, head=None,
+                 cwd=None):
+        self._branch = branch
+        self._message = message
+        self._allow_empty = allow_empty
+        self._cwd = cwd
+        self._proc = None
+        self._finished = False
+        self._temp_ref = 'refs/mike/commits/{}'.format(uuid.uuid4().hex)
+        self.head = head
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        if not self._finished:
+            if exc_type:
+                await self.abort()
+            else:
+                await self.finish()
+
+    async def start(self):
+        if self._proc is not None:
+            raise GitError('commit already started')
+
+        encoding, head = await asyncio.gather(
+            get_commit_encoding(cwd=self._cwd),
+            get_head(self._branch, cwd=self._cwd)
+        )
+        if self.head is None:
+            self.head = head
+
+        name = (os.getenv('GIT_COMMITTER_NAME') or
+                await get_config('user.name', encoding, cwd=self._cwd))
+        name = re.sub(r'[<>\n]', '', name)
+        email = (os.getenv('GIT_COMMITTER_EMAIL') or
+                 await get_config('user.email', encoding, cwd=self._cwd))
+        email = re.sub(r'[<>\n]', '', email)
+        when = make_when(os.getenv('GIT_COMMITTER_DATE'))
+
+        cmd = ['git', 'fast-import', '--date-format=rfc2822', '--quiet',
+               '--done']
+        self._proc = await asyncio.create_subprocess_exec(
+            *cmd, stdin=PIPE, stdout=DEVNULL, stderr=PIPE, cwd=self._cwd
+        )
+        # Read stderr as it arrives so that a chatty fast-import can never
+        # block waiting for us.
+        self._stderr = asyncio.ensure_future(self._proc.stderr.read())
+
+        try:
+            await self._write('commit {}\n'.format(self._temp_ref))
+            await self._write('committer {name}<{email}> {time}\n'.format(
+                name=name + ' ' if name else '', email=email, time=when
+            ))
+            await self._write_data(self._message)
+            if self.head:
+                await self._write('from {}\n'.format(self.head))
+        except BaseException:
+            await self.abort()
+            raise
+
+    async def _write(self, data):
+        if self._proc is None:
+            raise GitError('commit not started')
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        try:
+            self._proc.stdin.write(data)
+            await self._proc.stdin.drain()
+        except (BrokenPipeError, ConnectionResetError):  # pragma: no cover
+            raise GitCommitError((await self._stderr).decode('utf-8'))
+
+    async def _write_data(self, data):
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        await self._write('data {}\n'.format(len(data)).encode('utf-8') +
+                          data + b'\n')
+
+    @staticmethod
+    def _escape_path(path):
+        if re.search(r'[\n\"]', path):
+            return '"' + re.sub(r'[\n\"\\]', r'\\\g<0>', path) + '"'
+        return path
+
+    async def delete_files(self, files):
+        if files == '*':
+            await self._write('deleteall\n')
+        else:
+            for f in files:
+                await self._write('D {}\n'.format(
+                    self._escape_path(git_path(f))
+                ))
+
+    async def add_file(self, file_info):
+        # Reading the file at `source` would block the event loop, so do it in
+        # another thread.
+        if file_info.source is not None:
+            data = await asyncio.get_running_loop().run_in_executor(
+                None, lambda: file_info.data
+            )
+        else:
+            data = file_info.data
+
+        # If the file's blob is already in the repo, just refer to it.
+        if data is None and file_info.oid:
+            await self._write('M {mode:06o} {oid} {path}\n'.format(
+                path=self._escape_path(git_path(file_info.path)),
+                mode=file_info.mode, oid=file_info.oid
+            ))
+            return
+
+        await self._write('M {mode:06o} inline {path}\n'.format(
+            path=self._escape_path(git_path(file_info.path)),
+            mode=file_info.mode
+        ))
+        await self._write_data(data)
+
+    async def finish(self):
+        if self._finished:
+            raise GitError('commit already finalized')
+        self._finished = True
+
+        await self._write('done\n')
+        self._proc.stdin.close()
+        stderr = await self._stderr
+        try:
+            if await self._proc.wait() != 0:
+                raise GitCommitError(stderr.decode('utf-8'))
+            commit = await get_latest_commit(self._temp_ref, cwd=self._cwd)
+        finally:
+            await self._delete_temp_ref()
+
+        if ( not self._allow_empty and
+             await is_commit_empty(commit, cwd=self._cwd) ):
+            raise GitEmptyCommit()
+        async with lock_branch(self._branch, cwd=self._cwd):
+            await update_ref(self._branch, commit, self.head, cwd=self._cwd)
+        await auto_maintain(cwd=self._cwd)
+
+    async def abort(self):
+        if self._finished:
+            raise GitError('commit already finalized')
+        self._finished = True
+        if self._proc is None:
+            return
+
+        self._proc.stdin.close()
+        if self._proc.returncode is None:
+            self._proc.terminate()
+        await self._stderr
+        await self._proc.wait()
+        await self._delete_temp_ref()
+
+    async def _delete_temp_ref(self):
+        await _run(['git', 'update-ref', '-d', self._temp_ref], cwd=self._cwd)
+
+
+class _ObjectReader:
+    # An asynchronous `git cat-file --batch` process for reading several
+    # objects in turn.
+    def __init__(self, cwd=None, follow_symlinks=False):
+        self._cwd = cwd
+        self._follow_symlinks = follow_symlinks
+
+    async def __aenter__(self):
+        cmd = ['git', 'cat-file', '--batch']
+        if self._follow_symlinks:
+            cmd.append('--follow-symlinks')
+        self._proc = await asyncio.create_subprocess_exec(
+            *cmd, stdin=PIPE, stdout=PIPE, stderr=DEVNULL, cwd=self._cwd
+        )
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        self._proc.stdin.close()
+        if exc_type:
+            self._proc.terminate()
+        await self._proc.wait()
+
+    async def read(self, rev):
+        if '\n' in rev:
+            raise GitError('invalid object name {!r}'.format(rev))
+
+        self._proc.stdin.write(rev.encode('utf-8') + b'\n')
+        await self._proc.stdin.drain()
+
+        fields = (await self._proc.stdout.readline()).decode('utf-8').split()
+        if not fields:  # pragma: no cover
+            raise GitError('object reader exited unexpectedly')
+        if fields[-1] in ('missing', 'ambiguous'):
+            raise GitError('unable to read object {!r}'.format(rev))
+        data = (await self._proc.stdout.readexactly(int(fields[-1]) + 1))[:-1]
+        if len(fields) != 3:
+            raise GitError('unable to read object {!r}'.format(rev))
+        return fields[0], fields[1], data
+
+
+async def read_file(branch, filename, universal_newlines=False,
+                    follow_symlinks=True, *, cwd=None):
+    rev = '{branch}:{filename}'.format(branch=branch,
+                                       filename=git_path(filename))
+    try:
+        async with _ObjectReader(cwd, follow_symlinks) as reader:
+            _, kind, data = await reader.read(rev)
+    except GitError:
+        kind = None
+    if kind != 'blob':
+        raise GitError('unable to read file {!r}'.format(filename))
+    return data.decode('utf-8') if universal_newlines else data
+
+
+async def _list_tree(branch, path='', *, cwd=None):
+    gpath = git_path(path) if path else ''
+    returncode, stdout, stderr = await _run(
+        ['git', 'ls-tree', '--full-tree', '-r', '-z', '--',
+         '{branch}:{path}'.format(branch=branch, path=gpath)], cwd=cwd
+    )
+    if returncode != 0:
+        raise GitError("unable to read files in '{branch}:{path}'"
+                       .format(branch=branch, path=gpath), stderr)
+
+    for entry in stdout.split(b'\0'):
+        if entry:
+            info, filename = entry.decode('utf-8').split('\t', 1)
+            strmode, _, oid = info.split(' ')
+            yield filename, int(strmode, 8), oid
+
+
+async def walk_files(branch, path='', *, cwd=None):
+    # Read each file's contents from a single `git cat-file` process, one at
+    # a time, so that only the file being yielded is held in memory.
+    async with _ObjectReader(cwd) as reader:
+        async for filename, mode, oid in _list_tree(branch, path, cwd=cwd):
+            _, _, data = await reader.read(oid)
+            yield FileInfo(os.path.join(path, os.path.normpath(filename)),
+                           data, mode)
@@ -0,0 +1,206 @@
+"""
+A persistent cache for data derived from the Git repository, stored under
+`.git/mike/cache`. Entries are keyed by immutable data (usually object IDs), so
+they never go stale; instead, the least-recently-used entries are evicted once
+the cache grows past its maximum size.
+"""
+
+import hashlib
+import os
+import pickle
+import shutil
+import time
+from functools import lru_cache, wraps
+from tempfile import NamedTemporaryFile
+
+from . import git_utils
+from .app_version import version as app_version
+
+default_max_size = 64 * 1024 * 1024
+# Trimming has to look at every entry, so only do it every so many writes.
+default_trim_interval = 256
+
+# Files modified this recently might be modified again without changing their
+# size or mtime, so don't remember hashes for them.
+_racy_window = 2 * 10**9
+
+_missing = object()
+_caches = {}
+
+
+@lru_cache(maxsize=None)
+def _code_version():
+    # Entries are pickled, so they depend on the layout of mike's classes.
+    # Include a fingerprint of mike itself in each key so that upgrading (or
+    # editing) mike never loads objects pickled by a different version.
+    package_dir = os.path.dirname(os.path.abspath(__file__))
+    stamps = []
+    for name in sorted(os.listdir(package_dir)):
+        if name.endswith('.py'):
+            st = os.stat(os.path.join(package_dir, name))
+            stamps.append((name, st.st_size, st.st_mtime_ns))
+    return app_version, tuple(stamps)
+
+
+class Cache:
+    def __init__(self, path, max_size=default_max_size,
+                 trim_interval=default_trim_interval):
+        self.path = path
+        self.max_size = max_size
+        self.trim_interval = trim_interval
+
+    def _entry_path(self, namespace, key):
+        digest = hashlib.sha1(repr((_code_version(), key)).encode('utf-8'))
+        digest = digest.hexdigest()
+        return os.path.join(self.path, namespace, digest[:2], digest[2:])
+
+    def get(self, namespace, key, default=None):
+        path = self._entry_path(namespace, key)
+        try:
+            with open(path, 'rb') as f:
+                value = pickle.load(f)
+            # Mark this entry as recently used.
+            os.utime(path)
+            return value
+        except Exception:
+            return default
+
+    def set(self, namespace, key, value):
+        path = self._entry_path(namespace, key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Write to a temporary file first so that concurrent mike
+            # processes never see a partially-written entry.
+            with NamedTemporaryFile(dir=os.path.dirname(path), prefix='.tmp',
+                                    delete=False) as f:
+                pickle.dump(value, f, pickle.HIGHEST_PROTOCOL)
+            os.replace(f.name, path)
+            writes = self._count_write()
+        except OSError:
+            return
+
+        if writes >= self.trim_interval:
+            try:
+                os.remove(self._writes_path())
+            except OSError:  # pragma: no cover
+                pass
+            self.trim()
+
+    def _writes_path(self):
+        return os.path.join(self.path, '.writes')
+
+    def _count_write(self):
+        # Keep a count of writes that's shared by every mike process using
+        # this cache (one byte per write), so that even short-lived processes
+        # eventually trim the cache. Appending a byte is atomic, so processes
+        # can't lose each other's writes.
+        fd = os.open(self._writes_path(),
+                     os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, b'.')
+            return os.fstat(fd).st_size
+        finally:
+            os.close(fd)
+
+    def entries(self):
+        for path, dirs, filenames in os.walk(self.path):
+            for f in filenames:
+                if not f.startswith('.'):
+                    yield os.path.join(path, f)
+
+    def size(self):
+        total = 0
+        for i in self.entries():
+            try:
+                total += os.stat(i).st_size
+            except OSError:
+                pass
+        return total
+
+    def trim(self):
+        stats = []
+        for i in self.entries():
+            try:
+                st = os.stat(i)
+                stats.append((st.st_mtime_ns, st.st_size, i))
+            except OSError:
+                pass
+
+        total = sum(size for _, size, _ in stats)
+        for _, size, path in sorted(stats):
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+
+    def clear(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+
+
+def get_cache():
+    cwd = git_utils.get_working_directory()
+    if cwd not in _caches:
+        try:
+            git_dir = git_utils.get_git_dir()
+        except git_utils.GitError:
+            return None
+        _caches[cwd] = Cache(os.path.join(git_dir, 'mike', 'cache'))
+    return _caches[cwd]
+
+
+def memoize(namespace):
+    # Cache the result of a function taking a single argument that uniquely
+    # identifies its result (e.g. a Git object ID).
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(key):
+            cache = get_cache()
+            if cache is None:
+                return fn(key)
+
+            value = cache.get(namespace, key, _missing)
+            if value is _missing:
+                value = fn(key)
+                cache.set(namespace, key, value)
+            return value
+
+        return wrapper
+
+    return decorator
+
+
+def hash_real_files(srcdir):
+    # Like `git_utils.hash_real_files`, but reuse the object IDs of any files
+    # whose size and mtime haven't changed since we last hashed them.
+    cache = get_cache()
+    key = os.path.abspath(srcdir)
+    known = cache.get('file-hashes', key, {}) if cache is not None else {}
+
+    now = time.time_ns()
+    files = []
+    stamps = {}
+    for path, mode in git_utils.walk_real_paths(srcdir):
+        st = os.stat(path)
+        stamps[path] = (st.st_size, st.st_mtime_ns)
+        entry = known.get(os.path.relpath(path, srcdir))
+        oid = entry[2] if entry and entry[:2] == stamps[path] else None
+        files.append(git_utils.FileInfo(path, None, mode, oid=oid))
+
+    # The objects we remember may have been garbage-collected since then.
+    known_oids = [i.oid for i in files if i.oid]
+    missing = git_utils.missing_objects(known_oids) if known_oids else set()
+    unknown = [i for i in files if not i.oid or i.oid in missing]
+    oids = git_utils.hash_files([i.path for i in unknown])
+    for f, oid in zip(unknown, oids):
+        f.oid = oid
+
+    if cache is not None:
+        cache.set('file-hashes', key, {
+            os.path.relpath(path, srcdir): stamp + (f.oid,)
+            for f, (path, stamp) in zip(files, stamps.items())
+            if stamp[1] < now - _racy_window
+        })
+    return files
@@ -1,16 +1,20 @@
-import http.server
 import os
 import posixpath
+import random
 import sys
-from contextlib import contextmanager
+import time
+from collections import namedtuple
+from contextlib import contextmanager, ExitStack
+from copy import deepcopy
 from enum import Enum
-from jinja2 import Template
+from tempfile import TemporaryDirectory
 
+from . import cache
 from . import git_utils
+from . import jsonpath
 from . import mkdocs_utils
-from . import server
 from .app_version import version as app_version
-from .versions import Versions
+from .versions import merge as merge_versions, Versions
 
 if sys.version_info < (3, 10):
     import importlib_resources as resources
@@ -19,6 +23,18 @@ else:
 
 versions_file = 'versions.json'
 AliasType = Enum('AliasType', ['symlink', 'copy', 'redirect'])
+Project = namedtuple('Project', ['cfg', 'deploy_prefix', 'alias_type',
+                                 'template'],
+                     defaults=['', AliasType.symlink, None])
+Target = namedtuple('Target', ['branch', 'remote', 'deploy_prefix'],
+                    defaults=[None, ''])
+MatrixEntry = namedtuple('MatrixEntry', ['version', 'ref', 'title', 'aliases'],
+                         defaults=[None, []])
+
+# The delay (in seconds) before retrying a rejected push; this doubles after
+# each attempt, up to the maximum.
+push_retry_delay = 1
+max_push_retry_delay = 30
 
 
 def _format_deploy_prefix(deploy_prefix):
@@ -26,6 +42,8 @@ def _format_deploy_prefix(deploy_prefix):
 
 
 def _redirect_template(user_template=None):
+    from jinja2 import Template
+
     template_file = (
         user_template or
         resources.files('mike').joinpath('templates/redirect.html')
@@ -35,22 +53,118 @@ def _redirect_template(user_template=None):
                         keep_trailing_newline=True)
 
 
+@cache.memoize('trees')
+def _list_tree(oid):
+    return git_utils.list_tree(oid)
+
+
+def _existing_files(commit, branch, destdirs):
+    # Get the files currently in each of `destdirs` so that we can skip
+    # rewriting unchanged files and delete stale ones afterwards. Anything
+    # that isn't a directory (e.g. an old symlinked alias) is just deleted.
+    existing = {}
+    for d in destdirs:
+        try:
+            mode, oid = git_utils.tree_entry(branch, d)
+        except git_utils.GitError:
+            mode = None
+        if mode != 0o040000:
+            commit.delete_files([d])
+            continue
+        for path, entry in _list_tree(oid).items():
+            existing[git_utils.git_path(os.path.join(d, path))] = entry
+    return existing
+
+
+def _add_file_to_commit(commit, file_info, existing=None):
+    if existing is not None:
+        entry = existing.pop(git_utils.git_path(file_info.path), None)
+        if entry is not None:
+            mode, oid = entry
+            object_format = 'sha256' if len(oid) == 64 else 'sha1'
+            if ( mode == file_info.mode and
+                 oid == (file_info.oid or
+                         git_utils.hash_blob(file_info.data, object_format)) ):
+                return
+    commit.add_file(file_info)
+
+
 def _add_redirect_to_commit(commit, template, src, dst,
-                            use_directory_urls):
+                            use_directory_urls, existing=None):
     if os.path.splitext(src)[1] == '.html':
         reldst = os.path.relpath(dst, os.path.dirname(src))
         href = '/'.join(reldst.split(os.path.sep))
         if use_directory_urls and posixpath.basename(href) == 'index.html':
             href = posixpath.dirname(href) + '/'
-        commit.add_file(git_utils.FileInfo(src, template.render(href=href)))
+        _add_file_to_commit(commit, git_utils.FileInfo(
+            src, template.render(href=href)
+        ), existing)
+
+
+def _clear_version_dirs(commit, branch, destdir, alias_destdirs, alias_type,
+                        incremental=False):
+    if not incremental:
+        commit.delete_files([destdir] + alias_destdirs)
+        return None
+
+    # Only write the files that actually changed; anything left in `existing`
+    # after adding the site's files is stale and gets deleted.
+    tracked_destdirs = [destdir]
+    if alias_type == AliasType.symlink:
+        commit.delete_files(alias_destdirs)
+    else:
+        tracked_destdirs += alias_destdirs
+    return _existing_files(commit, branch, tracked_destdirs)
+
+
+def _add_site_to_commit(commit, site_files, site_dir, destdir, alias_destdirs,
+                        alias_type, template, use_directory_urls,
+                        existing=None):
+    for f in site_files:
+        canonical_file = f.copy(destdir, site_dir)
+        _add_file_to_commit(commit, canonical_file, existing)
+        for d in alias_destdirs:
+            alias_file = f.copy(d, site_dir)
+            if alias_type == AliasType.redirect:
+                _add_redirect_to_commit(
+                    commit, template, alias_file.path, canonical_file.path,
+                    use_directory_urls, existing
+                )
+            elif alias_type == AliasType.copy:
+                _add_file_to_commit(commit, alias_file, existing)
+            elif alias_type != AliasType.symlink:  # pragma: no cover
+                raise ValueError('unrecognized alias type')
+
+    if existing:
+        commit.delete_files(existing.keys())
+
+    if alias_type == AliasType.symlink:
+        for d in alias_destdirs:
+            base_dir = os.path.join(d, '..')
+            commit.add_file(git_utils.FileInfo(
+                d, os.path.relpath(destdir, base_dir), mode=0o120000
+            ))
+
+
+@cache.memoize('versions')
+def _load_versions(oid):
+    return Versions.loads(git_utils.read_blob(oid, universal_newlines=True))
 
 
 def list_versions(branch='gh-pages', deploy_prefix=''):
+    filename = os.path.join(deploy_prefix, versions_file)
     try:
-        return Versions.loads(git_utils.read_file(
-            branch, os.path.join(deploy_prefix, versions_file),
-            universal_newlines=True
-        ))
+        mode, oid = git_utils.tree_entry(branch, filename)
+    except git_utils.GitError:
+        mode = None
+
+    try:
+        if mode in (0o100644, 0o100755):
+            return _load_versions(oid)
+        # This might be a symlink or inside a symlinked directory, so try
+        # following it.
+        return Versions.loads(git_utils.read_file(branch, filename,
+                                                  universal_newlines=True))
     except git_utils.GitError:
         return Versions()
 
@@ -65,9 +179,10 @@ def make_nojekyll():
 
 
 @contextmanager
-def deploy(cfg, version, title=None, aliases=[], update_aliases=False,
-           alias_type=AliasType.symlink, template=None, *, branch='gh-pages',
-           message=None, allow_empty=False, deploy_prefix='', set_props=[]):
+def deploy_projects(projects, version, title=None, aliases=[],
+                    update_aliases=False, *, branch='gh-pages', message=None,
+                    allow_empty=False, set_props=[], incremental=False,
+                    walk_site=None):
     if message is None:
         message = (
             'Deployed {rev} to {doc_version}{deploy_prefix} with ' +
@@ -75,146 +190,536 @@ def deploy(cfg, version, title=None, aliases=[], update_aliases=False,
         ).format(
             rev=git_utils.get_latest_commit('HEAD', short=True),
             doc_version=version,
-            deploy_prefix=_format_deploy_prefix(deploy_prefix),
+            deploy_prefix=_format_deploy_prefix(
+                ', '.join(i.deploy_prefix for i in projects if i.deploy_prefix)
+            ),
             mkdocs_version=mkdocs_utils.version_info(),
             mike_version=app_version
         )
 
-    all_versions = list_versions(branch, deploy_prefix)
-    info = all_versions.add(version, title, aliases, update_aliases)
-    version_str = str(info.version)
-    destdir = os.path.join(deploy_prefix, version_str)
-    alias_destdirs = [os.path.join(deploy_prefix, i) for i in info.aliases]
+    if len({i.deploy_prefix for i in projects}) != len(projects):
+        raise ValueError('each project must use a different deploy prefix')
+    if walk_site is None:
+        # For incremental deploys, we only need the hashes of the built files
+        # (most of which are likely unchanged), not their contents.
+        walk_site = (cache.hash_real_files if incremental else
+                     git_utils.walk_real_files)
+
+    def start():
+        # Read the branch and start the commit (and for incremental deploys,
+        # read the existing files) before yielding so that this work can
+        # overlap with the build.
+        head = git_utils.get_head(branch)
+        deployments = []
+        for project in projects:
+            all_versions = list_versions(branch, project.deploy_prefix)
+            info = all_versions.add(version, title, aliases, update_aliases)
+            for path, value in set_props:
+                info.set_property(path, value)
+
+            destdir = os.path.join(project.deploy_prefix, str(info.version))
+            alias_destdirs = [os.path.join(project.deploy_prefix, i)
+                              for i in info.aliases]
+            t = (_redirect_template(project.template)
+                 if project.alias_type == AliasType.redirect and info.aliases
+                 else None)
+            deployments.append((project, all_versions, destdir,
+                                alias_destdirs, t))
+
+        commit = git_utils.Commit(branch, message, allow_empty=allow_empty,
+                                  head=head)
+        with _abort_on_error(commit):
+            existing = [_clear_version_dirs(commit, branch, destdir,
+                                            alias_destdirs, project.alias_type,
+                                            incremental)
+                        for project, _, destdir, alias_destdirs, _
+                        in deployments]
+        return commit, deployments, existing
+
+    def finish(commit, deployments, existing):
+        with commit:
+            for (project, all_versions, destdir, alias_destdirs, t), \
+                    existing_files in zip(deployments, existing):
+                site_dir = project.cfg['site_dir']
+                _add_site_to_commit(commit, walk_site(site_dir), site_dir,
+                                    destdir, alias_destdirs,
+                                    project.alias_type, t,
+                                    project.cfg['use_directory_urls'],
+                                    existing_files)
+                commit.add_file(versions_to_file_info(all_versions,
+                                                      project.deploy_prefix))
+            commit.add_file(make_nojekyll())
+
+    state = start()
+    with _abort_on_error(state[0]):
+        # Let the caller perform the build.
+        yield
+
+    # If another process changed the branch during the build, deploy again
+    # on top of its changes (holding the lock so that only non-mike writers
+    # can get in our way).
+    with git_utils.lock_branch(branch):
+        try:
+            finish(*state)
+        except git_utils.GitRefConflict:
+            git_utils.retry_on_conflict(lambda: finish(*start()))
 
-    for path, value in set_props:
-        info.set_property(path, value)
 
-    # Let the caller perform the build.
-    yield
+@contextmanager
+def _abort_on_error(commit):
+    try:
+        yield
+    except BaseException:
+        commit.abort()
+        raise
 
-    if alias_type == AliasType.redirect and info.aliases:
-        t = _redirect_template(template)
 
-    with git_utils.Commit(branch, message, allow_empty=allow_empty) as commit:
-        commit.delete_files([destdir] + alias_destdirs)
+class _SharedSiteFiles:
+    def __init__(self):
+        self._files = {}
 
-        for f in git_utils.walk_real_files(cfg['site_dir']):
-            canonical_file = f.copy(destdir, cfg['site_dir'])
-            commit.add_file(canonical_file)
-            for d in alias_destdirs:
-                alias_file = f.copy(d, cfg['site_dir'])
-                if alias_type == AliasType.redirect:
-                    _add_redirect_to_commit(
-                        commit, t, alias_file.path, canonical_file.path,
-                        cfg['use_directory_urls']
-                    )
-                elif alias_type == AliasType.copy:
-                    commit.add_file(alias_file)
-                elif alias_type != AliasType.symlink:  # pragma: no cover
-                    raise ValueError('unrecognized alias type')
+    def __call__(self, site_dir):
+        if site_dir not in self._files:
+            self._files[site_dir] = cache.hash_real_files(site_dir)
+        return self._files[site_dir]
 
-        if alias_type == AliasType.symlink:
-            for d in alias_destdirs:
-                base_dir = os.path.join(d, '..')
-                commit.add_file(git_utils.FileInfo(
-                    d, os.path.relpath(destdir, base_dir), mode=0o120000
-                ))
 
-        commit.add_file(versions_to_file_info(all_versions, deploy_prefix))
-        commit.add_file(make_nojekyll())
+@contextmanager
+def _skip_empty_commit(empty_targets, target):
+    try:
+        yield
+    except git_utils.GitEmptyCommit:
+        empty_targets.append(target)
 
 
-def delete(identifiers=None, all=False, *, branch='gh-pages', message=None,
-           allow_empty=False, deploy_prefix=''):
-    if not all and identifiers is None:
-        raise ValueError('specify `identifiers` or `all`')
+@contextmanager
+def deploy(cfg, version, title=None, aliases=[], update_aliases=False,
+           alias_type=AliasType.symlink, template=None, *, branch='gh-pages',
+           message=None, allow_empty=False, deploy_prefix='', set_props=[],
+           incremental=False, targets=None, walk_site=None):
+    if targets is None:
+        targets = [Target(branch, deploy_prefix=deploy_prefix)]
+    if len({i.branch for i in targets}) != len(targets):
+        raise ValueError('each target must use a different branch')
+
+    # When deploying to multiple targets, hash the built files once and share
+    # the resulting blobs between each target's commit.
+    if walk_site is None and len(targets) > 1:
+        walk_site = _SharedSiteFiles()
+
+    # If some (but not all) of the targets are unchanged, just skip creating
+    # commits for those.
+    empty_targets = []
+    with ExitStack() as stack:
+        for target in targets:
+            project = Project(cfg, target.deploy_prefix, alias_type, template)
+            stack.enter_context(_skip_empty_commit(empty_targets, target))
+            stack.enter_context(deploy_projects(
+                [project], version, title, aliases, update_aliases,
+                branch=target.branch, message=message,
+                allow_empty=allow_empty, set_props=set_props,
+                incremental=incremental, walk_site=walk_site
+            ))
+
+        # Let the caller perform the build.
+        yield
+
+    if len(empty_targets) == len(targets):
+        raise git_utils.GitEmptyCommit()
+
+
+def _build_ref(entry, workdir, config_files, quiet=False):
+    srcdir = os.path.join(workdir, 'src')
+    site_dir = os.path.join(workdir, 'site')
+    git_utils.archive(entry.ref, srcdir)
+
+    with mkdocs_utils.inject_plugin(
+        [os.path.join(srcdir, i) for i in config_files]
+    ) as config_file:
+        mkdocs_utils.build(config_file, str(entry.version), quiet=quiet,
+                           site_dir=site_dir)
+        # Settings like `use_directory_urls` can differ between refs, so use
+        # the ones from this ref's config.
+        ref_cfg = mkdocs_utils.resolve_config(config_file)
+    return site_dir, ref_cfg['use_directory_urls']
+
+
+def deploy_matrix(cfg, entries, update_aliases=False,
+                  alias_type=AliasType.symlink, template=None, *,
+                  config_file=None, jobs=None, quiet=False,
+                  branch='gh-pages', message=None, allow_empty=False,
+                  deploy_prefix=''):
+    from concurrent.futures import ThreadPoolExecutor
+    from contextvars import copy_context
 
     if message is None:
         message = (
-            'Removed {doc_identifiers}{deploy_prefix} with mike {mike_version}'
+            'Deployed {doc_versions}{deploy_prefix} with {mkdocs_version} ' +
+            'and mike {mike_version}'
         ).format(
-            doc_identifiers='everything' if all else ', '.join(identifiers),
+            doc_versions=', '.join('{} to {}'.format(i.ref, i.version)
+                                   for i in entries),
             deploy_prefix=_format_deploy_prefix(deploy_prefix),
+            mkdocs_version=mkdocs_utils.version_info(),
             mike_version=app_version
         )
 
-    with git_utils.Commit(branch, message, allow_empty=allow_empty) as commit:
-        if all:
-            if deploy_prefix:
-                commit.delete_files([deploy_prefix])
+    seen = set()
+    for i in entries:
+        if str(i.version) in seen:
+            raise ValueError('version {} specified more than once'
+                             .format(i.version))
+        seen.add(str(i.version))
+
+    def plan():
+        head = git_utils.get_head(branch)
+        all_versions = list_versions(branch, deploy_prefix)
+        infos = [all_versions.add(i.version, i.title, i.aliases,
+                                  update_aliases)
+                 for i in entries]
+        t = (_redirect_template(template)
+             if alias_type == AliasType.redirect and
+             any(i.aliases for i in infos)
+             else None)
+        return head, all_versions, infos, t
+
+    def write(builds, head, all_versions, infos, t):
+        with git_utils.Commit(branch, message, allow_empty=allow_empty,
+                              head=head) as commit:
+            for info, build in zip(infos, builds):
+                destdir = os.path.join(deploy_prefix, str(info.version))
+                alias_destdirs = [os.path.join(deploy_prefix, i)
+                                  for i in info.aliases]
+
+                _clear_version_dirs(commit, branch, destdir, alias_destdirs,
+                                    alias_type)
+                site_dir, use_directory_urls = build.result()
+                _add_site_to_commit(commit,
+                                    git_utils.walk_real_files(site_dir),
+                                    site_dir, destdir, alias_destdirs,
+                                    alias_type, t, use_directory_urls)
+
+            commit.add_file(versions_to_file_info(all_versions,
+                                                  deploy_prefix))
+            commit.add_file(make_nojekyll())
+
+    planned = plan()
+
+    # Find the config file relative to the root of the repo so that we can
+    # find it again in each ref's source tree.
+    toplevel = git_utils.get_toplevel()
+    workdir = git_utils.get_working_directory()
+    config_files = [
+        os.path.relpath(os.path.join(workdir, i), toplevel) for i in
+        ([config_file] if config_file else
+         mkdocs_utils.default_config_files())
+    ]
+
+    with TemporaryDirectory(prefix='mike-') as tmpdir, \
+         ThreadPoolExecutor(jobs) as executor:
+        # Each build runs in its own MkDocs process, so a thread per build is
+        # enough to build everything in parallel. Run each one in our context
+        # so that Git runs in the same repository as it does here.
+        builds = [executor.submit(copy_context().run, _build_ref, entry,
+                                  os.path.join(tmpdir, str(n)), config_files,
+                                  quiet)
+                  for n, entry in enumerate(entries)]
+
+        try:
+            # Wait for the builds before taking the lock so that we don't keep
+            # other processes waiting on them.
+            for i in builds:
+                i.result()
+
+            # If another process changed the branch while we were building,
+            # add our builds on top of its changes instead.
+            with git_utils.lock_branch(branch):
+                try:
+                    write(builds, *planned)
+                except git_utils.GitRefConflict:
+                    git_utils.retry_on_conflict(
+                        lambda: write(builds, *plan())
+                    )
+        except BaseException:
+            for i in builds:
+                i.cancel()
+            raise
+
+
+def _tree_files(branch, path):
+    # Refer to the blobs already in the repo rather than reading each file.
+    return [git_utils.FileInfo(os.path.join(path, os.path.normpath(name)),
+                               None, mode, oid=oid)
+            for name, (mode, oid) in git_utils.list_tree(branch, path).items()]
+
+
+class _PendingCommit:
+    # Record the changes for a commit so that we can write them all once we
+    # know the commit message (which `git fast-import` needs up front).
+    def __init__(self):
+        self._changes = []
+
+    def delete_files(self, files):
+        self._changes.append(('delete', files if files == '*'
+                              else list(files)))
+
+    def add_file(self, file_info):
+        self._changes.append(('add', file_info))
+
+    def apply(self, commit):
+        for kind, value in self._changes:
+            if kind == 'delete':
+                commit.delete_files(value)
             else:
-                commit.delete_files('*')
+                commit.add_file(value)
+
+
+class Batch:
+    """Apply several operations to a branch, writing them as one commit.
+
+    Each method works like the function of the same name in this module, but
+    only updates the batch's in-memory state; call `commit` (or use `batch`)
+    to write the result.
+    """
+
+    def __init__(self, branch='gh-pages', deploy_prefix='', *,
+                 versions=None, head=None):
+        self.branch = branch
+        self.deploy_prefix = deploy_prefix
+        # The commit we read the branch from; we'll only commit our changes
+        # if the branch still points there.
+        self.head = git_utils.get_head(branch) if head is None else head
+        self.versions = (list_versions(branch, deploy_prefix)
+                         if versions is None else versions)
+
+        self._pending = _PendingCommit()
+        self._descriptions = []
+        # The files deployed for each version in this batch, so that aliases
+        # of those versions can copy them before they're in the branch.
+        self._deployed = {}
+        self._versions_changed = False
+        self._built = False
+
+    def _path(self, *paths):
+        return os.path.join(self.deploy_prefix, *paths)
+
+    def _find(self, identifier):
+        try:
+            return self.versions.find(identifier, strict=True)[0]
+        except KeyError as e:
+            raise ValueError('identifier {} does not exist'.format(e))
+
+    def deploy(self, cfg, version, title=None, aliases=[],
+               update_aliases=False, alias_type=AliasType.symlink,
+               template=None, set_props=[], *, rev=None, walk_site=None):
+        info = self.versions.add(version, title, aliases, update_aliases)
+        for path, value in set_props:
+            info.set_property(path, value)
+
+        destdir = self._path(str(info.version))
+        alias_destdirs = [self._path(i) for i in info.aliases]
+        t = (_redirect_template(template)
+             if alias_type == AliasType.redirect and info.aliases else None)
+
+        # Later steps may rebuild the site, so write the built files to the
+        # object database now and only keep their IDs.
+        site_dir = cfg['site_dir']
+        site_files = (walk_site or cache.hash_real_files)(site_dir)
+        _clear_version_dirs(self._pending, self.branch, destdir,
+                            alias_destdirs, alias_type)
+        _add_site_to_commit(self._pending, site_files, site_dir, destdir,
+                            alias_destdirs, alias_type, t,
+                            cfg['use_directory_urls'])
+
+        self._deployed[str(info.version)] = [i.copy(destdir, site_dir)
+                                             for i in site_files]
+        self._versions_changed = self._built = True
+        self._descriptions.append('Deployed {rev} to {doc_version}'.format(
+            rev=rev or git_utils.get_latest_commit('HEAD', short=True),
+            doc_version=version
+        ))
+
+    def alias(self, cfg, identifier, aliases, update_aliases=False,
+              alias_type=AliasType.symlink, template=None):
+        real_version = self._find(identifier)
+        new_aliases = self.versions.update(real_version, aliases=aliases,
+                                           update_aliases=update_aliases)
+        destdirs = [self._path(i) for i in new_aliases]
+        canonical_dir = self._path(str(real_version))
+        self._pending.delete_files(destdirs)
+
+        if alias_type == AliasType.symlink:
+            for d in destdirs:
+                base_dir = os.path.join(d, '..')
+                self._pending.add_file(git_utils.FileInfo(
+                    d, os.path.relpath(canonical_dir, base_dir), mode=0o120000
+                ))
+        elif destdirs:
+            t = (_redirect_template(template)
+                 if alias_type == AliasType.redirect else None)
+            canonical_files = self._deployed.get(str(real_version))
+            if canonical_files is None:
+                canonical_files = _tree_files(self.branch, canonical_dir)
+            for canonical_file in canonical_files:
+                for d in destdirs:
+                    alias_file = canonical_file.copy(d, canonical_dir)
+                    if alias_type == AliasType.redirect:
+                        _add_redirect_to_commit(
+                            self._pending, t, alias_file.path,
+                            canonical_file.path, cfg['use_directory_urls']
+                        )
+                    elif alias_type == AliasType.copy:
+                        self._pending.add_file(alias_file)
+                    else:  # pragma: no cover
+                        raise ValueError('unrecognized alias type')
+
+        self._versions_changed = True
+        self._descriptions.append('Copied {doc_version} to {aliases}'.format(
+            doc_version=real_version, aliases=', '.join(aliases)
+        ))
+
+    def retitle(self, identifier, title):
+        try:
+            self.versions.update(identifier, title)
+        except KeyError:
+            raise ValueError('identifier {!r} does not exist'
+                             .format(identifier))
+
+        self._versions_changed = True
+        self._descriptions.append(
+            'Set title of {doc_identifier} to {title}'.format(
+                doc_identifier=identifier, title=title
+            )
+        )
+
+    def set_properties(self, set_props, identifiers=None, *,
+                       version_range=None, where=None):
+        selected = _select_versions(self.versions, identifiers, version_range,
+                                    where)
+        if not selected:
+            raise ValueError('no versions selected')
+
+        # Give each version its own copy of the values so that later changes
+        # to one version's properties don't leak into the others.
+        for info in selected:
+            for path, value in set_props:
+                info.set_property(path, value if value is jsonpath.Deleted
+                                  else deepcopy(value))
+
+        self._versions_changed = True
+        self._descriptions.append('Set properties for {}'.format(
+            ', '.join(str(i.version) for i in selected)
+        ))
+
+    def set_default(self, identifier, template=None, allow_undefined=False):
+        if not allow_undefined and not self.versions.find(identifier):
+            raise ValueError('identifier {!r} does not exist'
+                             .format(identifier))
+
+        t = _redirect_template(template)
+        self._pending.add_file(git_utils.FileInfo(
+            self._path('index.html'), t.render(href=identifier + '/')
+        ))
+        self._descriptions.append('Set default version to {}'.format(
+            identifier
+        ))
+
+    def delete(self, identifiers=None, all=False):
+        if not all and identifiers is None:
+            raise ValueError('specify `identifiers` or `all`')
+
+        if all:
+            self._pending.delete_files([self.deploy_prefix]
+                                       if self.deploy_prefix else '*')
+            self.versions = Versions()
+            self._deployed.clear()
+            self._versions_changed = self._built = False
         else:
-            all_versions = list_versions(branch, deploy_prefix)
             try:
-                removed = all_versions.difference_update(identifiers)
+                removed = self.versions.difference_update(identifiers)
             except KeyError as e:
                 raise ValueError('unable to delete nonexistant identifier {}'
                                  .format(e))
 
             for i in removed:
                 if isinstance(i, str):
-                    commit.delete_files([os.path.join(deploy_prefix, i)])
+                    self._pending.delete_files([self._path(i)])
                 else:
-                    commit.delete_files(
-                        [os.path.join(deploy_prefix, str(i.version))] +
-                        [os.path.join(deploy_prefix, j) for j in i.aliases]
+                    self._deployed.pop(str(i.version), None)
+                    self._pending.delete_files(
+                        [self._path(str(i.version))] +
+                        [self._path(j) for j in i.aliases]
                     )
-            commit.add_file(versions_to_file_info(all_versions, deploy_prefix))
-
+            self._versions_changed = True
 
-def alias(cfg, identifier, aliases, update_aliases=False,
-          alias_type=AliasType.symlink, template=None, *, branch='gh-pages',
-          message=None, allow_empty=False, deploy_prefix=''):
-    all_versions = list_versions(branch, deploy_prefix)
-    try:
-        real_version = all_versions.find(identifier, strict=True)[0]
-    except KeyError as e:
-        raise ValueError('identifier {} does not exist'.format(e))
+        self._descriptions.append('Removed {}'.format(
+            'everything' if all else ', '.join(identifiers)
+        ))
 
-    if message is None:
-        message = (
-            'Copied {doc_version} to {aliases}{deploy_prefix} with mike ' +
+    def default_message(self):
+        return (
+            '{operations}{deploy_prefix} with {mkdocs_version}mike ' +
             '{mike_version}'
         ).format(
-            doc_version=real_version,
-            aliases=', '.join(aliases),
-            deploy_prefix=_format_deploy_prefix(deploy_prefix),
+            operations='; '.join(self._descriptions) or 'Updated',
+            deploy_prefix=_format_deploy_prefix(self.deploy_prefix),
+            mkdocs_version=(mkdocs_utils.version_info() + ' and '
+                            if self._built else ''),
             mike_version=app_version
         )
 
-    new_aliases = all_versions.update(real_version, aliases=aliases,
-                                      update_aliases=update_aliases)
-    destdirs = [os.path.join(deploy_prefix, i) for i in new_aliases]
+    def commit(self, message=None, allow_empty=False):
+        if message is None:
+            message = self.default_message()
 
-    if alias_type == AliasType.redirect and destdirs:
-        t = _redirect_template(template)
+        with git_utils.Commit(self.branch, message, allow_empty=allow_empty,
+                              head=self.head) as commit:
+            self._pending.apply(commit)
+            if self._versions_changed:
+                commit.add_file(versions_to_file_info(self.versions,
+                                                      self.deploy_prefix))
+            if self._built:
+                commit.add_file(make_nojekyll())
 
-    with git_utils.Commit(branch, message, allow_empty=allow_empty) as commit:
-        commit.delete_files(destdirs)
 
-        canonical_dir = os.path.join(deploy_prefix, str(real_version))
-        for canonical_file in git_utils.walk_files(branch, canonical_dir):
-            for d in destdirs:
-                alias_file = canonical_file.copy(d, canonical_dir)
-                if alias_type == AliasType.redirect:
-                    _add_redirect_to_commit(
-                        commit, t, alias_file.path, canonical_file.path,
-                        cfg['use_directory_urls']
-                    )
-                elif alias_type == AliasType.copy:
-                    commit.add_file(alias_file)
-                elif alias_type != AliasType.symlink:  # pragma: no cover
-                    raise ValueError('unrecognized alias type')
+@contextmanager
+def batch(*, branch='gh-pages', message=None, allow_empty=False,
+          deploy_prefix=''):
+    # The branch stays locked for the whole `with` block, so build any sites
+    # the batch will deploy before entering it.
+    with git_utils.lock_branch(branch):
+        b = Batch(branch, deploy_prefix)
+        yield b
+        b.commit(message, allow_empty)
+
+
+def _apply_batch(operation, **kwargs):
+    # Run `operation` on a batch and commit it, starting over from the
+    # branch's new state if another process changes it first.
+    def attempt():
+        with batch(**kwargs) as b:
+            operation(b)
+
+    git_utils.retry_on_conflict(attempt)
+
+
+def delete(identifiers=None, all=False, *, branch='gh-pages', message=None,
+           allow_empty=False, deploy_prefix=''):
+    if not all and identifiers is None:
+        raise ValueError('specify `identifiers` or `all`')
+
+    _apply_batch(lambda b: b.delete(identifiers, all), branch=branch,
+                 message=message, allow_empty=allow_empty,
+                 deploy_prefix=deploy_prefix)
 
-        if alias_type == AliasType.symlink:
-            for d in destdirs:
-                base_dir = os.path.join(d, '..')
-                commit.add_file(git_utils.FileInfo(
-                    d, os.path.relpath(canonical_dir, base_dir), mode=0o120000
-                ))
 
-        commit.add_file(versions_to_file_info(all_versions, deploy_prefix))
+def alias(cfg, identifier, aliases, update_aliases=False,
+          alias_type=AliasType.symlink, template=None, *, branch='gh-pages',
+          message=None, allow_empty=False, deploy_prefix=''):
+    _apply_batch(lambda b: b.alias(cfg, identifier, aliases, update_aliases,
+                                   alias_type, template),
+                 branch=branch, message=message, allow_empty=allow_empty,
+                 deploy_prefix=deploy_prefix)
 
 
 def get_property(identifier, prop, *, branch='gh-pages', deploy_prefix=''):
@@ -228,81 +733,104 @@ def get_property(identifier, prop, *, branch='gh-pages', deploy_prefix=''):
     return info.get_property(prop)
 
 
-def set_properties(identifier, set_props, *, branch='gh-pages', message=None,
-                   allow_empty=False, deploy_prefix=''):
-    all_versions = list_versions(branch, deploy_prefix)
+def _select_versions(all_versions, identifiers, version_range, where):
     try:
-        real_version = all_versions.find(identifier, strict=True)[0]
-        info = all_versions[real_version]
+        return all_versions.select(identifiers, version_range=version_range,
+                                   where=where)
     except KeyError as e:
         raise ValueError('identifier {} does not exist'.format(e))
 
-    if message is None:
-        message = (
-            'Set properties for {doc_version}{deploy_prefix} with mike ' +
-            '{mike_version}'
-        ).format(
-            doc_version=real_version,
-            deploy_prefix=_format_deploy_prefix(deploy_prefix),
-            mike_version=app_version
-        )
 
-    for path, value in set_props:
-        info.set_property(path, value)
+def get_properties_all(props, *, identifiers=None, version_range=None,
+                       where=None, branch='gh-pages', deploy_prefix=''):
+    all_versions = list_versions(branch, deploy_prefix)
+    selected = _select_versions(all_versions, identifiers, version_range,
+                                where)
+    return all_versions.get_properties_all(props, versions=selected)
 
-    with git_utils.Commit(branch, message, allow_empty=allow_empty) as commit:
-        commit.add_file(versions_to_file_info(all_versions, deploy_prefix))
 
+def set_properties_all(set_props, *, identifiers=None, version_range=None,
+                       where=None, branch='gh-pages', message=None,
+                       allow_empty=False, deploy_prefix=''):
+    # Apply every change in memory so that we only need to write a single
+    # commit.
+    _apply_batch(lambda b: b.set_properties(set_props, identifiers,
+                                            version_range=version_range,
+                                            where=where),
+                 branch=branch, message=message, allow_empty=allow_empty,
+                 deploy_prefix=deploy_prefix)
 
-def retitle(identifier, title, *, branch='gh-pages', message=None,
-            allow_empty=False, deploy_prefix=''):
-    if message is None:
-        message = (
-            'Set title of {doc_identifier} to {title}{deploy_prefix} with ' +
-            'mike {mike_version}'
-        ).format(
-            doc_identifier=identifier,
-            title=title,
-            deploy_prefix=_format_deploy_prefix(deploy_prefix),
-            mike_version=app_version
-        )
 
-    all_versions = list_versions(branch, deploy_prefix)
-    try:
-        all_versions.update(identifier, title)
-    except KeyError:
-        raise ValueError('identifier {!r} does not exist'.format(identifier))
+def set_properties(identifier, set_props, *, branch='gh-pages', message=None,
+                   allow_empty=False, deploy_prefix=''):
+    set_properties_all(set_props, identifiers=[identifier], branch=branch,
+                       message=message, allow_empty=allow_empty,
+                       deploy_prefix=deploy_prefix)
 
-    with git_utils.Commit(branch, message, allow_empty=allow_empty) as commit:
-        commit.add_file(versions_to_file_info(all_versions, deploy_prefix))
+
+def retitle(identifier, title, *, branch='gh-pages', message=None,
+            allow_empty=False, deploy_prefix=''):
+    _apply_batch(lambda b: b.retitle(identifier, title), branch=branch,
+                 message=message, allow_empty=allow_empty,
+                 deploy_prefix=deploy_prefix)
 
 
 def set_default(identifier, template=None, allow_undefined=False, *,
                 branch='gh-pages', message=None, allow_empty=False,
                 deploy_prefix=''):
-    if message is None:
-        message = (
-            'Set default version to {doc_identifier}{deploy_prefix} with ' +
-            'mike {mike_version}'
-        ).format(
-            doc_identifier=identifier,
-            deploy_prefix=_format_deploy_prefix(deploy_prefix),
-            mike_version=app_version
-        )
+    _apply_batch(lambda b: b.set_default(identifier, template,
+                                         allow_undefined),
+                 branch=branch, message=message, allow_empty=allow_empty,
+                 deploy_prefix=deploy_prefix)
 
-    all_versions = list_versions(branch, deploy_prefix)
-    if not allow_undefined and not all_versions.find(identifier):
-        raise ValueError('identifier {!r} does not exist'.format(identifier))
-
-    t = _redirect_template(template)
-    with git_utils.Commit(branch, message, allow_empty=allow_empty) as commit:
-        commit.add_file(git_utils.FileInfo(
-            os.path.join(deploy_prefix, 'index.html'),
-            t.render(href=identifier + '/')
+
+def _merge_versions_file(path, base, ours, theirs):
+    # Combine concurrent changes to a `versions.json` file (e.g. from two jobs
+    # deploying different versions). Any other file changed on both sides is a
+    # conflict.
+    if ( posixpath.basename(path) != versions_file or
+         ours is None or theirs is None ):
+        return None
+
+    try:
+        merged = merge_versions(*(
+            Versions() if i is None else Versions.loads(i.decode('utf-8'))
+            for i in (base, ours, theirs)
         ))
+    except ValueError as e:
+        raise git_utils.GitMergeConflict(path, str(e))
+    return merged.dumps() + '\n'
+
+
+def push(remote='origin', branch='gh-pages', *, retries=0):
+    """Push `branch` to `remote`. If the push is rejected because someone else
+    pushed first, fetch their changes, replay ours on top of them (merging
+    `versions.json`), and push again, up to `retries` more times."""
+
+    upstream = '{}/{}'.format(remote, branch)
+    for attempt in range(retries + 1):
+        try:
+            return git_utils.push_branch(remote, branch)
+        except git_utils.GitPushRejected:
+            if attempt == retries:
+                raise
+
+        # Back off (with some jitter) so that deployers racing each other
+        # don't keep colliding.
+        time.sleep(min(push_retry_delay * 2 ** attempt, max_push_retry_delay) *
+                   random.uniform(0.5, 1))
+        git_utils.fetch_branch(remote, branch)
+        with git_utils.lock_branch(branch):
+            status = git_utils.compare_branches(branch, upstream)
+            if status == git_utils.BranchStatus.diverged:
+                git_utils.rebase_branch(branch, upstream,
+                                        _merge_versions_file)
 
 
 def serve(address='localhost:8000', *, branch='gh-pages', verbose=True):
+    import http.server
+    from . import server
+
     my_branch = branch
 
     class Handler(server.GitBranchHTTPHandler):
@@ -320,3 +848,32 @@ def serve(address='localhost:8000', *, branch='gh-pages', verbose=True):
     except KeyboardInterrupt:
         if verbose:
             print('Stopping server...')
+
+
+def receive(address='localhost:8000', *, verbose=True, **kwargs):
+    import http.server
+    from . import receiver
+
+    my_receiver = receiver.Receiver(**kwargs)
+
+    class Handler(receiver.ReceiveHTTPHandler):
+        receiver = my_receiver
+
+    host, *port = address.split(':', 1)
+    port = int(port[0]) if port else 8000
+    httpd = http.server.ThreadingHTTPServer((host, port), Handler)
+
+    if verbose:
+        print('Receiving uploads at http://{}:{}/deploy'.format(
+            *httpd.server_address[:2]
+        ), flush=True)
+        print('Press Ctrl+C to quit.', flush=True)
+    my_receiver.start()
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        if verbose:
+            print('Stopping server...')
+    finally:
+        httpd.server_close()
+        my_receiver.stop()
@@ -0,0 +1,452 @@
+"""
+A long-running server that handles `mike deploy`, `mike alias`, and `mike list`
+for clients connecting over a Unix domain socket. The server keeps MkDocs
+imported; for every request, it forks a child that runs the command with the
+client's working directory, environment, and standard streams (passed over the
+socket), so forwarding a command to the daemon behaves just like running it
+directly, minus the startup cost. Builds run in a fork of that child rather
+than in a new MkDocs process, so they don't pay that cost either.
+
+Requests that commit to the same branch of the same repository run one at a
+time. When coalescing is enabled, requests for a branch that queue up while
+another is running are handled together, and their commits are squashed into
+one (which is pushed once, if any of them asked to push).
+"""
+
+import array
+import io
+import json
+import os
+import selectors
+import signal
+import socket
+import sys
+import traceback
+import warnings
+from contextlib import contextmanager, ExitStack, redirect_stderr
+
+from . import commands
+from . import git_utils
+
+socket_var = 'MIKE_DAEMON_SOCKET'
+disable_var = 'MIKE_NO_DAEMON'
+
+_header_size = 4
+_stream_fds = (0, 1, 2)
+
+
+def supported():
+    return hasattr(socket, 'AF_UNIX') and hasattr(os, 'fork')
+
+
+def default_socket_path():
+    return os.path.join(git_utils.get_git_dir(), 'mike', 'daemon.sock')
+
+
+def socket_path():
+    if os.environ.get(socket_var):
+        return os.environ[socket_var]
+
+    # Look for the `.git` directory ourselves rather than running `git`, since
+    # this happens for every command that could be forwarded, even when no
+    # daemon is running. For anything unusual (e.g. `$GIT_DIR` or a worktree,
+    # whose `.git` is a file), let Git work it out.
+    if 'GIT_DIR' not in os.environ and 'GIT_COMMON_DIR' not in os.environ:
+        path = os.getcwd()
+        while True:
+            dot_git = os.path.join(path, '.git')
+            if os.path.isdir(dot_git):
+                return os.path.join(dot_git, 'mike', 'daemon.sock')
+            elif os.path.exists(dot_git):
+                break
+
+            parent = os.path.dirname(path)
+            if parent == path:
+                return None
+            path = parent
+
+    try:
+        return default_socket_path()
+    except git_utils.GitError:
+        return None
+
+
+def _recv_exact(sock, size):
+    data = b''
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError('connection closed unexpectedly')
+        data += chunk
+    return data
+
+
+def send_message(sock, data, fds=()):
+    payload = json.dumps(data).encode('utf-8')
+    ancdata = ([(socket.SOL_SOCKET, socket.SCM_RIGHTS, array.array('i', fds))]
+               if fds else [])
+    sock.sendmsg([len(payload).to_bytes(_header_size, 'big')], ancdata)
+    sock.sendall(payload)
+
+
+def recv_message(sock, max_fds=len(_stream_fds)):
+    fds = array.array('i')
+    header, ancdata, _, _ = sock.recvmsg(
+        _header_size, socket.CMSG_SPACE(max_fds * fds.itemsize)
+    )
+    for level, kind, data in ancdata:
+        if level == socket.SOL_SOCKET and kind == socket.SCM_RIGHTS:
+            fds.frombytes(data[:len(data) - (len(data) % fds.itemsize)])
+    if not header:
+        raise ConnectionError('connection closed unexpectedly')
+
+    header += _recv_exact(sock, _header_size - len(header))
+    size = int.from_bytes(header, 'big')
+    return json.loads(_recv_exact(sock, size).decode('utf-8')), list(fds)
+
+
+def _client_fds():
+    # Pass our standard streams to the daemon; if any are closed, give it
+    # /dev/null instead.
+    fds = []
+    for fd in _stream_fds:
+        try:
+            os.fstat(fd)
+            fds.append(fd)
+        except OSError:
+            fds.append(os.open(os.devnull, os.O_RDWR))
+    return fds
+
+
+def forward(argv):
+    """Run a mike command via the daemon, if one is running, returning its
+    exit code. If there's no daemon to forward to, return None."""
+
+    if os.environ.get(disable_var) or not supported():
+        return None
+    path = socket_path()
+    if not path or not os.path.exists(path):
+        return None
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    with sock:
+        try:
+            sock.connect(path)
+        except OSError:
+            # The daemon must have exited without cleaning up.
+            return None
+
+        sys.stdout.flush()
+        sys.stderr.flush()
+        send_message(sock, {'argv': argv, 'cwd': os.getcwd(),
+                            'env': dict(os.environ)}, _client_fds())
+        try:
+            return recv_message(sock)[0]['returncode']
+        except (ConnectionError, KeyError, ValueError):
+            sys.stderr.write('error: lost connection to mike daemon\n')
+            return 1
+
+
+@contextmanager
+def _request_context(request):
+    old_cwd = os.getcwd()
+    old_env = dict(os.environ)
+    os.chdir(request.cwd)
+    os.environ.clear()
+    os.environ.update(request.env)
+    try:
+        yield
+    finally:
+        os.chdir(old_cwd)
+        os.environ.clear()
+        os.environ.update(old_env)
+
+
+class Request:
+    def __init__(self, conn, argv, cwd, env, fds):
+        self.conn = conn
+        self.argv = argv
+        self.cwd = cwd
+        self.env = env
+        self.fds = fds
+
+    def close(self):
+        self.conn.close()
+        for fd in self.fds:
+            os.close(fd)
+
+
+class Daemon:
+    def __init__(self, path, *, coalesce=False, log=None):
+        from . import driver
+
+        self.path = path
+        self.coalesce = coalesce
+        self.log = log or sys.stdout
+
+        self._driver = driver
+        self._parser = driver.make_parser()
+        self._queues = {}
+        self._running = set()
+        self._jobs = {}
+        self._listener = None
+
+    def _log(self, message):
+        self.log.write(message + '\n')
+        self.log.flush()
+
+    def _parse(self, argv):
+        # Argument errors are reported to the client when it runs the command,
+        # so don't print anything here.
+        with redirect_stderr(io.StringIO()):
+            try:
+                return self._parser.parse_args(argv)
+            except SystemExit:
+                return None
+
+    def _branch_key(self, request):
+        # Work out which repository and branch this request will commit to (if
+        # any) from its arguments alone; loading the project's config here
+        # would hold up every other client while we do it. If the branch comes
+        # from the config, key on where the config is found instead, and let
+        # the child look up the branch itself.
+        driver = self._driver
+        args = self._parse(request.argv)
+        if args is None or args.func not in (driver.deploy, driver.alias):
+            return None
+
+        try:
+            with _request_context(request):
+                git_dir = git_utils.get_git_dir()
+        except git_utils.GitError:
+            # The command will fail without a repository, but still run it
+            # one at a time along with anything else in this directory.
+            git_dir = os.path.abspath(request.cwd)
+
+        if args.branch is not None:
+            return git_dir, args.branch
+        config_file = args.config_file
+        if isinstance(config_file, list):
+            config_file = tuple(config_file)
+        return git_dir, None, request.cwd, config_file
+
+    def _resolve_branch(self, request):
+        # Load the project's config to find the branch a request commits to.
+        # This process keeps the config cached, so the commands in this job
+        # don't have to load it again.
+        driver = self._driver
+        args = self._parser.parse_args(request.argv)
+        with _request_context(request):
+            if args.func == driver.deploy:
+                driver.load_deploy_projects(args)
+            else:
+                driver.load_mkdocs_config(args, full=False)
+        return args.branch
+
+    def _accept(self):
+        conn, _ = self._listener.accept()
+        conn.settimeout(5)
+        try:
+            data, fds = recv_message(conn)
+            request = Request(conn, data['argv'], data['cwd'], data['env'],
+                              fds)
+        except Exception as e:
+            self._log('invalid request: {}'.format(e))
+            conn.close()
+            return
+
+        conn.settimeout(None)
+        key = self._branch_key(request)
+        self._queues.setdefault(key, []).append(request)
+        self._schedule(key)
+
+    def _schedule(self, key):
+        queue = self._queues.get(key)
+        if not queue:
+            return
+        # Requests that don't commit to a branch can all run right away.
+        if key is None:
+            del self._queues[key]
+            for i in queue:
+                self._start_job(key, [i])
+            return
+
+        if key in self._running:
+            return
+        if self.coalesce:
+            requests = queue[:]
+            del queue[:]
+        else:
+            requests = [queue.pop(0)]
+        self._start_job(key, requests)
+
+    def _start_job(self, key, requests):
+        for i in requests:
+            self._log('running: mike {}'.format(' '.join(i.argv)))
+        if len(requests) > 1:
+            self._log('coalescing {} requests for {}'.format(
+                len(requests), key[1] or 'default branch'
+            ))
+
+        pid = os.fork()
+        if pid == 0:  # pragma: no cover
+            returncode = 1
+            try:
+                self._listener.close()
+                signal.signal(signal.SIGINT, signal.SIG_DFL)
+                signal.signal(signal.SIGTERM, signal.SIG_DFL)
+                self._run_job(key, requests)
+                returncode = 0
+            finally:
+                os._exit(returncode)
+
+        if key is not None:
+            self._running.add(key)
+        self._jobs[pid] = key
+        for i in requests:
+            i.close()
+
+    def _run_command(self, request, *, push=True):
+        driver = self._driver
+        sys.stdout.flush()
+        sys.stderr.flush()
+        for fd, target in zip(request.fds, _stream_fds):
+            os.dup2(fd, target)
+
+        pushes = []
+        try:
+            with _request_context(request), warnings.catch_warnings():
+                warnings.showwarning = driver.showwarning
+                args = self._parser.parse_args(request.argv)
+                if not push and getattr(args, 'push', False):
+                    args.push = False
+                    pushes.append((args.remote, args.branch,
+                                   args.push_retries))
+                returncode = driver.execute(self._parser, args) or 0
+        except SystemExit as e:
+            if e.code is None or isinstance(e.code, int):
+                returncode = e.code or 0
+            else:
+                sys.stderr.write('{}\n'.format(e.code))
+                returncode = 1
+        except BaseException:
+            traceback.print_exc()
+            returncode = 1
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+        return returncode, pushes
+
+    def _run_job(self, key, requests):
+        with ExitStack() as stack:
+            branch = base = None
+            if len(requests) > 1:
+                try:
+                    branch = key[1] or self._resolve_branch(requests[0])
+                except Exception:
+                    # Each command will report the error itself, so just run
+                    # them one after another.
+                    pass
+            coalescing = branch is not None
+            if coalescing:
+                # Hold the branch's lock for the whole job so that no other
+                # process's commits end up squashed in with ours.
+                with _request_context(requests[0]):
+                    stack.enter_context(git_utils.lock_branch(branch))
+                    base = git_utils.get_head(branch) or None
+
+            results = []
+            pushes = set()
+            for request in requests:
+                returncode, request_pushes = self._run_command(
+                    request, push=not coalescing
+                )
+                results.append(returncode)
+                pushes.update(request_pushes)
+
+            if coalescing:
+                results = self._finish_coalesced(branch, requests, results,
+                                                 base, pushes)
+
+        for request, returncode in zip(requests, results):
+            try:
+                send_message(request.conn, {'returncode': returncode})
+            except OSError:
+                pass
+
+    def _finish_coalesced(self, branch, requests, results, base, pushes):
+        try:
+            with _request_context(requests[0]):
+                git_utils.squash_commits(branch, base)
+                for remote, push_branch, retries in sorted(pushes):
+                    commands.push(remote, push_branch, retries=retries)
+        except Exception as e:
+            error = 'error: {}\n'.format(e).encode('utf-8')
+            for request in requests:
+                os.write(request.fds[2], error)
+            return [1] * len(requests)
+        return results
+
+    def _reap(self):
+        while self._jobs:
+            pid, _ = os.waitpid(-1, os.WNOHANG)
+            if pid == 0:
+                break
+            key = self._jobs.pop(pid, None)
+            self._running.discard(key)
+            self._schedule(key)
+
+    def _listen(self):
+        if os.path.exists(self.path):
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            with probe:
+                try:
+                    probe.connect(self.path)
+                    raise ValueError('mike daemon already running at {}'
+                                     .format(self.path))
+                except OSError:
+                    os.remove(self.path)
+
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)),
+                    exist_ok=True)
+        self._listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._listener.bind(self.path)
+        self._listener.listen()
+
+    def serve_forever(self):
+        from . import mkdocs_utils
+
+        if not supported():  # pragma: no cover
+            raise ValueError('mike daemon is not supported on this platform')
+
+        # Import MkDocs (including its command line and build machinery) now,
+        # and build in a fork of each request's process, so that builds don't
+        # have to import it all again.
+        import importlib
+        import mkdocs.commands.build  # noqa: F401
+        import mkdocs.config  # noqa: F401
+        import mkdocs.plugins  # noqa: F401
+        importlib.import_module(mkdocs_utils._program().name + '.__main__')
+        mkdocs_utils.enable_forked_builds()
+        mkdocs_utils.enable_config_cache()
+
+        def terminate(signum, frame):
+            raise KeyboardInterrupt()
+
+        signal.signal(signal.SIGTERM, terminate)
+        self._listen()
+        selector = selectors.DefaultSelector()
+        selector.register(self._listener, selectors.EVENT_READ)
+        self._log('listening on {}'.format(self.path))
+        try:
+            while True:
+                for _ in selector.select(timeout=0.1):
+                    self._accept()
+                self._reap()
+        finally:
+            selector.close()
+            self._listener.close()
+            try:
+                os.remove(self.path)
+            except OSError:  # pragma: no cover
+                pass
@@ -2,15 +2,19 @@ import json
 import os
 import sys
 import warnings
-from contextlib import contextmanager
+from argparse import Namespace
+from contextlib import contextmanager, ExitStack, nullcontext
+from functools import partial
+from tempfile import TemporaryDirectory
 
 from . import arguments
-from . import commands
 from . import git_utils
 from . import jsonpath
-from . import mkdocs_utils
 from .app_version import version as app_version
-from .mkdocs_plugin import MikePlugin
+
+# The names of each `commands.AliasType`, so that building the parser doesn't
+# need to import `commands`; these should match the enum.
+alias_types = ['symlink', 'copy', 'redirect']
 
 description = """
 mike is a utility to make it easy to deploy multiple versions of your
@@ -25,6 +29,20 @@ Build the current documentation and deploy it to the specified version (and
 aliases, if any) on the target branch.
 """
 
+deploy_matrix_desc = """
+Build several versions of the documentation from different Git refs in
+parallel and deploy all of them to the target branch in a single commit. FILE
+is a YAML or JSON file (or `-` for stdin) mapping each version to a Git ref, or
+to an object with `ref`, and optionally `title` and `aliases`, fields.
+"""
+
+batch_desc = """
+Apply several operations to the target branch in a single commit. FILE is a
+YAML or JSON file (or `-` for stdin) containing a list of steps, each mapping
+one of `deploy`, `alias`, `retitle`, `props`, `set-default`, or `delete` to
+its arguments.
+"""
+
 delete_desc = """
 Delete the documentation for the specified versions or aliases from the target
 branch. If deleting a version, that version and all its aliases will be
@@ -37,7 +55,8 @@ the target branch.
 """
 
 props_desc = """
-Get or set properties for the specified version.
+Get or set properties for the specified version. To get properties for every
+version at once, pass `--all PROP` instead of IDENTIFIER.
 
 When getting or setting a particular property, you can specify it with a
 limited JSONPath-like syntax. You can use bare field names, quoted field names,
@@ -72,6 +91,44 @@ serve_desc = """
 Start the development server, serving pages from the target branch.
 """
 
+receive_desc = """
+Start an HTTP server that deploys prebuilt sites uploaded by other machines.
+Send each site as a tar archive (optionally compressed) in the body of a POST
+request to `/deploy`, passing the version and other metadata in the query
+string: `version`, `title`, `alias` (may be repeated), `update-aliases`,
+`alias-type`, `set` and `set-string` (each as `PROP=VALUE`, may be repeated),
+`branch` (which must be the target branch or one passed to `--allow-branch`),
+and `rev` (the source revision, used in the commit message).
+Uploads for the same branch that arrive while another commit is being made are
+deployed together in a single commit, and each commit is pushed once if
+`--push` is set. The response is sent once the upload has been committed.
+"""
+
+daemon_desc = """
+Start a server that keeps MkDocs loaded and handles `mike deploy`, `mike
+alias`, and `mike list` for the current repository. While it's running, those
+commands are forwarded to the server automatically (set `MIKE_NO_DAEMON=1` to
+prevent this). Requests that commit to the same branch are run one at a time.
+"""
+
+cache_desc = """
+Manage mike's cache of data derived from your Git repository (e.g. parsed
+versions.json files and hashes of built files), stored in `.git/mike/cache`.
+"""
+
+cache_clear_desc = """
+Delete all of mike's cached data for the current repository.
+"""
+
+maintain_desc = """
+Repack the Git repository's objects (including the many small packs that
+mike's commits leave behind) into a single pack, and refresh the commit-graph
+and multi-pack-index, keeping long-lived clones fast. mike also does this
+automatically after a commit once there are 50 or more packs or 6700 or more
+loose objects (set `MIKE_PACK_LIMIT` or `MIKE_LOOSE_LIMIT` to change this, or
+`MIKE_PACK_LIMIT` to 0 to disable it).
+"""
+
 generate_completion_desc = """
 Generate shell-completion functions for bfg9000 and write them to standard
 output. This requires the Python package `shtab`.
@@ -82,10 +139,16 @@ def showwarning(message, category, filename, lineno, file=None, line=None):
     sys.stderr.write('warning: {}\n'.format(message))
 
 
-def add_git_arguments(parser, *, commit=True, deploy_prefix=True):
+def add_git_arguments(parser, *, commit=True, deploy_prefix=True,
+                      multiple_projects=False):
+    # When deploying multiple projects at once, `--config-file` and
+    # `--deploy-prefix` can be passed several times, once for each project.
+    action = 'append' if multiple_projects else 'store'
+
     # Add this whenever we add git arguments since we pull the remote and
     # branch from mkdocs.yml.
     parser.add_argument('-F', '--config-file', metavar='FILE', complete='file',
+                        action=action,
                         help='the MkDocs configuration file to use')
 
     git = parser.add_argument_group('git arguments')
@@ -98,12 +161,16 @@ def add_git_arguments(parser, *, commit=True, deploy_prefix=True):
         git.add_argument('-m', '--message', help='commit message')
         git.add_argument('-p', '--push', action='store_true',
                          help='push to {remote}/{branch} after commit')
+        git.add_argument('--push-retries', metavar='N', type=int, default=0,
+                         help=('if {remote}/{branch} changed before we ' +
+                               'could push, merge in its changes and push ' +
+                               'again, up to N times (default: 0)'))
         git.add_argument('--allow-empty', action='store_true',
                          help='allow commits with no changes')
 
     if deploy_prefix:
         git.add_argument('--deploy-prefix', metavar='PATH',
-                         complete='directory',
+                         complete='directory', action=action,
                          help=('subdirectory within {branch} where ' +
                                'generated docs should be deployed to'))
 
@@ -111,11 +178,12 @@ def add_git_arguments(parser, *, commit=True, deploy_prefix=True):
                      help="don't check status of remote branch")
 
 
-def add_set_prop_arguments(parser, *, prefix=''):
-    def parse_set_json(expression):
-        result = jsonpath.parse_set(expression)
-        return result[0], json.loads(result[1])
+def parse_set_json(expression):
+    result = jsonpath.parse_set(expression)
+    return result[0], json.loads(result[1])
 
+
+def add_set_prop_arguments(parser, *, prefix=''):
     prop_p = parser.add_argument_group('property manipulation arguments')
     prop_p.add_argument('--{}set'.format(prefix), metavar='PROP=JSON',
                         action='append', type=parse_set_json, dest='set_props',
@@ -138,29 +206,39 @@ def add_set_prop_arguments(parser, *, prefix=''):
     return prop_p
 
 
-def load_mkdocs_config(args, strict=False):
+def load_mkdocs_config(args, strict=False, *, full=True):
+    from . import mkdocs_utils
+
     def maybe_set(args, cfg, field, cfg_field=None):
         if getattr(args, field, object()) is None:
             setattr(args, field, cfg[cfg_field or field])
 
     try:
-        cfg = mkdocs_utils.load_config(args.config_file)
-        plugin = cfg['plugins'].get('mike') or MikePlugin.default()
+        # Commands that don't build the docs only need a few fields from the
+        # config, so avoid loading the whole thing for them.
+        if full:
+            from .mkdocs_plugin import MikePlugin
+            cfg = mkdocs_utils.load_config(args.config_file)
+            plugin_config = (cfg['plugins'].get('mike') or
+                             MikePlugin.default()).config
+        else:
+            cfg = mkdocs_utils.resolve_config(args.config_file)
+            plugin_config = cfg['plugins']['mike']
 
         maybe_set(args, cfg, 'branch', 'remote_branch')
         maybe_set(args, cfg, 'remote', 'remote_name')
-        maybe_set(args, plugin.config, 'alias_type')
-        maybe_set(args, plugin.config, 'template', 'redirect_template')
-        maybe_set(args, plugin.config, 'deploy_prefix')
+        maybe_set(args, plugin_config, 'alias_type')
+        maybe_set(args, plugin_config, 'template', 'redirect_template')
+        maybe_set(args, plugin_config, 'deploy_prefix')
         return cfg
     except FileNotFoundError as e:
         if strict:
             raise
 
-        plugin = MikePlugin.default()
-        maybe_set(args, plugin.config, 'alias_type')
-        maybe_set(args, plugin.config, 'template', 'redirect_template')
-        maybe_set(args, plugin.config, 'deploy_prefix')
+        plugin_config = mkdocs_utils.plugin_defaults
+        maybe_set(args, plugin_config, 'alias_type')
+        maybe_set(args, plugin_config, 'template', 'redirect_template')
+        maybe_set(args, plugin_config, 'deploy_prefix')
         if args.branch is None or args.remote is None:
             raise FileNotFoundError(
                 '{}; pass --config-file or set --remote/--branch explicitly'
@@ -191,35 +269,426 @@ def handle_empty_commit():
                       '--allow-empty')
 
 
+def load_projects(args):
+    config_files = args.config_file or [None]
+    deploy_prefixes = args.deploy_prefix or [None] * len(config_files)
+    if len(config_files) != len(deploy_prefixes):
+        raise ValueError('--config-file and --deploy-prefix must be passed ' +
+                         'the same number of times')
+
+    projects = []
+    for config_file, deploy_prefix in zip(config_files, deploy_prefixes):
+        project_args = Namespace(**vars(args))
+        project_args.config_file = config_file
+        project_args.deploy_prefix = deploy_prefix
+        cfg = load_mkdocs_config(project_args, strict=True)
+        projects.append((cfg, project_args))
+
+    if len({(i.branch, i.remote) for _, i in projects}) != 1:
+        raise ValueError('all projects must use the same remote and branch')
+    args.branch = projects[0][1].branch
+    args.remote = projects[0][1].remote
+    return projects
+
+
+def load_deploy_projects(args):
+    if not (args.from_archive or args.from_dir):
+        return load_projects(args)
+
+    # A prebuilt site doesn't need MkDocs at all; just read the few fields we
+    # need from the config.
+    if len(args.config_file or [None]) != 1 or \
+       len(args.deploy_prefix or [None]) != 1:
+        raise ValueError('--from-archive and --from-dir cannot be used with ' +
+                         'multiple projects')
+    if args.from_dir and not os.path.isdir(args.from_dir):
+        raise ValueError('{!r} is not a directory'.format(args.from_dir))
+    args.config_file = (args.config_file or [None])[0]
+    args.deploy_prefix = (args.deploy_prefix or [None])[0]
+    cfg = load_mkdocs_config(args, full=False)
+    return [({'site_dir': args.from_dir or '',
+              'use_directory_urls': (cfg['use_directory_urls'] if cfg
+                                     else True)}, args)]
+
+
+def parse_target(value):
+    from . import commands
+
+    remote, sep, rest = value.partition(':')
+    branch, _, deploy_prefix = rest.partition(':')
+    if not remote or not branch:
+        raise arguments.ArgumentTypeError(
+            'expected REMOTE:BRANCH[:PREFIX], got {!r}'.format(value)
+        )
+    return commands.Target(branch, remote, deploy_prefix)
+
+
+def parse_range(value):
+    from . import versions
+
+    try:
+        return versions.parse_range(value)
+    except ValueError as e:
+        raise arguments.ArgumentTypeError(str(e))
+
+
+def push_branch(args):
+    from . import commands
+
+    commands.push(args.remote, args.branch, retries=args.push_retries)
+
+
+def push_targets(targets, retries=0):
+    from concurrent.futures import ThreadPoolExecutor
+    from . import commands
+
+    with ThreadPoolExecutor() as executor:
+        pushes = [executor.submit(commands.push, i.remote, i.branch,
+                                  retries=retries)
+                  for i in targets]
+        for i in pushes:
+            i.result()
+
+
 def deploy(parser, args):
+    from . import commands
+    from . import mkdocs_utils
+
+    projects = load_deploy_projects(args)
+    if args.targets and len(projects) > 1:
+        raise ValueError('--target cannot be used with multiple projects')
+    prebuilt = args.from_archive or args.from_dir
+
+    with handle_empty_commit():
+        deploy_projects = [
+            commands.Project(cfg, i.deploy_prefix,
+                             commands.AliasType[i.alias_type], i.template)
+            for cfg, i in projects
+        ]
+        targets = [commands.Target(args.branch, args.remote,
+                                   deploy_projects[0].deploy_prefix)]
+        targets += args.targets or []
+
+        with ExitStack() as stack:
+            # Build each project in parallel.
+            waits = []
+            for _, i in ([] if prebuilt else projects):
+                config_file = stack.enter_context(
+                    mkdocs_utils.inject_plugin(i.config_file)
+                )
+                waits.append(stack.enter_context(
+                    mkdocs_utils.build_in_background(
+                        config_file, args.version, quiet=args.quiet,
+                        dirty=args.dirty
+                    )
+                ))
+
+            # Prepare everything on the Git side while the builds are running.
+            for i in targets:
+                check_remote_status(Namespace(**dict(
+                    vars(args), remote=i.remote, branch=i.branch
+                )), strict=True)
+
+            kwargs = dict(message=args.message, allow_empty=args.allow_empty,
+                          set_props=args.set_props or [],
+                          incremental=args.dirty)
+            if args.from_archive:
+                # Read the files straight from the archive into each commit.
+                kwargs['walk_site'] = partial(git_utils.walk_archive_files,
+                                              args.from_archive)
+            if len(targets) > 1:
+                project = deploy_projects[0]
+                deployment = commands.deploy(
+                    project.cfg, args.version, args.title, args.aliases,
+                    args.update_aliases, project.alias_type, project.template,
+                    targets=targets, **kwargs
+                )
+            else:
+                deployment = commands.deploy_projects(
+                    deploy_projects, args.version, args.title, args.aliases,
+                    args.update_aliases, branch=args.branch, **kwargs
+                )
+
+            with deployment:
+                for wait in waits:
+                    wait()
+        if args.push:
+            push_targets(targets, args.push_retries)
+
+
+def load_build_matrix(filename):
+    import yaml
+    from . import commands
+
+    with (nullcontext(sys.stdin) if filename == '-' else
+          open(filename)) as f:
+        # Use the base loader so that versions like `1.10` stay as strings.
+        data = yaml.load(f, Loader=yaml.BaseLoader)
+
+    if not isinstance(data, dict):
+        raise ValueError('build matrix must map versions to Git refs')
+
+    entries = []
+    for version, value in data.items():
+        if isinstance(value, str):
+            value = {'ref': value}
+        elif not isinstance(value, dict) or 'ref' not in value:
+            raise ValueError('no Git ref specified for version {!r}'
+                             .format(version))
+
+        aliases = value.get('aliases', [])
+        if isinstance(aliases, str):
+            aliases = [aliases]
+        elif ( not isinstance(aliases, list) or
+               not all(isinstance(i, str) for i in aliases) ):
+            raise ValueError(('aliases for version {!r} must be a list of ' +
+                              'strings').format(version))
+        entries.append(commands.MatrixEntry(
+            version, value['ref'], value.get('title'), aliases
+        ))
+    return entries
+
+
+def deploy_matrix(parser, args):
+    from . import commands
+
     cfg = load_mkdocs_config(args, strict=True)
+    entries = load_build_matrix(args.matrix)
     check_remote_status(args, strict=True)
     with handle_empty_commit():
         alias_type = commands.AliasType[args.alias_type]
-        with commands.deploy(cfg, args.version, args.title, args.aliases,
-                             args.update_aliases, alias_type, args.template,
-                             branch=args.branch, message=args.message,
-                             allow_empty=args.allow_empty,
-                             deploy_prefix=args.deploy_prefix,
-                             set_props=args.set_props or []), \
-             mkdocs_utils.inject_plugin(args.config_file) as config_file:
-            mkdocs_utils.build(config_file, args.version, quiet=args.quiet)
+        commands.deploy_matrix(cfg, entries, args.update_aliases, alias_type,
+                               args.template, config_file=args.config_file,
+                               jobs=args.jobs, quiet=args.quiet,
+                               branch=args.branch, message=args.message,
+                               allow_empty=args.allow_empty,
+                               deploy_prefix=args.deploy_prefix)
+        if args.push:
+            push_branch(args)
+
+
+_batch_fields = {
+    'deploy': {'version', 'title', 'aliases', 'update-aliases', 'alias-type',
+               'template', 'set', 'set-string', 'delete'},
+    'alias': {'identifier', 'aliases', 'update-aliases', 'alias-type',
+              'template'},
+    'retitle': {'identifier', 'title'},
+    'props': {'identifier', 'identifiers', 'range', 'where', 'set',
+              'set-string', 'delete'},
+    'set-default': {'identifier', 'template', 'allow-undefined'},
+    'delete': {'identifiers', 'all'},
+}
+
+
+def load_batch_script(filename):
+    import yaml
+
+    with (nullcontext(sys.stdin) if filename == '-' else
+          open(filename)) as f:
+        # Use the base loader so that versions like `1.10` stay as strings.
+        data = yaml.load(f, Loader=yaml.BaseLoader)
+
+    if not isinstance(data, list):
+        raise ValueError('batch script must be a list of steps')
+
+    steps = []
+    for step in data:
+        if not isinstance(step, dict) or len(step) != 1:
+            raise ValueError('each batch step must map a command to its ' +
+                             'arguments')
+        (command, step_args), = step.items()
+        if command not in _batch_fields:
+            raise ValueError('unknown batch command {!r}'.format(command))
+        if not isinstance(step_args, dict):
+            raise ValueError('arguments for {!r} must be a mapping'
+                             .format(command))
+        unknown = set(step_args) - _batch_fields[command]
+        if unknown:
+            raise ValueError('unknown argument {!r} for {!r}'
+                             .format(min(unknown), command))
+        steps.append((command, step_args))
+    return steps
+
+
+def _batch_required(command, step_args, field):
+    try:
+        value = step_args[field]
+    except KeyError:
+        raise ValueError('missing argument {!r} for {!r}'
+                         .format(field, command))
+    if not isinstance(value, str):
+        raise ValueError('expected a string for {!r}, got {!r}'
+                         .format(field, value))
+    return value
+
+
+def _batch_str(step_args, field, default=None):
+    value = step_args.get(field, default)
+    if value is not default and not isinstance(value, str):
+        raise ValueError('expected a string for {!r}, got {!r}'
+                         .format(field, value))
+    return value
+
+
+def _batch_list(step_args, field):
+    value = step_args.get(field, [])
+    if isinstance(value, str):
+        return [value]
+    if not isinstance(value, list) or \
+       not all(isinstance(i, str) for i in value):
+        raise ValueError('expected a list of strings for {!r}, got {!r}'
+                         .format(field, value))
+    return value
+
+
+def _batch_bool(step_args, field):
+    value = step_args.get(field, 'false')
+    if isinstance(value, str):
+        if value.lower() in ('true', 'yes', 'on'):
+            return True
+        elif value.lower() in ('false', 'no', 'off'):
+            return False
+    raise ValueError('expected a boolean for {!r}, got {!r}'
+                     .format(field, value))
+
+
+def _batch_alias_type(step_args, args):
+    from . import commands
+
+    name = _batch_str(step_args, 'alias-type', args.alias_type)
+    try:
+        return commands.AliasType[name]
+    except KeyError:
+        raise ValueError('unknown alias type {!r}'.format(name))
+
+
+def _batch_set_props(step_args):
+    return (
+        [parse_set_json(i) for i in _batch_list(step_args, 'set')] +
+        [jsonpath.parse_set(i) for i in _batch_list(step_args, 'set-string')] +
+        [(jsonpath.parse(i), jsonpath.Deleted)
+         for i in _batch_list(step_args, 'delete')]
+    )
+
+
+def parse_batch_step(command, step_args, args):
+    """Check the arguments for a batch step, returning a function that applies
+    the step to a batch, given the config for the step (for `deploy`, this
+    includes the site it built)."""
+
+    from . import versions
+
+    required = partial(_batch_required, command, step_args)
+    template = _batch_str(step_args, 'template', args.template)
+    if command == 'deploy':
+        deploy_args = (required('version'), _batch_str(step_args, 'title'),
+                       _batch_list(step_args, 'aliases'),
+                       _batch_bool(step_args, 'update-aliases'),
+                       _batch_alias_type(step_args, args), template,
+                       _batch_set_props(step_args))
+        return lambda b, cfg, **kwargs: b.deploy(cfg, *deploy_args, **kwargs)
+    elif command == 'alias':
+        alias_args = (required('identifier'),
+                      _batch_list(step_args, 'aliases'),
+                      _batch_bool(step_args, 'update-aliases'),
+                      _batch_alias_type(step_args, args), template)
+        return lambda b, cfg: b.alias(cfg, *alias_args)
+    elif command == 'retitle':
+        retitle_args = (required('identifier'), required('title'))
+        return lambda b, cfg: b.retitle(*retitle_args)
+    elif command == 'props':
+        identifiers = _batch_list(step_args, 'identifiers')
+        if 'identifier' in step_args:
+            identifiers = [required('identifier')] + identifiers
+        version_range = _batch_str(step_args, 'range')
+        props_args = (
+            _batch_set_props(step_args), identifiers or None,
+            versions.parse_range(version_range) if version_range else None,
+            [parse_set_json(i) for i in _batch_list(step_args, 'where')]
+        )
+
+        def set_properties(b, cfg):
+            set_props, identifiers, version_range, where = props_args
+            b.set_properties(set_props, identifiers,
+                             version_range=version_range, where=where)
+        return set_properties
+    elif command == 'set-default':
+        default_args = (required('identifier'), template,
+                        _batch_bool(step_args, 'allow-undefined'))
+        return lambda b, cfg: b.set_default(*default_args)
+    elif command == 'delete':
+        delete_args = (_batch_list(step_args, 'identifiers') or None,
+                       _batch_bool(step_args, 'all'))
+        return lambda b, cfg: b.delete(*delete_args)
+    else:  # pragma: no cover
+        raise ValueError('unknown batch command {!r}'.format(command))
+
+
+def batch(parser, args):
+    from . import cache
+    from . import commands
+    from . import mkdocs_utils
+
+    steps = load_batch_script(args.script)
+    building = any(command == 'deploy' for command, _ in steps)
+    cfg = load_mkdocs_config(args, strict=building, full=building)
+    operations = [parse_batch_step(command, step_args, args)
+                  for command, step_args in steps]
+    check_remote_status(args, strict=True)
+
+    with handle_empty_commit():
+        with ExitStack() as stack:
+            # Build (and hash) each deployed version into its own directory
+            # first, so that we only lock the branch while writing the commit.
+            step_kwargs = [{'cfg': cfg} for _ in steps]
+            if building:
+                config_file = stack.enter_context(
+                    mkdocs_utils.inject_plugin(args.config_file)
+                )
+                tmpdir = stack.enter_context(
+                    TemporaryDirectory(prefix='mike-')
+                )
+            for n, (command, step_args) in enumerate(steps):
+                if command != 'deploy':
+                    continue
+                site_dir = os.path.join(tmpdir, str(n))
+                mkdocs_utils.build(config_file, step_args['version'],
+                                   quiet=args.quiet, site_dir=site_dir)
+                site_files = cache.hash_real_files(site_dir)
+                step_kwargs[n] = {
+                    'cfg': {'site_dir': site_dir,
+                            'use_directory_urls': cfg['use_directory_urls']},
+                    'walk_site': lambda _, files=site_files: files,
+                }
+
+            def attempt():
+                with commands.batch(branch=args.branch, message=args.message,
+                                    allow_empty=args.allow_empty,
+                                    deploy_prefix=args.deploy_prefix) as b:
+                    for operation, kwargs in zip(operations, step_kwargs):
+                        operation(b, **kwargs)
+
+            git_utils.retry_on_conflict(attempt)
         if args.push:
-            git_utils.push_branch(args.remote, args.branch)
+            push_branch(args)
 
 
 def delete(parser, args):
-    load_mkdocs_config(args)
+    from . import commands
+
+    load_mkdocs_config(args, full=False)
     check_remote_status(args, strict=True)
     commands.delete(args.identifiers, args.all, branch=args.branch,
                     message=args.message, allow_empty=args.allow_empty,
                     deploy_prefix=args.deploy_prefix)
     if args.push:
-        git_utils.push_branch(args.remote, args.branch)
+        push_branch(args)
 
 
 def alias(parser, args):
-    cfg = load_mkdocs_config(args)
+    from . import commands
+
+    cfg = load_mkdocs_config(args, full=False)
     check_remote_status(args, strict=True)
     with handle_empty_commit():
         alias_type = commands.AliasType[args.alias_type]
@@ -228,23 +697,67 @@ def alias(parser, args):
                        message=args.message, allow_empty=args.allow_empty,
                        deploy_prefix=args.deploy_prefix)
         if args.push:
-            git_utils.push_branch(args.remote, args.branch)
+            push_branch(args)
+
+
+def print_table(header, rows):
+    widths = [max(len(i) for i in column) for column in zip(header, *rows)]
+    for row in [header] + rows:
+        print('  '.join(i.ljust(w) for i, w in zip(row, widths)).rstrip())
 
 
 def props(parser, args):
-    load_mkdocs_config(args)
+    from . import commands
+
+    selecting = (args.identifiers is not None or
+                 args.version_range is not None or args.where is not None)
+    if args.all_props is not None:
+        if args.identifier or args.set_props:
+            raise ValueError('--all cannot be used with IDENTIFIER or when ' +
+                             'setting properties')
+    elif args.table:
+        raise ValueError('--table requires --all')
+    elif selecting and not args.set_props:
+        raise ValueError('--identifier, --range, and --where require --all ' +
+                         'or setting properties')
+    elif not args.identifier and not selecting:
+        raise ValueError('IDENTIFIER is required')
+
+    load_mkdocs_config(args, full=False)
     check_remote_status(args, strict=args.set_props)
 
     if args.get_prop and args.set_props:
         raise ValueError('cannot get and set properties at the same time')
+    elif args.all_props is not None:
+        results = commands.get_properties_all(
+            args.all_props, identifiers=args.identifiers,
+            version_range=args.version_range, where=args.where,
+            branch=args.branch, deploy_prefix=args.deploy_prefix
+        )
+        if args.table:
+            print_table(['version'] + args.all_props, [
+                [str(info.version)] + [json.dumps(i) for i in values]
+                for info, values in results
+            ])
+        else:
+            for info, values in results:
+                print(json.dumps({
+                    'version': str(info.version),
+                    'properties': dict(zip(args.all_props, values)),
+                }))
     elif args.set_props:
+        identifiers = args.identifiers
+        if args.identifier:
+            identifiers = [args.identifier] + (identifiers or [])
         with handle_empty_commit():
-            commands.set_properties(args.identifier, args.set_props,
-                                    branch=args.branch, message=args.message,
-                                    allow_empty=args.allow_empty,
-                                    deploy_prefix=args.deploy_prefix)
+            commands.set_properties_all(
+                args.set_props, identifiers=identifiers,
+                version_range=args.version_range, where=args.where,
+                branch=args.branch, message=args.message,
+                allow_empty=args.allow_empty, deploy_prefix=args.deploy_prefix
+            )
             if args.push:
-                git_utils.push_branch(args.remote, args.branch)
+                push_branch(args)
     else:
         print(json.dumps(
             commands.get_property(args.identifier, args.get_prop,
@@ -254,17 +767,21 @@ def props(parser, args):
 
 
 def retitle(parser, args):
-    load_mkdocs_config(args)
+    from . import commands
+
+    load_mkdocs_config(args, full=False)
     check_remote_status(args, strict=True)
     with handle_empty_commit():
         commands.retitle(args.identifier, args.title, branch=args.branch,
                          message=args.message, allow_empty=args.allow_empty,
                          deploy_prefix=args.deploy_prefix)
         if args.push:
-            git_utils.push_branch(args.remote, args.branch)
+            push_branch(args)
 
 
 def list_versions(parser, args):
+    from . import commands
+
     def print_version(info):
         version = str(info.version)
         aliases = (' [{}]'.format(', '.join(sorted(info.aliases)))
@@ -278,11 +795,24 @@ def list_versions(parser, args):
                 version=version, aliases=aliases
             ))
 
-    load_mkdocs_config(args)
+    load_mkdocs_config(args, full=False)
     check_remote_status(args)
     all_versions = commands.list_versions(args.branch, args.deploy_prefix)
 
-    if args.identifier:
+    selecting = args.version_range is not None or args.where is not None
+    if selecting and args.identifier:
+        raise ValueError('cannot specify both IDENTIFIER and --range or ' +
+                         '--where')
+
+    if selecting:
+        selected = all_versions.select(version_range=args.version_range,
+                                       where=args.where)
+        if args.json:
+            print(json.dumps([i.to_json() for i in selected], indent=2))
+        else:
+            for i in selected:
+                print_version(i)
+    elif args.identifier:
         try:
             key = all_versions.find(args.identifier, strict=True)
             info = all_versions[key[0]]
@@ -300,7 +830,9 @@ def list_versions(parser, args):
 
 
 def set_default(parser, args):
-    load_mkdocs_config(args)
+    from . import commands
+
+    load_mkdocs_config(args, full=False)
     check_remote_status(args, strict=True)
     with handle_empty_commit():
         commands.set_default(args.identifier, args.template,
@@ -309,15 +841,47 @@ def set_default(parser, args):
                              allow_empty=args.allow_empty,
                              deploy_prefix=args.deploy_prefix)
         if args.push:
-            git_utils.push_branch(args.remote, args.branch)
+            push_branch(args)
 
 
 def serve(parser, args):
-    load_mkdocs_config(args)
+    from . import commands
+
+    load_mkdocs_config(args, full=False)
     check_remote_status(args)
     commands.serve(args.dev_addr, branch=args.branch)
 
 
+def receive(parser, args):
+    from . import commands
+
+    cfg = load_mkdocs_config(args, full=False)
+    check_remote_status(args, strict=True)
+    commands.receive(
+        args.addr, branch=args.branch, remote=args.remote,
+        deploy_prefix=args.deploy_prefix,
+        alias_type=commands.AliasType[args.alias_type],
+        template=args.template,
+        use_directory_urls=cfg['use_directory_urls'] if cfg else True,
+        message=args.message, allow_empty=args.allow_empty, push=args.push,
+        push_retries=args.push_retries, allowed_branches=args.allow_branch,
+        max_upload_size=args.max_upload_size
+    )
+
+
+def cache_clear(parser, args):
+    from . import cache
+
+    c = cache.get_cache()
+    if c is None:
+        raise ValueError('not a git repository')
+    c.clear()
+
+
+def maintain(parser, args):
+    git_utils.maintain()
+
+
 def help(parser, args):
     parser.parse_args(args.subcommand + ['--help'])
 
@@ -331,9 +895,21 @@ def generate_completion(parser, args):
         return 1
 
 
-def main():
-    warnings.showwarning = showwarning
+def start_daemon(parser, args):
+    from . import daemon
+
+    path = args.socket or daemon.default_socket_path()
+    try:
+        daemon.Daemon(path, coalesce=args.coalesce).serve_forever()
+    except KeyboardInterrupt:
+        pass
+
 
+# Commands that can be forwarded to a running `mike daemon`.
+daemon_commands = {deploy, alias, list_versions}
+
+
+def make_parser():
     parser = arguments.ArgumentParser(prog='mike', description=description)
     subparsers = parser.add_subparsers(metavar='COMMAND')
     subparsers.required = True
@@ -355,18 +931,69 @@ def main():
     deploy_p.add_argument('-u', '--update-aliases', action='store_true',
                           help='update aliases pointing to other versions')
     deploy_p.add_argument('--alias-type', metavar='TYPE',
-                          choices=[i.name for i in commands.AliasType],
+                          choices=alias_types,
                           help=('method for creating aliases (one of: ' +
                                 '%(choices)s; default: symlink)'))
     deploy_p.add_argument('-T', '--template', complete='file',
                           help='template file to use for redirects')
-    add_git_arguments(deploy_p)
+    deploy_p.add_argument('--dirty', action='store_true',
+                          help=('only rebuild changed files and commit only ' +
+                                'the files that differ from {branch}'))
+    prebuilt_p = deploy_p.add_mutually_exclusive_group()
+    prebuilt_p.add_argument('--from-archive', metavar='FILE', complete='file',
+                            help=('deploy a prebuilt site from a tar ' +
+                                  'archive (optionally compressed) instead ' +
+                                  'of building'))
+    prebuilt_p.add_argument('--from-dir', metavar='DIR',
+                            complete='directory',
+                            help=('deploy a prebuilt site from a directory ' +
+                                  'instead of building'))
+    add_git_arguments(deploy_p, multiple_projects=True)
+    deploy_p.add_argument('--target', metavar='REMOTE:BRANCH[:PREFIX]',
+                          action='append', type=parse_target, dest='targets',
+                          help=('additional branch (and optional deploy ' +
+                                'prefix) to deploy the same build to'))
     add_set_prop_arguments(deploy_p, prefix='prop-')
     deploy_p.add_argument('version', metavar='VERSION',
                           help='version to deploy this build to')
     deploy_p.add_argument('aliases', nargs='*', metavar='ALIAS',
                           help='additional alias for this build')
 
+    deploy_matrix_p = subparsers.add_parser(
+        'deploy-matrix', description=deploy_matrix_desc,
+        help='build docs from several Git refs and deploy them to a branch'
+    )
+    deploy_matrix_p.set_defaults(func=deploy_matrix)
+    deploy_matrix_p.add_argument('-u', '--update-aliases', action='store_true',
+                                 help=('update aliases pointing to other ' +
+                                       'versions'))
+    deploy_matrix_p.add_argument('--alias-type', metavar='TYPE',
+                                 choices=alias_types,
+                                 help=('method for creating aliases (one ' +
+                                       'of: %(choices)s; default: symlink)'))
+    deploy_matrix_p.add_argument('-T', '--template', complete='file',
+                                 help='template file to use for redirects')
+    deploy_matrix_p.add_argument('-j', '--jobs', metavar='N', type=int,
+                                 help='number of builds to run at once')
+    add_git_arguments(deploy_matrix_p)
+    deploy_matrix_p.add_argument('matrix', metavar='FILE', complete='file',
+                                 help='file mapping versions to Git refs')
+
+    batch_p = subparsers.add_parser(
+        'batch', description=batch_desc,
+        help='apply several operations to a branch in one commit'
+    )
+    batch_p.set_defaults(func=batch)
+    batch_p.add_argument('--alias-type', metavar='TYPE',
+                         choices=alias_types,
+                         help=('default method for creating aliases (one ' +
+                               'of: %(choices)s; default: symlink)'))
+    batch_p.add_argument('-T', '--template', complete='file',
+                         help='default template file to use for redirects')
+    add_git_arguments(batch_p)
+    batch_p.add_argument('script', metavar='FILE', complete='file',
+                         help='file listing the operations to apply')
+
     delete_p = subparsers.add_parser(
         'delete', description=delete_desc, help='delete docs from a branch'
     )
@@ -384,7 +1011,7 @@ def main():
     alias_p.add_argument('-u', '--update-aliases', action='store_true',
                          help='update aliases pointing to other versions')
     alias_p.add_argument('--alias-type', metavar='TYPE',
-                         choices=[i.name for i in commands.AliasType],
+                         choices=alias_types,
                          help=('method for creating aliases (one of: ' +
                                '%(choices)s; default: symlink)'))
     alias_p.add_argument('-T', '--template', complete='file',
@@ -402,7 +1029,25 @@ def main():
     props_p.set_defaults(func=props)
     add_git_arguments(props_p)
     add_set_prop_arguments(props_p)
-    props_p.add_argument('identifier', metavar='IDENTIFIER',
+    props_p.add_argument('--all', metavar='PROP', action='append',
+                         dest='all_props',
+                         help=('get a property for every version (can be ' +
+                               'passed multiple times)'))
+    props_p.add_argument('--table', action='store_true',
+                         help='with --all, display the result as a table')
+    select_p = props_p.add_argument_group('version selection arguments')
+    select_p.add_argument('--identifier', metavar='IDENTIFIER',
+                          action='append', dest='identifiers',
+                          help=('select a version or alias (can be passed ' +
+                                'multiple times)'))
+    select_p.add_argument('--range', metavar='RANGE', type=parse_range,
+                          dest='version_range',
+                          help="select versions in a range like '>=2.0,<3'")
+    select_p.add_argument('--where', metavar='PROP=JSON', action='append',
+                          type=parse_set_json,
+                          help=('select versions where the property at PROP ' +
+                                'equals a JSON value'))
+    props_p.add_argument('identifier', metavar='IDENTIFIER', nargs='?',
                          help='existing version or alias')
     props_p.add_argument('get_prop', nargs='?', metavar='PROP', default='',
                          help='property to get')
@@ -423,6 +1068,15 @@ def main():
     list_p.set_defaults(func=list_versions)
     list_p.add_argument('-j', '--json', action='store_true',
                         help='display the result as JSON')
+    list_p.add_argument('--range', metavar='RANGE', type=parse_range,
+                        dest='version_range',
+                        help=('only list versions matching a range like ' +
+                              "'>=2.0,<3'"))
+    list_p.add_argument('--where', metavar='PROP=JSON', action='append',
+                        type=parse_set_json,
+                        help=('only list versions where the property at ' +
+                              'PROP equals a JSON value (can be passed ' +
+                              'multiple times)'))
     add_git_arguments(list_p, commit=False)
     list_p.add_argument('identifier', metavar='IDENTIFIER', nargs='?',
                         help='optional version or alias to search for')
@@ -451,6 +1105,60 @@ def main():
                          help=('Host address and port to serve from ' +
                                '(default: %(default)s)'))
 
+    receive_p = subparsers.add_parser(
+        'receive', description=receive_desc,
+        help='deploy prebuilt sites uploaded over HTTP'
+    )
+    receive_p.set_defaults(func=receive)
+    receive_p.add_argument('--alias-type', metavar='TYPE',
+                           choices=alias_types,
+                           help=('default method for creating aliases (one ' +
+                                 'of: %(choices)s; default: symlink)'))
+    receive_p.add_argument('-T', '--template', complete='file',
+                           help='template file to use for redirects')
+    add_git_arguments(receive_p)
+    receive_p.add_argument('--allow-branch', metavar='BRANCH',
+                           action='append', default=[],
+                           help=('also allow uploads to BRANCH (may be ' +
+                                 'repeated)'))
+    receive_p.add_argument('--max-upload-size', metavar='BYTES', type=int,
+                           default=1024 ** 3,
+                           help=('reject uploads larger than BYTES ' +
+                                 '(default: %(default)s)'))
+    receive_p.add_argument('-a', '--addr', default='localhost:8000',
+                           metavar='HOST[:PORT]',
+                           help=('Host address and port to listen on ' +
+                                 '(default: %(default)s)'))
+
+    daemon_p = subparsers.add_parser(
+        'daemon', description=daemon_desc,
+        help='serve deploy, alias, and list requests from a local socket'
+    )
+    daemon_p.set_defaults(func=start_daemon)
+    daemon_p.add_argument('--socket', metavar='PATH', complete='file',
+                          help=('socket to listen on (default: ' +
+                                '.git/mike/daemon.sock)'))
+    daemon_p.add_argument('--coalesce', action='store_true',
+                          help=('combine queued requests for the same ' +
+                                'branch into a single commit'))
+
+    cache_p = subparsers.add_parser(
+        'cache', description=cache_desc, help="manage mike's cache"
+    )
+    cache_subparsers = cache_p.add_subparsers(metavar='COMMAND')
+    cache_subparsers.required = True
+
+    cache_clear_p = cache_subparsers.add_parser(
+        'clear', description=cache_clear_desc, help='delete all cached data'
+    )
+    cache_clear_p.set_defaults(func=cache_clear)
+
+    maintain_p = subparsers.add_parser(
+        'maintain', description=maintain_desc,
+        help='repack and index the Git repository'
+    )
+    maintain_p.set_defaults(func=maintain)
+
     help_p = subparsers.add_parser(
         'help', help='show this help message and exit', add_help=False
     )
@@ -468,7 +1176,10 @@ def main():
     completion_p.add_argument('-s', '--shell', metavar='SHELL', default=shell,
                               help='shell type (default: %(default)s)')
 
-    args = parser.parse_args()
+    return parser
+
+
+def execute(parser, args):
     if args.quiet:
         warnings.filterwarnings('ignore')
 
@@ -478,3 +1189,16 @@ def main():
         if args.debug:  # pragma: no cover
             raise
         parser.exit(1, 'error: {}\n'.format(e))
+
+
+def main():
+    warnings.showwarning = showwarning
+
+    parser = make_parser()
+    args = parser.parse_args()
+    if args.func in daemon_commands:
+        from . import daemon
+        returncode = daemon.forward(sys.argv[1:])
+        if returncode is not None:
+            return returncode
+    return execute(parser, args)
@@ -1,16 +1,50 @@
+import hashlib
 import os
+import posixpath
 import re
+import socket
 import subprocess as sp
 import sys
+import tarfile
 import textwrap
 import threading
+import time
 import unicodedata
+import uuid
+from contextvars import ContextVar
+from contextlib import contextmanager
 from datetime import datetime
+from tempfile import TemporaryDirectory
 from email.utils import parsedate_to_datetime
 from enum import Enum
 
 BranchStatus = Enum('BranchState', ['even', 'ahead', 'behind', 'diverged'])
 
+lock_timeout_var = 'MIKE_LOCK_TIMEOUT'
+default_lock_timeout = 60
+conflict_attempts = 3
+
+# Each commit runs its own `git fast-import`, which can leave behind a new
+# pack. Once there are this many packs, consolidate them.
+pack_limit_var = 'MIKE_PACK_LIMIT'
+default_pack_limit = 50
+# Files written with `git hash-object -w` are stored as loose objects, so
+# consolidate those too once there are this many (the same default as
+# `gc.auto`).
+loose_limit_var = 'MIKE_LOOSE_LIMIT'
+default_loose_limit = 6700
+
+# The branch locks held by this process: lock file -> [owner, count].
+_held_locks = {}
+_held_locks_lock = threading.Lock()
+# The repositories to maintain once an owner releases all its locks: owner ->
+# set of working directories.
+_deferred_maintenance = {}
+
+# The directory to run Git commands in for the current thread (or task); if
+# unset, use the process's working directory.
+_work_dir = ContextVar('mike_git_work_dir', default=None)
+
 
 class GitError(Exception):
     def __init__(self, message, stderr=None):
@@ -43,6 +77,47 @@ class GitEmptyCommit(GitError):
         super().__init__('nothing changed in commit')
 
 
+class GitRefConflict(GitError):
+    def __init__(self, branch):
+        super().__init__('{} was updated by another process'.format(branch))
+
+
+class GitPushRejected(GitError):
+    def __init__(self, remote, branch, stderr=None):
+        super().__init__('{remote}/{branch} has changes not in {branch}'
+                         .format(remote=remote, branch=branch), stderr)
+
+
+class GitMergeConflict(GitError):
+    def __init__(self, path, reason=None):
+        super().__init__('conflicting changes to {}'.format(path) +
+                         (': {}'.format(reason) if reason else ''))
+
+
+@contextmanager
+def working_directory(path):
+    """Run Git commands in `path` for the current thread (or task) without
+    changing the working directory of the whole process."""
+
+    token = _work_dir.set(os.path.abspath(path))
+    try:
+        yield
+    finally:
+        _work_dir.reset(token)
+
+
+def get_working_directory():
+    return _work_dir.get() or os.getcwd()
+
+
+def _run(cmd, **kwargs):
+    return sp.run(cmd, cwd=_work_dir.get(), **kwargs)
+
+
+def _popen(cmd, **kwargs):
+    return sp.Popen(cmd, cwd=_work_dir.get(), **kwargs)
+
+
 def git_path(path):
     path = os.path.normpath(path)
     # Fix unicode pathnames on macOS; see
@@ -75,7 +150,7 @@ def make_when(timestamp=None):
 
 def get_config(key, encoding='utf-8'):
     cmd = ['git', 'config', '--', key]
-    p = sp.run(cmd, stdout=sp.PIPE, stderr=sp.PIPE, encoding=encoding)
+    p = _run(cmd, stdout=sp.PIPE, stderr=sp.PIPE, encoding=encoding)
     if p.returncode != 0:
         raise GitError('error getting config {!r}'.format(key), p.stderr)
     return p.stdout.strip()
@@ -90,7 +165,7 @@ def get_commit_encoding():
 
 def get_latest_commit(rev, *, short=False):
     cmd = ['git', 'rev-parse'] + (['--short'] if short else []) + [rev]
-    p = sp.run(cmd, stdout=sp.PIPE, stderr=sp.PIPE, universal_newlines=True)
+    p = _run(cmd, stdout=sp.PIPE, stderr=sp.PIPE, universal_newlines=True)
     if p.returncode != 0:
         raise GitError('error getting latest commit', p.stderr)
     return p.stdout.strip()
@@ -98,16 +173,33 @@ def get_latest_commit(rev, *, short=False):
 
 def count_reachable(rev):
     cmd = ['git', 'rev-list', '--count', rev, '--']
-    p = sp.run(cmd, stdout=sp.PIPE, stderr=sp.PIPE, universal_newlines=True)
+    p = _run(cmd, stdout=sp.PIPE, stderr=sp.PIPE, universal_newlines=True)
     if p.returncode == 0:
         return int(p.stdout.strip())
     raise GitError('unable to get number of reachable commits from {}'
                    .format(rev), p.stderr)
 
 
+def get_toplevel():
+    cmd = ['git', 'rev-parse', '--show-toplevel']
+    p = _run(cmd, stdout=sp.PIPE, stderr=sp.PIPE, universal_newlines=True)
+    if p.returncode != 0:
+        raise GitError('error getting top-level directory', p.stderr)
+    return p.stdout.strip()
+
+
+def get_git_dir():
+    cmd = ['git', 'rev-parse', '--git-common-dir']
+    p = _run(cmd, stdout=sp.PIPE, stderr=sp.PIPE, universal_newlines=True)
+    if p.returncode != 0:
+        raise GitError('error getting git directory', p.stderr)
+    return os.path.abspath(os.path.join(get_working_directory(),
+                                        p.stdout.strip()))
+
+
 def get_ref(branch, *, nonexist_ok=False):
     cmd = ['git', 'rev-parse', '--symbolic-full-name', branch]
-    p = sp.run(cmd, stdout=sp.PIPE, stderr=sp.PIPE, universal_newlines=True)
+    p = _run(cmd, stdout=sp.PIPE, stderr=sp.PIPE, universal_newlines=True)
     if p.returncode != 0:
         if nonexist_ok:
             return 'refs/heads/{}'.format(branch)
@@ -115,11 +207,30 @@ def get_ref(branch, *, nonexist_ok=False):
     return p.stdout.strip()
 
 
-def update_ref(branch, new_ref):
-    cmd = ['git', 'update-ref', get_ref(branch, nonexist_ok=True), new_ref]
-    p = sp.run(cmd, stdout=sp.PIPE, stderr=sp.PIPE, universal_newlines=True)
+def get_head(branch):
+    # Get the commit `branch` points to, or '' if it doesn't exist (which is
+    # what `update_ref` expects as the old value of a branch to be created).
+    try:
+        return get_latest_commit(branch)
+    except GitError:
+        return ''
+
+
+def _update_ref(branch, args, old_ref, message):
+    cmd = (['git', 'update-ref'] + args +
+           ([] if old_ref is None else [old_ref]))
+    p = _run(cmd, stdout=sp.PIPE, stderr=sp.PIPE, universal_newlines=True)
     if p.returncode != 0:
-        raise GitError('error updating ref for {}'.format(branch), p.stderr)
+        if old_ref is not None and get_head(branch) != old_ref:
+            raise GitRefConflict(branch)
+        raise GitError(message, p.stderr)
+
+
+def update_ref(branch, new_ref, old_ref=None):
+    # If `old_ref` is set, only update the branch if it still points there
+    # ('' meaning that it mustn't exist yet).
+    _update_ref(branch, [get_ref(branch, nonexist_ok=True), new_ref], old_ref,
+                'error updating ref for {}'.format(branch))
 
 
 def has_branch(branch):
@@ -132,7 +243,7 @@ def has_branch(branch):
 
 def get_merge_base(rev1, rev2):
     cmd = ['git', 'merge-base', rev1, rev2]
-    p = sp.run(cmd, stdout=sp.PIPE, stderr=sp.PIPE, universal_newlines=True)
+    p = _run(cmd, stdout=sp.PIPE, stderr=sp.PIPE, universal_newlines=True)
 
     if p.returncode == 0:
         return p.stdout.strip()
@@ -157,58 +268,530 @@ def update_from_upstream(remote, branch):
     if not has_branch(remote_branch):
         return
 
-    if not has_branch(branch):
-        update_ref(branch, get_latest_commit(remote_branch))
+    head = get_head(branch)
+    if not head:
+        update_ref(branch, get_latest_commit(remote_branch), head)
     else:
-        status = compare_branches(branch, remote_branch)
+        status = compare_branches(head, remote_branch)
         if status == BranchStatus.behind:
-            update_ref(branch, get_latest_commit(remote_branch))
+            update_ref(branch, get_latest_commit(remote_branch), head)
         if status == BranchStatus.diverged:
             raise GitBranchDiverged(branch, remote_branch)
 
 
+# Matches a rejected ref in the output of `git push --porcelain`.
+_push_rejected_re = re.compile(r'^!\t.*\t\[rejected\]', re.MULTILINE)
+
+
 def push_branch(remote, branch):
-    cmd = ['git', 'push', '--', remote, branch]
-    p = sp.run(cmd, stdout=sp.PIPE, stderr=sp.PIPE, universal_newlines=True)
+    cmd = ['git', 'push', '--porcelain', '--', remote, branch]
+    p = _run(cmd, stdout=sp.PIPE, stderr=sp.PIPE, universal_newlines=True)
     if p.returncode != 0:
+        # Let callers tell when the push was rejected because someone else
+        # pushed first (as opposed to any other failure).
+        if _push_rejected_re.search(p.stdout):
+            raise GitPushRejected(remote, branch, p.stderr)
         raise GitError('failed to push branch {} to {}'.format(branch, remote),
                        p.stderr)
 
 
-def delete_branch(branch):
+def fetch_branch(remote, branch):
+    cmd = ['git', 'fetch', '--quiet', '--', remote,
+           '+refs/heads/{branch}:refs/remotes/{remote}/{branch}'
+           .format(remote=remote, branch=branch)]
+    p = _run(cmd, stdout=sp.PIPE, stderr=sp.PIPE, universal_newlines=True)
+    if p.returncode != 0:
+        raise GitError('failed to fetch branch {} from {}'
+                       .format(branch, remote), p.stderr)
+
+
+def delete_branch(branch, old_ref=None):
+    message = 'unable to delete branch {}'.format(branch)
+    if old_ref is not None:
+        _update_ref(branch, ['-d', get_ref(branch)], old_ref, message)
+        return
+
     cmd = ['git', 'branch', '--delete', '--force', '--', branch]
-    p = sp.run(cmd, stdout=sp.PIPE, stderr=sp.PIPE, universal_newlines=True)
+    p = _run(cmd, stdout=sp.PIPE, stderr=sp.PIPE, universal_newlines=True)
     if p.returncode != 0:
-        raise GitError('unable to delete branch {}'.format(branch),
-                       p.stderr)
+        raise GitError(message, p.stderr)
 
 
 def is_commit_empty(rev):
     cmd = ['git', 'log', '-1', '--format=', '--name-only', rev, '--']
-    p = sp.run(cmd, stdout=sp.PIPE, stderr=sp.PIPE, universal_newlines=True)
+    p = _run(cmd, stdout=sp.PIPE, stderr=sp.PIPE, universal_newlines=True)
     if p.returncode == 0:
         return not p.stdout
     raise GitError('error getting commit changes', p.stderr)
 
 
 def delete_latest_commit(branch):
-    if count_reachable(branch) > 1:
-        update_ref(branch, get_latest_commit(branch + '^'))
+    head = get_latest_commit(branch)
+    if count_reachable(head) > 1:
+        update_ref(branch, get_latest_commit(head + '^'), head)
     else:
-        delete_branch(branch)
+        delete_branch(branch, head)
+
+
+def squash_commits(branch, base=None):
+    # Replace the commits on `branch` since `base` (or all of them, if `base`
+    # is None) with a single commit, combining their messages.
+    with lock_branch(branch):
+        _squash_commits(branch, get_latest_commit(branch), base)
+
+
+def _squash_commits(branch, head, base):
+    rev_range = '{}..{}'.format(base, head) if base else head
+    if count_reachable(rev_range) < 2:
+        return
+
+    cmd = ['git', 'log', '--reverse', '--format=%B%x00', rev_range, '--']
+    p = _run(cmd, stdout=sp.PIPE, stderr=sp.PIPE, universal_newlines=True)
+    if p.returncode != 0:
+        raise GitError('error getting commit messages', p.stderr)
+    message = '\n'.join(i.strip() + '\n' for i in p.stdout.split('\0')
+                        if i.strip())
+
+    cmd = (['git', 'commit-tree', get_latest_commit(head + '^{tree}')] +
+           (['-p', base] if base else []))
+    p = _run(cmd, input=message, stdout=sp.PIPE, stderr=sp.PIPE,
+             universal_newlines=True)
+    if p.returncode != 0:
+        raise GitError('error squashing commits', p.stderr)
+    update_ref(branch, p.stdout.strip(), head)
+
+
+def diff_tree(rev1, rev2):
+    # Get the files that differ between `rev1` and `rev2`, mapping each path to
+    # its `(mode, oid)` in `rev2` (or None if it was deleted).
+    cmd = ['git', 'diff-tree', '-r', '-z', '--no-renames', rev1, rev2, '--']
+    p = _run(cmd, stdout=sp.PIPE, stderr=sp.PIPE)
+    if p.returncode != 0:
+        raise GitError('error comparing {} and {}'.format(rev1, rev2),
+                       p.stderr.decode('utf-8'))
+
+    fields = p.stdout.split(b'\0')
+    changes = {}
+    for header, path in zip(fields[0::2], fields[1::2]):
+        _, strmode, _, oid, status = header.decode('utf-8').split(' ')
+        changes[path.decode('utf-8')] = (None if status == 'D'
+                                         else (int(strmode, 8), oid))
+    return changes
+
+
+def write_blob(data):
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    cmd = ['git', 'hash-object', '-w', '--stdin']
+    p = _run(cmd, input=data, stdout=sp.PIPE, stderr=sp.PIPE)
+    if p.returncode != 0:
+        raise GitError('error writing blob', p.stderr.decode('utf-8'))
+    return p.stdout.decode('utf-8').strip()
+
+
+def _merge_entry(path, base_rev, ours, theirs, merge):
+    if merge is None:
+        raise GitMergeConflict(path)
+
+    try:
+        base = tree_entry(base_rev, path)
+    except GitError:
+        base = None
+    data = merge(path, *(None if i is None else read_blob(i[1])
+                         for i in (base, ours, theirs)))
+    if data is None:
+        raise GitMergeConflict(path)
+    mode = (ours or theirs)[0]
+    return mode, write_blob(data)
+
+
+def _write_tree(rev, entries, index):
+    env = dict(os.environ, GIT_INDEX_FILE=index)
+    p = _run(['git', 'read-tree', rev], stdout=sp.PIPE, stderr=sp.PIPE,
+             universal_newlines=True, env=env)
+    if p.returncode != 0:
+        raise GitError('error reading tree', p.stderr)
+
+    null_oid = '0' * len(get_latest_commit(rev))
+    index_info = b''.join(
+        '{:06o} {}\t'.format(*(entry or (0, null_oid))).encode('utf-8') +
+        path.encode('utf-8') + b'\0'
+        for path, entry in entries
+    )
+    cmd = ['git', 'update-index', '-z', '--replace', '--index-info']
+    p = _run(cmd, input=index_info, stdout=sp.PIPE, stderr=sp.PIPE,
+             env=env)
+    if p.returncode != 0:
+        raise GitError('error updating index', p.stderr.decode('utf-8'))
+
+    p = _run(['git', 'write-tree'], stdout=sp.PIPE, stderr=sp.PIPE,
+             universal_newlines=True, env=env)
+    if p.returncode != 0:
+        raise GitError('error writing tree', p.stderr)
+    return p.stdout.strip()
+
+
+def _replay_commit(commit, tree, parent):
+    # Write a commit with the same author and message as `commit`, but with
+    # the given tree and parent.
+    cmd = ['git', 'log', '-1', '--date=raw',
+           '--format=%an%x00%ae%x00%ad%x00%B', commit, '--']
+    p = _run(cmd, stdout=sp.PIPE, stderr=sp.PIPE, universal_newlines=True)
+    if p.returncode != 0:
+        raise GitError('error reading commit {}'.format(commit), p.stderr)
+    name, email, date, message = p.stdout.split('\0', 3)
+
+    env = dict(os.environ, GIT_AUTHOR_NAME=name, GIT_AUTHOR_EMAIL=email,
+               GIT_AUTHOR_DATE=date)
+    cmd = ['git', 'commit-tree', tree, '-p', parent]
+    p = _run(cmd, input=message, stdout=sp.PIPE, stderr=sp.PIPE,
+             universal_newlines=True, env=env)
+    if p.returncode != 0:
+        raise GitError('error replaying commit {}'.format(commit), p.stderr)
+    return p.stdout.strip()
+
+
+def rebase_branch(branch, upstream, merge=None):
+    # Replay each commit on `branch` since it diverged from `upstream` on top
+    # of `upstream`, then update `branch` (if it hasn't changed since we
+    # started). When a commit changes a file that also changed upstream,
+    # `merge(path, base, ours, theirs)` gets the contents of each version of
+    # the file (None if it doesn't exist there) and can return the merged
+    # contents; otherwise, this raises `GitMergeConflict`.
+    head = get_latest_commit(branch)
+    tip = get_latest_commit(upstream)
+    base = get_merge_base(head, tip)
+
+    cmd = ['git', 'rev-list', '--reverse', '--first-parent',
+           '{}..{}'.format(base, head), '--']
+    p = _run(cmd, stdout=sp.PIPE, stderr=sp.PIPE, universal_newlines=True)
+    if p.returncode != 0:
+        raise GitError('error listing commits to rebase', p.stderr)
+
+    with TemporaryDirectory(prefix='mike-') as tmpdir:
+        index = os.path.join(tmpdir, 'index')
+        for commit in p.stdout.split():
+            parent = commit + '^'
+            theirs = diff_tree(parent, tip)
+            entries = []
+            for path, entry in diff_tree(parent, commit).items():
+                if path in theirs and theirs[path] != entry:
+                    entry = _merge_entry(path, parent, entry, theirs[path],
+                                         merge)
+                entries.append((path, entry))
+            tip = _replay_commit(commit, _write_tree(tip, entries, index),
+                                 tip)
+
+    update_ref(branch, tip, head)
+    return tip
+
+
+def _lock_file(git_dir, ref):
+    return os.path.join(git_dir, 'mike', 'locks', *ref.split('/')) + '.lock'
+
+
+def lock_path(branch):
+    return _lock_file(get_git_dir(), get_ref(branch, nonexist_ok=True))
+
+
+def _read_lock(path):
+    try:
+        with open(path) as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+def _lock_is_stale(owner):
+    # A lock is stale if the process that took it is gone. We can only tell
+    # for processes on this machine, and only on POSIX systems.
+    try:
+        host, pid = owner.split()
+        pid = int(pid)
+    except (AttributeError, ValueError):
+        return False
+    if os.name != 'posix' or host != socket.gethostname():
+        return False
+
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return True
+    except OSError:
+        pass
+    return False
+
+
+def _remove_stale_lock(path):
+    # Remove the lock at `path` if it's stale. Another process may be doing the
+    # same thing (and then take the lock itself), so move the lock aside
+    # atomically, and make sure what we moved is the stale lock we checked
+    # before deleting it; if not, put it back.
+    owner = _read_lock(path)
+    if not _lock_is_stale(owner):
+        return False
+
+    claimed = '{}.{}.stale'.format(path, uuid.uuid4().hex)
+    try:
+        os.rename(path, claimed)
+    except FileNotFoundError:
+        return False
+    try:
+        if _read_lock(claimed) == owner:
+            return True
+        try:
+            os.link(claimed, path)
+        except OSError:  # pragma: no cover
+            pass
+        return False
+    finally:
+        os.remove(claimed)
+
+
+def _try_lock(path, owner):
+    with _held_locks_lock:
+        held = _held_locks.get(path)
+        if held:
+            if held[0] != owner:
+                return False
+            held[1] += 1
+            return True
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        for attempt in range(2):
+            try:
+                fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+                break
+            except FileExistsError:
+                # If the lock is stale, get rid of it and try once more.
+                if attempt or not _remove_stale_lock(path):
+                    return False
+        with os.fdopen(fd, 'w') as f:
+            f.write('{} {}\n'.format(socket.gethostname(), os.getpid()))
+        _held_locks[path] = [owner, 1]
+        return True
+
+
+def _unlock(path):
+    with _held_locks_lock:
+        held = _held_locks[path]
+        held[1] -= 1
+        if held[1] == 0:
+            del _held_locks[path]
+            try:
+                os.remove(path)
+            except OSError:  # pragma: no cover
+                pass
+
+
+def _lock_timeout(timeout):
+    if timeout is not None:
+        return timeout
+    try:
+        return float(os.environ[lock_timeout_var])
+    except (KeyError, ValueError):
+        return default_lock_timeout
+
+
+@contextmanager
+def lock_branch(branch, timeout=None):
+    # Keep other mike processes from changing `branch` until we're done. Locks
+    # are reentrant within a thread, so callers can hold a branch's lock
+    # across several operations that each lock it too.
+    path = lock_path(branch)
+    owner = threading.get_ident()
+    deadline = time.monotonic() + _lock_timeout(timeout)
+    while not _try_lock(path, owner):
+        if time.monotonic() >= deadline:
+            raise GitError(('timed out waiting for lock on {} (if no other ' +
+                            'mike process is running, delete {})')
+                           .format(branch, path))
+        time.sleep(0.05)
+
+    try:
+        yield
+    finally:
+        _unlock(path)
+        for work_dir in _take_deferred_maintenance(owner):
+            with working_directory(work_dir or os.getcwd()):
+                auto_maintain()
+
+
+def retry_on_conflict(fn, attempts=conflict_attempts):
+    # Call `fn` again (up to `attempts` times in all) if another process
+    # updates the branch before it can. `fn` should start over from the
+    # branch's current state each time.
+    for i in range(attempts):
+        try:
+            return fn()
+        except GitRefConflict:
+            if i + 1 == attempts:
+                raise
+
+
+def _count_packs(git_dir):
+    pack_dir = os.path.join(git_dir, 'objects', 'pack')
+    try:
+        return sum(1 for i in os.listdir(pack_dir) if i.endswith('.pack'))
+    except FileNotFoundError:
+        return 0
+
+
+def count_packs():
+    return _count_packs(get_git_dir())
+
+
+def _count_loose_objects(git_dir):
+    # Like `git count-objects`, count the files in each fan-out directory.
+    objects_dir = os.path.join(git_dir, 'objects')
+    count = 0
+    for i in range(256):
+        try:
+            count += sum(1 for j in os.listdir(
+                os.path.join(objects_dir, '{:02x}'.format(i))
+            ) if not j.startswith('tmp_'))
+        except FileNotFoundError:
+            pass
+    return count
+
+
+def count_loose_objects():
+    return _count_loose_objects(get_git_dir())
+
+
+def _env_limit(var, default):
+    try:
+        return int(os.environ[var])
+    except (KeyError, ValueError):
+        return default
+
+
+def _pack_limit():
+    return _env_limit(pack_limit_var, default_pack_limit)
+
+
+def _needs_maintenance(git_dir):
+    if _count_packs(git_dir) >= _pack_limit():
+        return True
+    loose_limit = _env_limit(loose_limit_var, default_loose_limit)
+    return loose_limit > 0 and _count_loose_objects(git_dir) >= loose_limit
+
+
+def _defer_maintenance(owner, work_dir):
+    # If `owner` holds any locks, put off maintaining the repository until it
+    # releases them so that other processes aren't left waiting on the locks
+    # while we repack.
+    with _held_locks_lock:
+        if not any(i[0] == owner for i in _held_locks.values()):
+            return False
+        _deferred_maintenance.setdefault(owner, set()).add(work_dir)
+        return True
+
+
+def _take_deferred_maintenance(owner):
+    with _held_locks_lock:
+        if any(i[0] == owner for i in _held_locks.values()):
+            return set()
+        return _deferred_maintenance.pop(owner, set())
+
+
+# The steps to maintain a repository. Pack everything into a single pack;
+# unreachable objects are kept (loose) for a while in case another process is
+# still writing a commit that refers to them, and are only pruned after that.
+_maintenance_steps = [
+    (['git', 'repack', '-A', '-d', '-q', '--unpack-unreachable=2.weeks.ago'],
+     'error repacking objects'),
+    (['git', 'prune', '--expire=2.weeks.ago'], 'error pruning objects'),
+    (['git', 'commit-graph', 'write', '--reachable'],
+     'error writing commit-graph'),
+    (['git', 'multi-pack-index', 'write'], 'error writing multi-pack-index'),
+]
+
+
+def _maintain():
+    for cmd, message in _maintenance_steps:
+        p = _run(cmd, stdout=sp.PIPE, stderr=sp.PIPE,
+                 universal_newlines=True)
+        if p.returncode != 0:
+            raise GitError(message, p.stderr)
+
+
+def maintain(timeout=None):
+    # Consolidate the repository's packs into one and refresh the commit-graph
+    # and multi-pack-index, so that looking up objects and walking history
+    # stay fast.
+    path = _lock_file(get_git_dir(), 'maintain')
+    owner = threading.get_ident()
+    deadline = time.monotonic() + _lock_timeout(timeout)
+    while not _try_lock(path, owner):
+        if time.monotonic() >= deadline:
+            raise GitError(('timed out waiting for lock on repository (if ' +
+                            'no other mike process is running, delete {})')
+                           .format(path))
+        time.sleep(0.05)
+
+    try:
+        _maintain()
+    finally:
+        _unlock(path)
+
+
+def auto_maintain():
+    # Maintain the repository if it has too many packs or loose objects. If
+    # this thread holds a lock, wait until it's released; if another process
+    # is already maintaining the repository (or it fails), just carry on.
+    # Either way, we'll try again after the next commit.
+    if _pack_limit() <= 0:
+        return False
+    if _defer_maintenance(threading.get_ident(), _work_dir.get()):
+        return False
+    git_dir = get_git_dir()
+    if not _needs_maintenance(git_dir):
+        return False
+
+    path = _lock_file(git_dir, 'maintain')
+    if not _try_lock(path, threading.get_ident()):
+        return False
+    try:
+        _maintain()
+        return True
+    except GitError:
+        return False
+    finally:
+        _unlock(path)
 
 
 class FileInfo:
-    def __init__(self, path, data, mode=0o100644):
-        if isinstance(data, str):
-            data = data.encode('utf-8')
+    # A file's contents can be given directly via `data`, read on demand from
+    # the file at `source`, or (if neither is set) referred to by its blob
+    # `oid`.
+    __slots__ = ('path', '_data', 'mode', 'oid', 'source')
+
+    def __init__(self, path, data, mode=0o100644, *, oid=None, source=None):
         self.path = path
         self.data = data
         self.mode = mode
+        self.oid = oid
+        self.source = source
+
+    @property
+    def data(self):
+        # Don't hold onto the contents of `source`; that way, walking a large
+        # site only keeps one file in memory at a time.
+        if self._data is None and self.source is not None:
+            with open(self.source, 'rb') as f:
+                return f.read()
+        return self._data
+
+    @data.setter
+    def data(self, value):
+        if isinstance(value, str):
+            value = value.encode('utf-8')
+        self._data = value
 
     def __eq__(self, rhs):
         return (self.path == rhs.path and self.data == rhs.data and
-                self.mode == rhs.mode)
+                self.mode == rhs.mode and self.oid == rhs.oid)
 
     def __repr__(self):
         return '<FileInfo({!r}, {:06o})>'.format(self.path, self.mode)
@@ -216,16 +799,20 @@ class FileInfo:
     def copy(self, destdir='', start=''):
         return FileInfo(
             os.path.join(destdir, os.path.relpath(self.path, start)),
-            self.data, self.mode
+            self._data, self.mode, oid=self.oid, source=self.source
         )
 
 
 class Commit:
-    def __init__(self, branch, message, *, allow_empty=False):
+    # fast-import writes the commit to a private ref; when finishing, the
+    # branch is only moved to it if it still points to `head` (by default,
+    # wherever it pointed when the commit started). That way, a commit never
+    # overwrites changes another process made in the meantime.
+    def __init__(self, branch, message, *, allow_empty=False, head=None):
         cmd = ['git', 'fast-import', '--date-format=rfc2822', '--quiet',
                '--done']
-        self._pipe = sp.Popen(cmd, stdin=sp.PIPE, stderr=sp.PIPE,
-                              universal_newlines=False)
+        self._pipe = _popen(cmd, stdin=sp.PIPE, stderr=sp.PIPE,
+                            universal_newlines=False)
         self._finished = False
         self._allow_empty = allow_empty
 
@@ -234,7 +821,7 @@ class Commit:
         self._read_thread.start()
 
         try:
-            self._start_commit(branch, message)
+            self._start_commit(branch, message, head)
         except Exception:
             self.abort()
             raise
@@ -278,8 +865,10 @@ class Commit:
         self._write(data)
         self._write('\n')
 
-    def _start_commit(self, branch, message):
+    def _start_commit(self, branch, message, head):
         self._branch = branch
+        self._temp_ref = 'refs/mike/commits/{}'.format(uuid.uuid4().hex)
+        self.head = get_head(branch) if head is None else head
         encoding = get_commit_encoding()
 
         name = (os.getenv('GIT_COMMITTER_NAME') or
@@ -292,16 +881,13 @@ class Commit:
 
         when = make_when(os.getenv('GIT_COMMITTER_DATE'))
 
-        self._write('commit {}\n'.format(get_ref(branch, nonexist_ok=True)))
+        self._write('commit {}\n'.format(self._temp_ref))
         self._write('committer {name}<{email}> {time}\n'.format(
             name=name + ' ' if name else '', email=email, time=when
         ))
         self._write_data(message)
-        try:
-            head = get_latest_commit(branch)
-            self._write('from {}\n'.format(head))
-        except GitError:
-            pass
+        if self.head:
+            self._write('from {}\n'.format(self.head))
 
     def delete_files(self, files):
         if files == '*':
@@ -311,11 +897,20 @@ class Commit:
                 self._write('D {}\n'.format(self._escape_path(git_path(f))))
 
     def add_file(self, file_info):
+        # If the file's blob is already in the repo, just refer to it.
+        data = file_info.data
+        if data is None and file_info.oid:
+            self._write('M {mode:06o} {oid} {path}\n'.format(
+                path=self._escape_path(git_path(file_info.path)),
+                mode=file_info.mode, oid=file_info.oid
+            ))
+            return
+
         self._write('M {mode:06o} inline {path}\n'.format(
             path=self._escape_path(git_path(file_info.path)),
             mode=file_info.mode
         ))
-        self._write_data(file_info.data)
+        self._write_data(data)
 
     def finish(self):
         if self._finished:
@@ -325,13 +920,18 @@ class Commit:
         self._write('done\n')
         self._pipe.stdin.close()
         self._read_thread.join()
-        if self._pipe.wait() != 0:
-            raise GitCommitError(self._stderr.decode('utf-8'))
+        try:
+            if self._pipe.wait() != 0:
+                raise GitCommitError(self._stderr.decode('utf-8'))
+            commit = get_latest_commit(self._temp_ref)
+        finally:
+            self._delete_temp_ref()
 
-        if ( not self._allow_empty
-             and is_commit_empty(get_latest_commit(self._branch)) ):
-            delete_latest_commit(self._branch)
+        if not self._allow_empty and is_commit_empty(commit):
             raise GitEmptyCommit()
+        with lock_branch(self._branch):
+            update_ref(self._branch, commit, self.head)
+        auto_maintain()
 
     def abort(self):
         if self._finished:
@@ -345,6 +945,11 @@ class Commit:
         self._pipe.terminate()
         self._read_thread.join()
         self._pipe.wait()
+        self._delete_temp_ref()
+
+    def _delete_temp_ref(self):
+        _run(['git', 'update-ref', '-d', self._temp_ref], stdout=sp.DEVNULL,
+             stderr=sp.DEVNULL)
 
 
 def real_path(branch, filename):
@@ -362,23 +967,28 @@ def real_path(branch, filename):
     return path
 
 
-def file_mode(branch, filename, follow_symlinks=True):
+def tree_entry(branch, filename):
     filename = filename.rstrip('/')
     # The root directory of the repo is, well... a directory.
     if not filename:
-        return 0o040000
-
-    if follow_symlinks:
-        filename = real_path(branch, filename)
+        return 0o040000, get_latest_commit(branch + '^{tree}')
 
     cmd = ['git', 'ls-tree', '--full-tree', '--', branch, git_path(filename)]
-    p = sp.run(cmd, stdout=sp.PIPE, stderr=sp.PIPE, universal_newlines=True)
+    p = _run(cmd, stdout=sp.PIPE, stderr=sp.PIPE, universal_newlines=True)
     if p.returncode != 0:
         raise GitError('unable to read file {!r}'.format(filename), p.stderr)
     if not p.stdout:
         raise GitError('file not found')
 
-    return int(p.stdout.split(' ', 1)[0], 8)
+    strmode, _, oid = p.stdout.split('\t', 1)[0].split(' ')
+    return int(strmode, 8), oid
+
+
+def file_mode(branch, filename, follow_symlinks=True):
+    filename = filename.rstrip('/')
+    if follow_symlinks and filename:
+        filename = real_path(branch, filename)
+    return tree_entry(branch, filename)[0]
 
 
 def read_file(branch, filename, universal_newlines=False,
@@ -389,20 +999,93 @@ def read_file(branch, filename, universal_newlines=False,
     cmd = ['git', 'show', '{branch}:{filename}'.format(
         branch=branch, filename=git_path(filename)
     )]
-    p = sp.run(cmd, stdout=sp.PIPE, stderr=sp.PIPE,
-               universal_newlines=universal_newlines)
+    p = _run(cmd, stdout=sp.PIPE, stderr=sp.PIPE,
+             universal_newlines=universal_newlines)
     if p.returncode != 0:
         raise GitError('unable to read file {!r}'.format(filename),
                        str(p.stderr))
     return p.stdout
 
 
+def read_blob(oid, universal_newlines=False):
+    cmd = ['git', 'cat-file', 'blob', oid]
+    p = _run(cmd, stdout=sp.PIPE, stderr=sp.PIPE,
+             universal_newlines=universal_newlines)
+    if p.returncode != 0:
+        raise GitError('unable to read blob {}'.format(oid), str(p.stderr))
+    return p.stdout
+
+
+class ObjectReader:
+    # A persistent `git cat-file --batch` process, so that reading many
+    # objects doesn't require starting a new process for each one.
+    def __init__(self, *, cwd=None):
+        cmd = ['git', 'cat-file', '--batch', '--follow-symlinks']
+        self._pipe = sp.Popen(cmd, stdin=sp.PIPE, stdout=sp.PIPE,
+                              stderr=sp.DEVNULL,
+                              cwd=cwd or _work_dir.get())
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def read(self, rev):
+        # Read the object named by `rev` (e.g. an object ID, a branch, or
+        # `branch:path`), returning its ID, type, and contents. Symlinks
+        # inside the tree are followed.
+        if '\n' in rev:
+            raise GitError('invalid object name {!r}'.format(rev))
+
+        with self._lock:
+            if self._pipe.poll() is not None:
+                raise GitError('object reader is closed')
+            try:
+                self._pipe.stdin.write(rev.encode('utf-8') + b'\n')
+                self._pipe.stdin.flush()
+            except BrokenPipeError:  # pragma: no cover
+                raise GitError('object reader exited unexpectedly')
+
+            header = self._pipe.stdout.readline().decode('utf-8')
+            if not header:  # pragma: no cover
+                raise GitError('object reader exited unexpectedly')
+
+            fields = header.split()
+            if fields[-1] in ('missing', 'ambiguous'):
+                raise GitError('unable to read object {!r}'.format(rev))
+            # Symlinks that can't be followed (e.g. ones pointing outside the
+            # repo) report a kind and size instead of an ID, type, and size.
+            data = self._pipe.stdout.read(int(fields[-1]) + 1)[:-1]
+            if len(fields) != 3:
+                raise GitError('unable to read object {!r}'.format(rev))
+            return fields[0], fields[1], data
+
+    def close(self):
+        with self._lock:
+            if self._pipe.poll() is None:
+                self._pipe.stdin.close()
+                self._pipe.wait()
+            self._pipe.stdout.close()
+
+
+def missing_objects(oids):
+    cmd = ['git', 'cat-file', '--batch-check=%(objectname)']
+    p = _run(cmd, input=''.join(i + '\n' for i in oids),
+             stdout=sp.PIPE, stderr=sp.PIPE, universal_newlines=True)
+    if p.returncode != 0:
+        raise GitError('unable to check objects', p.stderr)
+    return {line.split(' ', 1)[0] for line in p.stdout.splitlines()
+            if line.endswith(' missing')}
+
+
 def walk_files(branch, path=''):
     gpath = git_path(path) if path else ''
     cmd = ['git', 'ls-tree', '--full-tree', '-r', '--',
            '{branch}:{path}'.format(branch=branch, path=gpath)]
-    p = sp.Popen(cmd, stdout=sp.PIPE, stderr=sp.DEVNULL,
-                 universal_newlines=True)
+    p = _popen(cmd, stdout=sp.PIPE, stderr=sp.DEVNULL,
+               universal_newlines=True)
 
     for line in p.stdout:
         strmode, _, _, filename = re.split(r'\s', line.rstrip(), maxsplit=3)
@@ -419,13 +1102,138 @@ def walk_files(branch, path=''):
                        .format(branch=branch, path=gpath))
 
 
-def walk_real_files(srcdir):
+def list_tree(branch, path=''):
+    gpath = git_path(path) if path else ''
+    cmd = ['git', 'ls-tree', '--full-tree', '-r', '-z', '--',
+           '{branch}:{path}'.format(branch=branch, path=gpath)]
+    p = _run(cmd, stdout=sp.PIPE, stderr=sp.PIPE)
+    if p.returncode != 0:
+        raise GitError("unable to list files in '{branch}:{path}'"
+                       .format(branch=branch, path=gpath),
+                       p.stderr.decode('utf-8'))
+
+    result = {}
+    for entry in p.stdout.split(b'\0'):
+        if not entry:
+            continue
+        info, filename = entry.decode('utf-8').split('\t', 1)
+        strmode, _, oid = info.split(' ')
+        result[filename] = (int(strmode, 8), oid)
+    return result
+
+
+def hash_blob(data, object_format='sha1'):
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    h = hashlib.new(object_format)
+    h.update('blob {}\0'.format(len(data)).encode('ascii'))
+    h.update(data)
+    return h.hexdigest()
+
+
+def archive(rev, destdir):
+    cmd = ['git', 'archive', '--format=tar', rev, '--']
+    p = _popen(cmd, stdout=sp.PIPE, stderr=sp.PIPE)
+
+    error = None
+    try:
+        with tarfile.open(fileobj=p.stdout, mode='r|') as tar:
+            if hasattr(tarfile, 'data_filter'):
+                tar.extractall(destdir, filter='data')
+            else:  # pragma: no cover
+                tar.extractall(destdir)
+    except tarfile.TarError as e:
+        error = e
+
+    # If `git archive` failed, the tar error above is just a symptom of that,
+    # so report the error from Git instead.
+    stderr = p.communicate()[1]
+    if p.returncode != 0:
+        raise GitError('unable to archive {}'.format(rev),
+                       stderr.decode('utf-8'))
+    if error:
+        raise error
+
+
+def walk_real_paths(srcdir):
     for path, dirs, filenames in os.walk(srcdir):
         if '.git' in dirs:
             dirs.remove('.git')
         for f in filenames:
             filepath = os.path.join(path, f)
             mode = 0o100755 if os.access(filepath, os.X_OK) else 0o100644
-            with open(filepath, 'rb') as fd:
-                data = fd.read()
-            yield FileInfo(filepath, data, mode)
+            yield filepath, mode
+
+
+def walk_real_files(srcdir):
+    for filepath, mode in walk_real_paths(srcdir):
+        yield FileInfo(filepath, None, mode, source=filepath)
+
+
+def _open_tar_stream(f):
+    # `tarfile` can detect gzip, bzip2, and xz compression on its own, but not
+    # Zstandard.
+    magic = f.read(4)
+    f.seek(0)
+    if magic == b'\x28\xb5\x2f\xfd':
+        try:
+            import zstandard
+        except ImportError:
+            raise ValueError('zstandard not found; install via ' +
+                             '`pip install zstandard`')
+        f = zstandard.ZstdDecompressor().stream_reader(f)
+    return tarfile.open(fileobj=f, mode='r|*')
+
+
+def _walk_tar_stream(f, destdir):
+    with _open_tar_stream(f) as tar:
+        for member in tar:
+            if member.isdir():
+                continue
+
+            name = posixpath.normpath(member.name)
+            if ( name.startswith('/') or name == '..' or
+                 name.startswith('../') ):
+                raise ValueError('archive member {!r} is outside of the site'
+                                 .format(member.name))
+            if not member.isfile():
+                raise ValueError('archive member {!r} is not a regular file'
+                                 .format(member.name))
+
+            mode = 0o100755 if member.mode & 0o111 else 0o100644
+            with tar.extractfile(member) as data:
+                yield FileInfo(os.path.join(destdir, *name.split('/')),
+                               data.read(), mode)
+
+
+def walk_archive_files(archive, destdir=''):
+    # Read each file from a tar archive in order, yielding it before reading
+    # the next one. That way, the files can be written to a commit as they
+    # come in without extracting anything to disk.
+    with open(archive, 'rb') as f:
+        try:
+            yield from _walk_tar_stream(f, destdir)
+        except tarfile.TarError as e:
+            raise ValueError('unable to read archive {!r}: {}'
+                             .format(archive, e))
+
+
+def hash_files(paths):
+    # Write each file to the object database, returning the resulting IDs.
+    if not paths:
+        return []
+    cmd = ['git', 'hash-object', '-w', '--no-filters', '--stdin-paths']
+    # Git may run in another directory, so give it absolute paths.
+    p = _run(cmd, input=''.join(os.path.abspath(i) + '\n' for i in paths),
+             stdout=sp.PIPE, stderr=sp.PIPE, universal_newlines=True)
+    if p.returncode != 0:
+        raise GitError('unable to hash files', p.stderr)
+    return p.stdout.split()
+
+
+def hash_real_files(srcdir):
+    # Write every file in `srcdir` to the object database up front so that
+    # multiple commits can refer to the same blobs without re-sending them.
+    paths = list(walk_real_paths(srcdir))
+    return [FileInfo(path, None, mode, oid=oid) for (path, mode), oid in
+            zip(paths, hash_files([i for i, _ in paths]))]
@@ -11,7 +11,8 @@ or `tail` keywords, e.g.:
     foo[head]
 """
 
-import pyparsing as pp
+import re
+from functools import lru_cache
 
 Deleted = object()
 
@@ -27,29 +28,134 @@ class _IndexKeyword:
 head = _IndexKeyword('head')
 tail = _IndexKeyword('tail')
 
-head_keyword = pp.Keyword('head').set_parse_action(lambda _: head)
-tail_keyword = pp.Keyword('tail').set_parse_action(lambda _: tail)
 
-identifier = pp.Word(pp.alphas + '_-', pp.alphanums + '_-')
-string = pp.QuotedString('"') | pp.QuotedString("'")
-integer = pp.common.signed_integer.set_parse_action(lambda t: int(t[0]))
-index = integer | head_keyword | tail_keyword
+# Building the grammar (and importing pyparsing) is relatively expensive, so
+# wait until we actually need to parse something.
+@lru_cache(maxsize=None)
+def _grammar():
+    import pyparsing as pp
 
-field = (identifier | string).set_parse_action(lambda t: t[0])
-subfield = pp.Suppress('.') + field
-subscript = pp.Suppress('[') + (index | string) + pp.Suppress(']')
+    head_keyword = pp.Keyword('head').set_parse_action(lambda _: head)
+    tail_keyword = pp.Keyword('tail').set_parse_action(lambda _: tail)
 
-expr = (((field | subscript) + (subfield | subscript)[...]) |
-        pp.empty).set_parse_action(lambda t: [t.as_list()])
-set_expr = (expr + pp.Suppress('=') + pp.Regex('.*'))
+    identifier = pp.Word(pp.alphas + '_-', pp.alphanums + '_-')
+    string = pp.QuotedString('"') | pp.QuotedString("'")
+    integer = pp.common.signed_integer.set_parse_action(lambda t: int(t[0]))
+    index = integer | head_keyword | tail_keyword
+
+    field = (identifier | string).set_parse_action(lambda t: t[0])
+    subfield = pp.Suppress('.') + field
+    subscript = pp.Suppress('[') + (index | string) + pp.Suppress(']')
+
+    expr = (((field | subscript) + (subfield | subscript)[...]) |
+            pp.empty).set_parse_action(lambda t: [t.as_list()])
+    set_expr = (expr + pp.Suppress('=') + pp.Regex('.*'))
+    return expr, set_expr
+
+
+# A hand-written parser for the grammar above. This is much faster than using
+# pyparsing, which we only fall back to in order to report errors.
+_whitespace = ' \n\t\r'
+_identifier_re = re.compile(r'[A-Za-z_-][A-Za-z0-9_-]*')
+_string_re = re.compile(r'"([^"\n\r]*)"|\'([^\'\n\r]*)\'')
+_integer_re = re.compile(r'[+-]?\d+')
+_keyword_re = re.compile(r'(head|tail)(?![A-Za-z0-9_$])')
+_keywords = {'head': head, 'tail': tail}
+_value_re = re.compile(r'.*')
+
+
+class _ParseError(Exception):
+    pass
+
+
+def _skip_whitespace(expression, pos):
+    while pos < len(expression) and expression[pos] in _whitespace:
+        pos += 1
+    return pos
+
+
+def _match(regex, expression, pos):
+    m = regex.match(expression, pos)
+    if not m:
+        raise _ParseError()
+    return m
+
+
+def _parse_field(expression, pos):
+    m = _identifier_re.match(expression, pos)
+    if m:
+        return m.group(), m.end()
+    m = _match(_string_re, expression, pos)
+    return m.group(m.lastindex), m.end()
+
+
+def _parse_subscript(expression, pos):
+    pos = _skip_whitespace(expression, pos + 1)
+    m = _integer_re.match(expression, pos)
+    if m:
+        step = int(m.group())
+    else:
+        m = _keyword_re.match(expression, pos)
+        if m:
+            step = _keywords[m.group()]
+        else:
+            m = _match(_string_re, expression, pos)
+            step = m.group(m.lastindex)
+
+    pos = _skip_whitespace(expression, m.end())
+    if not expression.startswith(']', pos):
+        raise _ParseError()
+    return step, pos + 1
+
+
+def _parse_steps(expression):
+    # Like pyparsing, expand any tabs before parsing.
+    expression = expression.expandtabs()
+    steps = []
+    pos = _skip_whitespace(expression, 0)
+    while pos < len(expression):
+        if expression[pos] == '[':
+            step, pos = _parse_subscript(expression, pos)
+        elif steps and expression[pos] == '.':
+            pos = _skip_whitespace(expression, pos + 1)
+            step, pos = _parse_field(expression, pos)
+        elif not steps and expression[pos] not in '.=':
+            step, pos = _parse_field(expression, pos)
+        else:
+            break
+        steps.append(step)
+        pos = _skip_whitespace(expression, pos)
+    return tuple(steps), pos, expression
+
+
+@lru_cache(maxsize=256)
+def _compile(expression):
+    try:
+        steps, pos, expanded = _parse_steps(expression)
+        if pos != len(expanded):
+            raise _ParseError()
+        return steps
+    except _ParseError:
+        expr, _ = _grammar()
+        return tuple(expr.parse_string(expression, parse_all=True)[0])
 
 
 def parse(expression):
-    return expr.parse_string(expression, parse_all=True)[0]
+    return list(_compile(expression))
 
 
 def parse_set(expression):
-    return tuple(set_expr.parse_string(expression, parse_all=True))
+    try:
+        steps, pos, expanded = _parse_steps(expression)
+        if not expanded.startswith('=', pos):
+            raise _ParseError()
+        m = _value_re.match(expanded, _skip_whitespace(expanded, pos + 1))
+        if _skip_whitespace(expanded, m.end()) != len(expanded):
+            raise _ParseError()
+        return list(steps), m.group()
+    except _ParseError:
+        _, set_expr = _grammar()
+        return tuple(set_expr.parse_string(expression, parse_all=True))
 
 
 def _check_step(data, step):
@@ -63,7 +169,7 @@ def _check_step(data, step):
 
 def get_value(data, expression, *, strict=False):
     if isinstance(expression, str):
-        expression = parse(expression)
+        expression = _compile(expression)
 
     for step in expression:
         _check_step(data, step)
@@ -83,7 +189,7 @@ def set_value(data, expression, value, *, strict=False):
         return delete_value(data, expression, strict=strict)
 
     if isinstance(expression, str):
-        expression = parse(expression)
+        expression = _compile(expression)
 
     if len(expression) == 0:
         return value
@@ -121,7 +227,7 @@ def set_value(data, expression, value, *, strict=False):
 
 def delete_value(data, expression, *, strict=False):
     if isinstance(expression, str):
-        expression = parse(expression)
+        expression = _compile(expression)
 
     if not len(expression):
         return None
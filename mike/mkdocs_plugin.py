@@ -1,11 +1,13 @@
+import json
 import os
 import sys
+from functools import lru_cache
 from urllib.parse import urljoin
 from mkdocs.config import config_options as opts
 from mkdocs.plugins import BasePlugin
 from mkdocs.structure.files import File
 
-from .mkdocs_utils import docs_version_var
+from .mkdocs_utils import build_manifest_var, docs_version_var
 from .commands import AliasType
 
 if sys.version_info < (3, 10):
@@ -19,6 +21,7 @@ except ImportError:  # pragma: no cover
     PluginError = ValueError
 
 
+@lru_cache(maxsize=None)
 def get_theme_dir(theme_name):
     try:
         theme = metadata.entry_points(group='mike.themes')[theme_name]
@@ -78,3 +81,16 @@ class MikePlugin(BasePlugin):
                 files.append(File(f, srcdir, destdir, False))
                 config[extra_kind].append(relative_dest)
         return files
+
+    def on_env(self, env, config, files):
+        # Remember every file this build produces from the docs (and theme),
+        # whether or not it actually gets rewritten in dirty mode.
+        self._built_files = [i.abs_dest_path for i in files]
+        return env
+
+    def on_post_build(self, config):
+        manifest = os.environ.get(build_manifest_var)
+        if manifest:
+            with open(manifest, 'w') as f:
+                json.dump({'site_dir': config['site_dir'],
+                           'files': getattr(self, '_built_files', [])}, f)
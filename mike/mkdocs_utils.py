@@ -1,34 +1,62 @@
+import importlib.util
+import json
 import os
+import signal
 import subprocess
 import sys
+import threading
+import traceback
+from collections import namedtuple
 from collections.abc import Iterable, Mapping
 from contextlib import contextmanager
+from functools import lru_cache
 from tempfile import NamedTemporaryFile
 
-import mkdocs.config
-import mkdocs.plugins
-import mkdocs.utils
-import yaml
-import yaml_env_tag
+docs_version_var = 'MIKE_DOCS_VERSION'
+build_manifest_var = 'MIKE_BUILD_MANIFEST'
 
-if sys.version_info < (3, 10):
-    import importlib_metadata as metadata
-else:
-    from importlib import metadata
+_Program = namedtuple('_Program', ['name', 'brand', 'config_files'])
+
+
+# Check whether we should use ProperDocs instead of MkDocs. This avoids
+# importing either (or reading package metadata), since that's fairly slow.
+@lru_cache(maxsize=None)
+def _program():
+    config_files = ['mkdocs.yml', 'mkdocs.yaml']
+    if importlib.util.find_spec('properdocs'):
+        return _Program('properdocs', 'ProperDocs',
+                        ['properdocs.yml', 'properdocs.yaml'] + config_files)
+    return _Program('mkdocs', 'MkDocs', config_files)
+
+
+def default_config_files():
+    return _program().config_files
+
+
+def __getattr__(name):
+    # `default_config_file` used to be a list computed at import time; keep
+    # providing it for existing callers, but only probe for ProperDocs once
+    # someone asks for it.
+    if name == 'default_config_file':
+        return default_config_files()
+    raise AttributeError('module {!r} has no attribute {!r}'
+                         .format(__name__, name))
 
-docs_version_var = 'MIKE_DOCS_VERSION'
-default_config_file = ['mkdocs.yml', 'mkdocs.yaml']
 
-try:
-    _version = metadata.version('properdocs')
-    _program_name = 'properdocs'
-    _brand = 'ProperDocs'
-    default_config_file = (['properdocs.yml', 'properdocs.yaml'] +
-                           default_config_file)
-except metadata.PackageNotFoundError:
-    _version = metadata.version('mkdocs')
-    _program_name = 'mkdocs'
-    _brand = 'MkDocs'
+# The default values for the mike plugin's options that the CLI reads; these
+# should match `MikePlugin.config_scheme`.
+plugin_defaults = {
+    'alias_type': 'symlink',
+    'redirect_template': None,
+    'deploy_prefix': '',
+}
+
+_resolved_configs = {}
+# Fully-loaded configs, for long-running processes that opt in via
+# `enable_config_cache`.
+_loaded_configs = None
+# Whether to build in a fork of this process; see `enable_forked_builds`.
+_forked_builds = False
 
 
 class RoundTrippableTag:
@@ -47,24 +75,33 @@ class RoundTrippableTag:
         return data.node
 
 
-class RoundTripLoader(yaml.Loader):
-    pass
+@lru_cache(maxsize=None)
+def _round_trip_loader():
+    # Only set up our YAML loader (and import PyYAML) once we actually need to
+    # read a config file.
+    import yaml
+    import yaml_env_tag
 
+    class RoundTripLoader(yaml.Loader):
+        pass
 
-# We need to expand environment variables in our round trip loader (making it
-# less of a "round trip"), or else `INHERIT: !ENV ...` will fail when injecting
-# the mike plugin. MkDocs really doesn't make this easy on us...
-yaml.add_constructor('!ENV', yaml_env_tag.construct_env_tag,
-                     Loader=RoundTripLoader)
+    # We need to expand environment variables in our round trip loader
+    # (making it less of a "round trip"), or else `INHERIT: !ENV ...` will
+    # fail when injecting the mike plugin. MkDocs really doesn't make this
+    # easy on us...
+    yaml.add_constructor('!ENV', yaml_env_tag.construct_env_tag,
+                         Loader=RoundTripLoader)
 
-yaml.add_multi_constructor('!', RoundTrippableTag.constructor,
-                           Loader=RoundTripLoader)
-yaml.add_multi_representer(RoundTrippableTag, RoundTrippableTag.representer)
+    yaml.add_multi_constructor('!', RoundTrippableTag.constructor,
+                               Loader=RoundTripLoader)
+    yaml.add_multi_representer(RoundTrippableTag,
+                               RoundTrippableTag.representer)
+    return RoundTripLoader
 
 
 def _open_config(config_file=None):
     if config_file is None:
-        config_file = default_config_file
+        config_file = default_config_files()
     elif not isinstance(config_file, Iterable) or isinstance(config_file, str):
         config_file = [config_file]
 
@@ -78,24 +115,185 @@ def _open_config(config_file=None):
     raise exc
 
 
+def enable_config_cache():
+    # Remember each config we fully load until its files (or the environment)
+    # change. This is only safe if callers don't modify the resulting configs.
+    global _loaded_configs
+    if _loaded_configs is None:
+        _loaded_configs = {}
+
+
 def load_config(config_file=None, **kwargs):
     with _open_config(config_file) as f:
-        cfg = mkdocs.config.load_config(f, **kwargs)
+        if _loaded_configs is None:
+            return _load_full_config(f, **kwargs)
+
+        key = (os.path.abspath(f.name), repr(sorted(kwargs.items())))
+        env = dict(os.environ)
+        cached = _loaded_configs.get(key)
+        if cached and cached[1] == env and _stamps_valid(cached[0]):
+            return cached[2]
+
+        stamps = []
+        try:
+            _load_raw_config(f, stamps)
+        except _NeedsFullLoad:
+            stamps = None
+        f.seek(0)
+        cfg = _load_full_config(f, **kwargs)
 
-        if 'startup' in mkdocs.plugins.EVENTS:
-            cfg['plugins'].run_event('startup', command='mike', dirty=False)
-        cfg = cfg['plugins'].run_event('config', cfg)
-        if 'shutdown' in mkdocs.plugins.EVENTS:
-            cfg['plugins'].run_event('shutdown')
+    if stamps is not None:
+        _loaded_configs[key] = (stamps, env, cfg)
+    return cfg
 
-        return cfg
+
+def _load_full_config(f, **kwargs):
+    import mkdocs.config
+    import mkdocs.plugins
+
+    cfg = mkdocs.config.load_config(f, **kwargs)
+    if 'startup' in mkdocs.plugins.EVENTS:
+        cfg['plugins'].run_event('startup', command='mike', dirty=False)
+    cfg = cfg['plugins'].run_event('config', cfg)
+    if 'shutdown' in mkdocs.plugins.EVENTS:
+        cfg['plugins'].run_event('shutdown')
+    return cfg
+
+
+class _NeedsFullLoad(Exception):
+    pass
+
+
+def _check_type(value, types):
+    if not isinstance(value, types):
+        raise _NeedsFullLoad()
+    return value
+
+
+def _merge_config(parent, child):
+    result = dict(parent)
+    for k, v in child.items():
+        if isinstance(v, dict) and isinstance(result.get(k), dict):
+            result[k] = _merge_config(result[k], v)
+        else:
+            result[k] = v
+    return result
+
+
+def _load_raw_config(f, stamps):
+    import yaml
+
+    stamps.append((f.name, os.fstat(f.fileno()).st_mtime_ns))
+    try:
+        config = yaml.load(f, Loader=_round_trip_loader())
+    except yaml.YAMLError:
+        raise _NeedsFullLoad()
+    if config is None:
+        config = {}
+    _check_type(config, dict)
+
+    # Handle `INHERIT` the same way MkDocs does, merging this config on top of
+    # its parent.
+    if 'INHERIT' in config:
+        parent_file = os.path.normpath(os.path.join(
+            os.path.dirname(f.name),
+            _check_type(config.pop('INHERIT'), str)
+        ))
+        try:
+            with open(parent_file, 'rb') as pf:
+                config = _merge_config(_load_raw_config(pf, stamps), config)
+        except OSError:
+            raise _NeedsFullLoad()
+    return config
+
+
+def _resolve_raw_config(config):
+    from .commands import AliasType
+
+    plugins = config.get('plugins', [])
+    if isinstance(plugins, list):
+        entries = {}
+        for i in plugins:
+            if isinstance(i, str):
+                entries[i] = None
+            elif isinstance(i, dict) and len(i) == 1:
+                entries.update(i)
+            else:
+                raise _NeedsFullLoad()
+    else:
+        entries = _check_type(plugins, dict)
+
+    plugin = dict(plugin_defaults)
+    plugin.update(_check_type(entries.get('mike') or {}, dict))
+    if 'enabled' in plugin:
+        raise _NeedsFullLoad()
+    _check_type(plugin['redirect_template'], (str, type(None)))
+    _check_type(plugin['deploy_prefix'], str)
+    if plugin['alias_type'] not in [i.name for i in AliasType]:
+        raise _NeedsFullLoad()
+
+    return {
+        'remote_branch': _check_type(config.get('remote_branch', 'gh-pages'),
+                                     str),
+        'remote_name': _check_type(config.get('remote_name', 'origin'), str),
+        'use_directory_urls': _check_type(
+            config.get('use_directory_urls', True), bool
+        ),
+        'plugins': {'mike': plugin},
+    }
+
+
+def _resolve_full_config(config_file):
+    from .mkdocs_plugin import MikePlugin
+
+    cfg = load_config(config_file)
+    plugin = cfg['plugins'].get('mike') or MikePlugin.default()
+    return {
+        'remote_branch': cfg['remote_branch'],
+        'remote_name': cfg['remote_name'],
+        'use_directory_urls': cfg['use_directory_urls'],
+        'plugins': {'mike': {k: plugin.config[k] for k in plugin_defaults}},
+    }
+
+
+def _stamps_valid(stamps):
+    try:
+        return all(os.stat(path).st_mtime_ns == mtime
+                   for path, mtime in stamps)
+    except OSError:
+        return False
+
+
+def resolve_config(config_file=None):
+    # Loading the full MkDocs config (and running all the plugins' events) can
+    # be quite slow, so for commands that don't build anything, just read the
+    # few fields we care about. If we find anything we don't understand, fall
+    # back to asking MkDocs.
+    with _open_config(config_file) as f:
+        path = os.path.abspath(f.name)
+        env = dict(os.environ)
+        cached = _resolved_configs.get(path)
+        if cached and cached[1] == env and _stamps_valid(cached[0]):
+            return cached[2]
+
+        stamps = []
+        try:
+            result = _resolve_raw_config(_load_raw_config(f, stamps))
+        except _NeedsFullLoad:
+            return _resolve_full_config(path)
+
+    _resolved_configs[path] = (stamps, env, result)
+    return result
 
 
 @contextmanager
 def inject_plugin(config_file):
+    import mkdocs.utils
+    import yaml
+
     with _open_config(config_file) as f:
         config_file = f.name
-        config = mkdocs.utils.yaml_load(f, loader=RoundTripLoader)
+        config = mkdocs.utils.yaml_load(f, loader=_round_trip_loader())
 
     plugins = config.setdefault('plugins', ['search'])
     for i in plugins:
@@ -121,19 +319,189 @@ def inject_plugin(config_file):
         os.remove(f.name)
 
 
-def build(config_file, version, *, quiet=False, output=None):
+def _build_command(config_file, version, *, quiet=False, dirty=False,
+                   site_dir=None):
     command = (
-        [_program_name] +
+        [_program().name] +
         (['--quiet'] if quiet else []) +
-        ['build', '--clean'] +
-        (['--config-file', config_file] if config_file else [])
+        ['build', '--dirty' if dirty else '--clean'] +
+        (['--config-file', config_file] if config_file else []) +
+        (['--site-dir', site_dir] if site_dir else [])
     )
 
     env = os.environ.copy()
     env[docs_version_var] = version
+    return command, env
 
-    subprocess.run(command, check=True, env=env, stdout=output, stderr=output)
+
+def _prune_site(manifest, since):
+    try:
+        with open(manifest) as f:
+            data = json.load(f)
+    except ValueError:
+        # Our plugin didn't run, so we don't know what the build produced.
+        return
+
+    # Remove every file the build neither produced nor wrote to; these are
+    # left over from pages (or other files) that no longer exist.
+    site_dir = data['site_dir']
+    built = {os.path.normcase(os.path.normpath(i)) for i in data['files']}
+    emptied = set()
+    for path, dirs, files in os.walk(site_dir):
+        if '.git' in dirs:
+            dirs.remove('.git')
+        for name in files:
+            filepath = os.path.join(path, name)
+            if ( os.path.normcase(os.path.normpath(filepath)) not in built and
+                 os.lstat(filepath).st_mtime < since ):
+                os.remove(filepath)
+                emptied.add(path)
+
+    for path in sorted(emptied, key=len, reverse=True):
+        while os.path.normpath(path) != os.path.normpath(site_dir):
+            try:
+                os.rmdir(path)
+            except OSError:
+                break
+            path = os.path.dirname(path)
+
+
+@contextmanager
+def _build_manifest(env, dirty):
+    # MkDocs' dirty mode never removes anything from the site directory, so
+    # have our plugin record what the build produced; then we can remove the
+    # output of anything that's since been deleted from the docs. Yield a
+    # function to do this once the build succeeds.
+    if not dirty:
+        yield lambda: None
+        return
+
+    with NamedTemporaryFile(prefix='mike-manifest-', suffix='.json',
+                            delete=False) as f:
+        pass
+    try:
+        since = os.stat(f.name).st_mtime
+        env[build_manifest_var] = f.name
+        yield lambda: _prune_site(f.name, since)
+    finally:
+        os.remove(f.name)
+
+
+def enable_forked_builds():
+    # Run each build in a fork of this process instead of a new MkDocs
+    # process, so that it reuses everything we've already imported. This is
+    # only worthwhile for long-running processes that keep MkDocs imported.
+    global _forked_builds
+    _forked_builds = hasattr(os, 'fork')
+
+
+def _run_cli(command):
+    import importlib
+
+    cli = importlib.import_module(command[0] + '.__main__').cli
+    try:
+        cli.main(args=command[1:], prog_name=command[0])
+    except SystemExit as e:
+        if e.code is None or isinstance(e.code, int):
+            return e.code or 0
+        sys.stderr.write('{}\n'.format(e.code))
+        return 1
+    return 0
+
+
+class _ForkedBuild:
+    # Run a build command in a child of this process, mimicking the parts of
+    # `subprocess.Popen` that we use.
+    def __init__(self, command, env, output=None):
+        sys.stdout.flush()
+        sys.stderr.flush()
+        self.returncode = None
+        self.pid = os.fork()
+        if self.pid == 0:  # pragma: no cover
+            returncode = 1
+            try:
+                if output is not None:
+                    fd = (os.open(os.devnull, os.O_WRONLY)
+                          if output == subprocess.DEVNULL else
+                          output if isinstance(output, int) else
+                          output.fileno())
+                    os.dup2(fd, 1)
+                    os.dup2(fd, 2)
+                signal.signal(signal.SIGTERM, signal.SIG_DFL)
+                os.environ.clear()
+                os.environ.update(env)
+                returncode = _run_cli(command)
+            except BaseException:
+                traceback.print_exc()
+            finally:
+                sys.stdout.flush()
+                sys.stderr.flush()
+                os._exit(returncode)
+
+    def wait(self):
+        if self.returncode is None:
+            _, status = os.waitpid(self.pid, 0)
+            self.returncode = (-os.WTERMSIG(status) if os.WIFSIGNALED(status)
+                               else os.WEXITSTATUS(status))
+        return self.returncode
+
+    def terminate(self):
+        if self.returncode is None:
+            os.kill(self.pid, signal.SIGTERM)
+
+
+def _start_build(command, env, output):
+    # Forking a process with other threads running isn't safe, so only do it
+    # when we're on our own.
+    if _forked_builds and threading.active_count() == 1:
+        return _ForkedBuild(command, env, output)
+    return subprocess.Popen(command, env=env, stdout=output, stderr=output)
+
+
+def build(config_file, version, *, quiet=False, output=None, dirty=False,
+          site_dir=None):
+    command, env = _build_command(config_file, version, quiet=quiet,
+                                  dirty=dirty, site_dir=site_dir)
+    with _build_manifest(env, dirty) as prune:
+        if _forked_builds:
+            proc = _start_build(command, env, output)
+            if proc.wait() != 0:
+                raise subprocess.CalledProcessError(proc.returncode, command)
+        else:
+            subprocess.run(command, check=True, env=env, stdout=output,
+                           stderr=output)
+        prune()
+
+
+@contextmanager
+def build_in_background(config_file, version, *, quiet=False, output=None,
+                        dirty=False, site_dir=None):
+    command, env = _build_command(config_file, version, quiet=quiet,
+                                  dirty=dirty, site_dir=site_dir)
+    with _build_manifest(env, dirty) as prune:
+        proc = _start_build(command, env, output)
+
+        def wait():
+            if proc.wait() != 0:
+                raise subprocess.CalledProcessError(proc.returncode, command)
+            prune()
+
+        # Let the caller do other work while the build runs; if that work
+        # fails, there's no point in finishing the build.
+        try:
+            yield wait
+        except BaseException:
+            proc.terminate()
+            raise
+        finally:
+            proc.wait()
 
 
 def version_info():
-    return '{} {}'.format(_brand, _version)
+    if sys.version_info < (3, 10):
+        import importlib_metadata as metadata
+    else:
+        from importlib import metadata
+
+    program = _program()
+    return '{} {}'.format(program.brand, metadata.version(program.name))
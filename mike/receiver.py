@@ -0,0 +1,332 @@
+"""
+An HTTP service that deploys prebuilt sites uploaded by other machines (e.g.
+many CI jobs building different versions in parallel). Each upload is a tar
+archive of a built site, along with the version, aliases, and properties to
+deploy it as.
+
+Uploads are queued per branch and handled by a single writer thread: every
+upload waiting for a branch when the writer gets to it is deployed in one
+commit, which is then pushed once. This keeps the branch's history linear no
+matter how many machines are uploading at the same time.
+"""
+
+import json
+import threading
+import urllib.parse as urlparse
+from http.server import BaseHTTPRequestHandler
+from tempfile import NamedTemporaryFile
+
+from . import commands
+from . import git_utils
+from . import jsonpath
+from .app_version import version
+
+_chunk_size = 64 * 1024
+# The (nonexistent) directory the files of each upload are relative to.
+_site_dir = 'site'
+
+
+def _parse_bool(value):
+    if value.lower() in ('1', 'true', 'yes'):
+        return True
+    if value.lower() in ('', '0', 'false', 'no'):
+        return False
+    raise ValueError('expected a boolean, got {!r}'.format(value))
+
+
+class Upload:
+    def __init__(self, archive, version, title=None, aliases=[],
+                 update_aliases=False, set_props=[], *, branch=None,
+                 alias_type=None, rev=None):
+        self.archive = archive
+        self.version = version
+        self.title = title
+        self.aliases = aliases
+        self.update_aliases = update_aliases
+        self.set_props = set_props
+        self.branch = branch
+        self.alias_type = alias_type
+        self.rev = rev
+
+        self.commit = None
+        self.pushed = False
+        self.error = None
+        self._done = threading.Event()
+
+    @classmethod
+    def from_query(cls, archive, query):
+        """Create an upload from the query string of a request, e.g.
+        `version=1.0&alias=latest&set=tags=["new"]`."""
+
+        params = urlparse.parse_qs(query, keep_blank_values=True)
+        unknown = set(params) - {'version', 'title', 'alias', 'update-aliases',
+                                 'set', 'set-string', 'branch', 'alias-type',
+                                 'rev'}
+        if unknown:
+            raise ValueError('unknown parameter {!r}'.format(min(unknown)))
+
+        def single(name, default=None):
+            values = params.get(name)
+            if not values:
+                return default
+            if len(values) != 1:
+                raise ValueError('{!r} passed more than once'.format(name))
+            return values[0]
+
+        version = single('version')
+        if not version:
+            raise ValueError('no version specified')
+
+        alias_type = single('alias-type')
+        if alias_type is not None:
+            try:
+                alias_type = commands.AliasType[alias_type]
+            except KeyError:
+                raise ValueError('invalid alias type {!r}'.format(alias_type))
+
+        set_props = []
+        for name in ('set', 'set-string'):
+            for expression in params.get(name, []):
+                try:
+                    path, value = jsonpath.parse_set(expression)
+                    if name == 'set':
+                        value = json.loads(value)
+                except Exception:
+                    raise ValueError('invalid {!r} expression {!r}'
+                                     .format(name, expression))
+                set_props.append((path, value))
+
+        return cls(archive, version, single('title'), params.get('alias', []),
+                   _parse_bool(single('update-aliases', '')), set_props,
+                   branch=single('branch'), alias_type=alias_type,
+                   rev=single('rev'))
+
+    def finish(self, commit=None, pushed=False, error=None):
+        self.commit = commit
+        self.pushed = pushed
+        self.error = error
+        self._done.set()
+
+    def wait(self, timeout=None):
+        return self._done.wait(timeout)
+
+
+def read_archive(archive, destdir=''):
+    # Read the files straight from the uploaded archive rather than extracting
+    # it to disk. The archive comes from another machine, but
+    # `walk_archive_files` rejects anything that would end up outside of the
+    # site.
+    try:
+        return list(git_utils.walk_archive_files(archive, destdir))
+    except ValueError:
+        raise ValueError('invalid site archive')
+
+
+class Receiver:
+    def __init__(self, *, branch='gh-pages', remote='origin',
+                 deploy_prefix='', alias_type=commands.AliasType.symlink,
+                 template=None, use_directory_urls=True, message=None,
+                 allow_empty=False, push=False, push_retries=0,
+                 allowed_branches=(), max_upload_size=None):
+        self.branch = branch
+        self.allowed_branches = set(allowed_branches)
+        self.remote = remote
+        self.deploy_prefix = deploy_prefix
+        self.alias_type = alias_type
+        self.template = template
+        self.use_directory_urls = use_directory_urls
+        self.message = message
+        self.allow_empty = allow_empty
+        self.push = push
+        self.push_retries = push_retries
+        self.max_upload_size = max_upload_size
+
+        self._queues = {}
+        self._cond = threading.Condition()
+        self._stopping = False
+        self._thread = None
+
+    def submit(self, upload):
+        with self._cond:
+            if self._stopping:
+                raise ValueError('receiver is shutting down')
+
+            # Anyone who can reach the receiver can upload to it, so only let
+            # them pick a branch other than ours if it's explicitly allowed.
+            branch = upload.branch or self.branch
+            if branch != self.branch and branch not in self.allowed_branches:
+                raise ValueError('branch {!r} not allowed'.format(branch))
+            self._queues.setdefault(branch, []).append(upload)
+            self._cond.notify()
+        return upload
+
+    def start(self):
+        self._thread = threading.Thread(target=self.run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        with self._cond:
+            self._stopping = True
+            self._cond.notify()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    def _next_batch(self):
+        with self._cond:
+            while not self._queues and not self._stopping:
+                self._cond.wait()
+            if not self._queues:
+                return None, []
+            # Take every upload waiting for the branch queued up first.
+            branch = next(iter(self._queues))
+            return branch, self._queues.pop(branch)
+
+    def run(self):
+        while True:
+            branch, uploads = self._next_batch()
+            if not uploads:
+                return
+            try:
+                self.process(branch, uploads)
+            except Exception as e:
+                # Don't leave anyone waiting on an upload we couldn't handle.
+                for i in uploads:
+                    if not i.wait(0):
+                        i.finish(error=e)
+
+    def _deploy(self, b, upload, site_files):
+        cfg = {'site_dir': _site_dir,
+               'use_directory_urls': self.use_directory_urls}
+        b.deploy(cfg, upload.version, upload.title, upload.aliases,
+                 upload.update_aliases, upload.alias_type or self.alias_type,
+                 self.template, upload.set_props,
+                 rev=upload.rev or 'uploaded site',
+                 walk_site=lambda _: site_files)
+
+    def _commit(self, branch, uploads, site_files):
+        def attempt():
+            b = commands.Batch(branch, self.deploy_prefix)
+            for upload, files in zip(uploads, site_files):
+                self._deploy(b, upload, files)
+            b.commit(self.message, self.allow_empty)
+
+        try:
+            with git_utils.lock_branch(branch):
+                git_utils.retry_on_conflict(attempt)
+        except git_utils.GitEmptyCommit:
+            pass
+
+    def process(self, branch, uploads):
+        """Deploy `uploads` to `branch` in a single commit and push it. If
+        that fails, deploy each upload on its own so that one bad upload
+        doesn't prevent the rest from being deployed."""
+
+        pending = []
+        for upload in uploads:
+            try:
+                pending.append((upload, read_archive(upload.archive,
+                                                     _site_dir)))
+            except ValueError as e:
+                upload.finish(error=e)
+
+        if not pending:
+            return
+
+        committed = []
+        try:
+            self._commit(branch, *zip(*pending))
+            committed = pending
+        except Exception:
+            for upload, site_files in pending:
+                try:
+                    self._commit(branch, [upload], [site_files])
+                    committed.append((upload, site_files))
+                except Exception as e:
+                    upload.finish(error=e)
+
+        if not committed:
+            return
+
+        error = None
+        pushed = False
+        if self.push:
+            try:
+                commands.push(self.remote, branch, retries=self.push_retries)
+                pushed = True
+            except git_utils.GitError as e:
+                error = e
+
+        head = git_utils.get_latest_commit(branch)
+        for upload, _ in committed:
+            upload.finish(head, pushed, error)
+
+
+class ReceiveHTTPHandler(BaseHTTPRequestHandler):
+    server_version = 'MikeReceive/' + version
+
+    # Note: Set this in a subclass!
+    receiver = None
+
+    def send_json(self, code, data):
+        body = (json.dumps(data) + '\n').encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_json_error(self, code, message):
+        self.send_json(code, {'error': message})
+
+    def do_POST(self):
+        url = urlparse.urlsplit(self.path)
+        if url.path != '/deploy':
+            self.send_json_error(404, 'not found')
+            return
+
+        # We're not going to read the body of a request we reject, so don't
+        # try to read another request from the connection either.
+        try:
+            length = int(self.headers['Content-Length'])
+            if length < 0:
+                raise ValueError(length)
+        except (TypeError, ValueError):
+            self.close_connection = True
+            self.send_json_error(400, 'invalid or missing Content-Length')
+            return
+
+        max_size = self.receiver.max_upload_size
+        if max_size is not None and length > max_size:
+            self.close_connection = True
+            self.send_json_error(413, 'upload larger than {} bytes'
+                                 .format(max_size))
+            return
+
+        with NamedTemporaryFile(prefix='mike-upload-') as archive:
+            remaining = length
+            while remaining:
+                chunk = self.rfile.read(min(remaining, _chunk_size))
+                if not chunk:
+                    return
+                archive.write(chunk)
+                remaining -= len(chunk)
+            archive.flush()
+
+            try:
+                upload = self.receiver.submit(
+                    Upload.from_query(archive.name, url.query)
+                )
+            except ValueError as e:
+                self.send_json_error(400, str(e))
+                return
+            upload.wait()
+
+        if isinstance(upload.error, ValueError):
+            self.send_json_error(400, str(upload.error))
+        elif upload.error is not None:
+            self.send_json_error(500, str(upload.error))
+        else:
+            self.send_json(200, {'version': upload.version,
+                                 'commit': upload.commit,
+                                 'pushed': upload.pushed})
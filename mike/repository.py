@@ -0,0 +1,200 @@
+"""
+A long-lived handle on a Git repository for programs that call mike many times,
+e.g. a service that deploys docs on request. A `Repository` keeps a persistent
+`git cat-file --batch` process for reading objects and remembers the parsed
+`versions.json` for each branch until that branch changes, so repeated calls
+don't need to start new processes or re-read anything that hasn't changed.
+"""
+
+import os
+from contextlib import contextmanager
+from copy import deepcopy
+
+from . import commands
+from . import git_utils
+from .versions import Versions
+
+
+class Repository:
+    def __init__(self, path=None, *, branch='gh-pages', deploy_prefix=''):
+        self.path = os.path.abspath(path or os.getcwd())
+        self.branch = branch
+        self.deploy_prefix = deploy_prefix
+        self._reader = None
+        self._versions = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        if self._reader is not None:
+            self._reader.close()
+            self._reader = None
+        self._versions.clear()
+
+    @property
+    def reader(self):
+        if self._reader is None:
+            self._reader = git_utils.ObjectReader(cwd=self.path)
+        return self._reader
+
+    @contextmanager
+    def active(self):
+        # Run Git commands from this thread in this repository. This doesn't
+        # change the process's working directory, so other threads can use
+        # other repositories at the same time.
+        with git_utils.working_directory(self.path):
+            yield
+
+    def _resolve(self, branch, deploy_prefix):
+        return (self.branch if branch is None else branch,
+                self.deploy_prefix if deploy_prefix is None else deploy_prefix)
+
+    def _head(self, branch):
+        try:
+            return self.reader.read(branch + '^{commit}')[0]
+        except git_utils.GitError:
+            return None
+
+    def list_versions(self, branch=None, deploy_prefix=None):
+        # Return a copy of the cached versions so that callers (in any thread)
+        # can use or modify it freely; use `batch` to commit changes.
+        return deepcopy(self._list_versions(*self._resolve(branch,
+                                                           deploy_prefix)))
+
+    def _list_versions(self, branch, deploy_prefix):
+        head = self._head(branch)
+        cached = self._versions.get((branch, deploy_prefix))
+        if cached and cached[0] == head:
+            return cached[1]
+
+        all_versions = Versions()
+        if head is not None:
+            filename = git_utils.git_path(os.path.join(deploy_prefix,
+                                                       commands.versions_file))
+            try:
+                _, kind, data = self.reader.read(
+                    '{}:{}'.format(head, filename)
+                )
+                if kind == 'blob':
+                    all_versions = Versions.loads(data.decode('utf-8'))
+            except git_utils.GitError:
+                pass
+
+        self._versions[(branch, deploy_prefix)] = (head, all_versions)
+        return all_versions
+
+    @contextmanager
+    def batch(self, *, branch=None, message=None, allow_empty=False,
+              deploy_prefix=None):
+        branch, deploy_prefix = self._resolve(branch, deploy_prefix)
+        key = (branch, deploy_prefix)
+        with self.active(), git_utils.lock_branch(branch):
+            head = self._head(branch) or ''
+            b = commands.Batch(branch, deploy_prefix,
+                               versions=self.list_versions(branch,
+                                                           deploy_prefix),
+                               head=head)
+            yield b
+            b.commit(message, allow_empty)
+
+            # The batch's versions are exactly what we just committed, so
+            # there's no need to read them again. Store a copy, since the
+            # caller still has the batch.
+            self._versions[key] = (self._head(branch), deepcopy(b.versions))
+
+    @contextmanager
+    def deploy(self, cfg, version, title=None, aliases=[],
+               update_aliases=False, alias_type=commands.AliasType.symlink,
+               template=None, *, branch=None, message=None, allow_empty=False,
+               deploy_prefix=None, set_props=[], incremental=False,
+               targets=None):
+        branch, deploy_prefix = self._resolve(branch, deploy_prefix)
+        deployment = commands.deploy(
+            cfg, version, title, aliases, update_aliases, alias_type,
+            template, branch=branch, message=message, allow_empty=allow_empty,
+            deploy_prefix=deploy_prefix, set_props=set_props,
+            incremental=incremental, targets=targets
+        )
+
+        # Only make this repository active while working with Git (before and
+        # after the build), so the caller's build runs wherever it likes.
+        with self.active():
+            deployment.__enter__()
+        try:
+            yield
+        except BaseException as e:
+            with self.active():
+                if not deployment.__exit__(type(e), e, e.__traceback__):
+                    raise
+        else:
+            with self.active():
+                deployment.__exit__(None, None, None)
+
+    def deploy_matrix(self, cfg, entries, update_aliases=False,
+                      alias_type=commands.AliasType.symlink, template=None, *,
+                      branch=None, deploy_prefix=None, **kwargs):
+        branch, deploy_prefix = self._resolve(branch, deploy_prefix)
+        with self.active():
+            commands.deploy_matrix(cfg, entries, update_aliases, alias_type,
+                                   template, branch=branch,
+                                   deploy_prefix=deploy_prefix, **kwargs)
+
+    def _apply_batch(self, operation, **kwargs):
+        # Like `commands._apply_batch`, start over if another process changes
+        # the branch before we can commit.
+        def attempt():
+            with self.batch(**kwargs) as b:
+                operation(b)
+
+        git_utils.retry_on_conflict(attempt)
+
+    def delete(self, identifiers=None, all=False, **kwargs):
+        self._apply_batch(lambda b: b.delete(identifiers, all), **kwargs)
+
+    def alias(self, cfg, identifier, aliases, update_aliases=False,
+              alias_type=commands.AliasType.symlink, template=None, **kwargs):
+        self._apply_batch(lambda b: b.alias(cfg, identifier, aliases,
+                                            update_aliases, alias_type,
+                                            template), **kwargs)
+
+    def get_property(self, identifier, prop, *, branch=None,
+                     deploy_prefix=None):
+        all_versions = self.list_versions(branch, deploy_prefix)
+        try:
+            info = all_versions.select([identifier])[0]
+        except KeyError as e:
+            raise ValueError('identifier {} does not exist'.format(e))
+        return info.get_property(prop)
+
+    def get_properties_all(self, props, *, identifiers=None,
+                           version_range=None, where=None, branch=None,
+                           deploy_prefix=None):
+        all_versions = self.list_versions(branch, deploy_prefix)
+        try:
+            selected = all_versions.select(identifiers,
+                                           version_range=version_range,
+                                           where=where)
+        except KeyError as e:
+            raise ValueError('identifier {} does not exist'.format(e))
+        return all_versions.get_properties_all(props, versions=selected)
+
+    def set_properties_all(self, set_props, *, identifiers=None,
+                           version_range=None, where=None, **kwargs):
+        self._apply_batch(lambda b: b.set_properties(
+            set_props, identifiers, version_range=version_range, where=where
+        ), **kwargs)
+
+    def set_properties(self, identifier, set_props, **kwargs):
+        self.set_properties_all(set_props, identifiers=[identifier], **kwargs)
+
+    def retitle(self, identifier, title, **kwargs):
+        self._apply_batch(lambda b: b.retitle(identifier, title), **kwargs)
+
+    def set_default(self, identifier, template=None, allow_undefined=False,
+                    **kwargs):
+        self._apply_batch(lambda b: b.set_default(identifier, template,
+                                                  allow_undefined), **kwargs)
@@ -1,26 +1,125 @@
 import json
 import re
+import sys
+from bisect import bisect_left, bisect_right, insort
+from math import inf
 from verspec.loose import LooseVersion as Version
 
 from . import jsonpath
 
 
+_release_re = re.compile(r'v?\d')
+
+
 def _ensure_version(version):
     if not isinstance(version, Version):
         return Version(version)
     return version
 
 
+def _sort_key(version):
+    # Development versions (i.e. those without a leading digit) should be
+    # treated as newer than release versions.
+    return (0 if _release_re.match(str(version)) else 1, version)
+
+
+_range_re = re.compile(r'^\s*(>=|<=|==|!=|>|<)\s*(\S+)\s*$')
+
+
+def parse_range(spec):
+    """Parse a comma-separated list of version constraints, like
+    `>=2.0,<3`, into a tuple of `(operator, Version)` pairs."""
+
+    clauses = []
+    for i in spec.split(','):
+        m = _range_re.match(i)
+        if not m:
+            raise ValueError('invalid version range {!r}'.format(spec))
+        clauses.append((m.group(1), Version(m.group(2))))
+    return tuple(clauses)
+
+
+def _compile(expr):
+    return jsonpath.parse(expr) if isinstance(expr, str) else expr
+
+
+def _get_property(properties, expr, strict=False):
+    try:
+        return jsonpath.get_value(properties, expr, strict=strict)
+    except TypeError:
+        if strict:
+            raise
+        return None
+
+
+def _json_key(value):
+    # Return a hashable key for a JSON value such that equal values have equal
+    # keys. Unlike Python's `==`, booleans and numbers are never equal (in
+    # Python, `True == 1`).
+    if isinstance(value, bool):
+        return ('bool', value)
+    elif isinstance(value, (int, float)):
+        return ('number', value)
+    elif isinstance(value, list):
+        return ('list', tuple(_json_key(i) for i in value))
+    elif isinstance(value, dict):
+        return ('dict', frozenset((k, _json_key(v)) for k, v in value.items()))
+    return (type(value).__name__, value)
+
+
+class _AliasSet(set):
+    # A set of aliases that tells its owning `VersionInfo` whenever it
+    # changes, so that `Versions` can keep its alias index up to date.
+    __slots__ = ('_owner',)
+
+    def __init__(self, iterable=(), owner=None):
+        super().__init__(iterable)
+        self._owner = owner
+
+    def __reduce__(self):
+        return (type(self), (list(self), self._owner))
+
+
+def _notify_aliases_changed(name):
+    method = getattr(set, name)
+
+    def wrapper(self, *args):
+        before = set(self)
+        result = method(self, *args)
+        if self._owner is not None:
+            self._owner._aliases_changed(before, self)
+        return result
+
+    wrapper.__name__ = name
+    return wrapper
+
+
+for _name in ['add', 'remove', 'discard', 'pop', 'clear', 'update',
+              'difference_update', 'intersection_update',
+              'symmetric_difference_update', '__ior__', '__iand__',
+              '__isub__', '__ixor__']:
+    setattr(_AliasSet, _name, _notify_aliases_changed(_name))
+
+
 class VersionInfo:
+    # Large `versions.json` files can have thousands of these, so keep them
+    # compact.
+    __slots__ = ('_version', '_sort_key', 'title', '_aliases', '_properties',
+                 '_owner', '_seq')
+
     def __init__(self, version, title=None, aliases=[], properties=None):
         self._check_version(str(version), 'version')
         for i in aliases:
             self._check_version(i, 'alias')
 
         version_name = str(version)
-        self.version = _ensure_version(version)
-        self.title = version_name if title is None else title
-        self.aliases = set(aliases)
+        self._owner = None
+        self._seq = None
+        self.version = version
+        # Most titles are just the version name, so share the same string.
+        self.title = (version_name if title is None or title == version_name
+                      else title)
+        self.aliases = aliases
         self.properties = properties
 
         if str(self.version) in self.aliases:
@@ -64,6 +163,43 @@ class VersionInfo:
             ', {!r}'.format(self.properties) if self.properties else ''
         )
 
+    @property
+    def version(self):
+        return self._version
+
+    @version.setter
+    def version(self, value):
+        self._version = _ensure_version(value)
+        self._sort_key = _sort_key(self._version)
+        if self._owner is not None:
+            self._owner._invalidate_order()
+
+    @property
+    def aliases(self):
+        return self._aliases
+
+    @aliases.setter
+    def aliases(self, value):
+        before = getattr(self, '_aliases', set())
+        # The same aliases (e.g. `latest`) show up over and over, so intern
+        # them.
+        self._aliases = _AliasSet((sys.intern(i) for i in value), self)
+        self._aliases_changed(before, self._aliases)
+
+    def _aliases_changed(self, before, after):
+        if self._owner is not None:
+            self._owner._aliases_changed(str(self.version), before, after)
+
+    @property
+    def properties(self):
+        return self._properties
+
+    @properties.setter
+    def properties(self, value):
+        self._properties = value
+        if self._owner is not None:
+            self._owner._properties_changed(self)
+
     def update(self, title=None, aliases=[]):
         for i in aliases:
             self._check_version(i, 'alias')
@@ -88,15 +224,25 @@ class VersionInfo:
 class Versions:
     def __init__(self):
         self._data = {}
+        # A reverse index mapping each alias to the version it belongs to.
+        self._aliases = {}
+        # The versions in ascending order, or None if this needs to be
+        # recomputed; see `_order_entry`.
+        self._order = []
+        self._next_seq = 0
+        # Indexes of property values, built on demand; see `_property_index`.
+        self._property_indexes = {}
 
     @classmethod
     def from_json(cls, data):
         result = cls()
+        # Sort everything at once when we need to, rather than one at a time.
+        result._order = None
         for i in data:
             version = VersionInfo.from_json(i)
             version_str = str(version.version)
             result._ensure_unique_aliases(version_str, version.aliases)
-            result._data[version_str] = version
+            result._insert(version_str, version)
         return result
 
     def to_json(self):
@@ -109,14 +255,148 @@ class Versions:
     def dumps(self):
         return json.dumps(self.to_json(), indent=2)
 
+    @staticmethod
+    def _order_entry(info):
+        # Sort by each version's precomputed key. For equal versions, put the
+        # most-recently-inserted first so that iterating in reverse yields
+        # them in insertion order. (The sequence number is unique, so we never
+        # compare the `VersionInfo`s themselves.)
+        return info._sort_key + (-info._seq, info)
+
+    def _sorted_order(self):
+        if self._order is None:
+            self._order = sorted(self._order_entry(i)
+                                 for i in self._data.values())
+        return self._order
+
+    def _invalidate_order(self):
+        self._order = None
+
     def __iter__(self):
-        def key(info):
-            # Development versions (i.e. those without a leading digit) should
-            # be treated as newer than release versions.
-            return (0 if re.match(r'v?\d', str(info.version))
-                    else 1, info.version)
+        return iter([i[-1] for i in reversed(self._sorted_order())])
+
+    def in_range(self, spec):
+        """Return the versions matching `spec` (either a string like
+        `>=2.0,<3` or the result of `parse_range`), newest first. Versions
+        are compared in the same order we list them in, so development
+        versions are newer than every release."""
+
+        if isinstance(spec, str):
+            spec = parse_range(spec)
+
+        order = self._sorted_order()
+        # Entries are `(*sort_key, -seq, info)`; since `-seq` is always finite,
+        # `key` sorts before all entries equal to it and `key + (inf,)` sorts
+        # after them.
+        lo, hi = 0, len(order)
+        excluded = set()
+        for op, version in spec:
+            key = _sort_key(version)
+            if op in ('>=', '=='):
+                lo = max(lo, bisect_left(order, key))
+            elif op == '>':
+                lo = max(lo, bisect_right(order, key + (inf,)))
+            if op in ('<=', '=='):
+                hi = min(hi, bisect_right(order, key + (inf,)))
+            elif op == '<':
+                hi = min(hi, bisect_left(order, key))
+            if op == '!=':
+                excluded.add(version)
+
+        return [i[-1] for i in reversed(order[lo:hi])
+                if i[-1].version not in excluded]
+
+    def select(self, identifiers=None, *, version_range=None, where=None):
+        """Return the versions matching every given selector, newest first:
+        the versions or aliases in `identifiers`, the versions matching
+        `version_range` (see `in_range`), and the versions satisfying `where`.
+        `where` is either a function taking a `VersionInfo` or a list of
+        `(expr, value)` pairs whose properties must all equal `value`."""
+
+        matches = None
+        if where is not None and not callable(where):
+            matches = self._find_properties(where)
+
+        if version_range is not None:
+            selected = self.in_range(version_range)
+        elif matches is not None and identifiers is None:
+            # Only sort the matching versions instead of listing everything.
+            return [i[-1] for i in sorted(
+                (self._order_entry(i) for i in matches.values()), reverse=True
+            )]
+        else:
+            selected = list(self)
+
+        if identifiers is not None:
+            keys = {self.find(i, strict=True)[0] for i in identifiers}
+            selected = [i for i in selected if str(i.version) in keys]
+
+        if callable(where):
+            selected = [i for i in selected if where(i)]
+        elif where is not None:
+            selected = [i for i in selected if i._seq in matches]
+        return selected
+
+    def _property_index(self, expr):
+        # Get (or build) an index for `expr`, mapping the `_json_key` of each
+        # value to a dict of the versions with that value (keyed by their
+        # sequence numbers), along with a reverse mapping from sequence numbers
+        # to keys.
+        expr = tuple(_compile(expr))
+        if expr not in self._property_indexes:
+            index = self._property_indexes[expr] = ({}, {})
+            for info in self._data.values():
+                self._index_version(expr, index, info)
+        return self._property_indexes[expr]
 
-        return (i for i in sorted(self._data.values(), reverse=True, key=key))
+    @staticmethod
+    def _index_version(expr, index, info):
+        values, keys = index
+        key = _json_key(_get_property(info.properties, expr))
+        values.setdefault(key, {})[info._seq] = info
+        keys[info._seq] = key
+
+    @staticmethod
+    def _unindex_version(index, info):
+        values, keys = index
+        key = keys.pop(info._seq)
+        del values[key][info._seq]
+        if not values[key]:
+            del values[key]
+
+    def _properties_changed(self, info):
+        for expr, index in self._property_indexes.items():
+            self._unindex_version(index, info)
+            self._index_version(expr, index, info)
+
+    def _find_properties(self, conditions):
+        # Return the versions (keyed by sequence number) whose properties
+        # match every `(expr, value)` pair in `conditions`.
+        result = None
+        for expr, value in conditions:
+            values, _ = self._property_index(expr)
+            found = values.get(_json_key(value), {})
+            result = (found if result is None else
+                      {k: v for k, v in result.items() if k in found})
+        return dict(result) if result is not None else {
+            i._seq: i for i in self._data.values()
+        }
+
+    def get_properties_all(self, exprs, *, strict=False, versions=None):
+        """Get the values of each expression in `exprs` for every version (or
+        just those in `versions`), returning a list of `(VersionInfo, values)`
+        pairs. If `strict` is false, missing or incompatible values are
+        None."""
+
+        exprs = [_compile(i) for i in exprs]
+        return [(info, [_get_property(info.properties, i, strict)
+                        for i in exprs])
+                for info in (self if versions is None else versions)]
+
+    def get_property_all(self, expr, *, strict=False, versions=None):
+        return [(info, values[0]) for info, values in
+                self.get_properties_all([expr], strict=strict,
+                                        versions=versions)]
 
     def __len__(self):
         return len(self._data)
@@ -124,13 +404,33 @@ class Versions:
     def __getitem__(self, k):
         return self._data[str(k)]
 
+    def _insert(self, version, info):
+        info._owner = self
+        info._seq = self._next_seq
+        self._next_seq += 1
+        self._data[version] = info
+        if self._order is not None:
+            insort(self._order, self._order_entry(info))
+        for expr, index in self._property_indexes.items():
+            self._index_version(expr, index, info)
+        self._aliases_changed(version, set(), info.aliases)
+
+    def _aliases_changed(self, version, before, after):
+        for i in before - after:
+            # An alias can briefly belong to two versions while it's being
+            # moved from one to the other; only unindex it if it's ours.
+            if self._aliases.get(i) == version:
+                del self._aliases[i]
+        for i in after - before:
+            self._aliases[i] = version
+
     def find(self, identifier, strict=False):
         identifier = str(identifier)
         if identifier in self._data:
             return (identifier,)
-        for k, v in self._data.items():
-            if identifier in v.aliases:
-                return (k, identifier)
+        version = self._aliases.get(identifier)
+        if version is not None:
+            return (version, identifier)
         if strict:
             raise KeyError(identifier)
         return None
@@ -171,7 +471,7 @@ class Versions:
         if v in self._data:
             self._data[v].update(title, aliases)
         else:
-            self._data[v] = VersionInfo(version, title, aliases)
+            self._insert(v, VersionInfo(version, title, aliases))
 
         # Remove aliases from old versions that we've moved to this version.
         for i in removed_aliases:
@@ -193,8 +493,14 @@ class Versions:
 
     def _remove_by_key(self, key):
         if len(key) == 1:
-            item = self._data[key[0]]
-            del self._data[key[0]]
+            item = self._data.pop(key[0])
+            self._aliases_changed(key[0], item.aliases, set())
+            if self._order is not None:
+                del self._order[bisect_left(self._order,
+                                            self._order_entry(item)[:-1])]
+            for index in self._property_indexes.values():
+                self._unindex_version(index, item)
+            item._owner = item._seq = None
         else:
             item = key[1]
             self._data[key[0]].aliases.remove(key[1])
@@ -207,3 +513,30 @@ class Versions:
     def difference_update(self, identifiers):
         keys = [self.find(i, strict=True) for i in identifiers]
         return [self._remove_by_key(i) for i in keys]
+
+
+def _same_version(a, b):
+    return a is b if a is None or b is None else a == b
+
+
+def merge(base, ours, theirs):
+    """Combine the changes from `base` to `ours` and from `base` to `theirs`.
+    Each version takes whichever side changed it; if both sides changed the
+    same version differently, or if the result would give the same alias to
+    two versions, raise a `ValueError`."""
+
+    merged = []
+    names = dict.fromkeys(i for v in (theirs, ours, base) for i in v._data)
+    for name in names:
+        b, o, t = (i._data.get(name) for i in (base, ours, theirs))
+        if _same_version(o, b):
+            result = t
+        elif _same_version(t, b) or _same_version(o, t):
+            result = o
+        else:
+            raise ValueError('version {!r} was changed on both sides'
+                             .format(name))
+        if result is not None:
+            merged.append(result.to_json())
+
+    return Versions.from_json(merged)
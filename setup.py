@@ -91,6 +91,7 @@ setup(
     extras_require={
         'dev': ['coverage', 'flake8 >= 3.0', 'flake8-quotes', 'shtab'],
         'test': ['coverage', 'flake8 >= 3.0', 'flake8-quotes', 'shtab'],
+        'zstd': ['zstandard'],
     },
 
     entry_points={
@@ -0,0 +1,44 @@
+# Memory benchmarks for `mike.git_utils`. Run with:
+#
+#   python -m test.benchmarks.bench_git_utils
+
+import os
+import tracemalloc
+from tempfile import TemporaryDirectory
+
+from mike import git_utils
+
+sizes = [100, 1000, 4000]
+file_size = 16 * 1024
+
+
+def make_site(path, count):
+    for i in range(count):
+        dirname = os.path.join(path, str(i // 100))
+        os.makedirs(dirname, exist_ok=True)
+        with open(os.path.join(dirname, '{}.html'.format(i)), 'wb') as f:
+            f.write(os.urandom(file_size))
+
+
+def bench_walk(path):
+    # Measure the memory held by a full walk of a site, plus a copy of each
+    # file (as we'd make for an alias).
+    tracemalloc.start()
+    try:
+        files = list(git_utils.walk_real_files(path))
+        copies = [i.copy('alias', path) for i in files]  # noqa: F841
+        return tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+
+
+def main():
+    print('{:>8}  {:>12}'.format('files', 'walk (KiB)'))
+    for count in sizes:
+        with TemporaryDirectory() as path:
+            make_site(path, count)
+            print('{:>8}  {:>12.1f}'.format(count, bench_walk(path) / 1024))
+
+
+if __name__ == '__main__':
+    main()
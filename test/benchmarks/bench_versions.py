@@ -0,0 +1,96 @@
+# Microbenchmarks for `mike.versions`. Run with:
+#
+#   python -m test.benchmarks.bench_versions
+
+import timeit
+import tracemalloc
+
+from mike.versions import Versions
+
+sizes = [100, 1000, 4000]
+
+
+def make_versions(count):
+    versions = Versions()
+    for i in range(count):
+        info = versions.add('{}.{}'.format(i // 10, i % 10),
+                            aliases=['alias-{}'.format(i)])
+        info.properties = {'channel': 'lts' if i % 100 == 0 else 'stable'}
+    return versions
+
+
+def bench_find(versions, count):
+    # Look up aliases spread across the whole list so that we'd see the cost
+    # of a linear scan.
+    aliases = ['alias-{}'.format(i) for i in range(0, count, count // 10)]
+
+    def run():
+        for i in aliases:
+            versions.find(i)
+
+    number = 1000
+    return min(timeit.repeat(run, number=number, repeat=5)) / (
+        number * len(aliases)
+    )
+
+
+def bench_iter(versions, count):
+    number = 100
+    return min(timeit.repeat(lambda: list(versions), number=number,
+                             repeat=5)) / number
+
+
+def bench_dumps(versions, count):
+    number = 10
+    return min(timeit.repeat(versions.dumps, number=number,
+                             repeat=5)) / number
+
+
+def bench_in_range(versions, count):
+    # Select a narrow range so that we'd see the cost of a linear scan.
+    number = 1000
+    return min(timeit.repeat(lambda: versions.in_range('>=5.0,<6'),
+                             number=number, repeat=5)) / number
+
+
+def bench_memory(versions, count):
+    # Measure the memory used by loading a `versions.json` file.
+    data = versions.dumps()
+    tracemalloc.start()
+    try:
+        loaded = Versions.loads(data)  # noqa: F841
+        return tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+
+
+def bench_where(versions, count):
+    # Repeatedly filter on a rare property value; after the first query, this
+    # should only look at the matching versions.
+    number = 100
+    return min(timeit.repeat(
+        lambda: versions.select(where=[('channel', 'lts')]),
+        number=number, repeat=5
+    )) / number
+
+
+def main():
+    print('{:>8}  {:>12}  {:>12}  {:>12}  {:>14}  {:>12}  {:>12}'.format(
+        'versions', 'find (us)', 'iter (ms)', 'dumps (ms)', 'in_range (us)',
+        'loaded (KiB)', 'where (us)'
+    ))
+    for count in sizes:
+        versions = make_versions(count)
+        print(('{:>8}  {:>12.3f}  {:>12.3f}  {:>12.3f}  {:>14.3f}  ' +
+               '{:>12.1f}  {:>12.3f}').format(
+            count, bench_find(versions, count) * 1e6,
+            bench_iter(versions, count) * 1e3,
+            bench_dumps(versions, count) * 1e3,
+            bench_in_range(versions, count) * 1e6,
+            bench_memory(versions, count) / 1024,
+            bench_where(versions, count) * 1e6
+        ))
+
+
+if __name__ == '__main__':
+    main()
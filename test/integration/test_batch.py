@@ -0,0 +1,98 @@
+import os
+import subprocess
+import unittest
+
+from . import assertPopen
+from .. import *
+from mike import git_utils, versions
+
+
+class TestBatch(unittest.TestCase):
+    def setUp(self):
+        self.stage = stage_dir('batch')
+        git_init()
+        copytree(os.path.join(test_data_dir, 'basic_theme'), self.stage)
+        check_call_silent(['git', 'add', 'mkdocs.yml', 'docs'])
+        check_call_silent(['git', 'commit', '-m', 'initial commit'])
+        for i in ['0.9', '1.0']:
+            assertPopen(['mike', 'deploy', i])
+
+        with open('batch.yml', 'w') as f:
+            f.write('- deploy:\n' +
+                    '    version: 2.0\n' +
+                    '    aliases: [latest]\n' +
+                    '    set: [\'tags=["new"]\']\n' +
+                    '- retitle: {identifier: 1.0, title: 1.0.1}\n' +
+                    '- props: {range: "<2", set: [hidden=true]}\n' +
+                    '- set-default: {identifier: latest}\n' +
+                    '- delete: {identifiers: [0.9]}\n')
+
+    def _test_batch(self):
+        self.assertEqual(git_utils.count_reachable('gh-pages'), 3)
+        message = assertPopen(['git', 'log', '-1', '--pretty=%B',
+                               'gh-pages']).rstrip()
+        self.assertRegex(message, r'^Deployed \S+ to 2\.0; .*; Removed 0\.9 ')
+
+        check_call_silent(['git', 'checkout', 'gh-pages'])
+        assertDirectory('.', {
+            'versions.json',
+            'index.html',
+            '1.0',
+            '1.0/index.html',
+            '2.0',
+            '2.0/index.html',
+            'latest',
+        }, allow_extra=True)
+        self.assertFalse(os.path.exists('0.9'))
+        with open('index.html') as f:
+            self.assertRegex(f.read(), match_redir('latest/'))
+        with open('versions.json') as f:
+            self.assertEqual(list(versions.Versions.loads(f.read())), [
+                versions.VersionInfo('2.0', aliases=['latest'],
+                                     properties={'tags': ['new']}),
+                versions.VersionInfo('1.0', '1.0.1',
+                                     properties={'hidden': True}),
+            ])
+
+    def test_batch(self):
+        assertPopen(['mike', 'batch', 'batch.yml'])
+        self._test_batch()
+
+    def test_stdin(self):
+        with open('batch.yml') as f:
+            subprocess.run(['mike', 'batch', '-'], stdin=f,
+                           stdout=subprocess.DEVNULL,
+                           stderr=subprocess.DEVNULL, check=True)
+        self._test_batch()
+
+    def test_invalid_step(self):
+        rev = git_utils.get_latest_commit('gh-pages')
+        with open('batch.yml', 'w') as f:
+            f.write('- retitle: {identifier: 1.0, title: 1.0.1}\n' +
+                    '- delete: {identifiers: [3.0]}\n')
+        assertPopen(['mike', 'batch', 'batch.yml'], returncode=1)
+
+        with open('batch.yml', 'w') as f:
+            f.write('- retitle: {identifier: 1.0}\n')
+        output = assertPopen(['mike', 'batch', 'batch.yml'], returncode=1)
+        self.assertEqual(output, "error: missing argument 'title' for " +
+                         "'retitle'\n")
+        self.assertEqual(git_utils.get_latest_commit('gh-pages'), rev)
+
+    def test_push(self):
+        check_call_silent(['git', 'config', 'receive.denyCurrentBranch',
+                           'ignore'])
+        stage_dir('batch_clone')
+        check_call_silent(['git', 'clone', self.stage, '.'])
+        git_config()
+
+        with open('batch.yml', 'w') as f:
+            f.write('- retitle: {identifier: 1.0, title: 1.0.1}\n' +
+                    '- props: {identifier: 0.9, set: [hidden=true]}\n')
+        assertPopen(['mike', 'batch', 'batch.yml', '-p'])
+        clone_rev = git_utils.get_latest_commit('gh-pages')
+
+        with pushd(self.stage):
+            self.assertEqual(git_utils.get_latest_commit('gh-pages'),
+                             clone_rev)
+            self.assertEqual(git_utils.count_reachable('gh-pages'), 3)
@@ -0,0 +1,28 @@
+import os
+import unittest
+
+from . import assertPopen, assertOutput
+from .. import *
+
+
+class TestCacheClear(unittest.TestCase):
+    def setUp(self):
+        self.stage = stage_dir('cache_clear')
+        git_init()
+        copytree(os.path.join(test_data_dir, 'basic_theme'), self.stage)
+        check_call_silent(['git', 'add', 'mkdocs.yml', 'docs'])
+        check_call_silent(['git', 'commit', '-m', 'initial commit'])
+        self.cache_dir = os.path.join(self.stage, '.git', 'mike', 'cache')
+
+    def test_clear(self):
+        assertPopen(['mike', 'deploy', '1.0'])
+        assertOutput(self, ['mike', 'list'], '1.0\n')
+        self.assertTrue(os.path.exists(self.cache_dir))
+
+        assertPopen(['mike', 'cache', 'clear'])
+        self.assertFalse(os.path.exists(self.cache_dir))
+        assertOutput(self, ['mike', 'list'], '1.0\n')
+
+    def test_clear_empty(self):
+        assertPopen(['mike', 'cache', 'clear'])
+        self.assertFalse(os.path.exists(self.cache_dir))
@@ -24,7 +24,9 @@ class HelpTest(unittest.TestCase):
         output = assertPopen(['mike', 'help', 'props'])
         self.assertRegex(output, r'^usage: mike props')
         self.assertRegex(output, ('(?m)^Get or set properties for the ' +
-                                  'specified version\\.\n\nWhen getting'))
+                                  'specified version\\. To get properties ' +
+                                  'for every\nversion at once, .*\n\n' +
+                                  'When getting'))
 
 
 class GenerateCompletionTest(unittest.TestCase):
@@ -0,0 +1,86 @@
+import os
+import subprocess
+import unittest
+
+from . import assertPopen
+from .. import *
+from mike import daemon, git_utils, versions
+
+
+@unittest.skipIf(not daemon.supported(), 'daemon not supported')
+class TestDaemon(unittest.TestCase):
+    def setUp(self):
+        self.stage = stage_dir('daemon')
+        git_init()
+        copytree(os.path.join(test_data_dir, 'basic_theme'), self.stage)
+        check_call_silent(['git', 'add', 'mkdocs.yml', 'docs'])
+        check_call_silent(['git', 'commit', '-m', 'initial commit'])
+
+    def _start(self, options=[]):
+        proc = subprocess.Popen(
+            ['mike', 'daemon'] + options, stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT, universal_newlines=True
+        )
+        self.addCleanup(proc.wait)
+        self.addCleanup(proc.terminate)
+
+        self.assertEqual(proc.stdout.readline(), 'listening on {}\n'.format(
+            daemon.default_socket_path()
+        ))
+        return proc
+
+    def _stop(self, proc):
+        proc.terminate()
+        output = proc.communicate()[0]
+        self.assertEqual(proc.returncode, 0)
+        self.assertFalse(os.path.exists(daemon.default_socket_path()))
+        return output
+
+    def _versions(self):
+        return list(versions.Versions.loads(
+            git_utils.read_file('gh-pages', 'versions.json',
+                                universal_newlines=True)
+        ))
+
+    def test_forward(self):
+        proc = self._start()
+        assertPopen(['mike', 'deploy', '1.0', 'latest'])
+        self.assertEqual(assertPopen(['mike', 'list']), '1.0 [latest]\n')
+        out, err = assertPopen(['mike', 'alias', '2.0', 'stable'],
+                               returncode=1, stderr=True)
+        self.assertEqual(err, "error: identifier '2.0' does not exist\n")
+
+        self.assertEqual(self._stop(proc), (
+            'running: mike deploy 1.0 latest\n' +
+            'running: mike list\n' +
+            'running: mike alias 2.0 stable\n'
+        ))
+        self.assertEqual(self._versions(), [
+            versions.VersionInfo('1.0', aliases=['latest']),
+        ])
+
+    def test_not_forwarded(self):
+        proc = self._start()
+        assertPopen(['mike', 'deploy', '1.0'])
+        assertPopen(['mike', 'retitle', '1.0', '1.0.1'])
+        env = dict(os.environ)
+        env[daemon.disable_var] = '1'
+        subprocess.run(['mike', 'list'], stdout=subprocess.DEVNULL, env=env,
+                       check=True)
+
+        self.assertEqual(self._stop(proc), 'running: mike deploy 1.0\n')
+
+    def test_coalesce(self):
+        proc = self._start(['--coalesce'])
+        clients = [subprocess.Popen(['mike', 'deploy', i],
+                                    stdout=subprocess.DEVNULL,
+                                    stderr=subprocess.DEVNULL)
+                   for i in ['1.0', '2.0', '3.0', '4.0']]
+        for i in clients:
+            self.assertEqual(i.wait(), 0)
+
+        self._stop(proc)
+        self.assertEqual(self._versions(), [
+            versions.VersionInfo(i) for i in ['4.0', '3.0', '2.0', '1.0']
+        ])
+        self.assertLessEqual(git_utils.count_reachable('gh-pages'), 4)
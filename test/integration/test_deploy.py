@@ -1,9 +1,12 @@
 import os
+import subprocess
+import tarfile
 import unittest
 
 from . import assertPopen, assertOutput
 from .. import *
-from mike import git_utils, versions
+from mike import git_utils, mkdocs_utils, versions
+from mike.app_version import version as app_version
 from mike.commands import AliasType
 
 
@@ -138,6 +141,42 @@ class TestDeploy(DeployTestCase):
             versions.VersionInfo('1.0b1'),
         ])
 
+    def test_dirty(self):
+        assertPopen(['mike', 'deploy', '1.0', 'latest'])
+        with open(os.path.join('docs', 'index.md'), 'a') as f:
+            f.write('\nmore text\n')
+        check_call_silent(['git', 'commit', '-am', 'update docs'])
+        assertPopen(['mike', 'deploy', '1.0', 'latest', '--dirty'])
+
+        changes = assertPopen(['git', 'show', '--name-only', '--format=',
+                               '--no-renames', 'gh-pages'])
+        self.assertIn('1.0/index.html', changes.splitlines())
+        self.assertNotIn('1.0/css/version-select.css', changes.splitlines())
+        self.assertNotIn('versions.json', changes.splitlines())
+
+        check_call_silent(['git', 'checkout', 'gh-pages'])
+        self._test_deploy(expected_versions=[
+            versions.VersionInfo('1.0', aliases=['latest'])
+        ])
+
+    def test_dirty_removed_page(self):
+        with open(os.path.join('docs', 'page.md'), 'w') as f:
+            f.write('# Page\n')
+        check_call_silent(['git', 'add', 'docs/page.md'])
+        check_call_silent(['git', 'commit', '-m', 'add page'])
+        assertPopen(['mike', 'deploy', '1.0', '--dirty'])
+        files = assertPopen(['git', 'ls-tree', '-r', '--name-only',
+                             'gh-pages']).splitlines()
+        self.assertIn('1.0/page/index.html', files)
+
+        check_call_silent(['git', 'rm', '-q', 'docs/page.md'])
+        check_call_silent(['git', 'commit', '-m', 'remove page'])
+        assertPopen(['mike', 'deploy', '1.0', '--dirty'])
+        files = assertPopen(['git', 'ls-tree', '-r', '--name-only',
+                             'gh-pages']).splitlines()
+        self.assertIn('1.0/index.html', files)
+        self.assertNotIn('1.0/page/index.html', files)
+
     def test_from_subdir(self):
         os.mkdir('sub')
         with pushd('sub'):
@@ -175,6 +214,57 @@ class TestDeploy(DeployTestCase):
             self.assertEqual(git_utils.get_latest_commit('gh-pages'),
                              clone_rev)
 
+    def test_push_retries(self):
+        check_call_silent(['git', 'config', 'receive.denyCurrentBranch',
+                           'ignore'])
+        assertPopen(['mike', 'deploy', '1.0'])
+        stage_dir('deploy_clone')
+        check_call_silent(['git', 'clone', self.stage, '.'])
+        check_call_silent(['git', 'fetch', 'origin', 'gh-pages:gh-pages'])
+        git_config()
+
+        # Another deployer pushes first.
+        with pushd(self.stage):
+            assertPopen(['mike', 'deploy', '2.0', 'stable'])
+            origin_rev = git_utils.get_latest_commit('gh-pages')
+
+        assertPopen(['mike', 'deploy', '3.0', 'latest', '-p',
+                     '--push-retries', '1'])
+        self.assertEqual(git_utils.get_latest_commit('gh-pages^'), origin_rev)
+        clone_rev = git_utils.get_latest_commit('gh-pages')
+
+        with pushd(self.stage):
+            self.assertEqual(git_utils.get_latest_commit('gh-pages'),
+                             clone_rev)
+            check_call_silent(['git', 'checkout', 'gh-pages'])
+            self._test_deploy(expected_versions=[
+                versions.VersionInfo('3.0', aliases=['latest']),
+                versions.VersionInfo('2.0', aliases=['stable']),
+                versions.VersionInfo('1.0'),
+            ])
+
+    def test_targets(self):
+        check_call_silent(['git', 'config', 'receive.denyCurrentBranch',
+                           'ignore'])
+        stage_dir('deploy_clone')
+        check_call_silent(['git', 'clone', self.stage, '.'])
+        git_config()
+
+        assertPopen(['mike', 'deploy', '1.0', '-p',
+                     '--target', 'origin:mirror:prefix'])
+        gh_pages_rev = git_utils.get_latest_commit('gh-pages')
+        mirror_rev = git_utils.get_latest_commit('mirror')
+
+        with pushd(self.stage):
+            self.assertEqual(git_utils.get_latest_commit('gh-pages'),
+                             gh_pages_rev)
+            self.assertEqual(git_utils.get_latest_commit('mirror'),
+                             mirror_rev)
+            check_call_silent(['git', 'checkout', 'gh-pages'])
+            self._test_deploy()
+            check_call_silent(['git', 'checkout', 'mirror'])
+            self._test_deploy(directory='prefix')
+
     def test_remote_empty(self):
         stage_dir('deploy_clone')
         check_call_silent(['git', 'clone', self.stage, '.'])
@@ -386,3 +476,178 @@ class TestDeployNoDirectoryUrls(unittest.TestCase):
         with open('latest/page.html') as f:
             self.assertRegex(f.read(),
                              match_redir('../1.0/page.html'))
+
+
+class TestDeployProjects(DeployTestCase):
+    def setUp(self):
+        self.stage = stage_dir('deploy_projects')
+        git_init()
+        for i in ('one', 'two'):
+            copytree(os.path.join(test_data_dir, 'basic_theme'),
+                     os.path.join(self.stage, i))
+        check_call_silent(['git', 'add', 'one', 'two'])
+        check_call_silent(['git', 'commit', '-m', 'initial commit'])
+
+    def test_default(self):
+        assertPopen(['mike', 'deploy', '1.0', 'latest',
+                     '-F', 'one/mkdocs.yml', '--deploy-prefix', 'one',
+                     '-F', 'two/mkdocs.yml', '--deploy-prefix', 'two'])
+        self.assertEqual(git_utils.count_reachable('gh-pages'), 1)
+        check_call_silent(['git', 'checkout', 'gh-pages'])
+
+        expected_versions = [versions.VersionInfo('1.0', aliases=['latest'])]
+        self._test_deploy(expected_versions=expected_versions,
+                          directory='one')
+        self._test_deploy(expected_versions=expected_versions,
+                          directory='two')
+
+    def test_mismatched_arguments(self):
+        assertPopen(['mike', 'deploy', '1.0',
+                     '-F', 'one/mkdocs.yml', '--deploy-prefix', 'one',
+                     '-F', 'two/mkdocs.yml'], returncode=1)
+        self.assertFalse(git_utils.has_branch('gh-pages'))
+
+
+class TestDeployPrebuilt(unittest.TestCase):
+    def setUp(self):
+        self.stage = stage_dir('deploy_prebuilt')
+        git_init()
+        copytree(os.path.join(test_data_dir, 'basic_theme'), self.stage)
+        check_call_silent(['git', 'add', 'mkdocs.yml', 'docs'])
+        check_call_silent(['git', 'commit', '-m', 'initial commit'])
+
+        os.makedirs(os.path.join('prebuilt', 'css'))
+        with open(os.path.join('prebuilt', 'index.html'), 'w') as f:
+            f.write('main page')
+        with open(os.path.join('prebuilt', 'css', 'site.css'), 'w') as f:
+            f.write('body {}')
+        with tarfile.open('site.tar.gz', 'w:gz') as tar:
+            tar.add('prebuilt', '.')
+
+    def _test_deploy(self, branch='gh-pages',
+                     expected_versions=[versions.VersionInfo('1.0')]):
+        rev = git_utils.get_latest_commit('master', short=True)
+        message = assertPopen(['git', 'log', '-1', '--pretty=%B',
+                               branch]).rstrip()
+        self.assertRegex(message, r'^Deployed {} to {} with '.format(
+            rev, expected_versions[0].version
+        ))
+
+        for v in expected_versions:
+            for d in [str(v.version), *v.aliases]:
+                self.assertEqual(git_utils.read_file(
+                    branch, d + '/index.html'
+                ), b'main page')
+                self.assertEqual(git_utils.read_file(
+                    branch, d + '/css/site.css'
+                ), b'body {}')
+        self.assertEqual(list(versions.Versions.loads(git_utils.read_file(
+            branch, 'versions.json', universal_newlines=True
+        ))), expected_versions)
+
+    def test_from_archive(self):
+        assertPopen(['mike', 'deploy', '--from-archive', 'site.tar.gz', '1.0',
+                     'latest', '--alias-type=copy'])
+        self._test_deploy(expected_versions=[
+            versions.VersionInfo('1.0', aliases=['latest'])
+        ])
+        self.assertFalse(os.path.exists('site'))
+
+    def test_from_dir(self):
+        assertPopen(['mike', 'deploy', '--from-dir', 'prebuilt', '1.0'])
+        self._test_deploy()
+        self.assertFalse(os.path.exists('site'))
+
+    def test_concurrent(self):
+        # Several mike processes deploying to the same branch at once should
+        # all end up in it.
+        procs = [subprocess.Popen(
+            ['mike', 'deploy', '--from-dir', 'prebuilt', '{}.0'.format(i)],
+            stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+            universal_newlines=True
+        ) for i in range(1, 5)]
+        for p in procs:
+            output = p.communicate()[0]
+            self.assertEqual(p.returncode, 0, output)
+
+        self.assertEqual(git_utils.count_reachable('gh-pages'), 4)
+        self.assertEqual(
+            sorted(str(i.version) for i in versions.Versions.loads(
+                git_utils.read_file('gh-pages', 'versions.json',
+                                    universal_newlines=True)
+            )),
+            ['1.0', '2.0', '3.0', '4.0']
+        )
+        for i in range(1, 5):
+            self.assertEqual(git_utils.read_file(
+                'gh-pages', '{}.0/index.html'.format(i)
+            ), b'main page')
+
+    def test_targets(self):
+        assertPopen(['mike', 'deploy', '--from-archive', 'site.tar.gz', '1.0',
+                     '--target', 'origin:other'])
+        self._test_deploy()
+        self._test_deploy('other')
+
+    def test_no_config(self):
+        os.remove('mkdocs.yml')
+        assertPopen(['mike', 'deploy', '--from-archive', 'site.tar.gz', '1.0',
+                     '-r', 'origin', '-b', 'gh-pages'])
+        self._test_deploy()
+
+    def test_invalid(self):
+        assertPopen(['mike', 'deploy', '--from-archive', 'mkdocs.yml',
+                     '1.0'], returncode=1)
+        assertPopen(['mike', 'deploy', '--from-dir', 'nonexist', '1.0'],
+                    returncode=1)
+        assertPopen(['mike', 'deploy', '--from-dir', 'prebuilt',
+                     '--from-archive', 'site.tar.gz', '1.0'], returncode=2)
+        assertPopen(['mike', 'deploy', '--from-dir', 'prebuilt', '1.0',
+                     '-F', 'mkdocs.yml', '-F', 'mkdocs.yml'], returncode=1)
+        self.assertFalse(git_utils.has_branch('gh-pages'))
+
+
+class TestDeployMatrix(DeployTestCase):
+    expected_versions = [
+        versions.VersionInfo('2.0', aliases=['latest']),
+        versions.VersionInfo('1.0'),
+    ]
+
+    def setUp(self):
+        self.stage = stage_dir('deploy_matrix')
+        git_init()
+        copytree(os.path.join(test_data_dir, 'basic_theme'), self.stage)
+        check_call_silent(['git', 'add', 'mkdocs.yml', 'docs'])
+        check_call_silent(['git', 'commit', '-m', 'initial commit'])
+        check_call_silent(['git', 'tag', 'v1.0'])
+        check_call_silent(['git', 'tag', 'v2.0'])
+
+        with open('matrix.yml', 'w') as f:
+            f.write('1.0: v1.0\n' +
+                    '2.0:\n' +
+                    '  ref: v2.0\n' +
+                    '  aliases: [latest]\n')
+        self.expected_message = (
+            'Deployed v1.0 to 1.0, v2.0 to 2.0 with {} and mike {}'
+            .format(mkdocs_utils.version_info(), app_version)
+        )
+
+    def test_default(self):
+        assertPopen(['mike', 'deploy-matrix', 'matrix.yml'])
+        self.assertEqual(git_utils.count_reachable('gh-pages'), 1)
+        check_call_silent(['git', 'checkout', 'gh-pages'])
+        self._test_deploy(self.expected_message, self.expected_versions)
+
+    def test_stdin(self):
+        with open('matrix.yml') as f:
+            subprocess.run(['mike', 'deploy-matrix', '-j1', '-'], stdin=f,
+                           stdout=subprocess.DEVNULL,
+                           stderr=subprocess.DEVNULL, check=True)
+        check_call_silent(['git', 'checkout', 'gh-pages'])
+        self._test_deploy(self.expected_message, self.expected_versions)
+
+    def test_invalid_ref(self):
+        with open('matrix.yml', 'w') as f:
+            f.write('1.0: nonexist\n')
+        assertPopen(['mike', 'deploy-matrix', 'matrix.yml'], returncode=1)
+        self.assertFalse(git_utils.has_branch('gh-pages'))
@@ -72,6 +72,46 @@ class TestList(ListTestCase):
             'version': '3.0', 'title': '3.0.3', 'aliases': ['stable']
         })
 
+    def test_list_range(self):
+        self._check_list(['--range', '>=2.0,<4'],
+                         '"3.0.3" (3.0) [stable]\n"2.0.2" (2.0)\n')
+        self._check_list(['--range', '>9'], '')
+        self._check_list(['--range', 'bad'], '', mock.ANY, 2)
+        self._check_list(['--range', '>1', '1.0'], '',
+                         'error: cannot specify both IDENTIFIER and ' +
+                         '--range or --where\n', 1)
+
+    def test_list_range_json(self):
+        stdout = self._check_list(['-j', '--range', '<3'],
+                                  stdout=mock.ANY)[0]
+        self.assertEqual(json.loads(stdout), [
+            {'version': '2.0', 'title': '2.0.2', 'aliases': []},
+            {'version': '1.0', 'title': '1.0', 'aliases': []}
+        ])
+
+    def test_list_where(self):
+        path = os.path.join(self.deploy_prefix, 'versions.json')
+        all_versions = versions.Versions.loads(
+            git_utils.read_file('gh-pages', path)
+        )
+        all_versions['1.0'].properties = {'hidden': True, 'channel': 'lts'}
+        all_versions['2.0'].properties = {'hidden': True}
+        all_versions['3.0'].properties = {'hidden': False}
+        with git_utils.Commit('gh-pages', 'commit message') as commit:
+            commit.add_file(git_utils.FileInfo(path, all_versions.dumps()))
+
+        self._check_list(['--where', 'hidden=true'],
+                         '"2.0.2" (2.0)\n1.0\n')
+        self._check_list(['--where', 'hidden=true', '--where',
+                          'channel="lts"'], '1.0\n')
+        self._check_list(['--where', 'hidden=false', '--range', '<4'],
+                         '"3.0.3" (3.0) [stable]\n')
+        self._check_list(['--where', 'hidden=1'], '')
+        self._check_list(['--where', 'hidden=bad'], '', mock.ANY, 2)
+        self._check_list(['--where', 'hidden=true', '1.0'], '',
+                         'error: cannot specify both IDENTIFIER and ' +
+                         '--range or --where\n', 1)
+
     def test_from_subdir(self):
         os.mkdir('sub')
         with pushd('sub'):
@@ -0,0 +1,40 @@
+import os
+import unittest
+from unittest import mock
+
+from . import assertPopen
+from .. import *
+from mike import git_utils
+
+
+class TestMaintain(unittest.TestCase):
+    def setUp(self):
+        self.stage = stage_dir('maintain')
+        git_init()
+        copytree(os.path.join(test_data_dir, 'basic_theme'), self.stage)
+        check_call_silent(['git', 'add', 'mkdocs.yml', 'docs'])
+        check_call_silent(['git', 'commit', '-m', 'initial commit'])
+        # Make every commit write a new pack.
+        check_call_silent(['git', 'config', 'fastimport.unpackLimit', '0'])
+
+    def test_maintain(self):
+        assertPopen(['mike', 'deploy', '1.0'])
+        assertPopen(['mike', 'alias', '1.0', 'latest'])
+        assertPopen(['mike', 'set-default', 'latest'])
+        self.assertGreater(git_utils.count_packs(), 1)
+
+        assertPopen(['mike', 'maintain'])
+        self.assertEqual(git_utils.count_packs(), 1)
+        self.assertTrue(os.path.exists(os.path.join(
+            self.stage, '.git', 'objects', 'info', 'commit-graph'
+        )))
+        assertPopen(['mike', 'list'])
+
+    @mock.patch.dict(os.environ, {'MIKE_PACK_LIMIT': '3'})
+    def test_auto_maintain(self):
+        assertPopen(['mike', 'deploy', '1.0'])
+        assertPopen(['mike', 'alias', '1.0', 'latest'])
+        self.assertEqual(git_utils.count_packs(), 2)
+
+        assertPopen(['mike', 'set-default', 'latest'])
+        self.assertEqual(git_utils.count_packs(), 1)
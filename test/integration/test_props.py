@@ -143,6 +143,73 @@ class TestGetProp(PropsTestCase):
         )
 
 
+class TestGetPropAll(PropsTestCase):
+    stage_dir = 'get_prop_all'
+
+    def setUp(self):
+        super().setUp()
+        all_versions = versions.Versions()
+        all_versions.add('1.0').properties = {'hidden': True}
+        all_versions.add('2.0').properties = {'hidden': False, 'tag': 'new'}
+        all_versions.add('3.0')
+
+        with git_utils.Commit('gh-pages', 'commit message') as commit:
+            commit.add_file(git_utils.FileInfo(
+                'versions.json', all_versions.dumps()
+            ))
+
+    def test_json_lines(self):
+        assertOutput(self, ['mike', 'props', '--all', 'hidden'], (
+            '{"version": "3.0", "properties": {"hidden": null}}\n'
+            '{"version": "2.0", "properties": {"hidden": false}}\n'
+            '{"version": "1.0", "properties": {"hidden": true}}\n'
+        ))
+
+    def test_multiple(self):
+        assertOutput(
+            self, ['mike', 'props', '--all', 'hidden', '--all', 'tag'], (
+                '{"version": "3.0", "properties": ' +
+                '{"hidden": null, "tag": null}}\n'
+                '{"version": "2.0", "properties": ' +
+                '{"hidden": false, "tag": "new"}}\n'
+                '{"version": "1.0", "properties": ' +
+                '{"hidden": true, "tag": null}}\n'
+            )
+        )
+
+    def test_table(self):
+        assertOutput(
+            self, ['mike', 'props', '--table', '--all', 'hidden',
+                   '--all', 'tag'], (
+                'version  hidden  tag\n'
+                '3.0      null    null\n'
+                '2.0      false   "new"\n'
+                '1.0      true    null\n'
+            )
+        )
+
+    def test_select(self):
+        assertOutput(self, ['mike', 'props', '--all', 'tag', '--where',
+                            'hidden=false', '--range', '>=1'], (
+            '{"version": "2.0", "properties": {"tag": "new"}}\n'
+        ))
+        assertOutput(self, ['mike', 'props', '--all', 'hidden',
+                            '--identifier', '1.0'], (
+            '{"version": "1.0", "properties": {"hidden": true}}\n'
+        ))
+
+    def test_invalid(self):
+        assertOutput(self, ['mike', 'props', '--all', 'hidden', '1.0'],
+                     stdout='', stderr=(
+                         'error: --all cannot be used with IDENTIFIER or ' +
+                         'when setting properties\n'
+                     ), returncode=1)
+        assertOutput(self, ['mike', 'props', '--table', '1.0'], stdout='',
+                     stderr='error: --table requires --all\n', returncode=1)
+        assertOutput(self, ['mike', 'props'], stdout='',
+                     stderr='error: IDENTIFIER is required\n', returncode=1)
+
+
 class TestSetProps(PropsTestCase):
     stage_dir = 'set_props'
 
@@ -318,6 +385,70 @@ class TestSetProps(PropsTestCase):
         self.assertEqual(git_utils.get_latest_commit('gh-pages^'), clone_rev)
 
 
+class TestSetPropsSelected(PropsTestCase):
+    stage_dir = 'set_props_selected'
+
+    def setUp(self):
+        super().setUp()
+        all_versions = versions.Versions()
+        all_versions.add('1.0')
+        all_versions.add('1.1', aliases=['stable'])
+        all_versions.add('2.0').properties = {'hidden': True}
+
+        with git_utils.Commit('gh-pages', 'commit message') as commit:
+            commit.add_file(git_utils.FileInfo(
+                'versions.json', all_versions.dumps()
+            ))
+
+    def _test_set_props(self, expected_versions, expected_message):
+        message = assertPopen(['git', 'log', '-1', '--pretty=%B']).rstrip()
+        self.assertRegex(message, expected_message)
+        with open('versions.json') as f:
+            self.assertEqual(list(versions.Versions.loads(f.read())),
+                             expected_versions)
+
+    def test_identifiers(self):
+        assertPopen(['mike', 'props', '1.0', '--identifier', 'stable',
+                     '--set', 'hidden=true'])
+        check_call_silent(['git', 'checkout', 'gh-pages'])
+        self._test_set_props([
+            versions.VersionInfo('2.0', properties={'hidden': True}),
+            versions.VersionInfo('1.1', aliases=['stable'],
+                                 properties={'hidden': True}),
+            versions.VersionInfo('1.0', properties={'hidden': True}),
+        ], r'^Set properties for 1\.1, 1\.0 with mike \S+$')
+
+    def test_range(self):
+        assertPopen(['mike', 'props', '--range', '<2', '--set',
+                     'hidden=true'])
+        check_call_silent(['git', 'checkout', 'gh-pages'])
+        self._test_set_props([
+            versions.VersionInfo('2.0', properties={'hidden': True}),
+            versions.VersionInfo('1.1', aliases=['stable'],
+                                 properties={'hidden': True}),
+            versions.VersionInfo('1.0', properties={'hidden': True}),
+        ], r'^Set properties for 1\.1, 1\.0 with mike \S+$')
+
+    def test_where(self):
+        assertPopen(['mike', 'props', '--where', 'hidden=true', '--delete',
+                     'hidden'])
+        check_call_silent(['git', 'checkout', 'gh-pages'])
+        self._test_set_props([
+            versions.VersionInfo('2.0'),
+            versions.VersionInfo('1.1', aliases=['stable']),
+            versions.VersionInfo('1.0'),
+        ], r'^Set properties for 2\.0 with mike \S+$')
+
+    def test_invalid(self):
+        assertOutput(self, ['mike', 'props', '--range', '<2'], stdout='',
+                     stderr=('error: --identifier, --range, and --where ' +
+                             'require --all or setting properties\n'),
+                     returncode=1)
+        assertOutput(self, ['mike', 'props', '--range', '>3', '--set',
+                            'hidden=true'], stdout='',
+                     stderr='error: no versions selected\n', returncode=1)
+
+
 class TestSetPropsOtherRemote(PropsTestCase):
     def _deploy(self, branch=None, versions=['1.0'], deploy_prefix=''):
         extra_args = ['-b', branch] if branch else []
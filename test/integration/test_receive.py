@@ -0,0 +1,148 @@
+import io
+import json
+import os
+import signal
+import subprocess
+import sys
+import tarfile
+import unittest
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from .. import *
+from mike import git_utils, versions
+
+
+def make_archive(files):
+    f = io.BytesIO()
+    with tarfile.open(fileobj=f, mode='w:gz') as tar:
+        for name, data in files.items():
+            data = data.encode('utf-8')
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+    return f.getvalue()
+
+
+@unittest.skipIf(sys.platform == 'win32', "SIGINT doesn't work on windows")
+class TestReceive(unittest.TestCase):
+    def setUp(self):
+        self.stage = stage_dir('receive')
+        git_init()
+        copytree(os.path.join(test_data_dir, 'basic_theme'), self.stage)
+        check_call_silent(['git', 'add', 'mkdocs.yml', 'docs'])
+        check_call_silent(['git', 'commit', '-m', 'initial commit'])
+
+    def _start(self, options=[]):
+        env = dict(os.environ)
+        env['PYTHONUNBUFFERED'] = '1'
+        proc = subprocess.Popen(
+            ['mike', 'receive', '--addr=localhost:0'] + options,
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+            universal_newlines=True, env=env
+        )
+        self.addCleanup(proc.wait)
+        self.addCleanup(proc.kill)
+
+        line = proc.stdout.readline()
+        self.assertRegex(line, r'^Receiving uploads at http://\S+/deploy$')
+        self.assertEqual(proc.stdout.readline(), 'Press Ctrl+C to quit.\n')
+        return proc, line.split()[-1]
+
+    def _stop(self, proc):
+        proc.send_signal(signal.SIGINT)
+        stdout, stderr = proc.communicate()
+        self.assertEqual(stdout, 'Stopping server...\n')
+        for line in stderr.splitlines():
+            self.assertIn('"POST /deploy', line)
+
+    def _post(self, url, query, data):
+        try:
+            with urllib.request.urlopen(url + '?' + query, data) as f:
+                return f.status, json.loads(f.read())
+        except urllib.error.HTTPError as e:
+            return e.code, json.loads(e.read())
+
+    def test_receive(self):
+        proc, url = self._start()
+        status, result = self._post(url, 'version=1.0&alias=latest', (
+            make_archive({'index.html': 'main page'})
+        ))
+        self.assertEqual(status, 200)
+        self.assertEqual(result, {
+            'version': '1.0',
+            'commit': git_utils.get_latest_commit('gh-pages'),
+            'pushed': False,
+        })
+
+        self.assertEqual(self._post(url, 'version=2.0', b'garbage'), (
+            400, {'error': 'invalid site archive'}
+        ))
+        self._stop(proc)
+
+        self.assertEqual(git_utils.read_file('gh-pages', 'latest/index.html'),
+                         b'main page')
+        self.assertEqual(list(versions.Versions.loads(git_utils.read_file(
+            'gh-pages', 'versions.json', universal_newlines=True
+        ))), [versions.VersionInfo('1.0', aliases=['latest'])])
+
+    def test_allow_branch(self):
+        proc, url = self._start(['--allow-branch=preview'])
+        site = make_archive({'index.html': 'main page'})
+        self.assertEqual(self._post(url, 'version=1.0&branch=preview',
+                                    site)[0], 200)
+        self.assertEqual(self._post(url, 'version=1.0&branch=other', site), (
+            400, {'error': "branch 'other' not allowed"}
+        ))
+        self._stop(proc)
+
+        self.assertTrue(git_utils.has_branch('preview'))
+        self.assertFalse(git_utils.has_branch('other'))
+        self.assertFalse(git_utils.has_branch('gh-pages'))
+
+    def test_max_upload_size(self):
+        site = make_archive({'index.html': 'main page'})
+        proc, url = self._start(['--max-upload-size={}'.format(len(site))])
+        self.assertEqual(self._post(url, 'version=1.0', site)[0], 200)
+        self.assertEqual(self._post(url, 'version=2.0', site + b'\0'), (
+            413, {'error': 'upload larger than {} bytes'.format(len(site))}
+        ))
+        self._stop(proc)
+
+        self.assertEqual(list(versions.Versions.loads(git_utils.read_file(
+            'gh-pages', 'versions.json', universal_newlines=True
+        ))), [versions.VersionInfo('1.0')])
+
+    def test_concurrent_push(self):
+        origin = self.stage
+        stage_dir('receive_clone')
+        check_call_silent(['git', 'clone', '--bare', origin, '.'])
+        clone = os.getcwd()
+
+        with pushd(origin):
+            check_call_silent(['git', 'remote', 'add', 'clone', clone])
+            proc, url = self._start(['-r', 'clone', '--push'])
+
+            def upload(n):
+                return self._post(url, 'version={}.0&set=n%3D{}'.format(n, n),
+                                  make_archive({'index.html': str(n)}))
+
+            with ThreadPoolExecutor(8) as executor:
+                results = list(executor.map(upload, range(1, 9)))
+            self._stop(proc)
+
+            head = git_utils.get_latest_commit('gh-pages')
+            self.assertEqual([i[0] for i in results], [200] * 8)
+            self.assertTrue(all(i[1]['pushed'] for i in results))
+            self.assertIn(head, [i[1]['commit'] for i in results])
+            self.assertLessEqual(git_utils.count_reachable('gh-pages'), 8)
+            self.assertEqual(
+                [i.version for i in versions.Versions.loads(
+                    git_utils.read_file('gh-pages', 'versions.json',
+                                        universal_newlines=True)
+                )], [versions.Version('{}.0'.format(i))
+                     for i in range(8, 0, -1)]
+            )
+
+        self.assertEqual(git_utils.get_latest_commit('gh-pages'), head)
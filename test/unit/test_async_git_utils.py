@@ -0,0 +1,333 @@
+import asyncio
+import os
+import threading
+import unittest
+from unittest import mock
+
+from .. import *
+from mike import async_git_utils as agit, git_utils
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+async def collect(agen):
+    return [i async for i in agen]
+
+
+class TestBranches(unittest.TestCase):
+    def setUp(self):
+        self.stage = stage_dir('async_branches')
+        git_init()
+        commit_files(['file.txt'])
+        check_call_silent(['git', 'branch', 'other'])
+        commit_files(['file2.txt'])
+
+    def test_get_latest_commit(self):
+        with pushd(test_data_dir):
+            self.assertEqual(
+                run(agit.get_latest_commit('master', cwd=self.stage)),
+                check_output(['git', '-C', self.stage, 'rev-parse',
+                              'master']).strip()
+            )
+            with self.assertRaises(agit.GitError):
+                run(agit.get_latest_commit('nonexist', cwd=self.stage))
+
+    def test_has_branch(self):
+        self.assertTrue(run(agit.has_branch('other', cwd=self.stage)))
+        self.assertFalse(run(agit.has_branch('nonexist', cwd=self.stage)))
+
+    def test_compare_branches(self):
+        self.assertEqual(
+            run(agit.compare_branches('master', 'other', cwd=self.stage)),
+            agit.BranchStatus.ahead
+        )
+        self.assertEqual(
+            run(agit.compare_branches('other', 'master', cwd=self.stage)),
+            agit.BranchStatus.behind
+        )
+        self.assertEqual(
+            run(agit.compare_branches('master', 'master', cwd=self.stage)),
+            agit.BranchStatus.even
+        )
+
+    def test_update_ref(self):
+        run(agit.update_ref('other', 'master', cwd=self.stage))
+        self.assertEqual(git_utils.get_latest_commit('other'),
+                         git_utils.get_latest_commit('master'))
+
+    def test_update_ref_old_ref(self):
+        old = git_utils.get_latest_commit('other')
+        run(agit.update_ref('other', 'master', old, cwd=self.stage))
+        self.assertEqual(git_utils.get_latest_commit('other'),
+                         git_utils.get_latest_commit('master'))
+        with self.assertRaises(agit.GitRefConflict):
+            run(agit.update_ref('other', old, old, cwd=self.stage))
+
+    def test_push_branch(self):
+        origin = self.stage
+        stage_dir('async_branches_clone')
+        check_call_silent(['git', 'clone', '--bare', origin, '.'])
+        clone = os.getcwd()
+
+        with pushd(origin):
+            check_call_silent(['git', 'remote', 'add', 'clone', clone])
+            commit_files(['file3.txt'])
+            run(agit.push_branch('clone', 'master', cwd=origin))
+            self.assertEqual(
+                git_utils.get_latest_commit('master'),
+                check_output(['git', '-C', clone, 'rev-parse',
+                              'master']).strip()
+            )
+            with self.assertRaises(agit.GitError) as e:
+                run(agit.push_branch('nonexist', 'master', cwd=origin))
+            self.assertNotIsInstance(e.exception, agit.GitPushRejected)
+
+        # Someone else pushes first.
+        with pushd(clone):
+            git_config()
+            with git_utils.Commit('master', 'add file') as commit:
+                commit.add_file(git_utils.FileInfo('other.txt', 'text'))
+        with pushd(origin):
+            commit_files(['file4.txt'])
+            with self.assertRaises(agit.GitPushRejected):
+                run(agit.push_branch('clone', 'master', cwd=origin))
+
+
+class TestCommit(unittest.TestCase):
+    def setUp(self):
+        self.stage = stage_dir('async_commit')
+        git_init()
+
+    def _files(self, branch='branch'):
+        return sorted(git_utils.list_tree(branch))
+
+    def test_commit(self):
+        async def go():
+            async with agit.Commit('branch', 'add files',
+                                   cwd=self.stage) as commit:
+                await commit.add_file(agit.FileInfo('file.txt', 'text'))
+                await commit.add_file(agit.FileInfo('dir/file 2.txt', 'two'))
+
+            async with agit.Commit('branch', 'delete file',
+                                   cwd=self.stage) as commit:
+                await commit.delete_files(['file.txt'])
+
+        with pushd(test_data_dir):
+            run(go())
+        self.assertEqual(self._files(), ['dir/file 2.txt'])
+        self.assertEqual(git_utils.count_reachable('branch'), 2)
+        self.assertEqual(check_output(['git', 'log', '-1', '--pretty=%B',
+                                       'branch']).strip(), 'delete file')
+
+    def test_large_file(self):
+        data = os.urandom(8 * 1024 * 1024)
+
+        async def go():
+            async with agit.Commit('branch', 'add file',
+                                   cwd=self.stage) as commit:
+                await commit.add_file(agit.FileInfo('file.bin', data))
+
+        run(go())
+        self.assertEqual(git_utils.read_file('branch', 'file.bin'), data)
+
+    def test_source(self):
+        with open('source.txt', 'w') as f:
+            f.write('source text')
+        threads = []
+
+        def mock_open(*args, **kwargs):
+            threads.append(threading.get_ident())
+            return open(*args, **kwargs)
+
+        async def go():
+            async with agit.Commit('branch', 'add file',
+                                   cwd=self.stage) as commit:
+                await commit.add_file(agit.FileInfo(
+                    'file.txt', None, source=os.path.abspath('source.txt')
+                ))
+
+        with mock.patch('mike.git_utils.open', mock_open, create=True):
+            run(go())
+        self.assertEqual(git_utils.read_file('branch', 'file.txt'),
+                         b'source text')
+        # The file was read outside of the event loop's thread.
+        self.assertEqual(len(threads), 1)
+        self.assertNotEqual(threads[0], threading.get_ident())
+
+    def test_empty(self):
+        async def go():
+            async with agit.Commit('branch', 'add file',
+                                   cwd=self.stage) as commit:
+                await commit.add_file(agit.FileInfo('file.txt', 'text'))
+            async with agit.Commit('branch', 'nothing',
+                                   cwd=self.stage) as commit:
+                await commit.add_file(agit.FileInfo('file.txt', 'text'))
+
+        with self.assertRaises(agit.GitEmptyCommit):
+            run(go())
+        self.assertEqual(git_utils.count_reachable('branch'), 1)
+
+    def test_abort(self):
+        async def go():
+            async with agit.Commit('branch', 'add file',
+                                   cwd=self.stage) as commit:
+                await commit.add_file(agit.FileInfo('file.txt', 'text'))
+                raise RuntimeError('abort')
+
+        with self.assertRaises(RuntimeError):
+            run(go())
+        self.assertFalse(git_utils.has_branch('branch'))
+
+    def test_conflict(self):
+        async def go():
+            async with agit.Commit('branch', 'add file',
+                                   cwd=self.stage) as commit:
+                await commit.add_file(agit.FileInfo('file.txt', 'text'))
+                # Another process commits to the branch first.
+                with git_utils.Commit('branch', 'add file 2') as other:
+                    other.add_file(git_utils.FileInfo('file2.txt', 'text'))
+
+        with self.assertRaises(agit.GitRefConflict):
+            run(go())
+        self.assertEqual(self._files(), ['file2.txt'])
+        self.assertEqual(check_output(['git', 'for-each-ref', 'refs/mike']),
+                         '')
+
+    def test_lock_branch(self):
+        path = os.path.join(self.stage, '.git', 'mike', 'locks', 'refs',
+                            'heads', 'branch.lock')
+
+        async def go():
+            async with agit.lock_branch('branch', cwd=self.stage):
+                self.assertTrue(os.path.exists(path))
+                with self.assertRaises(agit.GitError):
+                    # Another task can't take the lock.
+                    await asyncio.ensure_future(self._lock(0.1))
+            self.assertFalse(os.path.exists(path))
+            await self._lock(0)
+
+        run(go())
+
+    async def _lock(self, timeout):
+        async with agit.lock_branch('branch', timeout, cwd=self.stage):
+            pass
+
+    def test_auto_maintain(self):
+        check_call_silent(['git', 'config', 'fastimport.unpackLimit', '0'])
+
+        async def go():
+            for i in range(3):
+                async with agit.Commit('branch', 'commit {}'.format(i),
+                                       cwd=self.stage) as commit:
+                    await commit.add_file(agit.FileInfo(
+                        'file{}.txt'.format(i), 'text'
+                    ))
+
+        with mock.patch.dict(os.environ, {'MIKE_PACK_LIMIT': '3'}), \
+             pushd(test_data_dir):
+            run(go())
+        self.assertEqual(git_utils.count_packs(), 1)
+        self.assertEqual(git_utils.count_reachable('branch'), 3)
+
+    def test_auto_maintain_deferred(self):
+        check_call_silent(['git', 'config', 'fastimport.unpackLimit', '0'])
+
+        async def go():
+            async with agit.lock_branch('branch', cwd=self.stage):
+                for i in range(3):
+                    async with agit.Commit('branch', 'commit {}'.format(i),
+                                           cwd=self.stage) as commit:
+                        await commit.add_file(agit.FileInfo(
+                            'file{}.txt'.format(i), 'text'
+                        ))
+                # Don't maintain the repository while holding the lock.
+                with git_utils.working_directory(self.stage):
+                    self.assertEqual(git_utils.count_packs(), 3)
+
+        with mock.patch.dict(os.environ, {'MIKE_PACK_LIMIT': '3'}), \
+             pushd(test_data_dir):
+            run(go())
+        self.assertEqual(git_utils.count_packs(), 1)
+
+    def test_not_started(self):
+        commit = agit.Commit('branch', 'add file', cwd=self.stage)
+        with self.assertRaises(agit.GitError):
+            run(commit.add_file(agit.FileInfo('file.txt', 'text')))
+
+    def test_concurrent(self):
+        repos = []
+        for i in range(4):
+            repos.append(stage_dir('async_commit_{}'.format(i)))
+            git_init()
+
+        async def deploy(path, n):
+            async with agit.Commit('gh-pages', 'commit {}'.format(n),
+                                   cwd=path) as commit:
+                for i in range(20):
+                    await commit.add_file(agit.FileInfo(
+                        '{}/file{}.txt'.format(n, i), 'text {}'.format(i)
+                    ))
+
+        async def go():
+            await asyncio.gather(*[deploy(path, n)
+                                   for n, path in enumerate(repos)])
+
+        run(go())
+        for n, path in enumerate(repos):
+            with pushd(path):
+                self.assertEqual(len(git_utils.list_tree('gh-pages')), 20)
+                self.assertEqual(git_utils.read_file(
+                    'gh-pages', '{}/file3.txt'.format(n)
+                ), b'text 3')
+
+
+class TestReadFiles(unittest.TestCase):
+    def setUp(self):
+        self.stage = stage_dir('async_read_files')
+        git_init()
+        with git_utils.Commit('branch', 'add files') as commit:
+            commit.add_file(git_utils.FileInfo('file.txt', 'hello there\n'))
+            commit.add_file(git_utils.FileInfo('dir/file 2.txt', 'second'))
+            commit.add_file(git_utils.FileInfo('link', 'dir', 0o120000))
+
+    def test_read_file(self):
+        with pushd(test_data_dir):
+            self.assertEqual(
+                run(agit.read_file('branch', 'file.txt', cwd=self.stage)),
+                b'hello there\n'
+            )
+            self.assertEqual(
+                run(agit.read_file('branch', 'link/file 2.txt',
+                                   universal_newlines=True, cwd=self.stage)),
+                'second'
+            )
+            self.assertEqual(
+                run(agit.read_file('branch', 'link', follow_symlinks=False,
+                                   cwd=self.stage)),
+                b'dir'
+            )
+            with self.assertRaises(agit.GitError):
+                run(agit.read_file('branch', 'nonexist', cwd=self.stage))
+            with self.assertRaises(agit.GitError):
+                run(agit.read_file('branch', 'dir', cwd=self.stage))
+
+    def test_walk_files(self):
+        with pushd(test_data_dir):
+            files = run(collect(agit.walk_files('branch', cwd=self.stage)))
+        self.assertEqual(sorted((i.path, i.mode, i.data) for i in files), [
+            (os.path.join('dir', 'file 2.txt'), 0o100644, b'second'),
+            ('file.txt', 0o100644, b'hello there\n'),
+            ('link', 0o120000, b'dir'),
+        ])
+
+    def test_walk_files_path(self):
+        files = run(collect(agit.walk_files('branch', 'dir', cwd=self.stage)))
+        self.assertEqual([(i.path, i.data) for i in files], [
+            (os.path.join('dir', 'file 2.txt'), b'second'),
+        ])
+
+        with self.assertRaises(agit.GitError):
+            run(collect(agit.walk_files('branch', 'nonexist',
+                                        cwd=self.stage)))
@@ -0,0 +1,150 @@
+import os
+import unittest
+from unittest import mock
+
+from .. import *
+from mike import cache, git_utils
+
+
+class TestCache(unittest.TestCase):
+    def setUp(self):
+        self.stage = stage_dir('cache')
+        self.cache = cache.Cache(os.path.join(self.stage, 'cache'))
+
+    def test_get_set(self):
+        self.assertEqual(self.cache.get('ns', 'key'), None)
+        self.assertEqual(self.cache.get('ns', 'key', 'default'), 'default')
+
+        self.cache.set('ns', 'key', {'value': [1, 2]})
+        self.assertEqual(self.cache.get('ns', 'key'), {'value': [1, 2]})
+        self.assertEqual(self.cache.get('ns', 'other'), None)
+        self.assertEqual(self.cache.get('other', 'key'), None)
+
+    def test_corrupt(self):
+        self.cache.set('ns', 'key', 'value')
+        with open(self.cache._entry_path('ns', 'key'), 'wb') as f:
+            f.write(b'garbage')
+        self.assertEqual(self.cache.get('ns', 'key'), None)
+
+    def test_trim(self):
+        self.cache.trim_interval = 1
+        self.cache.set('ns', 'key1', 'a' * 100)
+        self.cache.set('ns', 'key2', 'b' * 100)
+        self.cache.max_size = self.cache.size() + 50
+
+        # Make `key1` the most-recently-used entry.
+        os.utime(self.cache._entry_path('ns', 'key2'), ns=(0, 0))
+        self.cache.get('ns', 'key1')
+
+        self.cache.set('ns', 'key3', 'c' * 100)
+        self.assertEqual(self.cache.get('ns', 'key1'), 'a' * 100)
+        self.assertEqual(self.cache.get('ns', 'key2'), None)
+        self.assertEqual(self.cache.get('ns', 'key3'), 'c' * 100)
+        self.assertLessEqual(self.cache.size(), self.cache.max_size)
+
+    def test_trim_interval(self):
+        self.cache.trim_interval = 3
+        self.cache.max_size = 0
+        with mock.patch.object(self.cache, 'trim') as mtrim:
+            self.cache.set('ns', 'key1', 'value')
+            self.cache.set('ns', 'key2', 'value')
+        mtrim.assert_not_called()
+        self.assertEqual(self.cache.get('ns', 'key1'), 'value')
+
+        # Writes from other processes count too.
+        other = cache.Cache(self.cache.path, 0, 3)
+        other.set('ns', 'key3', 'value')
+        self.assertEqual(self.cache.size(), 0)
+
+    def test_clear(self):
+        self.cache.set('ns', 'key', 'value')
+        self.cache.clear()
+        self.assertEqual(self.cache.get('ns', 'key'), None)
+        self.assertEqual(self.cache.size(), 0)
+
+
+class TestGetCache(unittest.TestCase):
+    def test_repo(self):
+        self.stage = stage_dir('get_cache')
+        git_init()
+        self.assertEqual(cache.get_cache().path,
+                         os.path.join(self.stage, '.git', 'mike', 'cache'))
+
+    def test_not_repo(self):
+        self.stage = stage_dir('get_cache')
+        with mock.patch('mike.git_utils.get_git_dir',
+                        side_effect=git_utils.GitError('error')):
+            self.assertIs(cache.get_cache(), None)
+
+
+class TestMemoize(unittest.TestCase):
+    def setUp(self):
+        self.stage = stage_dir('memoize')
+        git_init()
+
+    def test_memoize(self):
+        calls = []
+
+        @cache.memoize('ns')
+        def fn(key):
+            calls.append(key)
+            return key * 2
+
+        self.assertEqual(fn('a'), 'aa')
+        self.assertEqual(fn('a'), 'aa')
+        self.assertEqual(fn('b'), 'bb')
+        self.assertEqual(calls, ['a', 'b'])
+
+
+class TestHashRealFiles(unittest.TestCase):
+    def setUp(self):
+        self.stage = stage_dir('cache_hash_real_files')
+        git_init()
+        self.site = os.path.join(self.stage, 'site')
+        os.mkdir(self.site)
+        for i in ('file1.txt', 'file2.txt'):
+            self._write(i, i)
+
+    def _write(self, name, data):
+        with open(os.path.join(self.site, name), 'w') as f:
+            f.write(data)
+
+    def _hash(self):
+        return {os.path.basename(i.path): i.oid
+                for i in cache.hash_real_files(self.site)}
+
+    def test_hash(self):
+        self.assertEqual(self._hash(), {
+            'file1.txt': git_utils.hash_blob('file1.txt'),
+            'file2.txt': git_utils.hash_blob('file2.txt'),
+        })
+
+    def test_reuse(self):
+        with mock.patch('mike.cache._racy_window', -10**18):
+            self._hash()
+            self._write('file2.txt', 'changed')
+            with mock.patch('mike.git_utils.hash_files',
+                            wraps=git_utils.hash_files) as mhash:
+                self.assertEqual(self._hash(), {
+                    'file1.txt': git_utils.hash_blob('file1.txt'),
+                    'file2.txt': git_utils.hash_blob('changed'),
+                })
+            mhash.assert_called_once_with([os.path.join(self.site,
+                                                        'file2.txt')])
+
+    def test_racy(self):
+        self._hash()
+        with mock.patch('mike.git_utils.hash_files',
+                        wraps=git_utils.hash_files) as mhash:
+            self._hash()
+        self.assertEqual(len(mhash.call_args[0][0]), 2)
+
+    def test_missing_object(self):
+        with mock.patch('mike.cache._racy_window', -10**18):
+            self._hash()
+            with mock.patch('mike.git_utils.missing_objects',
+                            side_effect=lambda x: set(x)):
+                self.assertEqual(self._hash(), {
+                    'file1.txt': git_utils.hash_blob('file1.txt'),
+                    'file2.txt': git_utils.hash_blob('file2.txt'),
+                })
@@ -2,8 +2,10 @@ import json
 import os
 import re
 import shutil
+import tarfile
 import unittest
 from collections.abc import Mapping
+from functools import partial
 from unittest import mock
 
 from .. import *
@@ -40,6 +42,30 @@ class TestListVersions(unittest.TestCase):
     def test_versions_nonexistent(self):
         self.assertEqual(list(commands.list_versions()), [])
 
+    def test_versions_cached(self):
+        with git_utils.Commit('gh-pages', 'add versions.json') as commit:
+            commit.add_file(git_utils.FileInfo(
+                'versions.json',
+                '[{"version": "1.0", "title": "1.0", "aliases": []}]',
+            ))
+
+        expected = [versions.VersionInfo('1.0')]
+        self.assertEqual(list(commands.list_versions()), expected)
+        with mock.patch('mike.git_utils.read_blob') as mread:
+            self.assertEqual(list(commands.list_versions()), expected)
+        mread.assert_not_called()
+
+    def test_versions_symlink(self):
+        with git_utils.Commit('gh-pages', 'add versions.json') as commit:
+            commit.add_file(git_utils.FileInfo(
+                'dir/versions.json',
+                '[{"version": "1.0", "title": "1.0", "aliases": []}]',
+            ))
+            commit.add_file(git_utils.FileInfo('prefix', 'dir', 0o120000))
+
+        self.assertEqual(list(commands.list_versions(deploy_prefix='prefix')),
+                         [versions.VersionInfo('1.0')])
+
 
 class TestBase(unittest.TestCase):
     def setUp(self):
@@ -289,6 +315,82 @@ class TestDeploy(TestBase):
             versions.VersionInfo('1.0', '1.0', ['latest'])
         ])
 
+    def test_build_error(self):
+        self._mock_commit()
+        old_rev = git_utils.get_latest_commit('gh-pages')
+        with self.assertRaises(RuntimeError):
+            with commands.deploy(self.cfg, '2.0'):
+                raise RuntimeError('build failed')
+        self.assertEqual(git_utils.get_latest_commit('gh-pages'), old_rev)
+
+    def test_concurrent_commit(self):
+        # If something else deploys while we're building, we should deploy on
+        # top of its changes.
+        with commands.deploy(self.cfg, '1.0'):
+            self._mock_build()
+            with commands.deploy(self.cfg, '2.0'):
+                pass
+        self.assertEqual(git_utils.count_reachable('gh-pages'), 2)
+        check_call_silent(['git', 'checkout', 'gh-pages'])
+        self._test_deploy(r'^Deployed \S+ to 1\.0 ', [
+            versions.VersionInfo('2.0'), versions.VersionInfo('1.0')
+        ])
+
+    def test_targets(self):
+        targets = [commands.Target('gh-pages'),
+                   commands.Target('mirror', deploy_prefix='prefix')]
+        with commands.deploy(self.cfg, '1.0', targets=targets):
+            self._mock_build()
+
+        self.assertEqual(git_utils.read_file('gh-pages', '1.0/page.html'),
+                         git_utils.read_file('mirror', 'prefix/1.0/page.html'))
+        check_call_silent(['git', 'checkout', 'gh-pages'])
+        self._test_deploy()
+        check_call_silent(['git', 'checkout', 'mirror'])
+        self._test_deploy(directory='prefix')
+
+    def test_targets_walk_site(self):
+        self._mock_build()
+        with tarfile.open('site.tar', 'w') as tar:
+            tar.add(self.cfg['site_dir'], '.')
+        shutil.rmtree(self.cfg['site_dir'])
+
+        targets = [commands.Target('gh-pages'), commands.Target('mirror')]
+        walk_site = partial(git_utils.walk_archive_files, 'site.tar')
+        with commands.deploy(self.cfg, '1.0', targets=targets,
+                             walk_site=walk_site):
+            pass
+
+        self.assertFalse(os.path.exists(self.cfg['site_dir']))
+        os.remove('site.tar')
+        self.assertEqual(git_utils.read_file('mirror', '1.0/page.html'),
+                         git_utils.read_file('gh-pages', '1.0/page.html'))
+        check_call_silent(['git', 'checkout', 'gh-pages'])
+        self._test_deploy()
+
+    def test_targets_partially_empty(self):
+        with commands.deploy(self.cfg, '1.0', aliases=['latest']):
+            self._mock_build()
+        targets = [commands.Target('gh-pages'), commands.Target('mirror')]
+        with commands.deploy(self.cfg, '1.0', aliases=['latest'],
+                             targets=targets):
+            self._mock_build()
+        self.assertEqual(git_utils.count_reachable('gh-pages'), 1)
+        self.assertEqual(git_utils.count_reachable('mirror'), 1)
+
+        with self.assertRaises(git_utils.GitEmptyCommit):
+            with commands.deploy(self.cfg, '1.0', aliases=['latest'],
+                                 targets=targets):
+                self._mock_build()
+
+    def test_duplicate_targets(self):
+        targets = [commands.Target('gh-pages'),
+                   commands.Target('gh-pages', deploy_prefix='prefix')]
+        with self.assertRaisesRegex(ValueError, 'different branch'):
+            with commands.deploy(self.cfg, '1.0', targets=targets):
+                raise AssertionError('should not get here')
+        self.assertFalse(git_utils.has_branch('gh-pages'))
+
     def test_update_aliases(self):
         self._mock_commit()
         with commands.deploy(self.cfg, '2.0', '2.0.0', ['latest'],
@@ -300,6 +402,219 @@ class TestDeploy(TestBase):
             versions.VersionInfo('1.0', '1.0', []),
         ])
 
+    def test_incremental(self):
+        self._mock_commit()
+        with git_utils.Commit('gh-pages', 'add stale file') as commit:
+            commit.add_file(git_utils.FileInfo('1.0/old-page.html', ''))
+
+        with commands.deploy(self.cfg, '1.0', aliases=['latest'],
+                             incremental=True):
+            self._mock_build()
+            with open(os.path.join(self.cfg['site_dir'], 'page.html'),
+                      'w') as f:
+                f.write('new page')
+
+        changes = check_output(['git', 'show', '--name-status', '--format=',
+                                '--no-renames', 'gh-pages'])
+        self.assertEqual(sorted(changes.splitlines()), [
+            'A\t.nojekyll',
+            'D\t1.0/old-page.html',
+            'M\t1.0/page.html',
+            'M\tversions.json',
+        ])
+
+        check_call_silent(['git', 'checkout', 'gh-pages'])
+        self._test_deploy(expected_versions=[
+            versions.VersionInfo('1.0', aliases=['latest'])
+        ])
+        with open(os.path.join('1.0', 'page.html')) as f:
+            self.assertEqual(f.read(), 'new page')
+
+    def test_incremental_new_version(self):
+        self._mock_commit()
+        with commands.deploy(self.cfg, '2.0', incremental=True):
+            self._mock_build()
+        check_call_silent(['git', 'checkout', 'gh-pages'])
+        self._test_deploy(expected_versions=[
+            versions.VersionInfo('2.0'),
+            versions.VersionInfo('1.0', aliases=['latest']),
+        ])
+
+    def test_incremental_aliases_copy(self):
+        self._mock_commit()
+        with commands.deploy(self.cfg, '1.0', aliases=['latest'],
+                             alias_type=AliasType.copy, incremental=True):
+            self._mock_build()
+        with commands.deploy(self.cfg, '1.0', aliases=['latest'],
+                             alias_type=AliasType.copy, incremental=True):
+            self._mock_build()
+            os.remove(os.path.join(self.cfg['site_dir'], 'file.txt'))
+
+        changes = check_output(['git', 'show', '--name-status', '--format=',
+                                '--no-renames', 'gh-pages'])
+        self.assertEqual(sorted(changes.splitlines()), [
+            'D\t1.0/file.txt',
+            'D\tlatest/file.txt',
+        ])
+
+        check_call_silent(['git', 'checkout', 'gh-pages~'])
+        self._test_deploy(expected_versions=[
+            versions.VersionInfo('1.0', aliases=['latest'])
+        ], alias_type=AliasType.copy)
+        self.assertFalse(os.path.islink('latest'))
+
+
+class TestDeployProjects(TestBase):
+    stage_dir = 'deploy_projects'
+
+    def setUp(self):
+        super().setUp()
+        self.projects = [
+            commands.Project(mock_config(os.path.join(self.stage, 'site1')),
+                             'one'),
+            commands.Project(mock_config(os.path.join(self.stage, 'site2')),
+                             'two', AliasType.copy),
+        ]
+
+    def _mock_build(self):
+        site1, site2 = (i.cfg['site_dir'] for i in self.projects)
+        copytree(self.stage, site1)
+        copytree(site1, site2)
+
+    def test_default(self):
+        with commands.deploy_projects(self.projects, '1.0',
+                                      aliases=['latest']):
+            self._mock_build()
+        self.assertEqual(git_utils.count_reachable('gh-pages'), 1)
+
+        for i in self.projects:
+            shutil.rmtree(i.cfg['site_dir'])
+        check_call_silent(['git', 'checkout', 'gh-pages'])
+        expected_versions = [versions.VersionInfo('1.0', aliases=['latest'])]
+        rev = git_utils.get_latest_commit('master', short=True)
+        self._test_state(
+            r'^Deployed {} to 1.0 in one, two with (MkDocs|ProperDocs) \S+ '
+            .format(rev) + r'and mike \S+$',
+            expected_versions, directory='one'
+        )
+        self._test_state('.*', expected_versions, AliasType.copy,
+                         directory='two')
+        self.assertTrue(os.path.islink(os.path.join('one', 'latest')))
+
+    def test_duplicate_prefix(self):
+        projects = [self.projects[0], self.projects[0]]
+        with self.assertRaisesRegex(ValueError, 'different deploy prefix'):
+            with commands.deploy_projects(projects, '1.0'):
+                raise AssertionError('should not get here')
+        self.assertFalse(git_utils.has_branch('gh-pages'))
+
+
+class TestDeployMatrix(unittest.TestCase):
+    def setUp(self):
+        self.stage = stage_dir('deploy_matrix')
+        git_init()
+        copytree(os.path.join(test_data_dir, 'basic_theme'), self.stage)
+        check_call_silent(['git', 'add', 'mkdocs.yml', 'docs'])
+        check_call_silent(['git', 'commit', '-m', 'initial commit'])
+        check_call_silent(['git', 'tag', 'v1'])
+
+        commit_files([os.path.join('docs', 'page.md')], 'add page')
+        check_call_silent(['git', 'tag', 'v2'])
+        self.cfg = mock_config(os.path.join(self.stage, 'site'))
+
+    def _test_state(self, expected_versions, pages={}):
+        assertDirectory('.', {'versions.json'} |
+                        {str(i.version) for i in expected_versions} |
+                        {j for i in expected_versions for j in i.aliases},
+                        allow_extra=True)
+        for v in expected_versions:
+            version = str(v.version)
+            self.assertTrue(os.path.exists(os.path.join(version,
+                                                        'index.html')))
+            self.assertEqual(os.path.exists(os.path.join(version, 'page')),
+                             pages.get(version, False))
+
+        with open('versions.json') as f:
+            self.assertEqual(list(versions.Versions.loads(f.read())),
+                             expected_versions)
+
+    def test_default(self):
+        commands.deploy_matrix(self.cfg, [
+            commands.MatrixEntry('1.0', 'v1'),
+            commands.MatrixEntry('2.0', 'v2', '2.0.0', ['latest']),
+        ], quiet=True)
+        self.assertEqual(git_utils.count_reachable('gh-pages'), 1)
+
+        message = check_output(['git', 'log', '-1', '--pretty=%B',
+                                'gh-pages']).rstrip()
+        self.assertRegex(message, (
+            r'^Deployed v1 to 1.0, v2 to 2.0 with (MkDocs|ProperDocs) \S+ ' +
+            r'and mike \S+$'
+        ))
+
+        check_call_silent(['git', 'checkout', 'gh-pages'])
+        self._test_state([
+            versions.VersionInfo('2.0', '2.0.0', ['latest']),
+            versions.VersionInfo('1.0'),
+        ], pages={'2.0': True})
+        self.assertTrue(os.path.islink('latest'))
+
+    def test_update_aliases(self):
+        commands.deploy_matrix(self.cfg, [
+            commands.MatrixEntry('1.0', 'v1', aliases=['latest']),
+        ], quiet=True)
+        commands.deploy_matrix(self.cfg, [
+            commands.MatrixEntry('1.0', 'v1'),
+            commands.MatrixEntry('2.0', 'v2', aliases=['latest']),
+        ], True, AliasType.copy, message='commit message', quiet=True)
+
+        message = check_output(['git', 'log', '-1', '--pretty=%B',
+                                'gh-pages']).rstrip()
+        self.assertEqual(message, 'commit message')
+
+        check_call_silent(['git', 'checkout', 'gh-pages'])
+        self._test_state([
+            versions.VersionInfo('2.0', aliases=['latest']),
+            versions.VersionInfo('1.0'),
+        ], pages={'2.0': True, 'latest': True})
+        self.assertFalse(os.path.islink('latest'))
+
+    def test_ref_config(self):
+        # Each ref is deployed using its own `use_directory_urls` setting.
+        with open('mkdocs.yml', 'a') as f:
+            f.write('use_directory_urls: false\n')
+        check_call_silent(['git', 'commit', '-am', 'no directory urls'])
+        check_call_silent(['git', 'tag', 'v3'])
+
+        commands.deploy_matrix(self.cfg, [
+            commands.MatrixEntry('2.0', 'v2', aliases=['latest']),
+            commands.MatrixEntry('3.0', 'v3', aliases=['stable']),
+        ], alias_type=AliasType.redirect, quiet=True)
+
+        self.assertIn('../../2.0/page/', git_utils.read_file(
+            'gh-pages', 'latest/page/index.html', universal_newlines=True
+        ))
+        self.assertIn('../3.0/page.html', git_utils.read_file(
+            'gh-pages', 'stable/page.html', universal_newlines=True
+        ))
+
+    def test_duplicate_version(self):
+        with self.assertRaisesRegex(ValueError,
+                                    'version 1.0 specified more than once'):
+            commands.deploy_matrix(self.cfg, [
+                commands.MatrixEntry('1.0', 'v1'),
+                commands.MatrixEntry('1.0', 'v2'),
+            ], quiet=True)
+        self.assertFalse(git_utils.has_branch('gh-pages'))
+
+    def test_build_error(self):
+        with self.assertRaises(git_utils.GitError):
+            commands.deploy_matrix(self.cfg, [
+                commands.MatrixEntry('1.0', 'v1'),
+                commands.MatrixEntry('2.0', 'nonexist'),
+            ], quiet=True)
+        self.assertFalse(git_utils.has_branch('gh-pages'))
+
 
 class TestDelete(TestBase):
     stage_dir = 'delete'
@@ -644,6 +959,34 @@ class TestGetProperty(TestPropertyBase):
             commands.get_property('2.0', '')
 
 
+class TestGetPropertiesAll(TestPropertyBase):
+    stage_dir = 'get_properties_all'
+
+    def test_get_properties_all(self):
+        self._commit_versions(
+            versions.VersionInfo('1.0', properties={'hidden': True}),
+            versions.VersionInfo('2.0', properties={'hidden': False,
+                                                    'tags': ['new']}),
+            versions.VersionInfo('3.0'),
+        )
+        self.assertEqual(
+            [(str(info.version), values) for info, values in
+             commands.get_properties_all(['hidden', 'tags[0]'])],
+            [('3.0', [None, None]), ('2.0', [False, 'new']),
+             ('1.0', [True, None])]
+        )
+
+    def test_deploy_prefix(self):
+        self._commit_versions(versions.VersionInfo(
+            '1.0', properties={'hidden': True}
+        ), deploy_prefix='prefix')
+        self.assertEqual(
+            [(str(info.version), values) for info, values in
+             commands.get_properties_all([''], deploy_prefix='prefix')],
+            [('1.0', [{'hidden': True}])]
+        )
+
+
 class TestSetProperties(TestPropertyBase):
     stage_dir = 'set_properties'
 
@@ -745,6 +1088,79 @@ class TestSetProperties(TestPropertyBase):
             commands.set_properties('2.0', [('foo.bar', True)])
 
 
+class TestSetPropertiesAll(TestPropertyBase):
+    stage_dir = 'set_properties_all'
+
+    def setUp(self):
+        super().setUp()
+        self._commit_versions(
+            versions.VersionInfo('1.0', properties={'hidden': False}),
+            versions.VersionInfo('1.1', aliases=['stable']),
+            versions.VersionInfo('2.0', properties={'hidden': False}),
+        )
+
+    def _test_set_properties(self, expected_versions, expected_message):
+        message = check_output(['git', 'log', '-1', '--pretty=%B',
+                                'gh-pages']).rstrip()
+        self.assertRegex(message, expected_message)
+        self.assertEqual(list(commands.list_versions()), expected_versions)
+        commit_count = int(check_output(['git', 'rev-list', '--count',
+                                         'gh-pages']))
+        self.assertEqual(commit_count, 2)
+
+    def test_identifiers(self):
+        commands.set_properties_all([('hidden', True)],
+                                    identifiers=['1.0', 'stable'])
+        self._test_set_properties([
+            versions.VersionInfo('2.0', properties={'hidden': False}),
+            versions.VersionInfo('1.1', aliases=['stable'],
+                                 properties={'hidden': True}),
+            versions.VersionInfo('1.0', properties={'hidden': True}),
+        ], r'^Set properties for 1\.1, 1\.0 with mike \S+$')
+
+    def test_range(self):
+        commands.set_properties_all([('hidden', True), ('tags[tail]', 'old')],
+                                    version_range='<2')
+        self._test_set_properties([
+            versions.VersionInfo('2.0', properties={'hidden': False}),
+            versions.VersionInfo('1.1', aliases=['stable'],
+                                 properties={'hidden': True,
+                                             'tags': ['old']}),
+            versions.VersionInfo('1.0', properties={'hidden': True,
+                                                    'tags': ['old']}),
+        ], r'^Set properties for 1\.1, 1\.0 with mike \S+$')
+
+    def test_where(self):
+        commands.set_properties_all([('', {'tags': []}),
+                                     ('tags[tail]', 'new')],
+                                    where=[('hidden', False)])
+        self._test_set_properties([
+            versions.VersionInfo('2.0', properties={'tags': ['new']}),
+            versions.VersionInfo('1.1', aliases=['stable']),
+            versions.VersionInfo('1.0', properties={'tags': ['new']}),
+        ], r'^Set properties for 2\.0, 1\.0 with mike \S+$')
+
+    def test_combined(self):
+        commands.set_properties_all([('hidden', Deleted)],
+                                    version_range='>=1.0,<2',
+                                    where=[('hidden', False)])
+        self._test_set_properties([
+            versions.VersionInfo('2.0', properties={'hidden': False}),
+            versions.VersionInfo('1.1', aliases=['stable']),
+            versions.VersionInfo('1.0'),
+        ], r'^Set properties for 1\.0 with mike \S+$')
+
+    def test_none_selected(self):
+        with self.assertRaisesRegex(ValueError, 'no versions selected'):
+            commands.set_properties_all([('hidden', True)],
+                                        version_range='>3')
+
+    def test_invalid_version(self):
+        with self.assertRaisesRegex(ValueError, "'3.0' does not exist"):
+            commands.set_properties_all([('hidden', True)],
+                                        identifiers=['1.0', '3.0'])
+
+
 class TestRetitle(unittest.TestCase):
     def setUp(self):
         self.stage = stage_dir('retitle')
@@ -812,6 +1228,27 @@ class TestRetitle(unittest.TestCase):
                            expected_message='.*', allow_extra=True)
         self._test_retitle(directory='prefix')
 
+    def test_concurrent_commit(self):
+        self._deploy()
+        orig_commit = commands.Batch.commit
+
+        def commit(b, *args, **kwargs):
+            # Simulate another process committing before we can.
+            if mock_commit.call_count == 1:
+                with git_utils.Commit('gh-pages', 'add file') as c:
+                    c.add_file(git_utils.FileInfo('other.txt', 'text'))
+            return orig_commit(b, *args, **kwargs)
+
+        with mock.patch.object(commands.Batch, 'commit', autospec=True,
+                               side_effect=commit) as mock_commit:
+            commands.retitle('1.0', '1.0.1')
+        self.assertEqual(mock_commit.call_count, 2)
+        self.assertEqual(git_utils.read_file('gh-pages', 'other.txt'),
+                         b'text')
+        self.assertEqual(list(commands.list_versions()), [
+            versions.VersionInfo('1.0', '1.0.1'),
+        ])
+
     def test_retitle_invalid(self):
         self._deploy()
         self.assertRaises(ValueError, commands.retitle, '2.0', '2.0.2')
@@ -899,6 +1336,205 @@ class TestSetDefault(unittest.TestCase):
                           branch='branch')
 
 
+class TestBatch(unittest.TestCase):
+    def setUp(self):
+        self.stage = stage_dir('batch')
+        self.cfg = mock_config(self.stage)
+        git_init()
+        commit_files(['file.txt'])
+        for i in ['0.9', '1.0']:
+            with commands.deploy(self.cfg, i):
+                pass
+
+    def test_batch(self):
+        with commands.batch() as b:
+            b.deploy(self.cfg, '2.0', aliases=['latest'], update_aliases=True)
+            b.alias(self.cfg, '2.0', ['stable'], alias_type=AliasType.copy)
+            b.retitle('1.0', '1.0.1')
+            b.set_properties([('hidden', True)], ['1.0'])
+            b.set_default('latest')
+            b.delete(['0.9'])
+
+        self.assertEqual(git_utils.count_reachable('gh-pages'), 3)
+        message = check_output(['git', 'log', '-1', '--pretty=%B',
+                                'gh-pages']).rstrip()
+        self.assertRegex(message, (
+            r'^Deployed \S+ to 2\.0; Copied 2\.0 to stable; ' +
+            r'Set title of 1\.0 to 1\.0\.1; Set properties for 1\.0; ' +
+            r'Set default version to latest; Removed 0\.9 with \S+ ' +
+            r'\S+ and mike \S+$'
+        ))
+
+        check_call_silent(['git', 'checkout', 'gh-pages'])
+        assertDirectory('.', {
+            'versions.json',
+            'index.html',
+            '1.0',
+            '1.0/file.txt',
+            '2.0',
+            '2.0/file.txt',
+            'latest',
+            'stable',
+            'stable/file.txt',
+        })
+        self.assertTrue(os.path.exists('.nojekyll'))
+        self.assertTrue(os.path.islink('latest'))
+        with open('index.html') as f:
+            self.assertRegex(f.read(), match_redir('latest/'))
+        with open('versions.json') as f:
+            self.assertEqual(list(versions.Versions.loads(f.read())), [
+                versions.VersionInfo('2.0', aliases=['latest', 'stable']),
+                versions.VersionInfo('1.0', '1.0.1',
+                                     properties={'hidden': True}),
+            ])
+
+    def test_alias_existing(self):
+        with commands.batch() as b:
+            b.alias(self.cfg, '1.0', ['stable'], alias_type=AliasType.copy)
+            b.alias(self.cfg, '0.9', ['old'], alias_type=AliasType.redirect)
+
+        self.assertEqual(git_utils.count_reachable('gh-pages'), 3)
+        check_call_silent(['git', 'checkout', 'gh-pages'])
+        assertDirectory('.', {
+            'versions.json',
+            '0.9',
+            '0.9/file.txt',
+            '1.0',
+            '1.0/file.txt',
+            'stable',
+            'stable/file.txt',
+        })
+
+    def test_delete_all(self):
+        with commands.batch() as b:
+            b.delete(all=True)
+            b.deploy(self.cfg, '2.0')
+
+        self.assertEqual(git_utils.count_reachable('gh-pages'), 3)
+        check_call_silent(['git', 'checkout', 'gh-pages'])
+        assertDirectory('.', {
+            'versions.json',
+            '2.0',
+            '2.0/file.txt',
+        })
+        self.assertTrue(os.path.exists('.nojekyll'))
+        with open('versions.json') as f:
+            self.assertEqual(list(versions.Versions.loads(f.read())), [
+                versions.VersionInfo('2.0'),
+            ])
+
+    def test_deploy_prefix(self):
+        with commands.batch(deploy_prefix='prefix') as b:
+            b.deploy(self.cfg, '2.0')
+            b.retitle('2.0', '2.0.1')
+
+        message = check_output(['git', 'log', '-1', '--pretty=%B',
+                                'gh-pages']).rstrip()
+        self.assertRegex(message, r'; Set title of 2\.0 to 2\.0\.1 in prefix ')
+        check_call_silent(['git', 'checkout', 'gh-pages'])
+        with open('prefix/versions.json') as f:
+            self.assertEqual(list(versions.Versions.loads(f.read())), [
+                versions.VersionInfo('2.0', '2.0.1'),
+            ])
+
+    def test_commit_message(self):
+        with commands.batch(message='commit message') as b:
+            b.retitle('1.0', '1.0.1')
+        self.assertEqual(check_output(['git', 'log', '-1', '--pretty=%B',
+                                       'gh-pages']).rstrip(),
+                         'commit message')
+
+    def test_error(self):
+        rev = git_utils.get_latest_commit('gh-pages')
+        with self.assertRaises(ValueError):
+            with commands.batch() as b:
+                b.retitle('1.0', '1.0.1')
+                b.delete(['2.0'])
+        self.assertEqual(git_utils.get_latest_commit('gh-pages'), rev)
+
+    def test_empty(self):
+        with self.assertRaises(git_utils.GitEmptyCommit):
+            with commands.batch() as b:
+                b.retitle('1.0', '1.0')
+        self.assertEqual(git_utils.count_reachable('gh-pages'), 2)
+
+        with commands.batch(allow_empty=True):
+            pass
+        self.assertEqual(git_utils.count_reachable('gh-pages'), 3)
+
+
+class TestPush(unittest.TestCase):
+    def setUp(self):
+        self.origin = stage_dir('push_origin')
+        git_init()
+        commit_files(['file.txt'], 'initial commit')
+        self._deploy('1.0')
+
+        self.stage = stage_dir('push')
+        check_call_silent(['git', 'clone', self.origin, '.'])
+        check_call_silent(['git', 'branch', 'gh-pages', 'origin/gh-pages'])
+        git_config()
+
+    def _deploy(self, version, aliases=[]):
+        all_versions = commands.list_versions()
+        all_versions.add(version, aliases=aliases)
+        with git_utils.Commit('gh-pages', 'add ' + version) as commit:
+            commit.add_file(git_utils.FileInfo(
+                'versions.json', all_versions.dumps()
+            ))
+            commit.add_file(git_utils.FileInfo(version + '/index.html',
+                                               'docs for ' + version))
+
+    def _race(self, their_aliases=[], our_aliases=[]):
+        with pushd(self.origin):
+            self._deploy('2.0', their_aliases)
+        self._deploy('3.0', our_aliases)
+
+    def test_push(self):
+        self._deploy('2.0')
+        head = git_utils.get_latest_commit('gh-pages')
+        commands.push()
+        with pushd(self.origin):
+            self.assertEqual(git_utils.get_latest_commit('gh-pages'), head)
+
+    def test_rejected(self):
+        self._race()
+        head = git_utils.get_latest_commit('gh-pages')
+        with self.assertRaises(git_utils.GitPushRejected):
+            commands.push()
+        self.assertEqual(git_utils.get_latest_commit('gh-pages'), head)
+
+    def test_retry(self):
+        self._race(['stable'], ['latest'])
+        with mock.patch('mike.commands.push_retry_delay', 0):
+            commands.push(retries=1)
+
+        with pushd(self.origin):
+            self.assertEqual(list(commands.list_versions()), [
+                versions.VersionInfo('3.0', aliases=['latest']),
+                versions.VersionInfo('2.0', aliases=['stable']),
+                versions.VersionInfo('1.0'),
+            ])
+            self.assertEqual(sorted(git_utils.list_tree('gh-pages')), [
+                '1.0/index.html', '2.0/index.html', '3.0/index.html',
+                'versions.json',
+            ])
+            self.assertEqual(
+                check_output(['git', 'log', '--format=%s', 'gh-pages'])
+                .splitlines(),
+                ['add 3.0', 'add 2.0', 'add 1.0']
+            )
+
+    def test_retry_conflict(self):
+        self._race(['latest'], ['latest'])
+        head = git_utils.get_latest_commit('gh-pages')
+        with mock.patch('mike.commands.push_retry_delay', 0), \
+             self.assertRaisesRegex(git_utils.GitMergeConflict,
+                                    r"versions\.json: alias 'latest'"):
+            commands.push(retries=1)
+        self.assertEqual(git_utils.get_latest_commit('gh-pages'), head)
+
+
 class TestServe(unittest.TestCase):
     def setUp(self):
         self.stage = stage_dir('serve')
@@ -919,3 +1555,35 @@ class TestServe(unittest.TestCase):
              mock.patch(handler_name + '.log_message') as m:
             commands.serve(branch='branch', verbose=False)
             self.assertEqual(m.call_args[0][1:3], ('GET / HTTP/1.1', '200'))
+
+
+class TestReceive(unittest.TestCase):
+    def setUp(self):
+        self.stage = stage_dir('receive')
+        git_init()
+
+    def test_receive(self):
+        servers = []
+
+        class MyMockServer(MockServer):
+            def __init__(self, addr, handler):
+                super().__init__(addr, handler)
+                self.server_address = addr
+                servers.append(self)
+
+            def serve_forever(self):
+                raise KeyboardInterrupt()
+
+            def server_close(self):
+                pass
+
+        with mock.patch('http.server.ThreadingHTTPServer', MyMockServer):
+            commands.receive('localhost:8001', branch='branch', push=True,
+                             verbose=False)
+
+        self.assertEqual(len(servers), 1)
+        self.assertEqual(servers[0].server_address, ('localhost', 8001))
+        r = servers[0].handler.receiver
+        self.assertEqual((r.branch, r.push), ('branch', True))
+        with self.assertRaisesRegex(ValueError, 'shutting down'):
+            r.submit(None)
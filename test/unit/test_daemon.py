@@ -0,0 +1,178 @@
+import os
+import socket
+import sys
+import unittest
+from unittest import mock
+
+from .. import *
+from mike import daemon
+
+
+@unittest.skipIf(not daemon.supported(), 'daemon not supported')
+class TestMessages(unittest.TestCase):
+    def setUp(self):
+        self.server, self.client = socket.socketpair()
+        self.addCleanup(self.server.close)
+        self.addCleanup(self.client.close)
+
+    def test_message(self):
+        daemon.send_message(self.client, {'argv': ['list'], 'cwd': '/'})
+        self.assertEqual(daemon.recv_message(self.server),
+                         ({'argv': ['list'], 'cwd': '/'}, []))
+
+    def test_large_message(self):
+        data = {'env': {'VAR': 'x' * 1024 * 1024}}
+
+        # Read from another process so that sending doesn't block.
+        pid = os.fork()
+        if pid == 0:  # pragma: no cover
+            try:
+                self.client.close()
+                daemon.send_message(self.server,
+                                    daemon.recv_message(self.server)[0])
+            finally:
+                os._exit(0)
+
+        daemon.send_message(self.client, data)
+        self.assertEqual(daemon.recv_message(self.client), (data, []))
+        os.waitpid(pid, 0)
+
+    def test_fds(self):
+        r, w = os.pipe()
+        daemon.send_message(self.client, {}, [w])
+        os.close(w)
+
+        data, fds = daemon.recv_message(self.server)
+        self.assertEqual(data, {})
+        self.assertEqual(len(fds), 1)
+        os.write(fds[0], b'hello')
+        os.close(fds[0])
+        self.assertEqual(os.read(r, 5), b'hello')
+        os.close(r)
+
+    def test_closed(self):
+        self.client.close()
+        with self.assertRaises(ConnectionError):
+            daemon.recv_message(self.server)
+
+
+@unittest.skipIf(not daemon.supported(), 'daemon not supported')
+class TestForward(unittest.TestCase):
+    def setUp(self):
+        self.stage = stage_dir('daemon_forward')
+        git_init()
+
+    def test_no_daemon(self):
+        self.assertEqual(daemon.socket_path(), daemon.default_socket_path())
+        self.assertEqual(daemon.forward(['list']), None)
+
+    def test_socket_path_without_git(self):
+        expected = daemon.default_socket_path()
+        os.makedirs(os.path.join('sub', 'dir'))
+        with pushd(os.path.join('sub', 'dir')), \
+             mock.patch('mike.git_utils.get_git_dir') as mgit:
+            self.assertEqual(daemon.socket_path(), expected)
+        mgit.assert_not_called()
+
+    def test_socket_path_git_dir(self):
+        with mock.patch.dict(os.environ, {
+            'GIT_DIR': os.path.join(self.stage, '.git')
+        }), mock.patch('mike.git_utils.get_git_dir',
+                       return_value='/path/to/.git') as mgit:
+            self.assertEqual(daemon.socket_path(),
+                             os.path.join('/path/to/.git', 'mike',
+                                          'daemon.sock'))
+        mgit.assert_called_once_with()
+
+    def test_stale_socket(self):
+        path = os.path.join(self.stage, 'daemon.sock')
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.bind(path)
+        sock.close()
+
+        with mock.patch.dict(os.environ, {daemon.socket_var: path}):
+            self.assertEqual(daemon.socket_path(), path)
+            self.assertEqual(daemon.forward(['list']), None)
+
+    def test_disabled(self):
+        path = os.path.join(self.stage, 'daemon.sock')
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.addCleanup(sock.close)
+        sock.bind(path)
+        sock.listen()
+
+        with mock.patch.dict(os.environ, {daemon.socket_var: path,
+                                          daemon.disable_var: '1'}):
+            self.assertEqual(daemon.forward(['list']), None)
+
+
+@unittest.skipIf(not daemon.supported(), 'daemon not supported')
+class TestListen(unittest.TestCase):
+    def setUp(self):
+        self.stage = stage_dir('daemon_listen')
+        self.path = os.path.join(self.stage, 'sub', 'daemon.sock')
+
+    def test_listen(self):
+        d = daemon.Daemon(self.path, log=sys.stderr)
+        d._listen()
+        self.addCleanup(d._listener.close)
+        self.assertTrue(os.path.exists(self.path))
+
+        with self.assertRaisesRegex(ValueError, 'already running'):
+            daemon.Daemon(self.path)._listen()
+
+    def test_stale_socket(self):
+        os.mkdir('sub')
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.bind(self.path)
+        sock.close()
+
+        d = daemon.Daemon(self.path)
+        d._listen()
+        self.addCleanup(d._listener.close)
+        self.assertTrue(os.path.exists(self.path))
+
+
+@unittest.skipIf(not daemon.supported(), 'daemon not supported')
+class TestBranchKey(unittest.TestCase):
+    def setUp(self):
+        self.stage = stage_dir('daemon_branch_key')
+        git_init()
+        self.git_dir = os.path.abspath('.git')
+        self.daemon = daemon.Daemon(os.path.join(self.stage, 'daemon.sock'))
+
+    def _request(self, argv):
+        return daemon.Request(None, argv, self.stage, dict(os.environ), [])
+
+    def test_explicit_branch(self):
+        self.assertEqual(self.daemon._branch_key(self._request(
+            ['deploy', '-b', 'branch', '1.0']
+        )), (self.git_dir, 'branch'))
+        self.assertEqual(self.daemon._branch_key(self._request(
+            ['alias', '-b', 'branch', '1.0', 'latest']
+        )), (self.git_dir, 'branch'))
+
+    def test_config_branch(self):
+        # The config file doesn't exist, but we shouldn't try to load it.
+        self.assertEqual(self.daemon._branch_key(self._request(
+            ['deploy', '1.0']
+        )), (self.git_dir, None, self.stage, None))
+        self.assertEqual(self.daemon._branch_key(self._request(
+            ['deploy', '-F', 'mkdocs.yml', '-F', 'other.yml', '1.0']
+        )), (self.git_dir, None, self.stage, ('mkdocs.yml', 'other.yml')))
+        self.assertEqual(self.daemon._branch_key(self._request(
+            ['alias', '-F', 'mkdocs.yml', '1.0', 'latest']
+        )), (self.git_dir, None, self.stage, 'mkdocs.yml'))
+
+    def test_no_repo(self):
+        with mock.patch('mike.git_utils.get_git_dir',
+                        side_effect=daemon.git_utils.GitError('error')):
+            self.assertEqual(self.daemon._branch_key(self._request(
+                ['deploy', '-b', 'branch', '1.0']
+            )), (self.stage, 'branch'))
+
+    def test_no_commit(self):
+        self.assertEqual(self.daemon._branch_key(self._request(['list'])),
+                         None)
+        self.assertEqual(self.daemon._branch_key(self._request(['bad'])),
+                         None)
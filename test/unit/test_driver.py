@@ -1,11 +1,31 @@
 import mkdocs.config
 import os
+import subprocess
+import sys
 import unittest
-from argparse import Namespace
+from argparse import ArgumentTypeError, Namespace
 from unittest import mock
+from verspec.loose import LooseVersion as Version
 
 from .. import *
-from mike import driver
+from mike import commands, driver, git_utils, mkdocs_utils, versions
+
+
+class TestLazyImports(unittest.TestCase):
+    def test_driver(self):
+        modules = check_output([sys.executable, '-c', (
+            'import sys, mike.driver\n'
+            'mike.driver.make_parser()\n'
+            'print(" ".join(sorted(sys.modules)))'
+        )]).split()
+        for i in ('mkdocs', 'jinja2', 'pyparsing', 'yaml', 'http.server',
+                  'mike.mkdocs_plugin', 'mike.commands', 'mike.cache',
+                  'mike.mkdocs_utils', 'mike.versions'):
+            self.assertNotIn(i, modules)
+
+    def test_alias_types(self):
+        self.assertEqual(driver.alias_types,
+                         [i.name for i in commands.AliasType])
 
 
 class TestLoadMkdocsConfig(unittest.TestCase):
@@ -40,6 +60,19 @@ class TestLoadMkdocsConfig(unittest.TestCase):
         self.assertEqual(args.template, 'file.html')
         self.assertEqual(args.deploy_prefix, 'prefix')
 
+    def test_config_resolve(self):
+        path = os.path.join(test_data_dir, 'remote', 'mkdocs.yml')
+        args = self.make_args(config_file=path, alias_type=None, template=None,
+                              deploy_prefix=None)
+        cfg = driver.load_mkdocs_config(args, full=False)
+        self.assertNotIsInstance(cfg, mkdocs.config.Config)
+        self.assertEqual(cfg['use_directory_urls'], True)
+        self.assertEqual(args.branch, 'mybranch')
+        self.assertEqual(args.remote, 'myremote')
+        self.assertEqual(args.alias_type, 'symlink')
+        self.assertEqual(args.template, None)
+        self.assertEqual(args.deploy_prefix, '')
+
     def test_no_config(self):
         args = self.make_args(branch='gh-pages', remote='origin')
         with mock.patch('builtins.open', side_effect=FileNotFoundError):
@@ -71,3 +104,250 @@ class TestLoadMkdocsConfig(unittest.TestCase):
         with mock.patch('builtins.open', side_effect=FileNotFoundError):
             with self.assertRaises(FileNotFoundError):
                 driver.load_mkdocs_config(args)
+
+
+class TestLoadProjects(unittest.TestCase):
+    def make_args(self, **kwargs):
+        default = {'config_file': None, 'deploy_prefix': None,
+                   'branch': None, 'remote': None, 'alias_type': None,
+                   'template': None}
+        default.update(kwargs)
+        return Namespace(**default)
+
+    def setUp(self):
+        self.config = os.path.join(test_data_dir, 'basic_theme', 'mkdocs.yml')
+        self.remote_config = os.path.join(test_data_dir, 'remote',
+                                          'mkdocs.yml')
+
+    def test_single(self):
+        args = self.make_args(config_file=[self.config])
+        projects = driver.load_projects(args)
+        self.assertEqual(len(projects), 1)
+        self.assertEqual(projects[0][1].config_file, self.config)
+        self.assertEqual(projects[0][1].deploy_prefix, '')
+        self.assertEqual(args.branch, 'gh-pages')
+        self.assertEqual(args.remote, 'origin')
+
+    def test_multiple(self):
+        args = self.make_args(config_file=[self.config, self.config],
+                              deploy_prefix=['one', 'two'])
+        projects = driver.load_projects(args)
+        self.assertEqual([i.deploy_prefix for _, i in projects],
+                         ['one', 'two'])
+        self.assertEqual(args.branch, 'gh-pages')
+
+    def test_mismatched_count(self):
+        args = self.make_args(config_file=[self.config, self.config],
+                              deploy_prefix=['one'])
+        with self.assertRaisesRegex(ValueError, 'same number of times'):
+            driver.load_projects(args)
+
+    def test_mismatched_branch(self):
+        args = self.make_args(config_file=[self.config, self.remote_config],
+                              deploy_prefix=['one', 'two'])
+        with self.assertRaisesRegex(ValueError, 'same remote and branch'):
+            driver.load_projects(args)
+
+
+class TestParseTarget(unittest.TestCase):
+    def test_branch(self):
+        self.assertEqual(driver.parse_target('origin:mirror'),
+                         commands.Target('mirror', 'origin', ''))
+
+    def test_prefix(self):
+        self.assertEqual(driver.parse_target('origin:mirror:docs/dir'),
+                         commands.Target('mirror', 'origin', 'docs/dir'))
+
+    def test_invalid(self):
+        for i in ('origin', 'origin:', ':mirror'):
+            with self.assertRaises(ArgumentTypeError):
+                driver.parse_target(i)
+
+
+class TestParseRange(unittest.TestCase):
+    def test_valid(self):
+        self.assertEqual(driver.parse_range('>=2.0,<3'), (
+            ('>=', Version('2.0')), ('<', Version('3')),
+        ))
+
+    def test_invalid(self):
+        for i in ('', '2.0', '=>2.0', '>=2.0,'):
+            with self.assertRaises(ArgumentTypeError):
+                driver.parse_range(i)
+
+
+class TestLoadBuildMatrix(unittest.TestCase):
+    def setUp(self):
+        self.stage = stage_dir('load_build_matrix')
+
+    def _load(self, data):
+        with open('matrix.yml', 'w') as f:
+            f.write(data)
+        return driver.load_build_matrix('matrix.yml')
+
+    def test_refs(self):
+        self.assertEqual(self._load('1.0: v1.0\n1.10: v1.10\n'), [
+            commands.MatrixEntry('1.0', 'v1.0'),
+            commands.MatrixEntry('1.10', 'v1.10'),
+        ])
+
+    def test_full(self):
+        self.assertEqual(self._load(
+            '2.0:\n  ref: v2.0.1\n  title: 2.0.1\n  aliases: [latest]\n'
+        ), [
+            commands.MatrixEntry('2.0', 'v2.0.1', '2.0.1', ['latest']),
+        ])
+
+    def test_single_alias(self):
+        entries = self._load('2.0:\n  ref: v2.0\n  aliases: latest\n')
+        self.assertEqual(entries, [
+            commands.MatrixEntry('2.0', 'v2.0', None, ['latest']),
+        ])
+
+        all_versions = versions.Versions()
+        all_versions.add(entries[0].version, entries[0].title,
+                         entries[0].aliases)
+        self.assertEqual(list(all_versions), [
+            versions.VersionInfo('2.0', aliases=['latest']),
+        ])
+
+    def test_json(self):
+        self.assertEqual(self._load('{"1.0": {"ref": "v1.0"}}'), [
+            commands.MatrixEntry('1.0', 'v1.0'),
+        ])
+
+    def test_invalid(self):
+        with self.assertRaisesRegex(ValueError, 'must map versions'):
+            self._load('- v1.0\n')
+        with self.assertRaisesRegex(ValueError,
+                                    "no Git ref specified for version '1.0'"):
+            self._load('1.0:\n  title: 1.0.0\n')
+        with self.assertRaisesRegex(ValueError, "aliases for version '1.0' " +
+                                    'must be a list of strings'):
+            self._load('1.0:\n  ref: v1.0\n  aliases: {latest: yes}\n')
+        with self.assertRaisesRegex(ValueError, "aliases for version '1.0' " +
+                                    'must be a list of strings'):
+            self._load('1.0:\n  ref: v1.0\n  aliases: [[latest]]\n')
+
+
+class TestLoadBatchScript(unittest.TestCase):
+    def setUp(self):
+        self.stage = stage_dir('load_batch_script')
+
+    def _load(self, data):
+        with open('batch.yml', 'w') as f:
+            f.write(data)
+        return driver.load_batch_script('batch.yml')
+
+    def test_steps(self):
+        self.assertEqual(self._load(
+            '- deploy: {version: 1.10, aliases: [latest]}\n' +
+            '- props: {identifier: 1.0, set: [hidden=true]}\n'
+        ), [
+            ('deploy', {'version': '1.10', 'aliases': ['latest']}),
+            ('props', {'identifier': '1.0', 'set': ['hidden=true']}),
+        ])
+
+    def test_json(self):
+        self.assertEqual(self._load('[{"delete": {"identifiers": ["0.9"]}}]'),
+                         [('delete', {'identifiers': ['0.9']})])
+
+    def test_invalid(self):
+        with self.assertRaisesRegex(ValueError, 'must be a list of steps'):
+            self._load('deploy: {version: 1.0}\n')
+        with self.assertRaisesRegex(ValueError, 'map a command'):
+            self._load('- deploy: {version: 1.0}\n  alias: {}\n')
+        with self.assertRaisesRegex(ValueError,
+                                    "unknown batch command 'serve'"):
+            self._load('- serve: {}\n')
+        with self.assertRaisesRegex(ValueError, "arguments for 'delete'"):
+            self._load('- delete: 1.0\n')
+        with self.assertRaisesRegex(ValueError,
+                                    "unknown argument 'ref' for 'deploy'"):
+            self._load('- deploy: {version: 1.0, ref: v1.0}\n')
+
+
+class TestParseBatchStep(unittest.TestCase):
+    def setUp(self):
+        self.args = Namespace(alias_type='symlink', template=None)
+
+    def _parse(self, command, step_args):
+        return driver.parse_batch_step(command, step_args, self.args)
+
+    def test_valid(self):
+        b = mock.Mock()
+        self._parse('retitle', {'identifier': '1.0', 'title': '1.0.1'})(
+            b, cfg=None
+        )
+        b.retitle.assert_called_once_with('1.0', '1.0.1')
+
+        self._parse('delete', {'identifiers': '0.9', 'all': 'no'})(
+            b, cfg=None
+        )
+        b.delete.assert_called_once_with(['0.9'], False)
+
+    def test_missing(self):
+        with self.assertRaisesRegex(ValueError,
+                                    "missing argument 'title' for 'retitle'"):
+            self._parse('retitle', {'identifier': '1.0'})
+
+    def test_invalid_type(self):
+        with self.assertRaisesRegex(ValueError,
+                                    "expected a boolean for 'all'"):
+            self._parse('delete', {'all': ['true']})
+        with self.assertRaisesRegex(ValueError,
+                                    "expected a boolean for 'all'"):
+            self._parse('delete', {'all': True})
+        with self.assertRaisesRegex(ValueError,
+                                    "expected a string for 'title'"):
+            self._parse('retitle', {'identifier': '1.0', 'title': ['x']})
+        with self.assertRaisesRegex(ValueError, 'expected a list of ' +
+                                    "strings for 'aliases'"):
+            self._parse('alias', {'identifier': '1.0',
+                                  'aliases': {'latest': ''}})
+
+    def test_key_error(self):
+        # Errors from applying the step aren't reported as missing arguments.
+        b = mock.Mock()
+        b.retitle.side_effect = KeyError('oops')
+        operation = self._parse('retitle', {'identifier': '1.0',
+                                            'title': '1.0.1'})
+        with self.assertRaises(KeyError):
+            operation(b, cfg=None)
+
+
+class TestBatch(unittest.TestCase):
+    def setUp(self):
+        self.stage = stage_dir('driver_batch')
+        git_init()
+        copytree(os.path.join(test_data_dir, 'basic_theme'), self.stage)
+        check_call_silent(['git', 'add', 'mkdocs.yml', 'docs'])
+        check_call_silent(['git', 'commit', '-m', 'initial commit'])
+        with open('batch.yml', 'w') as f:
+            f.write('- deploy: {version: 1.0}\n' +
+                    '- deploy: {version: 2.0, aliases: [latest]}\n')
+
+    def test_build_before_lock(self):
+        real_build = mkdocs_utils.build
+        built = []
+
+        def build(config_file, version, **kwargs):
+            self.assertFalse(os.path.exists(git_utils.lock_path('gh-pages')))
+            real_build(config_file, version, output=subprocess.DEVNULL,
+                       **kwargs)
+            built.append(version)
+
+        parser = driver.make_parser()
+        args = parser.parse_args(['batch', 'batch.yml'])
+        with mock.patch('mike.mkdocs_utils.build', build):
+            args.func(parser, args)
+
+        self.assertEqual(built, ['1.0', '2.0'])
+        self.assertEqual(git_utils.count_reachable('gh-pages'), 1)
+        self.assertEqual(list(commands.list_versions()), [
+            versions.VersionInfo('2.0', aliases=['latest']),
+            versions.VersionInfo('1.0'),
+        ])
+        for i in ('1.0', '2.0'):
+            self.assertIn(b'<html',
+                          git_utils.read_file('gh-pages', i + '/index.html'))
@@ -1,11 +1,22 @@
+import io
 import os
+import socket
 import sys
+import tarfile
+import threading
+import time
 import unittest
 from contextlib import contextmanager
+from unittest import mock
 
 from .. import *
 from mike import git_utils
 
+try:
+    import zstandard
+except ImportError:  # pragma: no cover
+    zstandard = None
+
 
 @contextmanager
 def let_env(**kwargs):
@@ -162,6 +173,32 @@ class TestUpdateRef(unittest.TestCase):
                           'branch', 'nonexist')
         self.assertEqual(git_utils.get_latest_commit('branch'), rev)
 
+    def test_old_ref(self):
+        old = git_utils.get_latest_commit('branch')
+        check_call_silent(['git', 'checkout', 'master'])
+        commit_files(['file2.txt'], 'second commit')
+        rev = git_utils.get_latest_commit('master')
+
+        git_utils.update_ref('branch', rev, old)
+        self.assertEqual(git_utils.get_latest_commit('branch'), rev)
+        with self.assertRaises(git_utils.GitRefConflict):
+            git_utils.update_ref('branch', old, old)
+        self.assertEqual(git_utils.get_latest_commit('branch'), rev)
+
+    def test_old_ref_nonexistent_branch(self):
+        rev = git_utils.get_latest_commit('branch')
+        git_utils.update_ref('branch-2', rev, '')
+        self.assertEqual(git_utils.get_latest_commit('branch-2'), rev)
+        with self.assertRaises(git_utils.GitRefConflict):
+            git_utils.update_ref('branch-2', 'master', '')
+        self.assertEqual(git_utils.get_latest_commit('branch-2'), rev)
+
+    def test_old_ref_nonexistent_ref(self):
+        rev = git_utils.get_latest_commit('branch')
+        with self.assertRaises(git_utils.GitError) as e:
+            git_utils.update_ref('branch', 'nonexist', rev)
+        self.assertNotIsInstance(e.exception, git_utils.GitRefConflict)
+
 
 class TestGetMergeBaseAndCompareBranches(unittest.TestCase):
     def setUp(self):
@@ -311,8 +348,38 @@ class TestPushBranch(unittest.TestCase):
             commit_files(['file2.txt'], 'add file2')
 
         commit_files(['file2.txt'], 'add file2 from clone')
-        self.assertRaises(git_utils.GitError, git_utils.push_branch, 'origin',
-                          'master')
+        self.assertRaises(git_utils.GitPushRejected, git_utils.push_branch,
+                          'origin', 'master')
+
+    def test_push_nonexistent_remote(self):
+        with self.assertRaises(git_utils.GitError) as e:
+            git_utils.push_branch('nonexist', 'master')
+        self.assertNotIsInstance(e.exception, git_utils.GitPushRejected)
+
+
+class TestFetchBranch(unittest.TestCase):
+    def setUp(self):
+        self.origin = stage_dir('fetch_branch_origin')
+        git_init()
+        commit_files(['file.txt'], 'initial commit')
+
+        self.stage = stage_dir('fetch_branch')
+        check_call_silent(['git', 'clone', self.origin, '.'])
+        git_config()
+
+    def test_fetch(self):
+        with pushd(self.origin):
+            commit_files(['file2.txt'], 'add file2')
+            origin_rev = git_utils.get_latest_commit('master')
+
+        git_utils.fetch_branch('origin', 'master')
+        self.assertEqual(git_utils.get_latest_commit('origin/master'),
+                         origin_rev)
+        self.assertNotEqual(git_utils.get_latest_commit('master'), origin_rev)
+
+    def test_fetch_fails(self):
+        self.assertRaises(git_utils.GitError, git_utils.fetch_branch,
+                          'origin', 'nonexist')
 
 
 class TestDeleteBranch(unittest.TestCase):
@@ -331,6 +398,21 @@ class TestDeleteBranch(unittest.TestCase):
         with self.assertRaises(git_utils.GitError):
             git_utils.delete_branch('nonexist')
 
+    def test_old_ref(self):
+        with git_utils.Commit('branch', 'add file') as commit:
+            commit.add_file(git_utils.FileInfo('file.txt', 'some text'))
+        old = git_utils.get_latest_commit('branch')
+        with git_utils.Commit('branch', 'add file') as commit:
+            commit.add_file(git_utils.FileInfo('file2.txt', 'some text'))
+
+        with self.assertRaises(git_utils.GitRefConflict):
+            git_utils.delete_branch('branch', old)
+        self.assertTrue(git_utils.has_branch('branch'))
+
+        git_utils.delete_branch('branch',
+                                git_utils.get_latest_commit('branch'))
+        self.assertFalse(git_utils.has_branch('branch'))
+
 
 class TestIsCommitEmpty(unittest.TestCase):
     def setUp(self):
@@ -383,6 +465,382 @@ class TestDeleteLatestCommit(unittest.TestCase):
             git_utils.delete_latest_commit('master')
 
 
+class TestSquashCommits(unittest.TestCase):
+    def setUp(self):
+        self.stage = stage_dir('squash_commits')
+        git_init()
+
+    def _add_file(self, name, branch='branch'):
+        with git_utils.Commit(branch, 'add {}'.format(name)) as commit:
+            commit.add_file(git_utils.FileInfo(name, 'this is some text'))
+
+    def _messages(self, branch='branch'):
+        return check_output(['git', 'log', '--format=%B', branch]).strip()
+
+    def test_squash(self):
+        self._add_file('file-1.txt')
+        base = git_utils.get_latest_commit('branch')
+        self._add_file('file-2.txt')
+        self._add_file('file-3.txt')
+
+        git_utils.squash_commits('branch', base)
+        self.assertEqual(git_utils.count_reachable('branch'), 2)
+        self.assertEqual(git_utils.get_latest_commit('branch^'), base)
+        self.assertEqual(sorted(git_utils.list_tree('branch')),
+                         ['file-1.txt', 'file-2.txt', 'file-3.txt'])
+        self.assertEqual(self._messages(),
+                         'add file-2.txt\n\nadd file-3.txt\n\n' +
+                         'add file-1.txt')
+
+    def test_squash_all(self):
+        self._add_file('file-1.txt')
+        self._add_file('file-2.txt')
+
+        git_utils.squash_commits('branch')
+        self.assertEqual(git_utils.count_reachable('branch'), 1)
+        self.assertEqual(sorted(git_utils.list_tree('branch')),
+                         ['file-1.txt', 'file-2.txt'])
+
+    def test_single_commit(self):
+        self._add_file('file-1.txt')
+        base = git_utils.get_latest_commit('branch')
+        self._add_file('file-2.txt')
+        rev = git_utils.get_latest_commit('branch')
+
+        git_utils.squash_commits('branch', base)
+        self.assertEqual(git_utils.get_latest_commit('branch'), rev)
+
+
+class TestDiffTree(unittest.TestCase):
+    def setUp(self):
+        self.stage = stage_dir('diff_tree')
+        git_init()
+        with git_utils.Commit('branch', 'add files') as commit:
+            commit.add_file(git_utils.FileInfo('file.txt', 'text'))
+            commit.add_file(git_utils.FileInfo('dir/file2.txt', 'text'))
+
+    def test_diff(self):
+        base = git_utils.get_latest_commit('branch')
+        with git_utils.Commit('branch', 'change files') as commit:
+            commit.delete_files(['dir/file2.txt'])
+            commit.add_file(git_utils.FileInfo('file.txt', 'new text'))
+            commit.add_file(git_utils.FileInfo('link', 'file.txt', 0o120000))
+
+        self.assertEqual(git_utils.diff_tree(base, 'branch'), {
+            'dir/file2.txt': None,
+            'file.txt': (0o100644, git_utils.hash_blob('new text')),
+            'link': (0o120000, git_utils.hash_blob('file.txt')),
+        })
+        self.assertEqual(git_utils.diff_tree('branch', 'branch'), {})
+
+    def test_invalid(self):
+        self.assertRaises(git_utils.GitError, git_utils.diff_tree, 'branch',
+                          'nonexist')
+
+
+class TestRebaseBranch(unittest.TestCase):
+    def setUp(self):
+        self.stage = stage_dir('rebase_branch')
+        git_init()
+        with git_utils.Commit('branch', 'add files') as commit:
+            commit.add_file(git_utils.FileInfo('file.txt', 'text'))
+            commit.add_file(git_utils.FileInfo('shared.txt', 'base'))
+        git_utils.update_ref('upstream', 'branch')
+
+        with git_utils.Commit('upstream', 'upstream change') as commit:
+            commit.add_file(git_utils.FileInfo('upstream.txt', 'upstream'))
+        self.upstream = git_utils.get_latest_commit('upstream')
+
+    def _log(self, rev, fmt='%s'):
+        return check_output(['git', 'log', '--format=' + fmt,
+                             rev]).splitlines()
+
+    def test_rebase(self):
+        check_call_silent(['git', 'config', 'user.name', 'Someone Else'])
+        with git_utils.Commit('branch', 'first change') as commit:
+            commit.add_file(git_utils.FileInfo('dir/ours.txt', 'ours'))
+        git_config()
+        with git_utils.Commit('branch', 'second change') as commit:
+            commit.delete_files(['file.txt'])
+
+        head = git_utils.rebase_branch('branch', 'upstream')
+        self.assertEqual(git_utils.get_latest_commit('branch'), head)
+        self.assertEqual(git_utils.get_merge_base('branch', 'upstream'),
+                         self.upstream)
+        self.assertEqual(self._log('branch'), [
+            'second change', 'first change', 'upstream change', 'add files',
+        ])
+        self.assertEqual(self._log('branch', '%an'), [
+            'username', 'Someone Else', 'username', 'username',
+        ])
+        self.assertEqual(sorted(git_utils.list_tree('branch')), [
+            'dir/ours.txt', 'shared.txt', 'upstream.txt',
+        ])
+
+    def test_same_change(self):
+        with git_utils.Commit('branch', 'change') as commit:
+            commit.add_file(git_utils.FileInfo('upstream.txt', 'upstream'))
+
+        git_utils.rebase_branch('branch', 'upstream')
+        self.assertEqual(self._log('branch'), [
+            'change', 'upstream change', 'add files',
+        ])
+        self.assertEqual(git_utils.read_file('branch', 'upstream.txt'),
+                         b'upstream')
+
+    def test_merge(self):
+        with git_utils.Commit('upstream', 'upstream change') as commit:
+            commit.add_file(git_utils.FileInfo('shared.txt', 'theirs'))
+        with git_utils.Commit('branch', 'change') as commit:
+            commit.add_file(git_utils.FileInfo('shared.txt', 'ours'))
+
+        merge = mock.Mock(return_value='merged')
+        git_utils.rebase_branch('branch', 'upstream', merge)
+        merge.assert_called_once_with('shared.txt', b'base', b'ours',
+                                      b'theirs')
+        self.assertEqual(git_utils.read_file('branch', 'shared.txt'),
+                         b'merged')
+
+    def test_conflict(self):
+        with git_utils.Commit('upstream', 'upstream change') as commit:
+            commit.add_file(git_utils.FileInfo('shared.txt', 'theirs'))
+        with git_utils.Commit('branch', 'change') as commit:
+            commit.delete_files(['shared.txt'])
+        head = git_utils.get_latest_commit('branch')
+
+        with self.assertRaisesRegex(git_utils.GitMergeConflict,
+                                    'conflicting changes to shared.txt'):
+            git_utils.rebase_branch('branch', 'upstream')
+        with self.assertRaises(git_utils.GitMergeConflict):
+            git_utils.rebase_branch('branch', 'upstream',
+                                    mock.Mock(return_value=None))
+        self.assertEqual(git_utils.get_latest_commit('branch'), head)
+
+
+class TestLockBranch(unittest.TestCase):
+    def setUp(self):
+        self.stage = stage_dir('lock_branch')
+        git_init()
+        self.path = os.path.join(self.stage, '.git', 'mike', 'locks', 'refs',
+                                 'heads', 'gh-pages.lock')
+
+    def _write_lock(self, pid):
+        os.makedirs(os.path.dirname(self.path))
+        with open(self.path, 'w') as f:
+            f.write('{} {}\n'.format(socket.gethostname(), pid))
+
+    def test_lock(self):
+        self.assertEqual(git_utils.lock_path('gh-pages'), self.path)
+        with git_utils.lock_branch('gh-pages'):
+            self.assertTrue(os.path.exists(self.path))
+            # Locks are reentrant within a thread.
+            with git_utils.lock_branch('gh-pages'):
+                pass
+            self.assertTrue(os.path.exists(self.path))
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_other_thread(self):
+        events = []
+
+        def lock():
+            with git_utils.lock_branch('gh-pages'):
+                events.append('locked')
+
+        with git_utils.lock_branch('gh-pages'):
+            thread = threading.Thread(target=lock)
+            thread.start()
+            time.sleep(0.2)
+            events.append('unlocking')
+        thread.join()
+        self.assertEqual(events, ['unlocking', 'locked'])
+
+    def test_timeout(self):
+        self._write_lock(os.getppid())
+        with self.assertRaisesRegex(git_utils.GitError,
+                                    'timed out waiting for lock on gh-pages'):
+            with git_utils.lock_branch('gh-pages', timeout=0.1):
+                pass
+        self.assertTrue(os.path.exists(self.path))
+
+        with let_env(MIKE_LOCK_TIMEOUT='0'), \
+             self.assertRaises(git_utils.GitError):
+            with git_utils.lock_branch('gh-pages'):
+                pass
+
+    @unittest.skipIf(os.name != 'posix', 'requires POSIX')
+    def test_stale(self):
+        self._write_lock(12345)
+        with mock.patch('os.kill', side_effect=ProcessLookupError()):
+            with git_utils.lock_branch('gh-pages', timeout=0):
+                pass
+        self.assertFalse(os.path.exists(self.path))
+
+    @unittest.skipIf(os.name != 'posix', 'requires POSIX')
+    def test_stale_replaced(self):
+        # Another process replaces the stale lock with its own just before we
+        # move it aside, so we should put its lock back.
+        self._write_lock(12345)
+        fresh = '{} {}\n'.format(socket.gethostname(), os.getppid())
+        real_rename = os.rename
+
+        def rename(src, dst):
+            with open(self.path, 'w') as f:
+                f.write(fresh)
+            real_rename(src, dst)
+
+        with mock.patch('os.kill', side_effect=ProcessLookupError()), \
+             mock.patch('os.rename', rename), \
+             self.assertRaises(git_utils.GitError):
+            with git_utils.lock_branch('gh-pages', timeout=0):
+                pass
+        with open(self.path) as f:
+            self.assertEqual(f.read(), fresh)
+        self.assertEqual(os.listdir(os.path.dirname(self.path)),
+                         [os.path.basename(self.path)])
+
+    @unittest.skipIf(os.name != 'posix', 'requires POSIX')
+    def test_stale_retaken(self):
+        # Another process removes the stale lock and takes it before we can.
+        self._write_lock(12345)
+        with mock.patch('mike.git_utils._remove_stale_lock',
+                        return_value=True), \
+             self.assertRaises(git_utils.GitError):
+            with git_utils.lock_branch('gh-pages', timeout=0):
+                pass
+        self.assertTrue(os.path.exists(self.path))
+
+
+class TestRetryOnConflict(unittest.TestCase):
+    def test_retry(self):
+        fn = mock.Mock(side_effect=[git_utils.GitRefConflict('branch'), 'ok'])
+        self.assertEqual(git_utils.retry_on_conflict(fn), 'ok')
+        self.assertEqual(fn.call_count, 2)
+
+    def test_give_up(self):
+        fn = mock.Mock(side_effect=git_utils.GitRefConflict('branch'))
+        with self.assertRaises(git_utils.GitRefConflict):
+            git_utils.retry_on_conflict(fn, attempts=2)
+        self.assertEqual(fn.call_count, 2)
+
+    def test_other_error(self):
+        fn = mock.Mock(side_effect=git_utils.GitError('bad'))
+        with self.assertRaises(git_utils.GitError):
+            git_utils.retry_on_conflict(fn)
+        self.assertEqual(fn.call_count, 1)
+
+
+class TestMaintain(unittest.TestCase):
+    def setUp(self):
+        self.stage = stage_dir('maintain')
+        git_init()
+        # Make every commit write a new pack.
+        check_call_silent(['git', 'config', 'fastimport.unpackLimit', '0'])
+        self.pack_dir = os.path.join(self.stage, '.git', 'objects', 'pack')
+        self.lock = os.path.join(self.stage, '.git', 'mike', 'locks',
+                                 'maintain.lock')
+
+    def _commit(self, n):
+        with let_env(MIKE_PACK_LIMIT='0'):
+            for i in range(n):
+                with git_utils.Commit('branch', 'commit {}'.format(i)) as c:
+                    c.add_file(git_utils.FileInfo('file{}.txt'.format(i),
+                                                  'text {}'.format(i)))
+
+    def _hold_lock(self):
+        os.makedirs(os.path.dirname(self.lock), exist_ok=True)
+        with open(self.lock, 'w') as f:
+            f.write('{} {}\n'.format(socket.gethostname(), os.getpid()))
+
+    def test_count_packs(self):
+        self.assertEqual(git_utils.count_packs(), 0)
+        self._commit(3)
+        self.assertEqual(git_utils.count_packs(), 3)
+
+    def test_maintain(self):
+        self._commit(3)
+        head = git_utils.get_latest_commit('branch')
+        git_utils.maintain()
+
+        self.assertEqual(git_utils.count_packs(), 1)
+        self.assertTrue(os.path.exists(os.path.join(
+            self.stage, '.git', 'objects', 'info', 'commit-graph'
+        )))
+        self.assertTrue(os.path.exists(os.path.join(self.pack_dir,
+                                                    'multi-pack-index')))
+        self.assertFalse(os.path.exists(self.lock))
+        self.assertEqual(git_utils.get_latest_commit('branch'), head)
+        self.assertEqual(git_utils.read_file('branch', 'file2.txt'),
+                         b'text 2')
+
+    def test_maintain_locked(self):
+        self._commit(2)
+        self._hold_lock()
+        with self.assertRaisesRegex(git_utils.GitError, 'timed out'):
+            git_utils.maintain(timeout=0)
+        self.assertEqual(git_utils.count_packs(), 2)
+
+    def test_auto_maintain(self):
+        self._commit(2)
+        with let_env(MIKE_PACK_LIMIT='3'):
+            self.assertEqual(git_utils.auto_maintain(), False)
+            self.assertEqual(git_utils.count_packs(), 2)
+
+            with git_utils.Commit('branch', 'commit') as c:
+                c.add_file(git_utils.FileInfo('file.txt', 'text'))
+            self.assertEqual(git_utils.count_packs(), 1)
+        self.assertEqual(git_utils.count_reachable('branch'), 3)
+
+    def test_auto_maintain_loose(self):
+        for i in range(3):
+            with open('file{}.txt'.format(i), 'w') as f:
+                f.write('text {}'.format(i))
+        oids = git_utils.hash_files(['file{}.txt'.format(i)
+                                     for i in range(3)])
+        self.assertEqual(git_utils.count_loose_objects(), 3)
+
+        with let_env(MIKE_LOOSE_LIMIT='3'):
+            with git_utils.Commit('branch', 'commit') as c:
+                for i, oid in enumerate(oids):
+                    c.add_file(git_utils.FileInfo('file{}.txt'.format(i),
+                                                  None, oid=oid))
+        self.assertEqual(git_utils.count_loose_objects(), 0)
+        self.assertEqual(git_utils.count_packs(), 1)
+        self.assertEqual(git_utils.read_file('branch', 'file2.txt'),
+                         b'text 2')
+
+    def test_auto_maintain_deferred(self):
+        self._commit(2)
+        with let_env(MIKE_PACK_LIMIT='3'):
+            with git_utils.lock_branch('branch'):
+                with git_utils.Commit('branch', 'commit') as c:
+                    c.add_file(git_utils.FileInfo('file.txt', 'text'))
+                # Don't maintain the repository while holding the lock.
+                self.assertEqual(git_utils.count_packs(), 3)
+            self.assertEqual(git_utils.count_packs(), 1)
+        self.assertEqual(git_utils.count_reachable('branch'), 3)
+
+    def test_auto_maintain_disabled(self):
+        self._commit(3)
+        with let_env(MIKE_PACK_LIMIT='0'):
+            self.assertEqual(git_utils.auto_maintain(), False)
+        self.assertEqual(git_utils.count_packs(), 3)
+
+    def test_auto_maintain_locked(self):
+        self._commit(3)
+        self._hold_lock()
+        with let_env(MIKE_PACK_LIMIT='3'):
+            self.assertEqual(git_utils.auto_maintain(), False)
+        self.assertEqual(git_utils.count_packs(), 3)
+
+    def test_auto_maintain_fails(self):
+        self._commit(3)
+        with let_env(MIKE_PACK_LIMIT='3'), \
+             mock.patch('mike.git_utils._maintenance_steps',
+                        [(['git', 'nonexist'], 'error')]):
+            self.assertEqual(git_utils.auto_maintain(), False)
+        self.assertFalse(os.path.exists(self.lock))
+
+
 class TestFileInfo(unittest.TestCase):
     def test_copy(self):
         f = git_utils.FileInfo(os.path.join('dir', 'file.txt'), '')
@@ -396,6 +854,24 @@ class TestFileInfo(unittest.TestCase):
             os.path.join('destdir', 'file.txt'), ''
         ))
 
+    def test_source(self):
+        source = os.path.join(test_data_dir, 'directory', 'file.txt')
+        with open(source, 'rb') as f:
+            data = f.read()
+
+        f = git_utils.FileInfo(os.path.join('dir', 'file.txt'), None,
+                               source=source)
+        self.assertEqual(f.data, data)
+        self.assertEqual(f.copy('destdir', 'dir'), git_utils.FileInfo(
+            os.path.join('destdir', 'file.txt'), data
+        ))
+        self.assertEqual(f.copy('destdir', 'dir').source, source)
+
+    def test_oid(self):
+        f = git_utils.FileInfo('file.txt', None, oid='0' * 40)
+        self.assertEqual(f.data, None)
+        self.assertEqual(f.copy('dir').oid, '0' * 40)
+
 
 class TestCommit(unittest.TestCase):
     def setUp(self):
@@ -429,6 +905,24 @@ class TestCommit(unittest.TestCase):
         with open('my "file".txt') as f:
             self.assertEqual(f.read(), 'this is some text')
 
+    def test_add_file_oid(self):
+        oid = git_utils.hash_real_files(
+            os.path.join(test_data_dir, 'directory')
+        )[0].oid
+        with git_utils.Commit('master', 'add file') as commit:
+            commit.add_file(git_utils.FileInfo('file.txt', None, oid=oid))
+        self.assertEqual(git_utils.list_tree('master'),
+                         {'file.txt': (0o100644, oid)})
+
+    def test_add_file_source(self):
+        source = os.path.join(test_data_dir, 'directory', 'file.txt')
+        with git_utils.Commit('master', 'add file') as commit:
+            commit.add_file(git_utils.FileInfo('file.txt', None,
+                                               source=source))
+        with open(source, 'rb') as f:
+            self.assertEqual(git_utils.read_file('master', 'file.txt'),
+                             f.read())
+
     def test_add_file_to_dir(self):
         self._add_file(os.path.join('dir', 'file.txt'))
         check_call_silent(['git', 'checkout', 'master'])
@@ -613,6 +1107,52 @@ class TestCommit(unittest.TestCase):
             pass
         self.assertTrue(git_utils.has_branch('branch'))
 
+    def test_conflict(self):
+        self._add_file('file.txt')
+        commit = git_utils.Commit('master', 'add file 2')
+        commit.add_file(git_utils.FileInfo('file2.txt', 'this is some text'))
+
+        # Another process commits to the branch first.
+        self._add_file('file3.txt')
+        rev = git_utils.get_latest_commit('master')
+        with self.assertRaises(git_utils.GitRefConflict):
+            commit.finish()
+        self.assertEqual(git_utils.get_latest_commit('master'), rev)
+        self.assertEqual(check_output(['git', 'for-each-ref', 'refs/mike']),
+                         '')
+
+    def test_conflict_new_branch(self):
+        commit = git_utils.Commit('branch', 'add file')
+        commit.add_file(git_utils.FileInfo('file.txt', 'this is some text'))
+        self._add_file('file2.txt', 'branch')
+        with self.assertRaises(git_utils.GitRefConflict):
+            commit.finish()
+        self.assertEqual(list(git_utils.list_tree('branch')), ['file2.txt'])
+
+    def test_head(self):
+        self._add_file('file.txt')
+        head = git_utils.get_latest_commit('master')
+        self._add_file('file2.txt')
+
+        commit = git_utils.Commit('master', 'add file 3', head=head)
+        self.assertEqual(commit.head, head)
+        commit.add_file(git_utils.FileInfo('file3.txt', 'this is some text'))
+        with self.assertRaises(git_utils.GitRefConflict):
+            commit.finish()
+
+        with git_utils.Commit('master', 'add file 3',
+                              head=git_utils.get_head('master')) as commit:
+            commit.add_file(git_utils.FileInfo('file3.txt', 'some text'))
+        self.assertEqual(sorted(git_utils.list_tree('master')),
+                         ['file.txt', 'file2.txt', 'file3.txt'])
+
+    def test_abort_removes_temp_ref(self):
+        commit = git_utils.Commit('master', 'add file')
+        commit.add_file(git_utils.FileInfo('file.txt', 'this is some text'))
+        commit.abort()
+        self.assertEqual(check_output(['git', 'for-each-ref', 'refs/mike']),
+                         '')
+
 
 class TestRealPath(unittest.TestCase):
     def setUp(self):
@@ -802,6 +1342,287 @@ class TestWalkFiles(unittest.TestCase):
             list(git_utils.walk_files('nonexist'))
 
 
+class TestWalkArchiveFiles(unittest.TestCase):
+    def setUp(self):
+        self.stage = stage_dir('walk_archive_files')
+
+    def _make_archive(self, members, mode='w'):
+        with tarfile.open('site.tar', mode) as tar:
+            for name, data, file_mode in members:
+                info = tarfile.TarInfo(name)
+                info.mode = file_mode
+                if data is None:
+                    info.type = tarfile.DIRTYPE
+                    tar.addfile(info)
+                elif file_mode == 0o120000:
+                    info.type = tarfile.SYMTYPE
+                    info.linkname = data
+                    tar.addfile(info)
+                else:
+                    info.size = len(data)
+                    tar.addfile(info, io.BytesIO(data))
+
+    def test_walk(self):
+        for mode in ['w', 'w:gz', 'w:bz2', 'w:xz']:
+            self._make_archive([
+                ('./', None, 0o755),
+                ('./index.html', b'main page', 0o644),
+                ('./dir/', None, 0o755),
+                ('./dir/script.sh', b'echo hi', 0o755),
+            ], mode)
+            self.assertEqual(list(git_utils.walk_archive_files('site.tar')), [
+                git_utils.FileInfo('index.html', b'main page'),
+                git_utils.FileInfo(os.path.join('dir', 'script.sh'),
+                                   b'echo hi', 0o100755),
+            ])
+
+    def test_destdir(self):
+        self._make_archive([('index.html', b'main page', 0o644)])
+        self.assertEqual(list(git_utils.walk_archive_files('site.tar',
+                                                           'site')), [
+            git_utils.FileInfo(os.path.join('site', 'index.html'),
+                               b'main page'),
+        ])
+
+    @unittest.skipIf(zstandard is None, 'zstandard not installed')
+    def test_zstd(self):
+        self._make_archive([('index.html', b'main page', 0o644)])
+        with open('site.tar', 'rb') as f:
+            data = zstandard.ZstdCompressor().compress(f.read())
+        with open('site.tar.zst', 'wb') as f:
+            f.write(data)
+
+        self.assertEqual(list(git_utils.walk_archive_files('site.tar.zst')), [
+            git_utils.FileInfo('index.html', b'main page'),
+        ])
+
+    def test_zstd_not_installed(self):
+        with open('site.tar.zst', 'wb') as f:
+            f.write(b'\x28\xb5\x2f\xfd')
+        with mock.patch.dict(sys.modules, {'zstandard': None}), \
+             self.assertRaisesRegex(ValueError, 'zstandard not found'):
+            list(git_utils.walk_archive_files('site.tar.zst'))
+
+    def test_invalid_member(self):
+        self._make_archive([('../index.html', b'main page', 0o644)])
+        with self.assertRaisesRegex(ValueError, 'outside of the site'):
+            list(git_utils.walk_archive_files('site.tar'))
+
+        self._make_archive([('link', 'index.html', 0o120000)])
+        with self.assertRaisesRegex(ValueError, 'not a regular file'):
+            list(git_utils.walk_archive_files('site.tar'))
+
+    def test_invalid_archive(self):
+        with open('site.tar', 'w') as f:
+            f.write('garbage')
+        with self.assertRaisesRegex(ValueError, 'unable to read archive'):
+            list(git_utils.walk_archive_files('site.tar'))
+
+
+class TestListTree(unittest.TestCase):
+    def setUp(self):
+        self.stage = stage_dir('list_tree')
+        git_init()
+        commit_files(['file.txt'], 'initial commit')
+
+        with git_utils.Commit('branch', 'add file') as commit:
+            commit.add_file(git_utils.FileInfo('file.txt', b'text'))
+            commit.add_file(git_utils.FileInfo(
+                os.path.join('dir', 'file.txt'), b'more text', 0o100755
+            ))
+            commit.add_file(git_utils.FileInfo(
+                os.path.join('dir', 'subdir', 'file 2.txt'), b'even more text'
+            ))
+            commit.add_file(git_utils.FileInfo('link', 'dir', 0o120000))
+
+    def _oid(self, rev):
+        return check_output(['git', 'rev-parse', rev]).rstrip()
+
+    def test_root(self):
+        self.assertEqual(git_utils.list_tree('branch'), {
+            'file.txt': (0o100644, self._oid('branch:file.txt')),
+            'dir/file.txt': (0o100755, self._oid('branch:dir/file.txt')),
+            'dir/subdir/file 2.txt': (
+                0o100644, self._oid('branch:dir/subdir/file 2.txt')
+            ),
+            'link': (0o120000, self._oid('branch:link')),
+        })
+
+    def test_dir(self):
+        self.assertEqual(git_utils.list_tree('branch', 'dir'), {
+            'file.txt': (0o100755, self._oid('branch:dir/file.txt')),
+            'subdir/file 2.txt': (
+                0o100644, self._oid('branch:dir/subdir/file 2.txt')
+            ),
+        })
+
+    def test_not_a_directory(self):
+        with self.assertRaises(git_utils.GitError):
+            git_utils.list_tree('branch', 'link')
+
+    def test_nonexistent(self):
+        with self.assertRaises(git_utils.GitError):
+            git_utils.list_tree('branch', 'nonexist')
+        with self.assertRaises(git_utils.GitError):
+            git_utils.list_tree('nonexist')
+
+    def test_tree_oid(self):
+        self.assertEqual(git_utils.list_tree(self._oid('branch:dir')),
+                         git_utils.list_tree('branch', 'dir'))
+
+
+class TestTreeEntry(unittest.TestCase):
+    def setUp(self):
+        self.stage = stage_dir('tree_entry')
+        git_init()
+        with git_utils.Commit('branch', 'add file') as commit:
+            commit.add_file(git_utils.FileInfo(
+                os.path.join('dir', 'file.txt'), b'text', 0o100755
+            ))
+            commit.add_file(git_utils.FileInfo('link', 'dir', 0o120000))
+
+    def _oid(self, rev):
+        return check_output(['git', 'rev-parse', rev]).rstrip()
+
+    def test_entry(self):
+        self.assertEqual(git_utils.tree_entry('branch', ''),
+                         (0o040000, self._oid('branch^{tree}')))
+        self.assertEqual(git_utils.tree_entry('branch', 'dir'),
+                         (0o040000, self._oid('branch:dir')))
+        self.assertEqual(git_utils.tree_entry('branch', 'dir/file.txt'),
+                         (0o100755, self._oid('branch:dir/file.txt')))
+        self.assertEqual(git_utils.tree_entry('branch', 'link'),
+                         (0o120000, self._oid('branch:link')))
+
+    def test_nonexistent(self):
+        with self.assertRaises(git_utils.GitError):
+            git_utils.tree_entry('branch', 'nonexist')
+        with self.assertRaises(git_utils.GitError):
+            git_utils.tree_entry('branch', 'link/file.txt')
+        with self.assertRaises(git_utils.GitError):
+            git_utils.tree_entry('nonexist', 'dir')
+
+
+class TestReadBlob(unittest.TestCase):
+    def setUp(self):
+        self.stage = stage_dir('read_blob')
+        git_init()
+
+    def test_read(self):
+        oid = git_utils.hash_files([os.path.join(test_data_dir, 'directory',
+                                                 'file.txt')])[0]
+        self.assertEqual(git_utils.read_blob(oid), b'hello there\n')
+        self.assertEqual(git_utils.read_blob(oid, universal_newlines=True),
+                         'hello there\n')
+        self.assertEqual(git_utils.missing_objects([oid]), set())
+
+    def test_missing(self):
+        oid = git_utils.hash_blob('nonexistent')
+        with self.assertRaises(git_utils.GitError):
+            git_utils.read_blob(oid)
+        self.assertEqual(git_utils.missing_objects([oid]), {oid})
+
+
+class TestObjectReader(unittest.TestCase):
+    def setUp(self):
+        self.stage = stage_dir('object_reader')
+        git_init()
+        with git_utils.Commit('branch', 'add files') as commit:
+            commit.add_file(git_utils.FileInfo('file.txt', 'hello there\n'))
+            commit.add_file(git_utils.FileInfo('dir/file 2.txt', 'second'))
+            commit.add_file(git_utils.FileInfo('link', 'dir', 0o120000))
+            commit.add_file(git_utils.FileInfo('outside', '../x', 0o120000))
+
+    def test_read(self):
+        with git_utils.ObjectReader() as reader:
+            self.assertEqual(reader.read('branch:file.txt'), (
+                git_utils.hash_blob('hello there\n'), 'blob',
+                b'hello there\n'
+            ))
+            self.assertEqual(reader.read('branch:dir/file 2.txt')[2],
+                             b'second')
+            oid, kind, _ = reader.read('branch')
+            self.assertEqual(oid, git_utils.get_latest_commit('branch'))
+            self.assertEqual(kind, 'commit')
+
+    def test_follow_symlinks(self):
+        with git_utils.ObjectReader() as reader:
+            self.assertEqual(reader.read('branch:link/file 2.txt')[2],
+                             b'second')
+            with self.assertRaises(git_utils.GitError):
+                reader.read('branch:outside')
+            # The reader should still work after that.
+            self.assertEqual(reader.read('branch:file.txt')[2],
+                             b'hello there\n')
+
+    def test_missing(self):
+        with git_utils.ObjectReader() as reader:
+            with self.assertRaises(git_utils.GitError):
+                reader.read('branch:nonexist')
+            with self.assertRaises(git_utils.GitError):
+                reader.read('nonexist')
+            with self.assertRaises(git_utils.GitError):
+                reader.read('branch\n')
+            self.assertEqual(reader.read('branch:file.txt')[2],
+                             b'hello there\n')
+
+    def test_ref_updated(self):
+        with git_utils.ObjectReader() as reader:
+            old_oid = reader.read('branch')[0]
+            with git_utils.Commit('branch', 'update file') as commit:
+                commit.add_file(git_utils.FileInfo('file.txt', 'new'))
+
+            new_oid = reader.read('branch')[0]
+            self.assertNotEqual(new_oid, old_oid)
+            self.assertEqual(reader.read('branch:file.txt')[2], b'new')
+
+    def test_closed(self):
+        reader = git_utils.ObjectReader()
+        reader.close()
+        with self.assertRaises(git_utils.GitError):
+            reader.read('branch')
+
+    def test_cwd(self):
+        with pushd(test_data_dir), \
+             git_utils.ObjectReader(cwd=self.stage) as reader:
+            self.assertEqual(reader.read('branch:file.txt')[2],
+                             b'hello there\n')
+
+
+class TestHashBlob(unittest.TestCase):
+    def test_hash(self):
+        self.assertEqual(git_utils.hash_blob(b'text'),
+                         'f3a34851d44d6b97c90fbb99dd3d18c261b9a237')
+        self.assertEqual(git_utils.hash_blob('text'),
+                         'f3a34851d44d6b97c90fbb99dd3d18c261b9a237')
+        self.assertEqual(git_utils.hash_blob(b''),
+                         'e69de29bb2d1d6434b8b29ae775ad8c2e48c5391')
+
+    def test_sha256(self):
+        self.assertEqual(
+            git_utils.hash_blob(b'', 'sha256'),
+            '473a0f4c3be8a93681a267e3b1e9a7dcda1185436fe141f7749120a303721813'
+        )
+
+
+class TestArchive(unittest.TestCase):
+    def setUp(self):
+        self.stage = stage_dir('archive')
+        git_init()
+        commit_files(['file.txt', os.path.join('dir', 'file2.txt')],
+                     'initial commit')
+        commit_files(['file3.txt'], 'second commit')
+
+    def test_archive(self):
+        destdir = os.path.join(self.stage, 'out')
+        git_utils.archive('master~', destdir)
+        assertDirectory(destdir, {'file.txt', 'dir', 'dir/file2.txt'})
+
+    def test_nonexistent(self):
+        with self.assertRaises(git_utils.GitError):
+            git_utils.archive('nonexist', os.path.join(self.stage, 'out'))
+
+
 class TestWalkRealFiles(unittest.TestCase):
     mode = 0o100755 if sys.platform == 'win32' else 0o100644
 
@@ -817,3 +1638,21 @@ class TestWalkRealFiles(unittest.TestCase):
             data = f.read()
 
         self.assertEqual(files, [git_utils.FileInfo(path, data, self.mode)])
+
+
+class TestHashRealFiles(unittest.TestCase):
+    mode = 0o100755 if sys.platform == 'win32' else 0o100644
+
+    def setUp(self):
+        self.directory = os.path.join(test_data_dir, 'directory')
+        self.stage = stage_dir('hash_real_files')
+        git_init()
+
+    def test_hash(self):
+        path = os.path.join(self.directory, 'file.txt')
+        with open(path, 'rb') as f:
+            oid = git_utils.hash_blob(f.read())
+
+        self.assertEqual(git_utils.hash_real_files(self.directory), [
+            git_utils.FileInfo(path, None, self.mode, oid=oid),
+        ])
@@ -1,5 +1,7 @@
+import pyparsing as pp
 import unittest
 from copy import deepcopy
+from unittest import mock
 
 from mike import jsonpath
 
@@ -43,6 +45,29 @@ class TestParse(unittest.TestCase):
         self.assertEqual(jsonpath.parse(' foo [ 1 ] . bar '),
                          ['foo', 1, 'bar'])
 
+    def test_tabs(self):
+        self.assertEqual(jsonpath.parse('foo\t[1]'), ['foo', 1])
+        self.assertEqual(jsonpath.parse('"a\tb"'), ['a' + ' ' * 6 + 'b'])
+
+    def test_invalid(self):
+        for i in ('.foo', 'foo.', 'foo bar', '[', '[foo]', '[headx]',
+                  '"foo', 'foo=bar'):
+            with self.assertRaises(pp.ParseException):
+                jsonpath.parse(i)
+
+    def test_fast_path(self):
+        with mock.patch('mike.jsonpath._grammar') as mgrammar:
+            self.assertEqual(jsonpath.parse('foo."bar"[0][head]'),
+                             ['foo', 'bar', 0, jsonpath.head])
+            self.assertEqual(jsonpath.parse_set('foo[1]=val'),
+                             (['foo', 1], 'val'))
+        mgrammar.assert_not_called()
+
+    def test_cached(self):
+        result = jsonpath.parse('foo.bar')
+        result.append('baz')
+        self.assertEqual(jsonpath.parse('foo.bar'), ['foo', 'bar'])
+
 
 class TestParseSet(unittest.TestCase):
     def test_empty_path(self):
@@ -80,6 +105,11 @@ class TestParseSet(unittest.TestCase):
         self.assertEqual(jsonpath.parse_set(' foo [ 1 ] . bar = val '),
                          (['foo', 1, 'bar'], 'val '))
 
+    def test_invalid(self):
+        for i in ('', 'foo', 'foo.=val', '[foo]=val', '=val\nval'):
+            with self.assertRaises(pp.ParseException):
+                jsonpath.parse_set(i)
+
 
 class TestGetValue(unittest.TestCase):
     def test_scalar(self):
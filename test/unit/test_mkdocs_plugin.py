@@ -1,3 +1,4 @@
+import json
 import os
 import unittest
 from collections import namedtuple
@@ -5,7 +6,7 @@ from unittest import mock
 
 from .. import *
 from mike import mkdocs_plugin
-from mike.mkdocs_utils import docs_version_var
+from mike.mkdocs_utils import build_manifest_var, docs_version_var
 
 
 class TestGetThemeDir(unittest.TestCase):
@@ -20,6 +21,10 @@ class TestGetThemeDir(unittest.TestCase):
     def test_unknown_theme(self):
         self.assertRaises(ValueError, mkdocs_plugin.get_theme_dir, 'nonexist')
 
+    def test_cached(self):
+        self.assertIs(mkdocs_plugin.get_theme_dir('mkdocs'),
+                      mkdocs_plugin.get_theme_dir('mkdocs'))
+
 
 class PluginTest(unittest.TestCase):
     def make_plugin(self, **kwargs):
@@ -89,3 +94,32 @@ class TestMkdocsPluginOnFiles(PluginTest):
         cfg = self.make_config('mkdocs')
         files = self.make_plugin(version_selector=False).on_files([], cfg)
         self.assertEqual(files, [])
+
+
+class TestMkdocsPluginManifest(PluginTest):
+    MockFile = namedtuple('MockFile', ['abs_dest_path'])
+
+    def setUp(self):
+        self.stage = stage_dir('mkdocs_plugin_manifest')
+        self.manifest = os.path.join(self.stage, 'manifest.json')
+
+    def test_write_manifest(self):
+        files = [self.MockFile('/site/index.html'),
+                 self.MockFile('/site/page/index.html')]
+        plugin = self.make_plugin()
+        self.assertEqual(plugin.on_env('env', {}, files), 'env')
+        with mock.patch('os.environ', {build_manifest_var: self.manifest}):
+            plugin.on_post_build({'site_dir': '/site'})
+
+        with open(self.manifest) as f:
+            self.assertEqual(json.load(f), {
+                'site_dir': '/site',
+                'files': ['/site/index.html', '/site/page/index.html'],
+            })
+
+    def test_no_manifest(self):
+        plugin = self.make_plugin()
+        plugin.on_env('env', {}, [self.MockFile('/site/index.html')])
+        with mock.patch('os.environ', {}):
+            plugin.on_post_build({'site_dir': '/site'})
+        self.assertFalse(os.path.exists(self.manifest))
@@ -26,6 +26,17 @@ def mock_open_files(files):
     return wrapper
 
 
+class TestDefaultConfigFiles(unittest.TestCase):
+    def test_default_config_files(self):
+        files = mkdocs_utils.default_config_files()
+        self.assertEqual(files[-2:], ['mkdocs.yml', 'mkdocs.yaml'])
+        self.assertEqual(mkdocs_utils.default_config_file, files)
+
+    def test_unknown_attribute(self):
+        with self.assertRaises(AttributeError):
+            mkdocs_utils.nonexist
+
+
 # This mostly just tests `load_config` from MkDocs, but we want to be sure it
 # behaves as we want it.
 class TestLoadConfig(unittest.TestCase):
@@ -84,6 +95,130 @@ class TestLoadConfig(unittest.TestCase):
         self.assertEqual(cfg['remote_branch'], 'gh-pages')
         self.assertEqual(cfg['use_directory_urls'], True)
 
+    def test_cache(self):
+        stage_dir('load_config_cache')
+        os.mkdir('docs')
+        with open('mkdocs.yml', 'w') as f:
+            f.write('site_name: test\n')
+
+        with mock.patch('mike.mkdocs_utils._loaded_configs', None):
+            self.assertIsNot(mkdocs_utils.load_config(),
+                             mkdocs_utils.load_config())
+
+            mkdocs_utils.enable_config_cache()
+            cfg = mkdocs_utils.load_config()
+            self.assertIs(mkdocs_utils.load_config(), cfg)
+
+            with open('mkdocs.yml', 'w') as f:
+                f.write('site_name: test\nremote_branch: branch\n')
+            os.utime('mkdocs.yml', ns=(0, 0))
+            self.assertEqual(mkdocs_utils.load_config()['remote_branch'],
+                             'branch')
+
+            with mock.patch.dict(os.environ, {'VAR': 'value'}):
+                self.assertIsNot(mkdocs_utils.load_config(), cfg)
+
+
+class TestResolveConfig(unittest.TestCase):
+    def setUp(self):
+        self.stage = stage_dir('resolve_config')
+        mkdocs_utils._resolved_configs.clear()
+
+    def _write(self, filename, data):
+        with open(filename, 'w') as f:
+            f.write(data)
+
+    def test_default(self):
+        os.chdir(os.path.join(test_data_dir, 'basic_theme'))
+        self.assertEqual(mkdocs_utils.resolve_config(), {
+            'remote_branch': 'gh-pages',
+            'remote_name': 'origin',
+            'use_directory_urls': True,
+            'plugins': {'mike': mkdocs_utils.plugin_defaults},
+        })
+
+    def test_remote(self):
+        os.chdir(os.path.join(test_data_dir, 'remote'))
+        cfg = mkdocs_utils.resolve_config()
+        self.assertEqual(cfg['remote_name'], 'myremote')
+        self.assertEqual(cfg['remote_branch'], 'mybranch')
+
+    def test_no_directory_urls(self):
+        os.chdir(os.path.join(test_data_dir, 'no_directory_urls'))
+        cfg = mkdocs_utils.resolve_config()
+        self.assertEqual(cfg['use_directory_urls'], False)
+
+    def test_nonexist(self):
+        with self.assertRaisesRegex(FileNotFoundError, r"'nonexist.yml'"):
+            mkdocs_utils.resolve_config('nonexist.yml')
+
+    def test_plugin_defaults(self):
+        from mike.mkdocs_plugin import MikePlugin
+        config = MikePlugin.default().config
+        self.assertEqual(mkdocs_utils.plugin_defaults,
+                         {k: config[k] for k in mkdocs_utils.plugin_defaults})
+
+    def test_mike_plugin(self):
+        self._write('mkdocs.yml', (
+            'plugins:\n' +
+            '  - search\n' +
+            '  - mike:\n      alias_type: copy\n      deploy_prefix: dir\n'
+        ))
+        self.assertEqual(mkdocs_utils.resolve_config()['plugins']['mike'], {
+            'alias_type': 'copy', 'redirect_template': None,
+            'deploy_prefix': 'dir',
+        })
+
+        self._write('mkdocs.yml', 'plugins:\n  mike:\n    alias_type: copy\n')
+        self.assertEqual(
+            mkdocs_utils.resolve_config()['plugins']['mike']['alias_type'],
+            'copy'
+        )
+
+    def test_inherit_env(self):
+        self._write('mkdocs.yml', (
+            'INHERIT: !ENV base_file\n' +
+            'remote_name: !ENV [remote, origin]\n' +
+            'plugins:\n  mike:\n    alias_type: copy\n'
+        ))
+        self._write('mkdocs-base.yml', (
+            'remote_branch: branch\n' +
+            'plugins:\n  mike:\n    deploy_prefix: dir\n'
+        ))
+        with mock.patch.dict(os.environ, {'base_file': 'mkdocs-base.yml',
+                                          'remote': 'myremote'}):
+            cfg = mkdocs_utils.resolve_config()
+        self.assertEqual(cfg['remote_branch'], 'branch')
+        self.assertEqual(cfg['remote_name'], 'myremote')
+        self.assertEqual(cfg['plugins']['mike'], {
+            'alias_type': 'copy', 'redirect_template': None,
+            'deploy_prefix': 'dir',
+        })
+
+    def test_full_load(self):
+        self._write('mkdocs.yml', (
+            'site_name: test\n' +
+            'remote_branch: !ENV [branch, gh-pages]\n' +
+            'plugins:\n  - mike:\n      alias_type: !!python/name:str\n'
+        ))
+        with mock.patch('mike.mkdocs_utils._resolve_full_config',
+                        return_value={}) as mresolve:
+            self.assertEqual(mkdocs_utils.resolve_config(), {})
+        mresolve.assert_called_once_with(os.path.abspath('mkdocs.yml'))
+
+    def test_cache(self):
+        self._write('mkdocs.yml', 'remote_branch: branch\n')
+        cfg = mkdocs_utils.resolve_config()
+        self.assertIs(mkdocs_utils.resolve_config(), cfg)
+
+        self._write('mkdocs.yml', 'remote_branch: other\n')
+        os.utime('mkdocs.yml', ns=(0, 0))
+        self.assertEqual(mkdocs_utils.resolve_config()['remote_branch'],
+                         'other')
+
+        with mock.patch.dict(os.environ, {'VAR': 'value'}):
+            self.assertIsNot(mkdocs_utils.resolve_config(), cfg)
+
 
 class TestInjectPlugin(unittest.TestCase):
     def setUp(self):
@@ -257,6 +392,32 @@ class TestBuild(unittest.TestCase):
 
         self.assertTrue(os.path.exists('site/index.html'))
 
+    def test_build_dirty(self):
+        self.stage = stage_dir('build')
+        copytree(os.path.join(test_data_dir, 'basic_theme'), self.stage)
+        os.makedirs('site')
+        open(os.path.join('site', 'stale.html'), 'w').close()
+        mkdocs_utils.build('mkdocs.yml', '1.0', output=subprocess.DEVNULL,
+                           dirty=True)
+
+        self.assertTrue(os.path.exists('site/index.html'))
+        self.assertTrue(os.path.exists('site/stale.html'))
+
+    def test_build_dirty_removed_page(self):
+        self.stage = stage_dir('build')
+        copytree(os.path.join(test_data_dir, 'mkdocs_plugin'), self.stage)
+        with open(os.path.join('docs', 'page.md'), 'w') as f:
+            f.write('# Page\n')
+        mkdocs_utils.build('mkdocs.yml', '1.0', output=subprocess.DEVNULL,
+                           dirty=True)
+        self.assertTrue(os.path.exists('site/page/index.html'))
+
+        os.remove(os.path.join('docs', 'page.md'))
+        mkdocs_utils.build('mkdocs.yml', '1.0', output=subprocess.DEVNULL,
+                           dirty=True)
+        self.assertTrue(os.path.exists('site/index.html'))
+        self.assertFalse(os.path.exists('site/page'))
+
     def test_build_directory(self):
         self.stage = stage_dir('build')
         copytree(os.path.join(test_data_dir, 'basic_theme'), self.stage)
@@ -271,6 +432,69 @@ class TestBuild(unittest.TestCase):
         self.assertTrue(os.path.exists('site/index.html'))
 
 
+class TestBuildInBackground(unittest.TestCase):
+    def setUp(self):
+        self.stage = stage_dir('build_in_background')
+        copytree(os.path.join(test_data_dir, 'basic_theme'), self.stage)
+
+    def test_build(self):
+        with mkdocs_utils.build_in_background(
+            'mkdocs.yml', '1.0', output=subprocess.DEVNULL
+        ) as wait:
+            wait()
+            self.assertTrue(os.path.exists('site/index.html'))
+
+    def test_build_error(self):
+        with self.assertRaises(subprocess.CalledProcessError):
+            with mkdocs_utils.build_in_background(
+                'nonexist.yml', '1.0', output=subprocess.DEVNULL
+            ) as wait:
+                wait()
+
+    def test_abort(self):
+        with mock.patch('subprocess.Popen') as mpopen:
+            with self.assertRaises(ValueError):
+                with mkdocs_utils.build_in_background('mkdocs.yml', '1.0'):
+                    raise ValueError('bad')
+            mpopen.return_value.terminate.assert_called_once_with()
+            mpopen.return_value.wait.assert_called_once_with()
+
+
+@unittest.skipIf(not hasattr(os, 'fork'), 'fork not supported')
+class TestForkedBuild(unittest.TestCase):
+    def setUp(self):
+        self.stage = stage_dir('forked_build')
+        copytree(os.path.join(test_data_dir, 'basic_theme'), self.stage)
+        patcher = mock.patch('mike.mkdocs_utils._forked_builds', True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_build(self):
+        with mock.patch('subprocess.run') as mrun, \
+             mock.patch('subprocess.Popen') as mpopen:
+            mkdocs_utils.build('mkdocs.yml', '1.0', output=subprocess.DEVNULL)
+            with mkdocs_utils.build_in_background(
+                'mkdocs.yml', '1.0', output=subprocess.DEVNULL,
+                site_dir='other_site'
+            ) as wait:
+                wait()
+            mrun.assert_not_called()
+            mpopen.assert_not_called()
+
+        self.assertTrue(os.path.exists('site/index.html'))
+        self.assertTrue(os.path.exists('other_site/index.html'))
+
+    def test_build_error(self):
+        with self.assertRaises(subprocess.CalledProcessError):
+            mkdocs_utils.build('nonexist.yml', '1.0',
+                               output=subprocess.DEVNULL)
+        with self.assertRaises(subprocess.CalledProcessError):
+            with mkdocs_utils.build_in_background(
+                'nonexist.yml', '1.0', output=subprocess.DEVNULL
+            ) as wait:
+                wait()
+
+
 class TestVersion(unittest.TestCase):
     def test_version(self):
         self.assertRegex(mkdocs_utils.version_info(),
@@ -0,0 +1,330 @@
+import http.client
+import http.server
+import io
+import json
+import os
+import tarfile
+import threading
+import unittest
+import urllib.error
+import urllib.request
+
+from .. import *
+from mike import commands, git_utils, receiver, versions
+from mike.commands import AliasType
+
+
+def make_archive(path, files, mode='w:gz'):
+    with tarfile.open(path, mode) as tar:
+        for name, data in files.items():
+            data = data.encode('utf-8')
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+    return path
+
+
+class TestUpload(unittest.TestCase):
+    def test_from_query(self):
+        upload = receiver.Upload.from_query('site.tar', 'version=1.0')
+        self.assertEqual(upload.archive, 'site.tar')
+        self.assertEqual(upload.version, '1.0')
+        self.assertEqual(upload.title, None)
+        self.assertEqual(upload.aliases, [])
+        self.assertEqual(upload.update_aliases, False)
+        self.assertEqual(upload.set_props, [])
+        self.assertEqual(upload.branch, None)
+        self.assertEqual(upload.alias_type, None)
+        self.assertEqual(upload.rev, None)
+
+    def test_from_query_full(self):
+        upload = receiver.Upload.from_query('site.tar', (
+            'version=1.0&title=Version+1&alias=latest&alias=stable&' +
+            'update-aliases=true&set=tags%3D%5B%22new%22%5D&' +
+            'set-string=note%3Dhi&branch=branch&alias-type=copy&rev=abc123'
+        ))
+        self.assertEqual(upload.version, '1.0')
+        self.assertEqual(upload.title, 'Version 1')
+        self.assertEqual(upload.aliases, ['latest', 'stable'])
+        self.assertEqual(upload.update_aliases, True)
+        self.assertEqual(upload.set_props, [(['tags'], ['new']),
+                                            (['note'], 'hi')])
+        self.assertEqual(upload.branch, 'branch')
+        self.assertEqual(upload.alias_type, AliasType.copy)
+        self.assertEqual(upload.rev, 'abc123')
+
+    def test_from_query_invalid(self):
+        with self.assertRaisesRegex(ValueError, 'no version specified'):
+            receiver.Upload.from_query('site.tar', 'title=foo')
+        with self.assertRaisesRegex(ValueError, "'version' passed more"):
+            receiver.Upload.from_query('site.tar', 'version=1&version=2')
+        with self.assertRaisesRegex(ValueError, "unknown parameter 'foo'"):
+            receiver.Upload.from_query('site.tar', 'version=1&foo=bar')
+        with self.assertRaisesRegex(ValueError, 'invalid alias type'):
+            receiver.Upload.from_query('site.tar', 'version=1&alias-type=x')
+        with self.assertRaisesRegex(ValueError, 'expected a boolean'):
+            receiver.Upload.from_query('site.tar',
+                                       'version=1&update-aliases=x')
+        with self.assertRaisesRegex(ValueError, "invalid 'set' expression"):
+            receiver.Upload.from_query('site.tar', 'version=1&set=foo%3D%7B')
+        with self.assertRaisesRegex(ValueError, "invalid 'set' expression"):
+            receiver.Upload.from_query('site.tar', 'version=1&set=foo')
+        with self.assertRaisesRegex(ValueError,
+                                    "invalid 'set-string' expression"):
+            receiver.Upload.from_query('site.tar', 'version=1&set-string=foo')
+
+
+class TestReadArchive(unittest.TestCase):
+    def setUp(self):
+        self.stage = stage_dir('read_archive')
+
+    def test_read(self):
+        for mode in ['w', 'w:gz', 'w:xz']:
+            make_archive('site.tar', {'index.html': 'main page',
+                                      'dir/index.html': 'sub page'}, mode)
+            self.assertEqual(receiver.read_archive('site.tar', 'site'), [
+                git_utils.FileInfo(os.path.join('site', 'index.html'),
+                                   b'main page'),
+                git_utils.FileInfo(os.path.join('site', 'dir', 'index.html'),
+                                   b'sub page'),
+            ])
+        self.assertEqual(os.listdir('.'), ['site.tar'])
+
+    def test_outside_destdir(self):
+        make_archive('site.tar', {'../index.html': 'main page'})
+        with self.assertRaisesRegex(ValueError, '^invalid site archive$'):
+            receiver.read_archive('site.tar', 'site')
+
+    def test_invalid(self):
+        with open('site.tar', 'w') as f:
+            f.write('garbage')
+        with self.assertRaisesRegex(ValueError, '^invalid site archive$'):
+            receiver.read_archive('site.tar', 'site')
+
+
+class TestReceiver(unittest.TestCase):
+    def setUp(self):
+        self.stage = stage_dir('receiver')
+        git_init()
+        os.mkdir('uploads')
+
+    def _upload(self, version, files=None, **kwargs):
+        archive = make_archive(
+            os.path.join('uploads', '{}.tar.gz'.format(version)),
+            files or {'index.html': 'docs for {}'.format(version)}
+        )
+        return receiver.Upload(archive, version, **kwargs)
+
+    def test_process(self):
+        r = receiver.Receiver()
+        uploads = [self._upload('1.0', aliases=['stable'], rev='abc'),
+                   self._upload('2.0', aliases=['latest'],
+                                set_props=[('tags', ['new'])])]
+        r.process('gh-pages', uploads)
+
+        head = git_utils.get_latest_commit('gh-pages')
+        for i in uploads:
+            self.assertEqual((i.commit, i.pushed, i.error),
+                             (head, False, None))
+            self.assertTrue(i.wait(0))
+
+        self.assertEqual(git_utils.count_reachable('gh-pages'), 1)
+        self.assertRegex(
+            check_output(['git', 'log', '-1', '--format=%s', 'gh-pages']),
+            r'^Deployed abc to 1\.0; Deployed uploaded site to 2\.0 with '
+        )
+        self.assertEqual(list(commands.list_versions()), [
+            versions.VersionInfo('2.0', aliases=['latest'],
+                                 properties={'tags': ['new']}),
+            versions.VersionInfo('1.0', aliases=['stable']),
+        ])
+        self.assertEqual(git_utils.read_file('gh-pages', 'stable/index.html'),
+                         b'docs for 1.0')
+
+    def test_process_options(self):
+        r = receiver.Receiver(branch='branch', deploy_prefix='prefix',
+                              alias_type=AliasType.copy, message='uploaded')
+        r.process('other', [self._upload('1.0', aliases=['latest'])])
+        self.assertFalse(git_utils.has_branch('branch'))
+        self.assertEqual(
+            check_output(['git', 'log', '-1', '--format=%s', 'other']).strip(),
+            'uploaded'
+        )
+        self.assertEqual(git_utils.file_mode('other', 'prefix/latest',
+                                             follow_symlinks=False), 0o040000)
+        self.assertEqual(list(commands.list_versions('other', 'prefix')), [
+            versions.VersionInfo('1.0', aliases=['latest']),
+        ])
+
+    def test_process_errors(self):
+        with open(os.path.join('uploads', 'bad.tar'), 'w') as f:
+            f.write('garbage')
+
+        r = receiver.Receiver()
+        uploads = [self._upload('1.0', aliases=['latest']),
+                   receiver.Upload(os.path.join('uploads', 'bad.tar'), '2.0'),
+                   self._upload('3.0', aliases=['latest']),
+                   self._upload('4.0')]
+        r.process('gh-pages', uploads)
+
+        head = git_utils.get_latest_commit('gh-pages')
+        self.assertEqual(uploads[0].commit, head)
+        self.assertEqual(str(uploads[1].error), 'invalid site archive')
+        self.assertIsInstance(uploads[2].error, ValueError)
+        self.assertEqual(uploads[3].commit, head)
+
+        # The good uploads are deployed separately.
+        self.assertEqual(git_utils.count_reachable('gh-pages'), 2)
+        self.assertEqual(list(commands.list_versions()), [
+            versions.VersionInfo('4.0'),
+            versions.VersionInfo('1.0', aliases=['latest']),
+        ])
+
+    def test_push(self):
+        origin = self.stage
+        stage_dir('receiver_clone')
+        check_call_silent(['git', 'clone', '--bare', origin, '.'])
+        clone = os.getcwd()
+
+        with pushd(origin):
+            check_call_silent(['git', 'remote', 'add', 'clone', clone])
+            r = receiver.Receiver(remote='clone', push=True)
+            upload = self._upload('1.0')
+            r.process('gh-pages', [upload])
+            self.assertEqual(upload.pushed, True)
+            self.assertEqual(upload.commit,
+                             git_utils.get_latest_commit('gh-pages'))
+        self.assertEqual(git_utils.get_latest_commit('gh-pages'),
+                         upload.commit)
+
+    def test_push_error(self):
+        r = receiver.Receiver(remote='nonexist', push=True)
+        upload = self._upload('1.0')
+        r.process('gh-pages', [upload])
+        self.assertEqual(upload.pushed, False)
+        self.assertIsInstance(upload.error, git_utils.GitError)
+        self.assertEqual(list(commands.list_versions()), [
+            versions.VersionInfo('1.0'),
+        ])
+
+    def test_run(self):
+        r = receiver.Receiver(allowed_branches=['branch'])
+        uploads = [r.submit(self._upload('1.0')),
+                   r.submit(self._upload('2.0', branch='branch')),
+                   r.submit(self._upload('3.0'))]
+        r.start()
+        r.stop()
+
+        self.assertTrue(all(i.wait(0) for i in uploads))
+        self.assertEqual(git_utils.count_reachable('gh-pages'), 1)
+        self.assertEqual(git_utils.count_reachable('branch'), 1)
+        self.assertEqual(list(commands.list_versions()), [
+            versions.VersionInfo('3.0'), versions.VersionInfo('1.0'),
+        ])
+
+        with self.assertRaisesRegex(ValueError, 'shutting down'):
+            r.submit(self._upload('4.0'))
+
+    def test_submit_branch(self):
+        r = receiver.Receiver(branch='branch', allowed_branches=['other'])
+        for branch in (None, 'branch', 'other'):
+            r.submit(self._upload('1.0', branch=branch))
+        with self.assertRaisesRegex(ValueError,
+                                    "branch 'gh-pages' not allowed"):
+            r.submit(self._upload('1.0', branch='gh-pages'))
+        self.assertEqual(sorted(r._queues), ['branch', 'other'])
+        self.assertEqual(len(r._queues['branch']), 2)
+
+
+class TestReceiveHTTPHandler(unittest.TestCase):
+    def setUp(self):
+        self.stage = stage_dir('receive_handler')
+        git_init()
+        self.receiver = receiver.Receiver()
+
+        class Handler(receiver.ReceiveHTTPHandler):
+            receiver = self.receiver
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = http.server.ThreadingHTTPServer(('localhost', 0),
+                                                     Handler)
+        thread = threading.Thread(target=self.httpd.serve_forever)
+        thread.start()
+        self.receiver.start()
+
+        self.addCleanup(self.httpd.server_close)
+        self.addCleanup(thread.join)
+        self.addCleanup(self.httpd.shutdown)
+        self.addCleanup(self.receiver.stop)
+
+    def _post(self, path, data):
+        url = 'http://localhost:{}{}'.format(self.httpd.server_port, path)
+        try:
+            with urllib.request.urlopen(url, data) as f:
+                return f.status, json.loads(f.read())
+        except urllib.error.HTTPError as e:
+            return e.code, json.loads(e.read())
+
+    def test_deploy(self):
+        with open(make_archive('site.tar.gz', {'index.html': 'main page'}),
+                  'rb') as f:
+            data = f.read()
+
+        status, result = self._post('/deploy?version=1.0&alias=latest', data)
+        self.assertEqual(status, 200)
+        self.assertEqual(result, {
+            'version': '1.0',
+            'commit': git_utils.get_latest_commit('gh-pages'),
+            'pushed': False,
+        })
+        self.assertEqual(git_utils.read_file('gh-pages', 'latest/index.html'),
+                         b'main page')
+
+    def test_errors(self):
+        self.assertEqual(self._post('/deploy?title=foo', b''), (
+            400, {'error': 'no version specified'}
+        ))
+        self.assertEqual(self._post('/deploy?version=1.0', b'garbage'), (
+            400, {'error': 'invalid site archive'}
+        ))
+        self.assertEqual(self._post('/deploy?version=1.0&set=foo', b''), (
+            400, {'error': "invalid 'set' expression 'foo'"}
+        ))
+        self.assertEqual(self._post('/deploy?version=1.0&branch=main', b''), (
+            400, {'error': "branch 'main' not allowed"}
+        ))
+        self.assertEqual(self._post('/nonexist', b''), (
+            404, {'error': 'not found'}
+        ))
+        self.assertFalse(git_utils.has_branch('gh-pages'))
+
+    def _post_length(self, length, data=b''):
+        conn = http.client.HTTPConnection('localhost', self.httpd.server_port)
+        try:
+            conn.putrequest('POST', '/deploy?version=1.0')
+            if length is not None:
+                conn.putheader('Content-Length', length)
+            conn.endheaders(data)
+            resp = conn.getresponse()
+            return resp.status, json.loads(resp.read())
+        finally:
+            conn.close()
+
+    def test_content_length(self):
+        error = {'error': 'invalid or missing Content-Length'}
+        self.assertEqual(self._post_length(None), (400, error))
+        self.assertEqual(self._post_length('-1'), (400, error))
+        self.assertEqual(self._post_length('foo'), (400, error))
+        self.assertFalse(git_utils.has_branch('gh-pages'))
+
+    def test_max_upload_size(self):
+        self.receiver.max_upload_size = 8
+        self.assertEqual(self._post('/deploy?version=1.0', b'x' * 9), (
+            413, {'error': 'upload larger than 8 bytes'}
+        ))
+        self.assertEqual(self._post('/deploy?version=1.0', b'x' * 8), (
+            400, {'error': 'invalid site archive'}
+        ))
+        self.assertFalse(git_utils.has_branch('gh-pages'))
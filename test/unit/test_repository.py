@@ -0,0 +1,199 @@
+import os
+import threading
+import unittest
+
+from .. import *
+from .test_commands import mock_config
+from mike import commands, git_utils, versions
+from mike.repository import Repository
+
+
+class TestRepository(unittest.TestCase):
+    def setUp(self):
+        self.stage = stage_dir('repository')
+        self.cfg = mock_config(self.stage)
+        git_init()
+        commit_files(['file.txt'])
+        with commands.deploy(self.cfg, '1.0', aliases=['latest']):
+            pass
+
+        self.repo = Repository()
+        self.addCleanup(self.repo.close)
+
+    def _versions(self, branch='gh-pages', deploy_prefix=''):
+        return list(commands.list_versions(branch, deploy_prefix))
+
+    def test_list_versions(self):
+        all_versions = self.repo.list_versions()
+        self.assertEqual(list(all_versions), [
+            versions.VersionInfo('1.0', aliases=['latest']),
+        ])
+
+        # Each call gets its own copy, so changing one doesn't affect others.
+        all_versions.add('2.0')
+        self.assertIsNot(self.repo.list_versions(), all_versions)
+        self.assertEqual(list(self.repo.list_versions()), [
+            versions.VersionInfo('1.0', aliases=['latest']),
+        ])
+
+    def test_list_versions_nonexistent(self):
+        self.assertEqual(list(self.repo.list_versions('nonexist')), [])
+        self.assertEqual(list(self.repo.list_versions(deploy_prefix='dir')),
+                         [])
+
+    def test_list_versions_symlink(self):
+        with git_utils.Commit('gh-pages', 'add versions.json') as commit:
+            commit.add_file(git_utils.FileInfo(
+                'dir/versions.json',
+                '[{"version": "2.0", "title": "2.0", "aliases": []}]',
+            ))
+            commit.add_file(git_utils.FileInfo('prefix', 'dir', 0o120000))
+        self.assertEqual(list(self.repo.list_versions(deploy_prefix='prefix')),
+                         [versions.VersionInfo('2.0')])
+
+    def test_invalidate(self):
+        all_versions = self.repo.list_versions()
+        commands.retitle('1.0', '1.0.1')
+        self.assertIsNot(self.repo.list_versions(), all_versions)
+        self.assertEqual(list(self.repo.list_versions()), [
+            versions.VersionInfo('1.0', '1.0.1', ['latest']),
+        ])
+
+    def test_batch(self):
+        all_versions = self.repo.list_versions()
+        with self.repo.batch() as b:
+            b.retitle('1.0', '1.0.1')
+            b.set_properties([('hidden', True)], ['latest'])
+            # Readers don't see the batch's changes until they're committed.
+            self.assertEqual(list(self.repo.list_versions()),
+                             list(all_versions))
+            self.assertEqual(list(all_versions), [
+                versions.VersionInfo('1.0', aliases=['latest']),
+            ])
+
+        expected = [versions.VersionInfo('1.0', '1.0.1', ['latest'],
+                                         {'hidden': True})]
+        self.assertEqual(git_utils.count_reachable('gh-pages'), 2)
+        self.assertEqual(self._versions(), expected)
+        self.assertEqual(list(self.repo.list_versions()), expected)
+
+        # Changing the batch's versions afterward doesn't affect the cache.
+        b.versions.add('2.0')
+        self.assertEqual(list(self.repo.list_versions()), expected)
+
+    def test_batch_error(self):
+        all_versions = self.repo.list_versions()
+        with self.assertRaises(ValueError):
+            with self.repo.batch() as b:
+                b.retitle('1.0', '1.0.1')
+                b.retitle('2.0', '2.0.1')
+
+        self.assertEqual(git_utils.count_reachable('gh-pages'), 1)
+        self.assertEqual(list(all_versions), [
+            versions.VersionInfo('1.0', aliases=['latest']),
+        ])
+        self.assertEqual(list(self.repo.list_versions()), [
+            versions.VersionInfo('1.0', aliases=['latest']),
+        ])
+
+    def test_commands(self):
+        self.repo.retitle('1.0', '1.0.1')
+        self.repo.set_properties('1.0', [('hidden', True)])
+        self.repo.alias(self.cfg, '1.0', ['stable'])
+        self.repo.set_default('stable')
+        self.assertEqual(git_utils.count_reachable('gh-pages'), 5)
+        self.assertEqual(self.repo.get_property('stable', 'hidden'), True)
+        self.assertEqual(self.repo.get_properties_all(['hidden']),
+                         [(versions.VersionInfo('1.0', '1.0.1',
+                                                ['latest', 'stable'],
+                                                {'hidden': True}), [True])])
+        with self.assertRaises(ValueError):
+            self.repo.get_property('2.0', 'hidden')
+
+        with self.repo.deploy(self.cfg, '2.0'):
+            pass
+        self.repo.delete(['1.0'])
+        self.assertEqual(list(self.repo.list_versions()), [
+            versions.VersionInfo('2.0'),
+        ])
+        self.assertEqual(self._versions(), [versions.VersionInfo('2.0')])
+
+    def test_deploy(self):
+        with pushd(test_data_dir):
+            with Repository(self.stage) as repo:
+                with repo.deploy(self.cfg, '2.0'):
+                    # The build doesn't keep the repository active.
+                    self.assertEqual(os.getcwd(), test_data_dir)
+                    with Repository(self.stage) as other:
+                        other.retitle('1.0', '1.0.1')
+                self.assertEqual(os.getcwd(), test_data_dir)
+
+                with self.assertRaises(RuntimeError):
+                    with repo.deploy(self.cfg, '3.0'):
+                        raise RuntimeError('build failed')
+                self.assertEqual(os.getcwd(), test_data_dir)
+
+        self.assertEqual(git_utils.count_reachable('gh-pages'), 3)
+        self.assertEqual(self._versions(), [
+            versions.VersionInfo('2.0'),
+            versions.VersionInfo('1.0', '1.0.1', ['latest']),
+        ])
+
+    def test_options(self):
+        repo = Repository(branch='branch', deploy_prefix='prefix')
+        self.addCleanup(repo.close)
+        with repo.deploy(self.cfg, '2.0'):
+            pass
+        repo.retitle('2.0', '2.0.1')
+        self.assertEqual(self._versions('branch', 'prefix'), [
+            versions.VersionInfo('2.0', '2.0.1'),
+        ])
+        self.assertEqual(list(repo.list_versions()), [
+            versions.VersionInfo('2.0', '2.0.1'),
+        ])
+        self.assertEqual(list(repo.list_versions('gh-pages', '')), [
+            versions.VersionInfo('1.0', aliases=['latest']),
+        ])
+
+    def test_path(self):
+        with pushd(test_data_dir):
+            with Repository(self.stage) as repo:
+                repo.retitle('1.0', '1.0.1')
+                self.assertEqual(os.getcwd(), test_data_dir)
+                self.assertEqual(list(repo.list_versions()), [
+                    versions.VersionInfo('1.0', '1.0.1', ['latest']),
+                ])
+        self.assertEqual(self._versions(), [
+            versions.VersionInfo('1.0', '1.0.1', ['latest']),
+        ])
+
+    def test_active(self):
+        other_stage = stage_dir('repository_other')
+        git_init()
+        commit_files(['file.txt'])
+        other = Repository(other_stage)
+        self.addCleanup(other.close)
+
+        # Each thread runs Git in its own repository, and neither changes the
+        # process's working directory.
+        results = {}
+        ready = threading.Barrier(2)
+
+        def run(repo):
+            with repo.active():
+                ready.wait()
+                results[repo.path] = (git_utils.get_git_dir(), os.getcwd())
+                ready.wait()
+
+        with pushd(test_data_dir):
+            threads = [threading.Thread(target=run, args=(i,))
+                       for i in (self.repo, other)]
+            for i in threads:
+                i.start()
+            for i in threads:
+                i.join()
+
+        self.assertEqual(results, {
+            self.stage: (os.path.join(self.stage, '.git'), test_data_dir),
+            other_stage: (os.path.join(other_stage, '.git'), test_data_dir),
+        })
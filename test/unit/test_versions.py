@@ -1,9 +1,12 @@
 import json
+import pickle
+import sys
 import unittest
 from verspec.loose import LooseVersion as Version
 
+from mike import jsonpath
 from mike.jsonpath import Deleted
-from mike.versions import VersionInfo, Versions
+from mike.versions import merge, parse_range, VersionInfo, Versions
 
 
 class TestVersionInfo(unittest.TestCase):
@@ -61,6 +64,14 @@ class TestVersionInfo(unittest.TestCase):
                                     '^duplicated version and alias$'):
             VersionInfo('1.0', aliases=['1.0'])
 
+    def test_shared_strings(self):
+        data = json.loads('{"version": "1.0", "title": "1.0", ' +
+                          '"aliases": ["latest"]}')
+        v = VersionInfo.from_json(data)
+        self.assertIs(v.title, str(v.version))
+        self.assertIs(next(iter(v.aliases)), sys.intern('latest'))
+        self.assertFalse(hasattr(v, '__dict__'))
+
     def test_equality(self):
         v = VersionInfo('1.0')
         self.assertEqual(v, VersionInfo('1.0'))
@@ -499,6 +510,228 @@ class TestVersions(unittest.TestCase):
             VersionInfo('3.0'),
         ])
 
+    def test_find(self):
+        versions = Versions()
+        versions.add('1.0', aliases=['stable'])
+        versions.add('2.0', aliases=['latest'])
+        self.assertEqual(versions.find('1.0'), ('1.0',))
+        self.assertEqual(versions.find('latest'), ('2.0', 'latest'))
+        self.assertEqual(versions.find('nonexist'), None)
+        with self.assertRaises(KeyError):
+            versions.find('nonexist', strict=True)
+
+    def test_find_moved_alias(self):
+        versions = Versions()
+        versions.add('1.0', aliases=['latest'])
+        versions.add('2.0', aliases=['latest'], update_aliases=True)
+        self.assertEqual(versions.find('latest'), ('2.0', 'latest'))
+
+        versions.update('1.0', aliases=['latest'], update_aliases=True)
+        self.assertEqual(versions.find('latest'), ('1.0', 'latest'))
+
+    def test_find_removed(self):
+        versions = Versions()
+        versions.add('1.0', aliases=['stable'])
+        versions.add('2.0', aliases=['latest', 'greatest'])
+        versions.difference_update(['stable', '2.0'])
+        self.assertEqual(versions.find('stable'), None)
+        self.assertEqual(versions.find('latest'), None)
+        self.assertEqual(versions.find('greatest'), None)
+
+    def test_find_direct_mutation(self):
+        versions = Versions()
+        info = versions.add('1.0', aliases=['stable'])
+
+        info.aliases.add('latest')
+        self.assertEqual(versions.find('latest'), ('1.0', 'latest'))
+        info.aliases.discard('stable')
+        self.assertEqual(versions.find('stable'), None)
+        info.aliases |= {'a', 'b'}
+        self.assertEqual(versions.find('a'), ('1.0', 'a'))
+        info.aliases -= {'a'}
+        self.assertEqual(versions.find('a'), None)
+
+        info.aliases = ['c']
+        self.assertEqual(versions.find('b'), None)
+        self.assertEqual(versions.find('latest'), None)
+        self.assertEqual(versions.find('c'), ('1.0', 'c'))
+        info.aliases.clear()
+        self.assertEqual(versions.find('c'), None)
+
+        # Removed versions no longer update the index.
+        versions.remove('1.0')
+        info.aliases.add('d')
+        self.assertEqual(versions.find('d'), None)
+
+    def test_order_after_mutation(self):
+        versions = Versions()
+        for i in ['1.0', '3.0', 'devel', '2.0', '1.10']:
+            versions.add(i)
+        versions.remove('2.0')
+        versions.add('1.2')
+        self.assertEqual([str(i.version) for i in versions],
+                         ['devel', '3.0', '1.10', '1.2', '1.0'])
+
+        versions['1.2'].version = '4.0'
+        self.assertEqual([str(i.version) for i in versions],
+                         ['devel', '4.0', '3.0', '1.10', '1.0'])
+
+    def test_order_equal_versions(self):
+        # Versions that compare equal are listed in insertion order.
+        versions = Versions()
+        versions.add('1.0')
+        versions.add('1.00')
+        versions.add('2.0')
+        self.assertEqual([str(i.version) for i in versions],
+                         ['2.0', '1.0', '1.00'])
+
+        versions = Versions.from_json([
+            {'version': '1.00', 'title': '1.00', 'aliases': []},
+            {'version': '1.0', 'title': '1.0', 'aliases': []},
+        ])
+        versions.add('0.1')
+        self.assertEqual([str(i.version) for i in versions],
+                         ['1.00', '1.0', '0.1'])
+
+    def test_in_range(self):
+        versions = Versions()
+        for i in ['0.9', '1.0', '1.4', '2.0', '2.1', '2.10', '3.0', 'devel']:
+            versions.add(i)
+
+        def in_range(spec):
+            return [str(i.version) for i in versions.in_range(spec)]
+
+        self.assertEqual(in_range('>=2.0,<3'), ['2.10', '2.1', '2.0'])
+        self.assertEqual(in_range('>2.0,<=2.10'), ['2.10', '2.1'])
+        self.assertEqual(in_range('<1.4'), ['1.0', '0.9'])
+        self.assertEqual(in_range('>= 3'), ['devel', '3.0'])
+        self.assertEqual(in_range('==2.0'), ['2.0'])
+        self.assertEqual(in_range('==2.2'), [])
+        self.assertEqual(in_range('>=2,!=2.1'),
+                         ['devel', '3.0', '2.10', '2.0'])
+        self.assertEqual(in_range('>3,<2'), [])
+        self.assertEqual(in_range(parse_range('<1')), ['0.9'])
+
+    def test_in_range_equal_versions(self):
+        versions = Versions()
+        versions.add('1.0')
+        versions.add('2.0')
+        versions.add('1.00')
+        self.assertEqual([str(i.version) for i in versions.in_range('<=1')],
+                         ['1.0', '1.00'])
+        self.assertEqual([str(i.version) for i in versions.in_range('>1')],
+                         ['2.0'])
+
+    def test_parse_range(self):
+        self.assertEqual(parse_range('>=2.0, <3'), (
+            ('>=', Version('2.0')), ('<', Version('3')),
+        ))
+        for i in ('', '2.0', '~=2.0', '>=2.0,', '> 1 2'):
+            with self.assertRaises(ValueError):
+                parse_range(i)
+
+    def test_get_property_all(self):
+        versions = Versions()
+        versions.add('1.0').properties = {'hidden': True}
+        versions.add('2.0').properties = {'hidden': False, 'tags': ['new']}
+        versions.add('3.0').properties = 'scalar'
+        versions.add('4.0')
+
+        self.assertEqual(
+            [(str(i.version), v) for i, v in
+             versions.get_property_all('hidden')],
+            [('4.0', None), ('3.0', None), ('2.0', False), ('1.0', True)]
+        )
+        self.assertEqual(
+            [(str(i.version), v) for i, v in
+             versions.get_properties_all(['tags[0]', ''])],
+            [('4.0', [None, None]), ('3.0', [None, 'scalar']),
+             ('2.0', ['new', {'hidden': False, 'tags': ['new']}]),
+             ('1.0', [None, {'hidden': True}])]
+        )
+
+    def test_get_property_all_strict(self):
+        versions = Versions()
+        versions.add('1.0').properties = {'hidden': True}
+        versions.add('2.0').properties = {}
+        with self.assertRaises(KeyError):
+            versions.get_property_all('hidden', strict=True)
+
+        versions.add('3.0')
+        with self.assertRaises(TypeError):
+            versions.get_property_all('hidden', strict=True)
+
+    def test_select(self):
+        versions = Versions()
+        versions.add('1.0').properties = {'hidden': True, 'n': 1}
+        versions.add('1.1', aliases=['stable']).properties = {'hidden': 1}
+        versions.add('2.0').properties = {'hidden': False, 'n': 1.0}
+        versions.add('3.0').properties = 'scalar'
+
+        def select(*args, **kwargs):
+            return [str(i.version) for i in versions.select(*args, **kwargs)]
+
+        self.assertEqual(select(), ['3.0', '2.0', '1.1', '1.0'])
+        self.assertEqual(select(['1.0', 'stable']), ['1.1', '1.0'])
+        self.assertEqual(select(version_range='>=1.1'), ['3.0', '2.0', '1.1'])
+        self.assertEqual(select(['1.0', '2.0'], version_range='>=1.1'),
+                         ['2.0'])
+        self.assertEqual(select(where=[('hidden', True)]), ['1.0'])
+        self.assertEqual(select(where=[('hidden', 1)]), ['1.1'])
+        self.assertEqual(select(where=[('n', 1)]), ['2.0', '1.0'])
+        self.assertEqual(select(where=[('n', 1), ('hidden', False)]), ['2.0'])
+        self.assertEqual(select(where=[('', 'scalar')]), ['3.0'])
+        self.assertEqual(select(where=lambda i: i.aliases), ['1.1'])
+        self.assertEqual(select([]), [])
+        with self.assertRaises(KeyError):
+            select(['4.0'])
+
+    def test_select_index(self):
+        versions = Versions()
+        versions.add('1.0').properties = {'hidden': True}
+        versions.add('2.0').properties = {'hidden': False}
+
+        def where(*conditions):
+            return [str(i.version) for i in versions.select(where=conditions)]
+
+        self.assertEqual(where(('hidden', True)), ['1.0'])
+        self.assertEqual(list(versions._property_indexes), [('hidden',)])
+
+        # The index is kept up to date as versions change...
+        versions['2.0'].set_property('hidden', True)
+        self.assertEqual(where(('hidden', True)), ['2.0', '1.0'])
+        versions['1.0'].properties = {'hidden': False}
+        self.assertEqual(where(('hidden', True)), ['2.0'])
+        self.assertEqual(where(('hidden', False)), ['1.0'])
+        versions['1.0'].set_property('hidden', jsonpath.Deleted)
+        self.assertEqual(where(('hidden', None)), ['1.0'])
+
+        # ... and as they're added and removed.
+        versions.add('3.0').set_property('hidden', True)
+        versions.add('devel').properties = {'hidden': True}
+        self.assertEqual(where(('hidden', True)), ['devel', '3.0', '2.0'])
+        versions.remove('2.0')
+        self.assertEqual(where(('hidden', True)), ['devel', '3.0'])
+        self.assertEqual(versions.select(where=[('hidden', True)],
+                                         version_range='<4'),
+                         [versions['3.0']])
+
+    def test_select_index_json_values(self):
+        versions = Versions()
+        versions.add('1.0').properties = {'tags': ['a', 'b'], 'n': 1}
+        versions.add('2.0').properties = {'tags': {'a': [1.0]}, 'n': True}
+
+        def where(*conditions):
+            return [str(i.version) for i in versions.select(where=conditions)]
+
+        self.assertEqual(where(('tags', ['a', 'b'])), ['1.0'])
+        self.assertEqual(where(('tags', ['b', 'a'])), [])
+        self.assertEqual(where(('tags', {'a': [1]})), ['2.0'])
+        self.assertEqual(where(('n', 1.0)), ['1.0'])
+        self.assertEqual(where(('n', True)), ['2.0'])
+        self.assertEqual(where(('tags[0]', 'a')), ['1.0'])
+        self.assertEqual(where(('tags[0]', None)), ['2.0'])
+
     def test_difference_update_nonexistent(self):
         versions = Versions()
         versions.add('1.0')
@@ -543,6 +776,16 @@ class TestVersions(unittest.TestCase):
             VersionInfo('2.0', '2.0.2', aliases={'latest'}),
             VersionInfo('1.0', '1.0.1', aliases={'stable'}),
         ])
+        self.assertEqual(versions.find('stable'), ('1.0', 'stable'))
+
+    def test_pickle(self):
+        versions = Versions()
+        versions.add('1.0', aliases=['stable'])
+        versions = pickle.loads(pickle.dumps(versions))
+        self.assertEqual(versions.find('stable'), ('1.0', 'stable'))
+
+        versions['1.0'].aliases.add('latest')
+        self.assertEqual(versions.find('latest'), ('1.0', 'latest'))
 
     def test_dumps(self):
         versions = Versions()
@@ -552,3 +795,64 @@ class TestVersions(unittest.TestCase):
             {'version': '2.0', 'title': '2.0.2', 'aliases': ['latest']},
             {'version': '1.0', 'title': '1.0.1', 'aliases': ['stable']}
         ])
+
+
+class TestMerge(unittest.TestCase):
+    def _versions(self, *infos):
+        versions = Versions()
+        for i in infos:
+            versions.add(*i)
+        return versions
+
+    def test_union(self):
+        base = self._versions(('1.0', None, ['stable']))
+        ours = self._versions(('1.0', None, ['stable']), ('2.0',))
+        theirs = self._versions(('1.0', None, ['stable']), ('3.0',))
+        self.assertEqual(list(merge(base, ours, theirs)), [
+            VersionInfo('3.0'), VersionInfo('2.0'),
+            VersionInfo('1.0', aliases=['stable']),
+        ])
+
+    def test_one_side_changed(self):
+        base = self._versions(('1.0',), ('2.0',))
+        ours = self._versions(('1.0', '1.0.1'), ('2.0',))
+        theirs = self._versions(('1.0',))
+        self.assertEqual(list(merge(base, ours, theirs)), [
+            VersionInfo('1.0', '1.0.1'),
+        ])
+
+    def test_same_change(self):
+        base = self._versions(('1.0',))
+        ours = self._versions(('1.0',), ('2.0', None, ['latest']))
+        theirs = self._versions(('1.0',), ('2.0', None, ['latest']))
+        self.assertEqual(list(merge(base, ours, theirs)), [
+            VersionInfo('2.0', aliases=['latest']), VersionInfo('1.0'),
+        ])
+
+    def test_moved_alias(self):
+        base = self._versions(('1.0', None, ['latest']))
+        ours = self._versions(('1.0',), ('2.0', None, ['latest']))
+        theirs = self._versions(('1.0', None, ['latest']), ('0.9',))
+        self.assertEqual(list(merge(base, ours, theirs)), [
+            VersionInfo('2.0', aliases=['latest']), VersionInfo('1.0'),
+            VersionInfo('0.9'),
+        ])
+
+    def test_conflicting_version(self):
+        base = self._versions(('1.0',))
+        ours = self._versions(('1.0', '1.0.1'))
+        theirs = self._versions(('1.0', '1.0.2'))
+        with self.assertRaisesRegex(ValueError,
+                                    "version '1.0' was changed on both"):
+            merge(base, ours, theirs)
+
+        with self.assertRaisesRegex(ValueError,
+                                    "version '1.0' was changed on both"):
+            merge(base, Versions(), theirs)
+
+    def test_conflicting_alias(self):
+        base = self._versions(('1.0',))
+        ours = self._versions(('1.0',), ('2.0', None, ['latest']))
+        theirs = self._versions(('1.0',), ('3.0', None, ['latest']))
+        with self.assertRaisesRegex(ValueError, "alias 'latest' already"):
+            merge(base, ours, theirs)